@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+
+
+# Sensor log constants (in sync with GasExposureAnalytics)
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+DEVICE_ID_COL = 'device_id'
+DEVICE_TIMESTAMP_COL = 'device_timestamp'
+RANGE_EXCEEDED = -1
+SUPPORTED_GASES = ['carbon_monoxide', 'nitrogen_dioxide']
+# The sensor log columns, in the same order as tests/GasExposureAnalytics_test_dataset.csv
+SENSOR_LOG_COLS = [TIMESTAMP_COL, FIREFIGHTER_ID_COL, 'temperature', 'humidity', 'carbon_monoxide',
+                   DEVICE_TIMESTAMP_COL, DEVICE_ID_COL, 'nitrogen_dioxide']
+# The number of minutes after its minute that each record reaches the sensor log (not a sensor log column).
+ARRIVAL_DELAY_COL = 'arrival_delay_mins'
+
+# Defaults for a synthetic incident.
+DEFAULT_START = '2000-01-01 09:00:00'
+# Late records arrive between 1 and this many minutes late.
+MAX_ARRIVAL_DELAY_MINS = 10
+
+
+# Generates a synthetic incident - a sensor log in the same form as the Prometeo devices send (and as
+# tests/GasExposureAnalytics_test_dataset.csv holds), for any number of firefighters. Everything is drawn from a
+# seeded random generator, so that the same parameters always give exactly the same incident (e.g. to compare
+# benchmark runs across commits).
+#
+# Each firefighter arrives some time in the first tenth of the incident and leaves some time in the last tenth. Each
+# of them has their own background level of each gas, which drifts (a random walk) minute by minute - so some
+# firefighters get close to, or over, their exposure limits, and most don't.
+#
+# firefighters        : The number of firefighters at the incident.
+# duration_mins       : The length of the incident in minutes.
+# dropout_rate        : The proportion of (firefighter, minute) readings that never arrive (e.g. lost connectivity).
+# late_arrival_rate   : The proportion of readings that arrive 1 to MAX_ARRIVAL_DELAY_MINS minutes late.
+# range_exceeded_rate : The proportion of gas readings where the sensor has exceeded its range (sent as -1).
+# seed                : Seed for the random generator.
+# start               : The first minute of the incident.
+class SyntheticIncident(object):
+
+
+    def __init__(self, firefighters, duration_mins, dropout_rate=0.0, late_arrival_rate=0.0, range_exceeded_rate=0.0,
+                 seed=0, start=DEFAULT_START):
+
+        self.FIREFIGHTERS = firefighters
+        self.DURATION_MINS = duration_mins
+        self.DROPOUT_RATE = dropout_rate
+        self.LATE_ARRIVAL_RATE = late_arrival_rate
+        self.RANGE_EXCEEDED_RATE = range_exceeded_rate
+        self.SEED = seed
+        self.START = pd.Timestamp(start)
+
+
+    # The first and last minute of the incident.
+    def time_span(self) :
+        return self.START, self.START + pd.Timedelta(minutes = self.DURATION_MINS - 1)
+
+
+    # Generate the sensor log. Returns a dataframe of SENSOR_LOG_COLS plus ARRIVAL_DELAY_COL (one row per reading,
+    # sorted by minute then firefighter).
+    def sensor_log(self) :
+
+        random = np.random.RandomState(self.SEED)
+        minutes = self.DURATION_MINS
+        firefighter_ids = np.array(['%04d' % (idx + 1) for idx in range(self.FIREFIGHTERS)])
+
+        # When each firefighter arrives and leaves, as minute offsets into the incident.
+        edge_mins = max(1, minutes // 10)
+        arrives = random.randint(0, edge_mins, size=self.FIREFIGHTERS)
+        leaves = minutes - random.randint(0, edge_mins, size=self.FIREFIGHTERS)
+        offsets = np.arange(minutes)
+        on_scene = (offsets[np.newaxis, :] >= arrives[:, np.newaxis]) & (offsets[np.newaxis, :] < leaves[:, np.newaxis])
+
+        # Readings for every (firefighter, minute) - a background level per firefighter plus a random walk.
+        shape = (self.FIREFIGHTERS, minutes)
+        carbon_monoxide = (random.uniform(0, 25, size=(self.FIREFIGHTERS, 1))
+                           + np.cumsum(random.normal(0, 1.5, size=shape), axis=1))
+        nitrogen_dioxide = (random.uniform(0, 1, size=(self.FIREFIGHTERS, 1))
+                            + np.cumsum(random.normal(0, 0.05, size=shape), axis=1))
+        gases = {
+            'carbon_monoxide'  : np.round(np.clip(carbon_monoxide, 0, None), 0),
+            'nitrogen_dioxide' : np.round(np.clip(nitrogen_dioxide, 0, None), 2),
+        }
+        for gas in SUPPORTED_GASES :
+            gases[gas][random.random_sample(shape) < self.RANGE_EXCEEDED_RATE] = RANGE_EXCEEDED
+        temperature = np.round(random.uniform(18, 45, size=(self.FIREFIGHTERS, 1)) + random.normal(0, 1, size=shape), 0)
+        humidity = np.round(np.clip(random.uniform(40, 80, size=(self.FIREFIGHTERS, 1))
+                                    + random.normal(0, 2, size=shape), 0, 100), 0)
+        device_seconds = random.uniform(0, 60, size=shape)
+        arrival_delay = np.where(random.random_sample(shape) < self.LATE_ARRIVAL_RATE,
+                                 random.randint(1, MAX_ARRIVAL_DELAY_MINS + 1, size=shape), 0)
+
+        # Keep the readings of firefighters on scene that weren't dropped - minute by minute.
+        reading = on_scene & (random.random_sample(shape) >= self.DROPOUT_RATE)
+        minute_idx, ff_idx = np.nonzero(reading.T)
+        timestamps = self.START + pd.to_timedelta(offsets[minute_idx], unit='min')
+
+        sensor_log_df = pd.DataFrame({
+            TIMESTAMP_COL        : timestamps,
+            FIREFIGHTER_ID_COL   : firefighter_ids[ff_idx],
+            'temperature'        : temperature[ff_idx, minute_idx],
+            'humidity'           : humidity[ff_idx, minute_idx],
+            'carbon_monoxide'    : gases['carbon_monoxide'][ff_idx, minute_idx],
+            DEVICE_TIMESTAMP_COL : (timestamps + pd.to_timedelta(device_seconds[ff_idx, minute_idx], unit='s')).floor('ms'),
+            DEVICE_ID_COL        : firefighter_ids[ff_idx],
+            'nitrogen_dioxide'   : gases['nitrogen_dioxide'][ff_idx, minute_idx],
+            ARRIVAL_DELAY_COL    : arrival_delay[ff_idx, minute_idx],
+        })
+        return sensor_log_df[SENSOR_LOG_COLS + [ARRIVAL_DELAY_COL]]
+
+
+    # Write the sensor log to a CSV file that GasExposureAnalytics can run from.
+    # arrival_delays : Include ARRIVAL_DELAY_COL (which isn't a sensor log column - drop it before running analytics).
+    def to_csv(self, csv_filepath, sensor_log_df=None, arrival_delays=False) :
+        if sensor_log_df is None :
+            sensor_log_df = self.sensor_log()
+        csv_df = sensor_log_df[SENSOR_LOG_COLS + ([ARRIVAL_DELAY_COL] if arrival_delays else [])].copy()
+        csv_df[DEVICE_TIMESTAMP_COL] = csv_df[DEVICE_TIMESTAMP_COL].dt.strftime('%Y-%m-%d %H:%M:%S.%f').str[:-3] # as ms
+        csv_df.to_csv(csv_filepath, index=False, date_format='%Y-%m-%d %H:%M:%S')
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+# Benchmarks for how the analytics scale with the size of an incident - runs GasExposureAnalytics (from memory) over
+# synthetic incidents (see SyntheticIncident) minute by minute, as the scheduler would, and reports the per-minute
+# latency percentiles, peak memory and throughput of each engine to a JSON file that can be compared across commits.
+# e.g. from the repository root:
+#   python -m benchmarks.run_benchmarks --firefighters 50,500 --duration-mins 60 --output results.json
+#   python -m benchmarks.run_benchmarks --firefighters 50,500 --duration-mins 60 --compare results.json
+#
+# Every scenario parameter takes a comma-separated list, and every combination of them is run.
+#
+# Engines:
+#   reference   : run_analytics every minute, averaging every window from scratch.
+#   incremental : run_analytics every minute, with running sums (incremental=True).
+#   parallel    : run_analytics every minute, averaging every window from scratch in a pool of worker processes
+#                 (parallel_workers=PARALLEL_WORKERS).
+#   range       : run_analytics_range over the whole incident in one call (late arrivals don't apply).
+# The per-minute engines also recompute the results that late-arriving records change (recompute_late_arrivals=True).
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import GasExposureAnalytics
+from src.AnalyticsStorage import InMemoryStorage
+from benchmarks.SyntheticIncident import SyntheticIncident, ARRIVAL_DELAY_COL
+
+ENGINES = ['reference', 'incremental', 'parallel', 'range']
+PER_MINUTE_ENGINES = ['reference', 'incremental', 'parallel']
+# Worker processes for the 'parallel' engine - one per core.
+PARALLEL_WORKERS = os.cpu_count()
+# Version of the results file format.
+RESULTS_FORMAT_VERSION = 1
+LATENCY_PERCENTILES = [50, 90, 99]
+# The analytics stages to report the time spent in (see AnalyticsMetrics).
+STAGES = ['read', 'resample', 'windows', 'status', 'recompute']
+
+
+# Run the analytics over a synthetic incident, with one of the ENGINES.
+# Returns the seconds taken for each minute's run (one entry for the whole incident, for 'range') and the analytics.
+# csv_filepath : The incident's sensor log, including ARRIVAL_DELAY_COL.
+def _run_engine(engine, csv_filepath, incident, config_filename) :
+
+    sensor_log_df = InMemoryStorage.from_csv_files(csv_filepath).sensor_log_df
+    arrival = sensor_log_df.index + pd.to_timedelta(sensor_log_df.pop(ARRIVAL_DELAY_COL).values, unit='min')
+    first_minute, last_minute = incident.time_span()
+    one_minute = pd.Timedelta(minutes = 1)
+
+    if engine == 'range' :
+        analytics = GasExposureAnalytics(config_filename=config_filename, storage=InMemoryStorage(sensor_log_df))
+        start_time = time.perf_counter()
+        analytics.run_analytics_range(first_minute + one_minute, last_minute + one_minute, commit=False)
+        return [time.perf_counter() - start_time], analytics
+
+    # Records are added to the sensor log as they arrive, minute by minute.
+    analytics = GasExposureAnalytics(config_filename=config_filename, incremental=(engine == 'incremental'),
+                                     recompute_late_arrivals=True, storage=InMemoryStorage(),
+                                     parallel_workers=(PARALLEL_WORKERS if engine == 'parallel' else None))
+    latencies = []
+    try :
+        for timestamp_key in pd.date_range(first_minute, last_minute, freq='min') :
+            analytics.STORAGE.write_sensor_log(sensor_log_df.loc[arrival == timestamp_key, :])
+            start_time = time.perf_counter()
+            analytics.run_analytics(timestamp_key + one_minute, commit=False)
+            latencies.append(time.perf_counter() - start_time)
+    finally :
+        analytics.close()
+    return latencies, analytics
+
+
+# Benchmark one engine over one synthetic incident. Returns a JSON-serializable dict of the results.
+# trace_memory : Also measure peak memory (in a second, separate run - tracing slows everything down).
+def run_benchmark(incident, engine, config_filename, trace_memory=True) :
+
+    sensor_log_df = incident.sensor_log()
+    with tempfile.TemporaryDirectory() as tmp_dir :
+        csv_filepath = os.path.join(tmp_dir, 'sensor_log.csv')
+        incident.to_csv(csv_filepath, sensor_log_df, arrival_delays=True)
+
+        latencies, analytics = _run_engine(engine, csv_filepath, incident, config_filename)
+
+        peak_memory_mb = None
+        if trace_memory :
+            tracemalloc.start()
+            try :
+                _run_engine(engine, csv_filepath, incident, config_filename)
+                peak_memory_mb = tracemalloc.get_traced_memory()[1] / 2**20
+            finally :
+                tracemalloc.stop()
+
+    total_seconds = sum(latencies)
+    minutes = incident.DURATION_MINS
+    firefighter_minutes = len(sensor_log_df.index)
+    result = {
+        'scenario'   : {
+            'firefighters'        : incident.FIREFIGHTERS,
+            'duration_mins'       : incident.DURATION_MINS,
+            'dropout_rate'        : incident.DROPOUT_RATE,
+            'late_arrival_rate'   : incident.LATE_ARRIVAL_RATE,
+            'range_exceeded_rate' : incident.RANGE_EXCEEDED_RATE,
+            'seed'                : incident.SEED,
+        },
+        'engine'         : engine,
+        'minutes'        : minutes,
+        'sensor_records' : firefighter_minutes,
+        'total_seconds'  : total_seconds,
+        'latency_ms'     : None,
+        'throughput'     : {
+            'minutes_per_second'         : minutes / total_seconds,
+            'sensor_records_per_second'  : firefighter_minutes / total_seconds,
+        },
+        'peak_memory_mb' : peak_memory_mb,
+        'stage_seconds'  : {stage : analytics.METRICS.stage_seconds(stage)[0] for stage in STAGES},
+    }
+    if engine in PER_MINUTE_ENGINES :
+        latencies_ms = np.array(latencies) * 1000
+        result['latency_ms'] = dict([('p%d' % (percentile), float(np.percentile(latencies_ms, percentile)))
+                                     for percentile in LATENCY_PERCENTILES]
+                                    + [('mean', float(latencies_ms.mean())), ('max', float(latencies_ms.max()))])
+    return result
+
+
+# The commit being benchmarked (None if it isn't a git checkout).
+def _git_commit() :
+    try :
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode('utf8').strip()
+    except (OSError, subprocess.CalledProcessError) :
+        return None
+
+
+# Run every combination of the scenario parameters with every engine. Returns the results file contents.
+def run_benchmarks(firefighters, duration_mins, dropout_rates, late_arrival_rates, range_exceeded_rates, seed,
+                   engines, config_filename, trace_memory=True) :
+
+    results = []
+    for firefighter_count, duration, dropout_rate, late_arrival_rate, range_exceeded_rate in itertools.product(
+            firefighters, duration_mins, dropout_rates, late_arrival_rates, range_exceeded_rates) :
+        incident = SyntheticIncident(firefighter_count, duration, dropout_rate, late_arrival_rate, range_exceeded_rate,
+                                     seed=seed)
+        for engine in engines :
+            result = run_benchmark(incident, engine, config_filename, trace_memory)
+            print('%-12s %s : %.1f minutes/s%s' % (engine, json.dumps(result['scenario']),
+                  result['throughput']['minutes_per_second'],
+                  '' if result['latency_ms'] is None else ', p99 %.1fms' % (result['latency_ms']['p99'])))
+            results.append(result)
+
+    return {
+        'format_version' : RESULTS_FORMAT_VERSION,
+        'created'        : datetime.now(timezone.utc).isoformat(),
+        'git_commit'     : _git_commit(),
+        'environment'    : {
+            'python'   : platform.python_version(),
+            'pandas'   : pd.__version__,
+            'numpy'    : np.__version__,
+            'platform' : platform.platform(),
+        },
+        'config_filename' : config_filename,
+        'results'         : results,
+    }
+
+
+# Compare two results files - for each (scenario, engine) in both, the ratio of new to old for the headline numbers
+# (< 1 is faster / smaller for latencies and memory, > 1 is faster for throughput).
+def compare_results(old_results, new_results) :
+
+    def key(result) :
+        return (json.dumps(result['scenario'], sort_keys=True), result['engine'])
+    old_by_key = {key(result) : result for result in old_results['results']}
+
+    comparisons = []
+    for new_result in new_results['results'] :
+        old_result = old_by_key.get(key(new_result))
+        if old_result is None :
+            continue
+        ratios = {'minutes_per_second' : (new_result['throughput']['minutes_per_second']
+                                          / old_result['throughput']['minutes_per_second'])}
+        if new_result['latency_ms'] and old_result['latency_ms'] :
+            for percentile in LATENCY_PERCENTILES :
+                name = 'p%d' % (percentile)
+                ratios['latency_' + name] = new_result['latency_ms'][name] / old_result['latency_ms'][name]
+        if new_result['peak_memory_mb'] and old_result['peak_memory_mb'] :
+            ratios['peak_memory_mb'] = new_result['peak_memory_mb'] / old_result['peak_memory_mb']
+        comparisons.append({'scenario' : new_result['scenario'], 'engine' : new_result['engine'], 'ratios' : ratios})
+    return comparisons
+
+
+def _list_of(parse) :
+    return lambda text : [parse(value) for value in text.split(',')]
+
+
+def main(argv=None) :
+
+    parser = argparse.ArgumentParser(description='Benchmark the Prometeo analytics over synthetic incidents.')
+    parser.add_argument('--firefighters', type=_list_of(int), default=[50, 500])
+    parser.add_argument('--duration-mins', type=_list_of(int), default=[60])
+    parser.add_argument('--dropout-rate', type=_list_of(float), default=[0.05])
+    parser.add_argument('--late-arrival-rate', type=_list_of(float), default=[0.0])
+    parser.add_argument('--range-exceeded-rate', type=_list_of(float), default=[0.001])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engines', type=_list_of(str), default=ENGINES)
+    parser.add_argument('--config', default='prometeo_config.json',
+                        help='Analytics configuration file, relative to src/')
+    parser.add_argument('--no-memory', action='store_true', help="Don't measure peak memory (halves the run time)")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='A previous results file to compare these results with')
+    args = parser.parse_args(argv)
+
+    unknown_engines = set(args.engines) - set(ENGINES)
+    if unknown_engines :
+        parser.error('unknown engine(s) %s - expected some of %s' % (sorted(unknown_engines), ENGINES))
+
+    # Only log errors by default - logging every minute's run would be part of what's timed.
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", logging.ERROR))
+    results = run_benchmarks(args.firefighters, args.duration_mins, args.dropout_rate, args.late_arrival_rate,
+                             args.range_exceeded_rate, args.seed, args.engines, args.config, not args.no_memory)
+    with open(args.output, 'w') as file :
+        json.dump(results, file, indent=2)
+    print('Results written to ' + args.output)
+
+    if args.compare :
+        with open(args.compare) as file :
+            old_results = json.load(file)
+        for comparison in compare_results(old_results, results) :
+            print('%-12s %s' % (comparison['engine'], json.dumps(comparison['scenario'])))
+            for name, ratio in sorted(comparison['ratios'].items()) :
+                print('    %-20s x%.2f' % (name, ratio))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+
+
+# Bump whenever what's checkpointed changes, so that checkpoints written by an earlier version are ignored.
+CHECKPOINT_VERSION = 1
+# Default number of minutes between checkpoints.
+DEFAULT_CHECKPOINT_MINS = 5
+
+# Names of the arrays that every checkpoint has.
+VERSION_ARRAY = 'version'
+CONFIGURATION_ARRAY = 'configuration'
+TIMESTAMP_KEY_ARRAY = 'timestamp_key'
+
+# Arrays of strings (e.g. firefighter IDs) are saved as integer codes (-1 for missing) and the strings they stand for.
+CODES_SUFFIX = '.codes'
+STRINGS_SUFFIX = '.strings'
+
+
+# A checkpoint of the state that the analytics keep from minute to minute (e.g. the firefighters' time spans, the
+# running sums and the sensor log cache), saved to a local file - so that after a restart (e.g. a crash or a rolling
+# deploy, with the file on a volume) the analytics can carry on from where they left off, catching up on just the
+# minutes since the checkpoint, instead of re-reading and re-calculating the whole block of sensor readings.
+#
+# The state is a flat dict of named numpy arrays (see frame_to_arrays for dataframes), saved as one uncompressed .npz
+# file - quick to write and read, and loaded without pickle, so a stale or tampered file can't run code. It's written
+# to a temporary file first and then renamed, so that a crash can't leave a partial checkpoint behind.
+#
+# Each checkpoint records the minute key it was saved at and a description of the configuration it was saved with.
+# A checkpoint for a different configuration (or an earlier checkpoint version), or one that can't be read, is
+# ignored - the analytics then start from scratch, as they would without one.
+class AnalyticsCheckpoint(object):
+
+
+    # filename        : The checkpoint file (e.g. on a volume that survives restarts).
+    # configuration   : A string describing everything the state depends on (e.g. the time-windows and gases).
+    # checkpoint_mins : Minutes between checkpoints (see due()).
+    def __init__(self, filename, configuration, checkpoint_mins=DEFAULT_CHECKPOINT_MINS):
+
+        # Get a logger and keep its name in sync with this filename
+        self.logger = logging.getLogger(os.path.basename(__file__))
+
+        assert checkpoint_mins >= 1, "checkpoint_mins must be at least 1, but is %s" % (checkpoint_mins)
+        self.FILENAME = filename
+        self.CONFIGURATION = configuration
+        self.CHECKPOINT_MINS = checkpoint_mins
+        self._saved_timestamp_key = None # the minute key of the latest checkpoint saved (or loaded)
+
+
+    # Whether it's time for another checkpoint - i.e. if there isn't one yet, or the latest is checkpoint_mins old.
+    def due(self, timestamp_key) :
+        return ((self._saved_timestamp_key is None)
+                or (timestamp_key - self._saved_timestamp_key >= pd.Timedelta(minutes=self.CHECKPOINT_MINS)))
+
+
+    # Save the state as of a minute key. Failing to save is logged, but isn't an error - the analytics carry on, and
+    # a restart just catches up from an earlier checkpoint (or starts from scratch).
+    # timestamp_key : The minute key the state is for.
+    # arrays        : The state - a dict of numpy arrays.
+    # Returns whether the checkpoint was saved.
+    def save(self, timestamp_key, arrays) :
+
+        temp_filename = self.FILENAME + '.tmp'
+        try :
+            arrays = _encode_strings(arrays)
+            arrays[VERSION_ARRAY] = np.array(CHECKPOINT_VERSION)
+            arrays[CONFIGURATION_ARRAY] = np.array(self.CONFIGURATION)
+            arrays[TIMESTAMP_KEY_ARRAY] = np.array(timestamp_key.to_datetime64())
+            directory = os.path.dirname(os.path.abspath(self.FILENAME))
+            os.makedirs(directory, exist_ok=True)
+            with open(temp_filename, 'wb') as file :
+                np.savez(file, **arrays)
+            os.replace(temp_filename, self.FILENAME)
+        except Exception :
+            self.logger.exception("Failed to save the analytics checkpoint to %s" % (self.FILENAME))
+            return False
+
+        self._saved_timestamp_key = timestamp_key
+        self.logger.info("Saved the analytics checkpoint for minute key '%s' to %s"
+                         % (timestamp_key.isoformat(), self.FILENAME))
+        return True
+
+
+    # Load the latest checkpoint.
+    # Returns (timestamp_key, arrays) - the minute key it was saved at and the state, as saved - or (None, None) if
+    # there's no checkpoint to use.
+    def load(self) :
+
+        if not os.path.exists(self.FILENAME) :
+            self.logger.info("No analytics checkpoint at %s - starting from scratch" % (self.FILENAME))
+            return None, None
+
+        try :
+            with np.load(self.FILENAME, allow_pickle=False) as npz_file :
+                arrays = {name : npz_file[name] for name in npz_file.files}
+            version = int(arrays.pop(VERSION_ARRAY))
+            configuration = str(arrays.pop(CONFIGURATION_ARRAY))
+            timestamp_key = pd.Timestamp(arrays.pop(TIMESTAMP_KEY_ARRAY)[()])
+            arrays = _decode_strings(arrays)
+        except Exception :
+            self.logger.exception("Failed to read the analytics checkpoint %s - starting from scratch" % (self.FILENAME))
+            return None, None
+
+        if (version != CHECKPOINT_VERSION) or (configuration != self.CONFIGURATION) :
+            self.logger.warning("The analytics checkpoint %s was saved by a different version or configuration - "
+                                "starting from scratch" % (self.FILENAME))
+            return None, None
+
+        self._saved_timestamp_key = timestamp_key
+        self.logger.info("Loaded the analytics checkpoint for minute key '%s' from %s"
+                         % (timestamp_key.isoformat(), self.FILENAME))
+        return timestamp_key, arrays
+
+
+# A dataframe (including its index) as a dict of arrays, for a checkpoint. The index must be named.
+def frame_to_arrays(df) :
+
+    index_names = list(df.index.names)
+    df = df.reset_index()
+    arrays = {'columns' : np.array(df.columns, dtype=str), 'index' : np.array(index_names, dtype=str)}
+    for position, column in enumerate(df.columns) :
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype) :
+            arrays[str(position)] = np.asarray(values, dtype=object)
+        elif (values.dtype == object) and (pd.api.types.infer_dtype(values, skipna=True) in ('datetime', 'datetime64')) :
+            # Python datetimes (e.g. read from a database) are saved as numpy ones.
+            arrays[str(position)] = pd.to_datetime(values).to_numpy()
+        else :
+            arrays[str(position)] = values.to_numpy()
+    return arrays
+
+
+# The dataframe that frame_to_arrays saved.
+def frame_from_arrays(arrays) :
+    columns = [str(column) for column in arrays['columns']]
+    df = pd.DataFrame({column : arrays[str(position)] for position, column in enumerate(columns)}, columns=columns)
+    return df.set_index([str(name) for name in arrays['index']])
+
+
+# Save a dataframe (see frame_to_arrays) to a file of its own - e.g. results waiting to be written - in the same
+# data-only format as a checkpoint.
+# file : The file (or filename) to save it to.
+def save_frame(file, df) :
+    np.savez(file, **_encode_strings(frame_to_arrays(df)))
+
+
+# The dataframe that save_frame saved to a file (loaded without pickle).
+def load_frame(filename) :
+    with np.load(filename, allow_pickle=False) as npz_file :
+        return frame_from_arrays(_decode_strings({name : npz_file[name] for name in npz_file.files}))
+
+
+# The arrays whose names start with a prefix (e.g. one component's state), without the prefix.
+def arrays_with_prefix(prefix, arrays) :
+    return {name[len(prefix):] : array for name, array in arrays.items() if name.startswith(prefix)}
+
+
+# The arrays with a prefix added to their names (e.g. to keep components' states apart).
+def add_prefix(prefix, arrays) :
+    return {prefix + name : array for name, array in arrays.items()}
+
+
+# Replace object arrays (which np.load can't read without pickle) with integer codes and the strings they stand for.
+def _encode_strings(arrays) :
+
+    encoded_arrays = {}
+    for name, array in arrays.items() :
+        if array.dtype != object :
+            encoded_arrays[name] = array
+            continue
+        codes, strings = pd.factorize(array)
+        if pd.api.types.infer_dtype(strings, skipna=True) not in ('string', 'empty') :
+            raise TypeError("Can't checkpoint '%s' - only strings can be saved from object arrays" % (name))
+        encoded_arrays[name + CODES_SUFFIX] = codes
+        encoded_arrays[name + STRINGS_SUFFIX] = np.array(strings, dtype=str)
+    return encoded_arrays
+
+
+# The object arrays that _encode_strings encoded (with None for missing values).
+def _decode_strings(arrays) :
+
+    decoded_arrays = {}
+    for name, array in arrays.items() :
+        if name.endswith(STRINGS_SUFFIX) :
+            continue
+        if not name.endswith(CODES_SUFFIX) :
+            decoded_arrays[name] = array
+            continue
+        name = name[:-len(CODES_SUFFIX)]
+        strings = np.append(arrays[name + STRINGS_SUFFIX].astype(object), None) # code -1 -> None
+        decoded_arrays[name] = strings[array]
+    return decoded_arrays
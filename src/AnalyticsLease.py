@@ -0,0 +1,115 @@
+import os
+import logging
+import socket
+import pandas as pd
+import sqlalchemy
+
+try :
+    from .DatabaseFrames import select
+except ImportError :
+    from DatabaseFrames import select
+
+
+# Database constants
+LEASE_TABLE = 'analytics_lease'
+LEASE_NAME_COL = 'lease_name'
+HOLDER_ID_COL = 'holder_id'
+EXPIRES_AT_COL = 'expires_at'
+
+# The lease for running the scheduled analytics.
+SCHEDULER_LEASE_NAME = 'analytics_scheduler'
+# Default number of seconds a lease lasts unless it's renewed - a few analytics runs, so a holder that's a little late
+# doesn't lose it, but one that has died is replaced within a few minutes.
+DEFAULT_LEASE_SECONDS = 180
+# An expiry time for leases that nobody holds.
+_EXPIRED = pd.Timestamp('2000-01-01 00:00:00').to_pydatetime()
+
+_METADATA = sqlalchemy.MetaData()
+_LEASES = sqlalchemy.Table(LEASE_TABLE, _METADATA,
+                           sqlalchemy.Column(LEASE_NAME_COL, sqlalchemy.types.VARCHAR(length=50), primary_key=True),
+                           sqlalchemy.Column(HOLDER_ID_COL, sqlalchemy.types.VARCHAR(length=100)),
+                           sqlalchemy.Column(EXPIRES_AT_COL, sqlalchemy.types.DateTime, nullable=False))
+
+
+# A lease in the database, so that only one process in a deployment does a job (e.g. runs the scheduled analytics),
+# however many web processes, workers or replicas there are - without an external coordination service. The holder
+# renews the lease each time it does the job (acquire()). If it dies, the lease expires and the next process to ask for
+# it takes over.
+#
+# Taking or renewing the lease is a single conditional UPDATE (of a row that's created up-front), so it's atomic in
+# any database. Expiry times are UTC, from the clocks of the processes involved - which only need to agree to within a
+# small part of lease_seconds.
+class AnalyticsLease(object):
+
+
+    # db_engine     : SQLAlchemy engine for the Prometeo database.
+    # lease_name    : The name of the lease (one per job).
+    # holder_id     : Identifies this process to the others - defaults to the host name and process ID.
+    # lease_seconds : How long the lease lasts unless it's renewed.
+    def __init__(self, db_engine, lease_name=SCHEDULER_LEASE_NAME, holder_id=None, lease_seconds=DEFAULT_LEASE_SECONDS):
+
+        # Get a logger and keep its name in sync with this filename
+        self.logger = logging.getLogger(os.path.basename(__file__))
+
+        self._db_engine = db_engine
+        self.LEASE_NAME = lease_name
+        self.HOLDER_ID = holder_id if holder_id is not None else '%s-%s' % (socket.gethostname(), os.getpid())
+        self.LEASE = pd.Timedelta(seconds = lease_seconds)
+        self._held_until = None
+
+        # Make sure the lease's row exists (another process may be creating it at the same time).
+        _METADATA.create_all(db_engine, tables=[_LEASES], checkfirst=True)
+        try :
+            with db_engine.begin() as connection :
+                connection.execute(_LEASES.insert().values({LEASE_NAME_COL : lease_name, HOLDER_ID_COL : None,
+                                                            EXPIRES_AT_COL : _EXPIRED}))
+        except sqlalchemy.exc.IntegrityError :
+            pass
+
+
+    # Take the lease if it's free (or has expired), or renew it if this process already holds it.
+    # Returns whether this process holds the lease.
+    def acquire(self) :
+
+        now = pd.Timestamp.utcnow().tz_convert(None)
+        expires_at = now + self.LEASE
+        with self._db_engine.begin() as connection :
+            result = connection.execute(_LEASES.update()
+                                        .where(_LEASES.c[LEASE_NAME_COL] == self.LEASE_NAME)
+                                        .where(sqlalchemy.or_(_LEASES.c[HOLDER_ID_COL] == self.HOLDER_ID,
+                                                              _LEASES.c[EXPIRES_AT_COL] < now.to_pydatetime()))
+                                        .values({HOLDER_ID_COL : self.HOLDER_ID,
+                                                 EXPIRES_AT_COL : expires_at.to_pydatetime()}))
+        acquired = result.rowcount > 0
+        if acquired and not self.held :
+            self.logger.info("%s has taken the '%s' lease" % (self.HOLDER_ID, self.LEASE_NAME))
+        elif self.held and not acquired :
+            self.logger.warning("%s has lost the '%s' lease" % (self.HOLDER_ID, self.LEASE_NAME))
+        self._held_until = expires_at if acquired else None
+        return acquired
+
+
+    # Whether this process holds the lease (as of the last acquire()).
+    @property
+    def held(self) :
+        return (self._held_until is not None) and (pd.Timestamp.utcnow().tz_convert(None) < self._held_until)
+
+
+    # The process that holds the lease (None if nobody does).
+    def holder(self) :
+        with self._db_engine.connect() as connection :
+            row = connection.execute(select(_LEASES.c[HOLDER_ID_COL], _LEASES.c[EXPIRES_AT_COL])
+                                     .where(_LEASES.c[LEASE_NAME_COL] == self.LEASE_NAME)).fetchone()
+        if (row is None) or (pd.Timestamp(row[1]) <= pd.Timestamp.utcnow().tz_convert(None)) :
+            return None
+        return row[0]
+
+
+    # Give the lease up (if this process holds it), so another process can take over straight away - e.g. at shutdown.
+    def release(self) :
+        with self._db_engine.begin() as connection :
+            connection.execute(_LEASES.update()
+                               .where(_LEASES.c[LEASE_NAME_COL] == self.LEASE_NAME)
+                               .where(_LEASES.c[HOLDER_ID_COL] == self.HOLDER_ID)
+                               .values({HOLDER_ID_COL : None, EXPIRES_AT_COL : _EXPIRED}))
+        self._held_until = None
@@ -0,0 +1,121 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+# All metric names start with this.
+METRIC_PREFIX = 'prometeo_analytics_'
+
+# Help text for each metric (any others are still exported, without help).
+METRIC_HELP = {
+    'stage_seconds'                : 'Time spent in each stage of the analytics.',
+    'stage_last_seconds'           : 'Time spent in each stage of the analytics, the last time it ran.',
+    'runs_total'                   : 'Number of analytics runs.',
+    'sensor_records_read_total'    : 'Number of sensor records analysed.',
+    'firefighters'                 : 'Number of firefighters with results in the last analytics run.',
+    'results_total'                : 'Number of analytic results produced (including recomputed ones).',
+    'rows_written_total'           : 'Number of analytic results rows written to the database.',
+    'write_backlog_frames'         : 'Number of analytic results frames waiting to be written to the database.',
+    'scheduler_lag_seconds'        : 'How late the last scheduled analytics run finished, after the time it was scheduled for.',
+    'scheduler_missed_runs_total'  : 'Number of scheduled analytics runs that were missed.',
+    'missed_minutes_total'         : 'Number of minutes the analytics missed (e.g. after an overrunning run or a restart).',
+    'caught_up_minutes_total'      : 'Number of missed minutes the analytics caught up on.',
+    'scheduler_lease_held'         : 'Whether this process holds the lease to run the scheduled analytics (1) or not (0).',
+    'shard_index'                  : 'The shard of firefighters this analytics worker is analysing (from 0).',
+    'shard_count'                  : 'The number of analytics workers sharing the firefighters between them.',
+    'db_pool_checkouts_total'      : 'Number of database connections taken from the connection pool.',
+    'db_pool_wait_seconds_total'   : 'Time spent waiting for a database connection from the connection pool.',
+    'db_pool_timeouts_total'       : 'Number of times no database connection was free before the pool timeout.',
+    'db_pool_size'                 : 'Number of database connections the connection pool keeps open.',
+    'db_pool_checked_out'          : 'Number of database connections in use.',
+    'db_pool_checked_in'           : 'Number of open database connections that are free.',
+    'db_pool_overflow'             : 'Number of database connections open beyond the pool size.',
+}
+
+
+# Lightweight instrumentation for the analytics - cheap enough to leave on in production (a clock read and a dict
+# update per stage, per minute). Stage timings are kept as Prometheus 'summaries' (a count and a total, labelled by
+# stage - e.g. read, resample, windows, status, commit, write), alongside counters and gauges, and exported in the
+# Prometheus text format for the /metrics endpoint.
+class AnalyticsMetrics(object):
+
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        # {stage : [count, total seconds, last seconds]}
+        self._stage_seconds = {}
+        self._counters = {}
+        self._gauges = {}
+
+
+    # Time a stage of the analytics, e.g. 'with metrics.time('read') : ...'
+    @contextmanager
+    def time(self, stage) :
+        start_time = time.perf_counter()
+        try :
+            yield
+        finally :
+            self.observe(stage, time.perf_counter() - start_time)
+
+
+    # Record the time spent in a stage.
+    def observe(self, stage, seconds) :
+        with self._lock :
+            stage_seconds = self._stage_seconds.setdefault(stage, [0, 0.0, 0.0])
+            stage_seconds[0] += 1
+            stage_seconds[1] += seconds
+            stage_seconds[2] = seconds
+
+
+    # Add to a counter.
+    def increment(self, counter, value=1) :
+        with self._lock :
+            self._counters[counter] = self._counters.get(counter, 0) + value
+
+
+    # Set a gauge.
+    def set_gauge(self, gauge, value) :
+        with self._lock :
+            self._gauges[gauge] = value
+
+
+    # The total time spent in a stage and the number of times it ran (zero if it hasn't).
+    def stage_seconds(self, stage) :
+        with self._lock :
+            count, total_seconds, _ = self._stage_seconds.get(stage, [0, 0.0, 0.0])
+            return total_seconds, count
+
+
+    # The value of a counter or a gauge (None if it hasn't been recorded).
+    def value(self, name) :
+        with self._lock :
+            return self._counters.get(name, self._gauges.get(name))
+
+
+    # All metrics, in the Prometheus text exposition format.
+    def to_prometheus_text(self) :
+
+        lines = []
+        def describe(name, metric_type) :
+            if name in METRIC_HELP :
+                lines.append('# HELP %s%s %s' % (METRIC_PREFIX, name, METRIC_HELP[name]))
+            lines.append('# TYPE %s%s %s' % (METRIC_PREFIX, name, metric_type))
+
+        with self._lock :
+            if self._stage_seconds :
+                describe('stage_seconds', 'summary')
+                for stage, (count, total_seconds, _) in sorted(self._stage_seconds.items()) :
+                    lines.append('%sstage_seconds_sum{stage="%s"} %r' % (METRIC_PREFIX, stage, total_seconds))
+                    lines.append('%sstage_seconds_count{stage="%s"} %d' % (METRIC_PREFIX, stage, count))
+                describe('stage_last_seconds', 'gauge')
+                for stage, (_, _, last_seconds) in sorted(self._stage_seconds.items()) :
+                    lines.append('%sstage_last_seconds{stage="%s"} %r' % (METRIC_PREFIX, stage, last_seconds))
+            for name, value in sorted(self._counters.items()) :
+                describe(name, 'counter')
+                lines.append('%s%s %r' % (METRIC_PREFIX, name, value))
+            for name, value in sorted(self._gauges.items()) :
+                describe(name, 'gauge')
+                lines.append('%s%s %r' % (METRIC_PREFIX, name, float(value)))
+
+        return '\n'.join(lines) + '\n'
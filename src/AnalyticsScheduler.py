@@ -0,0 +1,100 @@
+import os
+import logging
+from datetime import datetime, timezone
+from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
+
+
+# How often the analytics run.
+ANALYTICS_FREQUENCY_SECONDS = 60
+
+
+# Runs the analytics once a minute - in one process per deployment. Each process that could run them (analytics
+# workers, and web processes if they're allowed to) asks for the scheduler lease (see AnalyticsLease) every minute.
+# The one that holds it runs the analytics. The others stand by, and take over if the holder dies and the lease expires.
+# Without a lease (e.g. with in-memory storage, which can't be shared anyway) the analytics always run.
+#
+# Each run catches up on any minutes missed since the last one (see run_analytics_catching_up) - e.g. after a run that
+# overran, a stall, or taking over the lease from a worker that died. Runs never overlap: a run that comes due while
+# the last one is still going is skipped, and runs that were missed (e.g. while the process was suspended) are
+# coalesced into one - either way, the next run catches up on the minutes in one pass.
+#
+# Alternatively, for incidents too big for one process, analytics workers can share the firefighters between them
+# (see ShardMembership) - each one analysing its own shard every minute, instead of one worker analysing everyone.
+class AnalyticsScheduler(object):
+
+
+    # analytics  : The GasExposureAnalytics to run.
+    # lease      : The AnalyticsLease to hold while running the analytics (None to always run them).
+    # on_results : Called with each run's analytic results (which may be None, or span several minutes when catching
+    #              up) - e.g. to push them to clients.
+    # on_standby : Called each minute that another process holds the lease, instead of running the analytics.
+    # membership : The ShardMembership to get this process's shard of the firefighters from each minute (None to
+    #              analyse everyone). Use instead of a lease.
+    def __init__(self, analytics, lease=None, on_results=None, on_standby=None, membership=None):
+
+        # Get a logger and keep its name in sync with this filename
+        self.logger = logging.getLogger(os.path.basename(__file__))
+
+        self.ANALYTICS = analytics
+        self.LEASE = lease
+        self._on_results = on_results
+        self._on_standby = on_standby
+        self.MEMBERSHIP = membership
+        self._scheduler = None
+
+
+    # Run the analytics for the last minute (and any missed minutes), if this process holds the lease (or can take it).
+    # Returns whether the analytics ran.
+    def run_once(self) :
+
+        if (self.LEASE is not None) and (not self.LEASE.acquire()) :
+            self.ANALYTICS.METRICS.set_gauge('scheduler_lease_held', 0)
+            self.logger.info("Standing by - the analytics are running in %s" % (self.LEASE.holder()))
+            if self._on_standby is not None :
+                self._on_standby()
+            return False
+
+        self.ANALYTICS.METRICS.set_gauge('scheduler_lease_held', 1)
+        shard = None
+        if self.MEMBERSHIP is not None :
+            shard = self.MEMBERSHIP.refresh()
+            self.ANALYTICS.METRICS.set_gauge('shard_index', shard.SHARD_INDEX)
+            self.ANALYTICS.METRICS.set_gauge('shard_count', shard.SHARD_COUNT)
+        self.logger.info('Running analytics')
+        analytics_df = self.ANALYTICS.run_analytics_catching_up(shard=shard)
+        if self._on_results is not None :
+            self._on_results(analytics_df)
+        return True
+
+
+    # Record how far behind schedule the analytics are running (see /metrics).
+    def _record_scheduler_metrics(self, event) :
+        if event.code in (EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES) :
+            self.ANALYTICS.METRICS.increment('scheduler_missed_runs_total')
+        else :
+            self.ANALYTICS.METRICS.set_gauge('scheduler_lag_seconds',
+                                             (datetime.now(timezone.utc) - event.scheduled_run_time).total_seconds())
+
+
+    # Start running once a minute.
+    # scheduler : An APScheduler scheduler - e.g. a BackgroundScheduler in a web process, or a BlockingScheduler in a
+    #             dedicated worker (in which case this doesn't return until the scheduler is shut down).
+    def start(self, scheduler) :
+        self._scheduler = scheduler
+        scheduler.add_job(func=self.run_once, trigger="interval", seconds=ANALYTICS_FREQUENCY_SECONDS,
+                          coalesce=True, max_instances=1, misfire_grace_time=ANALYTICS_FREQUENCY_SECONDS)
+        scheduler.add_listener(self._record_scheduler_metrics,
+                               EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+        scheduler.start()
+
+
+    # Stop running, write any analytic results that are still waiting to be written, and give up the lease (or this
+    # process's shard) so that other processes can take over straight away.
+    def shutdown(self) :
+        if (self._scheduler is not None) and self._scheduler.running :
+            self._scheduler.shutdown()
+        self.ANALYTICS.close()
+        if (self.LEASE is not None) and self.LEASE.held :
+            self.LEASE.release()
+        if self.MEMBERSHIP is not None :
+            self.MEMBERSHIP.leave()
@@ -0,0 +1,159 @@
+import os
+import logging
+import socket
+import zlib
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+try :
+    from .DatabaseFrames import select
+except ImportError :
+    from DatabaseFrames import select
+
+
+# Database constants
+WORKERS_TABLE = 'analytics_workers'
+WORKER_ID_COL = 'worker_id'
+EXPIRES_AT_COL = 'expires_at'
+FIREFIGHTER_ID_COL = 'firefighter_id'
+
+# Default number of seconds a worker stays a member without a heartbeat - a few analytics runs, so a worker that's a
+# little late keeps its shard, but the shards of one that has died are taken over within a few minutes.
+DEFAULT_MEMBERSHIP_SECONDS = 180
+
+_METADATA = sqlalchemy.MetaData()
+_WORKERS = sqlalchemy.Table(WORKERS_TABLE, _METADATA,
+                            sqlalchemy.Column(WORKER_ID_COL, sqlalchemy.types.VARCHAR(length=100), primary_key=True),
+                            sqlalchemy.Column(EXPIRES_AT_COL, sqlalchemy.types.DateTime, nullable=False))
+
+
+# The CRC-32 of a firefighter ID (as MariaDB's CRC32() function calculates it).
+def _crc32(firefighter_id) :
+    return zlib.crc32(str(firefighter_id).encode('utf-8'))
+
+
+# Give an SQLite database the CRC32() function that MariaDB has, so that shards can be selected in SQL. Call it before
+# the engine's first connection.
+def register_crc32_function(db_engine) :
+    sqlalchemy.event.listen(db_engine, 'connect', _create_crc32_function)
+
+def _create_crc32_function(dbapi_connection, _) :
+    dbapi_connection.create_function('CRC32', 1, lambda firefighter_id : (None if firefighter_id is None
+                                                                          else _crc32(firefighter_id)))
+
+
+# One shard of the firefighters - those whose ID hashes (CRC-32, modulo the number of shards) to the shard's index.
+# Every firefighter is in exactly one shard, so workers that each analyse one shard between them analyse everyone,
+# and their results never overlap.
+class ShardAssignment(object):
+
+
+    # shard_index : This shard, from 0 to shard_count - 1.
+    # shard_count : The number of shards.
+    def __init__(self, shard_index, shard_count):
+
+        assert 0 <= shard_index < shard_count, \
+            "shard_index must be from 0 to %s, but is %s" % (shard_count - 1, shard_index)
+        self.SHARD_INDEX = shard_index
+        self.SHARD_COUNT = shard_count
+
+
+    def __eq__(self, other) :
+        return (isinstance(other, ShardAssignment) and (self.SHARD_INDEX == other.SHARD_INDEX)
+                and (self.SHARD_COUNT == other.SHARD_COUNT))
+
+    def __ne__(self, other) :
+        return not self.__eq__(other)
+
+    def __repr__(self) :
+        return 'ShardAssignment(%s, %s)' % (self.SHARD_INDEX, self.SHARD_COUNT)
+
+
+    # Whether each of a set of firefighters is in this shard. Returns a boolean array.
+    def owns(self, firefighter_ids) :
+        firefighter_ids = pd.Series(firefighter_ids, dtype=object)
+        if self.SHARD_COUNT == 1 :
+            return np.ones(len(firefighter_ids.index), dtype=bool)
+        # Hash each firefighter once (there are far fewer firefighters than sensor records).
+        unique_ids = firefighter_ids.unique()
+        owned_ids = [firefighter_id for firefighter_id in unique_ids
+                     if (_crc32(firefighter_id) % self.SHARD_COUNT) == self.SHARD_INDEX]
+        return firefighter_ids.isin(owned_ids).to_numpy()
+
+
+    # Only the sensor records (or results) of the firefighters in this shard.
+    # df : A dataframe with a firefighter ID column (or index level).
+    def filter(self, df) :
+        if FIREFIGHTER_ID_COL in df.columns :
+            return df.loc[self.owns(df[FIREFIGHTER_ID_COL]), :]
+        return df.loc[self.owns(df.index.get_level_values(FIREFIGHTER_ID_COL)), :]
+
+
+    # An SQL condition that selects the firefighters in this shard, for a database that has a CRC32() function (MariaDB
+    # and MySQL, and SQLite with register_crc32_function) - or None if it doesn't (filter the records in memory instead).
+    # db_engine             : SQLAlchemy engine (or connection) for the database.
+    # firefighter_id_column : The SQLAlchemy column to select on.
+    def sql_condition(self, db_engine, firefighter_id_column) :
+        db_engine = db_engine.engine
+        has_crc32 = ((db_engine.dialect.name == 'mysql')
+                     or ((db_engine.dialect.name == 'sqlite')
+                         and sqlalchemy.event.contains(db_engine, 'connect', _create_crc32_function)))
+        if not has_crc32 :
+            return None
+        return (sqlalchemy.func.crc32(firefighter_id_column) % self.SHARD_COUNT) == self.SHARD_INDEX
+
+
+# Membership of the group of analytics workers that share the firefighters between them, kept in the database (so no
+# external coordination service is needed). Each worker sends a heartbeat every minute (refresh()), and is given a
+# shard by its place among the live workers, ordered by ID. When a worker joins, leaves (or dies, and its membership
+# expires), the shards are rebalanced over the workers that remain - each picks up its new shard at its next refresh.
+# (While the workers pick up a change, a firefighter can briefly be analysed by two of them - their results are the
+# same, and are upserted, so this does no harm.)
+class ShardMembership(object):
+
+
+    # db_engine          : SQLAlchemy engine for the Prometeo database.
+    # worker_id          : Identifies this worker to the others - defaults to the host name and process ID.
+    # membership_seconds : How long a worker stays a member without a heartbeat.
+    def __init__(self, db_engine, worker_id=None, membership_seconds=DEFAULT_MEMBERSHIP_SECONDS):
+
+        # Get a logger and keep its name in sync with this filename
+        self.logger = logging.getLogger(os.path.basename(__file__))
+
+        self._db_engine = db_engine
+        self.WORKER_ID = worker_id if worker_id is not None else '%s-%s' % (socket.gethostname(), os.getpid())
+        self.MEMBERSHIP = pd.Timedelta(seconds = membership_seconds)
+        self._shard = None
+
+        _METADATA.create_all(db_engine, tables=[_WORKERS], checkfirst=True)
+
+
+    # Send a heartbeat (joining the group if need be), and get this worker's current shard.
+    # Returns a ShardAssignment.
+    def refresh(self) :
+
+        now = pd.Timestamp.utcnow().tz_convert(None)
+        expires_at = (now + self.MEMBERSHIP).to_pydatetime()
+        with self._db_engine.begin() as connection :
+            result = connection.execute(_WORKERS.update().where(_WORKERS.c[WORKER_ID_COL] == self.WORKER_ID)
+                                        .values({EXPIRES_AT_COL : expires_at}))
+            if result.rowcount == 0 :
+                connection.execute(_WORKERS.insert().values({WORKER_ID_COL : self.WORKER_ID, EXPIRES_AT_COL : expires_at}))
+            # Forget workers that have died.
+            connection.execute(_WORKERS.delete().where(_WORKERS.c[EXPIRES_AT_COL] < now.to_pydatetime()))
+            worker_ids = [row[0] for row in connection.execute(
+                select(_WORKERS.c[WORKER_ID_COL]).order_by(_WORKERS.c[WORKER_ID_COL]))]
+
+        shard = ShardAssignment(worker_ids.index(self.WORKER_ID), len(worker_ids))
+        if shard != self._shard :
+            self.logger.info("%s is analysing shard %s of %s" % (self.WORKER_ID, shard.SHARD_INDEX + 1, shard.SHARD_COUNT))
+        self._shard = shard
+        return shard
+
+
+    # Leave the group, so that the other workers take over this worker's firefighters straight away - e.g. at shutdown.
+    def leave(self) :
+        with self._db_engine.begin() as connection :
+            connection.execute(_WORKERS.delete().where(_WORKERS.c[WORKER_ID_COL] == self.WORKER_ID))
+        self._shard = None
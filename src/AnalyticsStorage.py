@@ -0,0 +1,310 @@
+import os
+import logging
+import time
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from sqlalchemy.pool import StaticPool
+
+try :
+    from .AnalyticsWriter import AnalyticsWriter, DEFAULT_BATCH_SIZE
+    from .DatabasePool import create_db_engine, pool_settings_from_env
+    from .AnalyticsShards import register_crc32_function
+    from .DatabaseFrames import read_frame, write_frame, select
+except ImportError :
+    from AnalyticsWriter import AnalyticsWriter, DEFAULT_BATCH_SIZE
+    from DatabasePool import create_db_engine, pool_settings_from_env
+    from AnalyticsShards import register_crc32_function
+    from DatabaseFrames import read_frame, write_frame, select
+
+
+# Database constants (in sync with GasExposureAnalytics)
+SENSOR_LOG_TABLE = 'firefighter_sensor_log'
+FIREFIGHTER_ID_COL = 'firefighter_id'
+FIREFIGHTER_ID_COL_TYPE = sqlalchemy.types.VARCHAR(length=20)
+TIMESTAMP_COL = 'timestamp_mins'
+
+# SQL expressions for the sensor log (see SensorLogCache).
+SENSOR_LOG = sqlalchemy.table(SENSOR_LOG_TABLE)
+SENSOR_LOG_TIMESTAMP = sqlalchemy.column(TIMESTAMP_COL, sqlalchemy.types.DateTime)
+SENSOR_LOG_FIREFIGHTER_ID = sqlalchemy.column(FIREFIGHTER_ID_COL)
+
+# Environment variable for the storage URL (see create_storage).
+STORAGE_URL_ENV_VAR = 'PROMETEO_STORAGE_URL'
+# Storage URL for in-memory storage that doesn't need a database (InMemoryStorage).
+IN_MEMORY_STORAGE_URL = 'memory://'
+# Storage URL prefix for a Parquet dataset (ParquetStorage).
+PARQUET_STORAGE_URL_PREFIX = 'parquet://'
+
+
+# A narrow, typed copy of some sensor records - just the firefighter IDs (as a category) and the given gases (as
+# floats), with the same (time) index. This is all the time-weighted averages need, without the other columns (e.g.
+# temperature, humidity, device IDs) being carried through every step.
+def typed_sensor_readings(sensor_log_df, gases) :
+    if sensor_log_df.empty :
+        # (An empty sensor log - e.g. in-memory storage before any records arrive - may not have the columns yet.)
+        sensor_log_df = sensor_log_df.reindex(columns=[FIREFIGHTER_ID_COL] + list(gases))
+    typed_df = sensor_log_df.loc[:, gases].astype(float)
+    typed_df.insert(0, FIREFIGHTER_ID_COL, sensor_log_df[FIREFIGHTER_ID_COL].astype('category'))
+    return typed_df
+
+
+# Where the analytics read the sensor log from and write their results to. There are three implementations:
+#   DatabaseStorage : Any database SQLAlchemy can connect to - e.g. the MariaDB server, or an embedded SQLite (or
+#                     DuckDB) file for deployments without a database server (e.g. on a laptop in the command vehicle).
+#   InMemoryStorage : pandas dataframes - e.g. for running from CSV files, and for benchmarks.
+#   ParquetStorage  : A Parquet dataset - e.g. for replaying archives of past incidents (see ParquetStorage).
+# Use create_storage to get one from a URL.
+class AnalyticsStorage(object):
+
+    # SQLAlchemy engine for the database (None for storage that isn't a database). Other components that query the
+    # database directly (e.g. SensorLogCache, StatusReader) use this.
+    db_engine = None
+
+
+    # Read all sensor log records with timestamps in [block_start, block_end] (inclusive). Returns a time-indexed
+    # dataframe (which may not be sorted).
+    # firefighter_ids : Only read these firefighters' records (defaults to everyone's).
+    # shard           : Only read the records of the firefighters in this ShardAssignment (defaults to everyone's).
+    # gases           : Only read the firefighter IDs and these gases - e.g. for the time-weighted averages, which
+    #                   need nothing else (see typed_sensor_readings). Defaults to every column.
+    def read_sensor_log(self, block_start, block_end, firefighter_ids=None, shard=None, gases=None) :
+        raise NotImplementedError
+
+
+    # Whether there's a sensor log to read yet (a new embedded database has none until the first records are written).
+    def sensor_log_exists(self) :
+        return True
+
+
+    # Add records to the sensor log (normally the devices' job - useful for local deployments and testing).
+    # sensor_log_df : A time-indexed dataframe of sensor records.
+    def write_sensor_log(self, sensor_log_df) :
+        raise NotImplementedError
+
+
+    # Write (upsert) analytic results, keyed on [firefighter_id, timestamp_mins]. Returns the number of rows written.
+    def write(self, analytics_df) :
+        raise NotImplementedError
+
+
+    # Release any resources (e.g. database connections).
+    def close(self) :
+        pass
+
+
+# Storage in a database - reads the sensor log table and writes results with an AnalyticsWriter.
+class DatabaseStorage(AnalyticsStorage):
+
+
+    # db_engine  : SQLAlchemy engine for the Prometeo database.
+    # batch_size : Maximum number of rows per INSERT when writing results.
+    # metrics    : AnalyticsMetrics to record write timings and row counts in (optional).
+    def __init__(self, db_engine, batch_size=DEFAULT_BATCH_SIZE, metrics=None):
+
+        # Get a logger and keep its name in sync with this filename
+        self.logger = logging.getLogger(os.path.basename(__file__))
+
+        self.db_engine = db_engine
+        self.ANALYTICS_WRITER = AnalyticsWriter(db_engine, batch_size=batch_size, metrics=metrics)
+        self._sensor_log_exists = False
+
+
+    def sensor_log_exists(self) :
+        if not self._sensor_log_exists :
+            self._sensor_log_exists = SENSOR_LOG_TABLE in sqlalchemy.inspect(self.db_engine).get_table_names()
+        return self._sensor_log_exists
+
+
+    def read_sensor_log(self, block_start, block_end, firefighter_ids=None, shard=None, gases=None) :
+
+        if not self.sensor_log_exists() :
+            return pd.DataFrame(index=pd.DatetimeIndex([], name=TIMESTAMP_COL))
+
+        # Non-blocking read (this type of SELECT is non-blocking on MariaDB/InnoDB - ref:
+        # https://dev.mysql.com/doc/refman/8.0/en/innodb-consistent-read.html)
+        # For just the gases, the timestamps are read as seconds since the epoch where the database can work them out,
+        # so that they're converted in one go rather than parsed one by one.
+        epoch_seconds = self._epoch_seconds(SENSOR_LOG_TIMESTAMP) if gases is not None else None
+        if gases is None :
+            columns = [sqlalchemy.literal_column('*')]
+        else :
+            columns = ([SENSOR_LOG_FIREFIGHTER_ID,
+                        SENSOR_LOG_TIMESTAMP if epoch_seconds is None else epoch_seconds.label(TIMESTAMP_COL)]
+                       + [sqlalchemy.column(gas) for gas in gases])
+        sql = (select(*columns).select_from(SENSOR_LOG)
+               .where(SENSOR_LOG_TIMESTAMP.between(block_start.to_pydatetime(), block_end.to_pydatetime())))
+        if firefighter_ids is not None :
+            sql = sql.where(SENSOR_LOG_FIREFIGHTER_ID.in_(list(firefighter_ids)))
+        # Select the shard in the database if it can, and otherwise once the records are read.
+        shard_condition = shard.sql_condition(self.db_engine, SENSOR_LOG_FIREFIGHTER_ID) if shard is not None else None
+        if shard_condition is not None :
+            sql = sql.where(shard_condition)
+        if epoch_seconds is None :
+            sensor_log_df = read_frame(self.db_engine, sql, parse_dates=[TIMESTAMP_COL], index_col=TIMESTAMP_COL)
+        else :
+            sensor_log_df = read_frame(self.db_engine, sql)
+            sensor_log_df = sensor_log_df.set_index(pd.DatetimeIndex(
+                pd.to_datetime(sensor_log_df.pop(TIMESTAMP_COL).to_numpy(dtype=np.int64), unit='s'), name=TIMESTAMP_COL))
+        if (shard is not None) and (shard_condition is None) :
+            sensor_log_df = shard.filter(sensor_log_df)
+        return sensor_log_df if gases is None else typed_sensor_readings(sensor_log_df, gases)
+
+
+    # The seconds since the epoch of a timestamp, in this database's SQL (None if it's not one this knows the SQL for).
+    def _epoch_seconds(self, timestamp) :
+        if self.db_engine.dialect.name == 'sqlite' :
+            return sqlalchemy.cast(sqlalchemy.func.strftime('%s', timestamp), sqlalchemy.types.BigInteger)
+        if self.db_engine.dialect.name == 'mysql' :
+            # (Not UNIX_TIMESTAMP(), which depends on the session time zone.)
+            return sqlalchemy.func.timestampdiff(sqlalchemy.text('SECOND'), '1970-01-01 00:00:00', timestamp)
+        return None
+
+
+    def write_sensor_log(self, sensor_log_df) :
+        write_frame(sensor_log_df, SENSOR_LOG_TABLE, self.db_engine, if_exists='append', index_label=TIMESTAMP_COL,
+                    dtype={FIREFIGHTER_ID_COL : FIREFIGHTER_ID_COL_TYPE})
+        self._sensor_log_exists = True
+
+
+    def write(self, analytics_df) :
+        return self.ANALYTICS_WRITER.write(analytics_df)
+
+
+    def close(self) :
+        self.db_engine.dispose()
+
+
+# Storage in memory, with no database - the sensor log and the results are held in dataframes (and lost on exit).
+class InMemoryStorage(AnalyticsStorage):
+
+
+    # sensor_log_df : The sensor log - a time-indexed dataframe of sensor records (optional).
+    # metrics       : AnalyticsMetrics to record write timings and row counts in (optional).
+    def __init__(self, sensor_log_df=None, metrics=None):
+
+        self._metrics = metrics
+        self._sensor_log_df = pd.DataFrame(index=pd.DatetimeIndex([], name=TIMESTAMP_COL))
+        # The results written so far, keyed on [firefighter_id, timestamp_mins] (None until there are any).
+        self._analytics_df = None
+        if sensor_log_df is not None :
+            self.write_sensor_log(sensor_log_df)
+
+
+    # In-memory storage with the sensor log from a set of CSV files (e.g. known sensor test data).
+    # list_of_csv_files : A CSV file path, or a list of them.
+    @classmethod
+    def from_csv_files(cls, list_of_csv_files, metrics=None) :
+
+        # Allow clients to pass either single (non-list) CSV file path, or a list of CSV file paths
+        if not isinstance(list_of_csv_files, list) : list_of_csv_files = [list_of_csv_files]
+        dataframes = []
+        for csv_file in list_of_csv_files :
+            df = pd.read_csv(csv_file, engine='python', parse_dates=[TIMESTAMP_COL], index_col = TIMESTAMP_COL)
+            assert FIREFIGHTER_ID_COL in df.columns, "CSV file %s is missing key column %s" % (csv_file, FIREFIGHTER_ID_COL)
+            dataframes.append(df)
+        return cls(pd.concat(dataframes), metrics)
+
+
+    # The whole sensor log (sorted by timestamp).
+    @property
+    def sensor_log_df(self) :
+        return self._sensor_log_df
+
+
+    def read_sensor_log(self, block_start, block_end, firefighter_ids=None, shard=None, gases=None) :
+        sensor_log_df = self._sensor_log_df.loc[block_start:block_end,:]
+        if firefighter_ids is not None :
+            sensor_log_df = sensor_log_df.loc[sensor_log_df[FIREFIGHTER_ID_COL].isin(firefighter_ids), :]
+        if shard is not None :
+            sensor_log_df = shard.filter(sensor_log_df)
+        return sensor_log_df.copy() if gases is None else typed_sensor_readings(sensor_log_df, gases)
+
+
+    def write_sensor_log(self, sensor_log_df) :
+        # Keep the log sorted (a stable sort, so records keep their arrival order within each minute), to speed up
+        # reads and enable debug slicing on the index.
+        self._sensor_log_df = pd.concat([self._sensor_log_df, sensor_log_df]).sort_index(kind='mergesort')
+
+
+    def write(self, analytics_df) :
+
+        if (analytics_df is None) or analytics_df.empty :
+            return 0
+        start_time = time.perf_counter()
+        if self._analytics_df is None :
+            self._analytics_df = analytics_df.copy()
+        else :
+            # Upsert - rows for keys that have been written before replace the earlier rows.
+            combined_df = pd.concat([self._analytics_df, analytics_df])
+            self._analytics_df = combined_df.loc[~combined_df.index.duplicated(keep='last'), :]
+        if self._metrics is not None :
+            self._metrics.observe('write', time.perf_counter() - start_time)
+            self._metrics.increment('rows_written_total', len(analytics_df.index))
+        return len(analytics_df.index)
+
+
+    # The results written so far, sorted by [firefighter_id, timestamp_mins] (None if there aren't any).
+    def analytics(self) :
+        return None if self._analytics_df is None else self._analytics_df.sort_index()
+
+
+# Get the storage for a URL:
+#   None or ''             : The MariaDB server set by the MARIADB_USERNAME, MARIADB_PASSWORD, MARIADB_HOST and
+#                            MARIADB_PORT environment variables.
+#   memory://              : InMemoryStorage.
+#   sqlite:///<file path>  : An embedded SQLite database file (created if it doesn't exist).
+#   sqlite://              : An in-memory SQLite database (shared by every thread, lost on exit).
+#   duckdb:///<file path>  : An embedded DuckDB database file (needs the duckdb_engine package).
+#   parquet://<path>       : A Parquet file, or a directory of them (needs the pyarrow package). The results are kept
+#                            in memory.
+#   anything else          : Any other SQLAlchemy database URL.
+# Database servers (MariaDB, and anything else) get a pool of connections, configured by the PROMETEO_DB_POOL_*
+# environment variables (see DatabasePool.pool_settings_from_env).
+# batch_size : Maximum number of rows per INSERT when writing results to a database.
+# metrics    : AnalyticsMetrics to record write timings, row counts and connection pool usage in (optional).
+def create_storage(url=None, batch_size=DEFAULT_BATCH_SIZE, metrics=None) :
+
+    if url == IN_MEMORY_STORAGE_URL :
+        return InMemoryStorage(metrics=metrics)
+    if url and url.startswith(PARQUET_STORAGE_URL_PREFIX) :
+        try :
+            from .ParquetStorage import ParquetStorage
+        except ImportError :
+            from ParquetStorage import ParquetStorage
+        return ParquetStorage(url[len(PARQUET_STORAGE_URL_PREFIX):], metrics=metrics)
+
+    if not url :
+        missing_env_vars = [env_var for env_var in ['MARIADB_USERNAME', 'MARIADB_PASSWORD', 'MARIADB_HOST', 'MARIADB_PORT']
+                            if os.getenv(env_var) is None]
+        if missing_env_vars :
+            raise ValueError("No storage configured - set %s to a storage URL, or set %s for the MariaDB server"
+                             % (STORAGE_URL_ENV_VAR, ', '.join(missing_env_vars)))
+        url = ("mysql+pymysql://"+os.getenv('MARIADB_USERNAME')
+               +":"+os.getenv("MARIADB_PASSWORD")
+               +"@"+os.getenv("MARIADB_HOST")
+               +":"+str(os.getenv("MARIADB_PORT"))
+               +"/prometeo")
+
+    if url.startswith('sqlite:') :
+        # The analytics, the write-behind queue and the app's endpoints all use the database from their own threads.
+        connect_args = {'check_same_thread' : False}
+        if url in ['sqlite://', 'sqlite:///:memory:'] :
+            # One connection, so that every thread sees the same in-memory database.
+            db_engine = sqlalchemy.create_engine(url, connect_args=connect_args, poolclass=StaticPool)
+        else :
+            db_engine = sqlalchemy.create_engine(url, connect_args=connect_args)
+            # Write-ahead logging, so that reads (e.g. the status endpoints) don't wait for writes, or vice versa.
+            sqlalchemy.event.listen(db_engine, 'connect',
+                                    lambda dbapi_connection, _ : dbapi_connection.execute('PRAGMA journal_mode=WAL'))
+        # So that analytics shards can be selected in SQL, as with MariaDB (see AnalyticsShards).
+        register_crc32_function(db_engine)
+    elif url.startswith('duckdb:') :
+        try :
+            db_engine = sqlalchemy.create_engine(url)
+        except sqlalchemy.exc.NoSuchModuleError :
+            raise ValueError("DuckDB storage needs the duckdb_engine package (pip install duckdb-engine)")
+    else :
+        db_engine = create_db_engine(url, metrics=metrics, **pool_settings_from_env())
+
+    return DatabaseStorage(db_engine, batch_size=batch_size, metrics=metrics)
@@ -0,0 +1,225 @@
+import os
+import logging
+import queue
+import tempfile
+import threading
+import time
+import sqlalchemy
+
+try :
+    from .AnalyticsCheckpoint import save_frame, load_frame
+except ImportError :
+    from AnalyticsCheckpoint import save_frame, load_frame
+
+
+# Default maximum number of analytic results frames waiting to be written.
+DEFAULT_MAX_QUEUED_FRAMES = 10
+# Default number of seconds that adding a frame to a full queue will wait for space, before spilling it to file.
+DEFAULT_PUT_TIMEOUT_SECONDS = 5
+# Default number of seconds between attempts to replay spilled frames while the database is unreachable.
+DEFAULT_RETRY_SECONDS = 30
+# The environment variable for the directory to spill frames that couldn't be written to the database to - e.g. on a
+# volume, so that they survive a restart.
+SPILL_DIRECTORY_ENV_VAR = 'PROMETEO_SPILL_DIRECTORY'
+# The spill directory if SPILL_DIRECTORY_ENV_VAR isn't set (on local storage, so only for running locally).
+DEFAULT_SPILL_DIRECTORY = os.path.join(tempfile.gettempdir(), 'prometeo_analytics_spill')
+SPILL_FILE_EXTENSION = '.npz'
+# Spill files (and frames) that can't be written (e.g. corrupt) are renamed with (or saved with) this extension and
+# left for investigation.
+BAD_SPILL_FILE_EXTENSION = '.bad'
+
+# Database errors that mean 'can't reach the database right now' (as opposed to a problem with the data).
+DB_UNREACHABLE_ERRORS = (sqlalchemy.exc.OperationalError, sqlalchemy.exc.InterfaceError)
+
+# Queued after the last frame, to stop the background thread.
+_STOP = object()
+
+
+# A 'write-behind' queue for analytic results, so that slow (or failed) database writes never hold up the next
+# minute's analytics. Finished results frames are added to a bounded in-memory queue and a background thread writes
+# them to the database (with an AnalyticsWriter).
+#
+# Backpressure : If the queue is full (i.e. the database is falling behind), put() waits for space - up to a timeout.
+#                After that, the frame is spilled to file instead of being dropped.
+# Spill        : If the database is unreachable, frames are saved to a 'spill' directory (one file per frame, written
+#                atomically, in the same data-only format as AnalyticsCheckpoint - loaded without pickle, so a tampered
+#                file can't run code), so that they survive a restart. While there are spilled frames, the
+#                background thread retries them (oldest first) every few seconds, and new frames join the back of the
+#                spill, so that results are always written in order. (Each frame is numbered as it's put(), and spill
+#                files are named by that number - so a frame spilled from put() waits for the older frames still in
+#                the queue, which are spilled behind it, in order, rather than being written before them.) Spilled frames left over from a previous run are
+#                replayed at startup. Frames that fail to write for any other reason (a problem with the data) are set
+#                aside in the spill directory for investigation, rather than retried or dropped.
+# Shutdown     : close() (e.g. from an atexit hook) writes everything still queued - or spills it, if the database
+#                is unreachable.
+class AnalyticsWriteQueue(object):
+
+
+    # writer          : The AnalyticsWriter (or AnalyticsStorage) used to write to the database.
+    # max_size        : Maximum number of frames waiting to be written.
+    # put_timeout     : Seconds that put() waits for space in a full queue, before spilling the frame to file.
+    # retry_seconds   : Seconds between attempts to replay spilled frames.
+    # spill_directory : Where to save frames that can't be written to the database. Defaults to the directory in
+    #                   SPILL_DIRECTORY_ENV_VAR (or DEFAULT_SPILL_DIRECTORY, if that isn't set).
+    def __init__(self, writer, max_size=DEFAULT_MAX_QUEUED_FRAMES, put_timeout=DEFAULT_PUT_TIMEOUT_SECONDS,
+                 retry_seconds=DEFAULT_RETRY_SECONDS, spill_directory=None):
+
+        # Get a logger and keep its name in sync with this filename
+        self.logger = logging.getLogger(os.path.basename(__file__))
+
+        self._writer = writer
+        self.PUT_TIMEOUT = put_timeout
+        self.RETRY_SECONDS = retry_seconds
+        self.SPILL_DIRECTORY = spill_directory or os.getenv(SPILL_DIRECTORY_ENV_VAR)
+        if not self.SPILL_DIRECTORY :
+            self.logger.warning("%s isn't set - spilling analytics results to %s, which may not survive a restart"
+                                % (SPILL_DIRECTORY_ENV_VAR, DEFAULT_SPILL_DIRECTORY))
+            self.SPILL_DIRECTORY = DEFAULT_SPILL_DIRECTORY
+        os.makedirs(self.SPILL_DIRECTORY, exist_ok=True)
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._spill_lock = threading.Lock()
+        self._sequence_lock = threading.Lock()
+        self._sequence = 0
+        self._thread = threading.Thread(target=self._write_frames, name='AnalyticsWriteQueue', daemon=True)
+        self._thread.start()
+
+
+    # Queue a frame of analytic results to be written to the database. If the queue is full, waits for space for up
+    # to 'put_timeout' seconds, then spills the frame to file instead.
+    # Returns True if the frame was queued, False if it was spilled.
+    def put(self, analytics_df) :
+
+        frame_key = self._next_frame_key()
+        if not self._thread.is_alive() :
+            self.logger.warning("Analytics write queue is closed - spilling results to file")
+            self._spill(frame_key, analytics_df)
+            return False
+
+        try :
+            self._queue.put((frame_key, analytics_df), timeout=self.PUT_TIMEOUT)
+            return True
+        except queue.Full :
+            self.logger.warning("Analytics write queue is full - spilling results to file")
+            self._spill(frame_key, analytics_df)
+            return False
+
+
+    # A key for the next frame put(), in the order they're put - and after any spilled in a previous run. It names the
+    # frame's spill file, if it's spilled.
+    def _next_frame_key(self) :
+        with self._sequence_lock :
+            self._sequence += 1
+            return '%019d-%06d' % (time.time_ns(), self._sequence)
+
+
+    # The number of frames waiting to be written (queued or spilled).
+    def backlog(self) :
+        return self._queue.qsize() + len(self._spill_files())
+
+
+    # Wait until everything queued so far has been written (or spilled).
+    def flush(self) :
+        self._queue.join()
+
+
+    # Write (or spill) everything still queued, then stop the background thread.
+    # timeout : Maximum seconds to wait for the background thread to finish.
+    def close(self, timeout=None) :
+        if self._thread.is_alive() :
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+
+    # The spill files, oldest first.
+    def _spill_files(self) :
+        return sorted(os.path.join(self.SPILL_DIRECTORY, filename) for filename in os.listdir(self.SPILL_DIRECTORY)
+                      if filename.endswith(SPILL_FILE_EXTENSION))
+
+
+    # Save a frame to the spill directory - written to a temporary file first and then renamed, so that a crash
+    # can't leave a partial spill file behind.
+    # frame_key : The frame's key (from put()), which orders it in the spill.
+    # extension : The spill file's extension - BAD_SPILL_FILE_EXTENSION too, to set the frame aside.
+    def _spill(self, frame_key, analytics_df, extension=SPILL_FILE_EXTENSION) :
+
+        with self._spill_lock :
+            filename = frame_key + extension
+            temp_path = os.path.join(self.SPILL_DIRECTORY, filename + '.tmp')
+            try :
+                with open(temp_path, 'wb') as file :
+                    save_frame(file, analytics_df)
+                os.replace(temp_path, os.path.join(self.SPILL_DIRECTORY, filename))
+            except Exception :
+                # e.g. the volume is full - nowhere left to keep the frame.
+                self.logger.exception("Failed to spill analytics results to %s - discarding them" % (temp_path))
+                if os.path.exists(temp_path) :
+                    os.remove(temp_path)
+
+
+    # Write spilled frames to the database, oldest first, deleting each once it's written.
+    # Returns True if the spill is now empty.
+    def _replay_spill(self) :
+
+        spill_files = self._spill_files()
+        for spill_file in spill_files :
+            try :
+                self._writer.write(load_frame(spill_file))
+            except DB_UNREACHABLE_ERRORS as e :
+                self.logger.warning("Database still unreachable, %s spilled results frames waiting (%s)"
+                                    % (len(self._spill_files()), e))
+                return False
+            except Exception :
+                # Retrying won't help - set the file aside, so that it doesn't block the rest of the spill.
+                self.logger.exception("Failed to write spilled analytics results from %s - renaming it to %s"
+                                      % (spill_file, spill_file + BAD_SPILL_FILE_EXTENSION))
+                os.replace(spill_file, spill_file + BAD_SPILL_FILE_EXTENSION)
+                continue
+            os.remove(spill_file)
+
+        if spill_files :
+            self.logger.info("Replayed %s spilled results frames to the database" % (len(spill_files)))
+        return True
+
+
+    # Write one frame - or spill it, if the database is unreachable. While there are spilled frames (which may be older
+    # or newer than this one), it joins the spill in order, and the spill is replayed.
+    def _write_frame(self, frame_key, analytics_df) :
+
+        if self._spill_files() :
+            self._spill(frame_key, analytics_df)
+            self._replay_spill()
+            return
+
+        try :
+            self._writer.write(analytics_df)
+        except DB_UNREACHABLE_ERRORS as e :
+            self.logger.warning("Database unreachable - spilling results to file (%s)" % (e))
+            self._spill(frame_key, analytics_df)
+        except Exception :
+            # Anything else is a problem with the data itself, so retrying won't help - set the frame aside (as
+            # _replay_spill does with spill files), so that it isn't lost.
+            self.logger.exception("Failed to write analytics results - setting them aside in %s (with the extension %s)"
+                                  % (self.SPILL_DIRECTORY, BAD_SPILL_FILE_EXTENSION))
+            self._spill(frame_key, analytics_df, SPILL_FILE_EXTENSION + BAD_SPILL_FILE_EXTENSION)
+
+
+    # The background thread - writes queued frames, and retries spilled frames when there's nothing else to do.
+    def _write_frames(self) :
+
+        self._replay_spill()
+
+        while True :
+            try :
+                queued = self._queue.get(timeout=self.RETRY_SECONDS)
+            except queue.Empty :
+                if self._spill_files() :
+                    self._replay_spill()
+                continue
+
+            try :
+                if queued is _STOP :
+                    return
+                self._write_frame(*queued)
+            finally :
+                self._queue.task_done()
@@ -0,0 +1,140 @@
+import os
+import logging
+import time
+from collections import deque
+import pandas as pd
+import sqlalchemy
+from sqlalchemy.dialects import mysql
+
+try :
+    from .DatabaseFrames import write_frame
+except ImportError :
+    from DatabaseFrames import write_frame
+
+
+# Database constants (in sync with GasExposureAnalytics)
+ANALYTICS_TABLE = 'firefighter_status_analytics'
+FIREFIGHTER_ID_COL = 'firefighter_id'
+FIREFIGHTER_ID_COL_TYPE = sqlalchemy.types.VARCHAR(length=20)
+TIMESTAMP_COL = 'timestamp_mins'
+ANALYTICS_KEY_INDEX = 'ix_' + ANALYTICS_TABLE + '_key'
+
+# Default number of rows per INSERT batch.
+DEFAULT_BATCH_SIZE = 500
+# Number of recent batch latencies to keep.
+LATENCY_HISTORY_LENGTH = 1000
+
+
+# Writes analytic results to the analytics table in batches - each batch is a single multi-row INSERT (executemany)
+# in its own transaction, on a connection taken from the engine's connection pool. Writes are 'upserts' on
+# (firefighter_id, timestamp_mins), so re-writing a minute (e.g. retrying after a failure, or re-running the
+# analytics for a past minute) replaces its rows instead of duplicating them:
+#   MariaDB : INSERT ... ON DUPLICATE KEY UPDATE
+#   SQLite : INSERT OR REPLACE
+#   DuckDB : INSERT ... ON CONFLICT (firefighter_id, timestamp_mins) DO UPDATE (DuckDB won't INSERT OR REPLACE into a
+#            table with more than one index - and the analytics table has the ones DataFrame.to_sql creates too)
+# All rely on a unique key on (firefighter_id, timestamp_mins). If the analytics table doesn't exist yet, it's
+# created (from the first results written, with the same column types DataFrame.to_sql would use) along with that key. If it exists without one,
+# a warning is logged and rows are appended as before.
+#
+# The latency of every batch is logged and kept (see batch_latencies).
+class AnalyticsWriter(object):
+
+
+    # db_engine  : SQLAlchemy engine for the Prometeo database.
+    # batch_size : Maximum number of rows per INSERT.
+    # metrics    : AnalyticsMetrics to record write timings and row counts in (optional).
+    def __init__(self, db_engine, batch_size=DEFAULT_BATCH_SIZE, metrics=None):
+
+        # Get a logger and keep its name in sync with this filename
+        self.logger = logging.getLogger(os.path.basename(__file__))
+
+        assert batch_size > 0, "batch_size must be a positive number of rows, but is %s" % (batch_size)
+        self._db_engine = db_engine
+        self.BATCH_SIZE = batch_size
+        self._metrics = metrics
+
+        # (rows, seconds) for each recent batch written.
+        self.batch_latencies = deque(maxlen=LATENCY_HISTORY_LENGTH)
+
+        self._table_checked = False
+
+
+    # Make sure the analytics table exists, with a unique key on (firefighter_id, timestamp_mins).
+    def _check_table(self, analytics_df) :
+
+        inspector = sqlalchemy.inspect(self._db_engine)
+        if ANALYTICS_TABLE not in inspector.get_table_names() :
+            self.logger.info("Creating table '%s'" % (ANALYTICS_TABLE))
+            write_frame(analytics_df.head(0), ANALYTICS_TABLE, self._db_engine, dtype={FIREFIGHTER_ID_COL:FIREFIGHTER_ID_COL_TYPE})
+            analytics_table = sqlalchemy.Table(ANALYTICS_TABLE, sqlalchemy.MetaData(), autoload_with=self._db_engine)
+            sqlalchemy.Index(ANALYTICS_KEY_INDEX, analytics_table.c[FIREFIGHTER_ID_COL], analytics_table.c[TIMESTAMP_COL],
+                             unique=True).create(self._db_engine)
+
+        else :
+            key = [FIREFIGHTER_ID_COL, TIMESTAMP_COL]
+            unique_keys = ([index['column_names'] for index in inspector.get_indexes(ANALYTICS_TABLE) if index['unique']]
+                           + [constraint['column_names'] for constraint in inspector.get_unique_constraints(ANALYTICS_TABLE)]
+                           + [inspector.get_pk_constraint(ANALYTICS_TABLE)['constrained_columns']])
+            if not any(sorted(unique_key) == sorted(key) for unique_key in unique_keys) :
+                self.logger.warning(("Table '%s' has no unique key on %s - re-written minutes will be duplicated. "
+                                     + "To fix: CREATE UNIQUE INDEX %s ON %s (%s)")
+                                    % (ANALYTICS_TABLE, key, ANALYTICS_KEY_INDEX, ANALYTICS_TABLE, ', '.join(key)))
+
+        self._table_checked = True
+
+
+    # The upsert statement for the given columns, for this database.
+    def _upsert_statement(self, columns) :
+
+        analytics_table = sqlalchemy.table(ANALYTICS_TABLE, *[
+            sqlalchemy.column(col, sqlalchemy.types.DateTime) if col == TIMESTAMP_COL else sqlalchemy.column(col)
+            for col in columns])
+
+        if self._db_engine.dialect.name == 'mysql' :
+            insert = mysql.insert(analytics_table)
+            return insert.on_duplicate_key_update({col : insert.inserted[col] for col in columns
+                                                   if col not in [FIREFIGHTER_ID_COL, TIMESTAMP_COL]})
+        elif self._db_engine.dialect.name == 'sqlite' :
+            return analytics_table.insert().prefix_with('OR REPLACE')
+        elif self._db_engine.dialect.name == 'duckdb' :
+            quote = self._db_engine.dialect.identifier_preparer.quote
+            return sqlalchemy.text("INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s, %s) DO UPDATE SET %s" % (
+                quote(ANALYTICS_TABLE), ', '.join(quote(col) for col in columns),
+                ', '.join(':' + col for col in columns), quote(FIREFIGHTER_ID_COL), quote(TIMESTAMP_COL),
+                ', '.join('%s = excluded.%s' % (quote(col), quote(col)) for col in columns
+                          if col not in [FIREFIGHTER_ID_COL, TIMESTAMP_COL])))
+        else :
+            return analytics_table.insert()
+
+
+    # Write analytic results (as returned by GasExposureAnalytics.run_analytics - keyed on
+    # [firefighter_id, timestamp_mins]) in batches of up to BATCH_SIZE rows.
+    # Returns the number of rows written.
+    def write(self, analytics_df) :
+
+        if (analytics_df is None) or analytics_df.empty :
+            return 0
+        if not self._table_checked :
+            self._check_table(analytics_df)
+
+        # Plain python values, with NULL (None) for missing values.
+        records_df = analytics_df.reset_index()
+        records_df = records_df.astype(object).where(records_df.notna(), None)
+        columns = records_df.columns.to_list()
+        statement = self._upsert_statement(columns)
+        records = records_df.to_dict('records')
+
+        for batch_start in range(0, len(records), self.BATCH_SIZE) :
+            batch = records[batch_start:batch_start + self.BATCH_SIZE]
+            start_time = time.perf_counter()
+            with self._db_engine.begin() as connection :
+                connection.execute(statement, batch)
+            latency = time.perf_counter() - start_time
+            self.batch_latencies.append((len(batch), latency))
+            if self._metrics is not None :
+                self._metrics.observe('write', latency)
+                self._metrics.increment('rows_written_total', len(batch))
+            self.logger.info("Wrote %s rows to '%s' in %.1fms" % (len(batch), ANALYTICS_TABLE, latency * 1000))
+
+        return len(records)
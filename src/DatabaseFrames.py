@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from contextlib import contextmanager
+
+
+# Reading and writing DataFrames through SQLAlchemy itself, rather than pandas' read_sql / to_sql. Which SQLAlchemy
+# engines pandas accepts depends on its version (pandas 2.2 doesn't recognise SQLAlchemy 1.4, and treats an engine or
+# connection as a DBAPI connection), so these work the same on any combination of the two.
+
+# SQLAlchemy before 1.4 takes select's columns (and case's whens) as a list, and 2.0 only takes them as arguments.
+_LIST_ARGUMENTS = tuple(int(part) for part in sqlalchemy.__version__.split('.')[:2]) < (1, 4)
+
+
+# A SELECT of the given columns (or tables), on any SQLAlchemy version.
+def select(*columns) :
+    return sqlalchemy.select(list(columns)) if _LIST_ARGUMENTS else sqlalchemy.select(*columns)
+
+
+# A CASE expression of (condition, value) pairs, on any SQLAlchemy version.
+def case(*whens, **kwargs) :
+    return sqlalchemy.case(list(whens), **kwargs) if _LIST_ARGUMENTS else sqlalchemy.case(*whens, **kwargs)
+
+
+# connectable : SQLAlchemy engine or connection. An engine lends a connection for the duration (in a transaction,
+#               committed on the way out, if 'begin' is set), and a connection is used as it is.
+@contextmanager
+def _connection(connectable, begin=False) :
+
+    if isinstance(connectable, sqlalchemy.engine.Engine) :
+        with (connectable.begin() if begin else connectable.connect()) as connection :
+            yield connection
+    else :
+        yield connectable
+
+
+def _execute(connection, sql, params) :
+
+    if isinstance(sql, str) :
+        sql = sqlalchemy.text(sql)
+    return connection.execute(sql, params) if params else connection.execute(sql)
+
+
+# Build a DataFrame from some rows of a query's results, like pandas' read_sql does.
+def _frame_from_rows(rows, columns, parse_dates, index_col) :
+
+    frame = pd.DataFrame.from_records([tuple(row) for row in rows], columns=columns, coerce_float=True)
+    for column in (parse_dates or []) :
+        frame[column] = pd.to_datetime(frame[column])
+    if index_col is not None :
+        frame = frame.set_index(index_col)
+    return frame
+
+
+# Read the results of a query into a DataFrame.
+# connectable : SQLAlchemy engine or connection to read from.
+# sql : the query - a SQLAlchemy statement, or a string of SQL (with :named parameters).
+# params : dict of the query's parameters (optional).
+# parse_dates : list of the columns to convert to timestamps (optional).
+# index_col : column (or list of columns) to index the results by (optional).
+def read_frame(connectable, sql, params=None, parse_dates=None, index_col=None) :
+
+    with _connection(connectable) as connection :
+        result = _execute(connection, sql, params)
+        return _frame_from_rows(result.fetchall(), list(result.keys()), parse_dates, index_col)
+
+
+# Read the results of a query as a series of DataFrames of (up to) 'chunksize' rows each, without holding all of them
+# in memory. The query runs on the given connection (set stream_results on it to have the database stream the rows).
+def read_frame_chunks(connection, sql, chunksize, params=None, parse_dates=None, index_col=None) :
+
+    result = _execute(connection, sql, params)
+    columns = list(result.keys())
+    while True :
+        rows = result.fetchmany(chunksize)
+        if not rows :
+            break
+        yield _frame_from_rows(rows, columns, parse_dates, index_col)
+
+
+# The SQL type for a column of values - the same mapping pandas' to_sql uses.
+def _sql_type(values) :
+
+    inferred_type = pd.api.types.infer_dtype(values, skipna=True)
+    if inferred_type in ('datetime64', 'datetime') :
+        return sqlalchemy.DateTime(timezone=getattr(values.dtype, 'tz', None) is not None)
+    if inferred_type == 'timedelta64' :
+        return sqlalchemy.BigInteger
+    if inferred_type == 'floating' :
+        return sqlalchemy.Float(precision=(23 if values.dtype == np.float32 else 53))
+    if inferred_type == 'integer' :
+        return (sqlalchemy.Integer if values.dtype.name.lower() in ('int8', 'uint8', 'int16', 'int32')
+                else sqlalchemy.BigInteger)
+    if inferred_type == 'boolean' :
+        return sqlalchemy.Boolean
+    if inferred_type == 'date' :
+        return sqlalchemy.Date
+    if inferred_type == 'time' :
+        return sqlalchemy.Time
+    return sqlalchemy.Text
+
+
+# The names of a DataFrame's index levels as columns (like to_sql's - 'index', or 'level_N', for unnamed levels).
+def _index_labels(frame, index_label) :
+
+    if index_label is not None :
+        return [index_label] if isinstance(index_label, str) else list(index_label)
+    if frame.index.nlevels == 1 :
+        return [frame.index.name if frame.index.name is not None else 'index']
+    return [name if name is not None else ('level_%d' % level) for level, name in enumerate(frame.index.names)]
+
+
+# Write a DataFrame to a database table, creating the table first if it doesn't exist - like pandas' to_sql.
+# frame : the DataFrame to write.
+# table_name : name of the table to write to.
+# connectable : SQLAlchemy engine or connection to write to. An engine writes in a transaction of its own.
+# dtype : dict of SQLAlchemy types for some (or all) of the columns, to use instead of the ones for their values.
+# index : whether to write the index (as columns, indexed in the database) as well.
+# index_label : column name(s) for the index (optional - see _index_labels).
+# if_exists : 'fail' to raise a ValueError if the table already exists, or 'append' to add to it.
+def write_frame(frame, table_name, connectable, dtype=None, index=True, index_label=None, if_exists='fail') :
+
+    if if_exists not in ('fail', 'append') :
+        raise ValueError("if_exists must be 'fail' or 'append', not '%s'" % (if_exists))
+
+    index_labels = _index_labels(frame, index_label) if index else []
+    columns_df = (frame.reset_index() if index else frame).set_axis(
+        index_labels + [str(column) for column in frame.columns], axis=1)
+    dtype = dtype or {}
+
+    with _connection(connectable, begin=True) as connection :
+
+        table_exists = table_name in sqlalchemy.inspect(connection).get_table_names()
+        if table_exists and (if_exists == 'fail') :
+            raise ValueError("Table '%s' already exists." % (table_name))
+
+        table = sqlalchemy.Table(table_name, sqlalchemy.MetaData(),
+                                 *[sqlalchemy.Column(column, dtype.get(column, _sql_type(columns_df[column])),
+                                                     index=(column in index_labels))
+                                   for column in columns_df.columns])
+        if not table_exists :
+            table.create(connection)
+
+        if not columns_df.empty :
+            # Python values (rather than numpy's), with None for the missing ones.
+            records = columns_df.astype(object).where(columns_df.notna(), None).to_dict(orient='records')
+            connection.execute(table.insert(), records)
@@ -0,0 +1,108 @@
+import os
+import time
+import sqlalchemy
+from sqlalchemy.pool import QueuePool
+
+
+# Environment variables for the database connection pool settings (see pool_settings_from_env), and their defaults.
+POOL_SIZE_ENV_VAR = 'PROMETEO_DB_POOL_SIZE'
+MAX_OVERFLOW_ENV_VAR = 'PROMETEO_DB_MAX_OVERFLOW'
+POOL_TIMEOUT_ENV_VAR = 'PROMETEO_DB_POOL_TIMEOUT_SECONDS'
+POOL_RECYCLE_ENV_VAR = 'PROMETEO_DB_POOL_RECYCLE_SECONDS'
+POOL_PRE_PING_ENV_VAR = 'PROMETEO_DB_POOL_PRE_PING'
+CONNECT_TIMEOUT_ENV_VAR = 'PROMETEO_DB_CONNECT_TIMEOUT_SECONDS'
+
+DEFAULT_POOL_SIZE = 5         # Connections kept open - for the scheduler job, the write-behind thread and requests.
+DEFAULT_MAX_OVERFLOW = 10     # Extra connections opened under load (and closed again when they're returned).
+DEFAULT_POOL_TIMEOUT = 10     # Seconds to wait for a free connection before giving up (rather than hang).
+DEFAULT_POOL_RECYCLE = 1800   # Seconds before a connection is replaced (well inside MariaDB's wait_timeout).
+DEFAULT_POOL_PRE_PING = True  # Check each connection is alive before using it (e.g. after a MariaDB failover).
+DEFAULT_CONNECT_TIMEOUT = 10  # Seconds to wait for the database server when opening a connection.
+
+
+# A QueuePool that records how it's being used - the number of checkouts, the time spent waiting for a connection and
+# the number of times callers gave up waiting - in an AnalyticsMetrics (if it has one). The web requests, the
+# scheduled analytics and the write-behind thread all share one pool, so these show whether they're starving each
+# other of connections (see pool_status for how many connections are in use).
+class MonitoredQueuePool(QueuePool):
+
+
+    # metrics : AnalyticsMetrics to record the pool's usage in (optional).
+    def __init__(self, creator, metrics=None, **kwargs):
+        super(MonitoredQueuePool, self).__init__(creator, **kwargs)
+        self.METRICS = metrics
+
+
+    # Get a connection from the queue (every checkout goes through this, however the engine asks for a connection).
+    def _do_get(self) :
+
+        start_time = time.perf_counter()
+        try :
+            connection = super(MonitoredQueuePool, self)._do_get()
+        except sqlalchemy.exc.TimeoutError :
+            if self.METRICS is not None :
+                self.METRICS.increment('db_pool_timeouts_total')
+            raise
+        finally :
+            if self.METRICS is not None :
+                self.METRICS.increment('db_pool_wait_seconds_total', time.perf_counter() - start_time)
+        if self.METRICS is not None :
+            self.METRICS.increment('db_pool_checkouts_total')
+        return connection
+
+
+    # The same pool, for a new engine (e.g. after dispose()) - keeping its metrics.
+    def recreate(self) :
+        pool = super(MonitoredQueuePool, self).recreate()
+        pool.METRICS = self.METRICS
+        return pool
+
+
+# Connection pool settings from the environment (see the *_ENV_VAR constants), with defaults for any that aren't set
+# (or are empty). Returns a dict of the keyword arguments for create_db_engine.
+def pool_settings_from_env() :
+    setting = lambda env_var, default : os.getenv(env_var) or default
+    return {
+        'pool_size'       : int(setting(POOL_SIZE_ENV_VAR, DEFAULT_POOL_SIZE)),
+        'max_overflow'    : int(setting(MAX_OVERFLOW_ENV_VAR, DEFAULT_MAX_OVERFLOW)),
+        'pool_timeout'    : float(setting(POOL_TIMEOUT_ENV_VAR, DEFAULT_POOL_TIMEOUT)),
+        'pool_recycle'    : int(setting(POOL_RECYCLE_ENV_VAR, DEFAULT_POOL_RECYCLE)),
+        'pool_pre_ping'   : str(setting(POOL_PRE_PING_ENV_VAR, DEFAULT_POOL_PRE_PING)).lower() in ['true', '1', 'yes'],
+        'connect_timeout' : int(setting(CONNECT_TIMEOUT_ENV_VAR, DEFAULT_CONNECT_TIMEOUT)),
+    }
+
+
+# Create a SQLAlchemy engine for a database server (e.g. MariaDB), with a MonitoredQueuePool of connections. One engine
+# should be shared by everything in the process that uses the database.
+# url             : SQLAlchemy database URL.
+# metrics         : AnalyticsMetrics to record the pool's usage in (optional).
+# pool_size, max_overflow, pool_timeout, pool_recycle, pool_pre_ping : As for sqlalchemy.create_engine.
+# connect_timeout : Seconds to wait for the server when opening a connection (None to leave it to the DB driver).
+def create_db_engine(url, metrics=None, pool_size=DEFAULT_POOL_SIZE, max_overflow=DEFAULT_MAX_OVERFLOW,
+                     pool_timeout=DEFAULT_POOL_TIMEOUT, pool_recycle=DEFAULT_POOL_RECYCLE,
+                     pool_pre_ping=DEFAULT_POOL_PRE_PING, connect_timeout=DEFAULT_CONNECT_TIMEOUT) :
+
+    connect_args = {}
+    if (connect_timeout is not None) and sqlalchemy.engine.url.make_url(url).drivername.startswith('mysql') :
+        connect_args['connect_timeout'] = connect_timeout
+    db_engine = sqlalchemy.create_engine(url, poolclass=MonitoredQueuePool, pool_size=pool_size,
+                                         max_overflow=max_overflow, pool_timeout=pool_timeout,
+                                         pool_recycle=pool_recycle, pool_pre_ping=pool_pre_ping,
+                                         connect_args=connect_args)
+    db_engine.pool.METRICS = metrics
+    return db_engine
+
+
+# The state of an engine's connection pool, as a dict of {'db_pool_size', 'db_pool_checked_out', 'db_pool_checked_in',
+# 'db_pool_overflow'} - or None if the engine doesn't have a QueuePool (e.g. an embedded database).
+def pool_status(db_engine) :
+
+    pool = db_engine.pool if db_engine is not None else None
+    if not isinstance(pool, QueuePool) :
+        return None
+    return {
+        'db_pool_size'        : pool.size(),
+        'db_pool_checked_out' : pool.checkedout(),
+        'db_pool_checked_in'  : pool.checkedin(),
+        'db_pool_overflow'    : max(pool.overflow(), 0),
+    }
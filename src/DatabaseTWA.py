@@ -0,0 +1,200 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+try :
+    from .AnalyticsStorage import SENSOR_LOG_TABLE, SENSOR_LOG, SENSOR_LOG_TIMESTAMP, SENSOR_LOG_FIREFIGHTER_ID
+    from .DatabaseFrames import read_frame, select, case
+except ImportError :
+    from AnalyticsStorage import SENSOR_LOG_TABLE, SENSOR_LOG, SENSOR_LOG_TIMESTAMP, SENSOR_LOG_FIREFIGHTER_ID
+    from DatabaseFrames import read_frame, select, case
+
+
+# Sensor log constants (in sync with GasExposureAnalytics)
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+DATA_START = 'data_start'
+DATA_END = 'data_end'
+
+# Column names in the query results.
+PREVIOUS_GAP_COL = 'previous_gap_mins'
+NEXT_GAP_COL = 'next_gap_mins'
+WEIGHT_COL = 'weight_%s'
+ROWS_COL = 'rows_%s'
+SUM_COL = '%s_sum_%s'
+COUNT_COL = '%s_count_%s'
+EXCEEDED_COL = '%s_exceeded_%s'
+
+# The databases whose SQL this can write (they need window functions - MariaDB 10.2+, MySQL 8+ or SQLite 3.25+).
+SUPPORTED_DIALECTS = ['mysql', 'sqlite']
+
+
+# Adds up the sensor readings in every time-window in the database, for GasExposureAnalytics' time-weighted averages
+# - so that the database returns a sum and count for each (firefighter, window, gas), instead of every sensor record
+# in the longest window (i.e. firefighters x windows x gases numbers, rather than 480 rows x every column per
+# firefighter).
+#
+# The averages are the same as the pandas calculation (the reference implementation in
+# GasExposureAnalytics._calculate_TWAs), including its 1-min quantization, which fills
+# a missing minute with a neighbouring reading (see IncrementalTWA for the precise rule). In SQL, each reading is
+# given a weight for each window - the number of minutes of the window it stands for: its own minute, plus the minute
+# before it if that's missing and there's an earlier reading (the gap before it is 2+ minutes), plus the minute after it
+# if that's missing, the next minute is missing too and there's a later reading (the gap after it is 3+ minutes).
+# The gaps come from the LAG() and LEAD() window functions.
+#
+# Range-exceeded sensor values ('-1') are counted separately rather than added up - an average is inf if any reading
+# in its window is out of range, just as with pandas. If a firefighter has more than one reading in a minute, the
+# highest is used (or range-exceeded, if any of them is), to err on the side of caution.
+class DatabaseTWA(object):
+
+
+    # db_engine   : SQLAlchemy engine for the Prometeo database.
+    # window_mins : The length (in minutes) of every time-window to calculate averages for.
+    # gases       : The supported gases (sensor log columns).
+    def __init__(self, db_engine, window_mins, gases):
+
+        # Get a logger and keep its name in sync with this filename
+        self.logger = logging.getLogger(os.path.basename(__file__))
+
+        assert DatabaseTWA.supports(db_engine), \
+            "Can't add up the readings in a '%s' database - only in %s" % (db_engine.dialect.name, SUPPORTED_DIALECTS)
+        self._db_engine = db_engine
+        self.WINDOW_MINS = list(window_mins)
+        self.GASES = list(gases)
+        self._sensor_log_exists = False
+
+
+    # Whether the readings can be added up in this database.
+    @staticmethod
+    def supports(db_engine) :
+        return (db_engine is not None) and (db_engine.dialect.name in SUPPORTED_DIALECTS)
+
+
+    # The sums and counts of the readings in every window, for every firefighter with readings in the longest one.
+    # timestamp_key : The minute-quantized timestamp key at the end of every window.
+    # shard         : Only add up the readings of the firefighters in this ShardAssignment (defaults to everyone's).
+    # Returns a dataframe indexed by firefighter, with ROWS_COL (the number of minutes in each window with a
+    # reading), SUM_COL, COUNT_COL and EXCEEDED_COL (for each gas, for each window) and the first and last minute with
+    # a reading (DATA_START and DATA_END) - or an empty dataframe if there are no readings.
+    def window_sums(self, timestamp_key, shard=None) :
+
+        # A new embedded database has no sensor log until the first records are written.
+        if not self._sensor_log_exists :
+            self._sensor_log_exists = SENSOR_LOG_TABLE in sqlalchemy.inspect(self._db_engine).get_table_names()
+            if not self._sensor_log_exists :
+                return pd.DataFrame()
+
+        sql = self._window_sums_query(timestamp_key, shard)
+        window_sums_df = read_frame(self._db_engine, sql, index_col=FIREFIGHTER_ID_COL)
+
+        # The shard can't be selected in SQL without a CRC32() function - but each row is one firefighter, so it's just
+        # as easy afterwards.
+        if (shard is not None) and (shard.sql_condition(self._db_engine, SENSOR_LOG_FIREFIGHTER_ID) is None) :
+            window_sums_df = shard.filter(window_sums_df)
+
+        # Sums of integers can come back as decimals (e.g. from MariaDB).
+        sum_cols = window_sums_df.columns.difference([DATA_START, DATA_END])
+        window_sums_df[sum_cols] = window_sums_df[sum_cols].astype(float)
+        window_sums_df[[DATA_START, DATA_END]] = window_sums_df[[DATA_START, DATA_END]].apply(pd.to_datetime)
+        return window_sums_df
+
+
+    # The average of each gas, for each firefighter, over each time-window (from window_sums - before they're scaled to
+    # the proportion of each window covered).
+    # Returns (ff_ids, window_averages, ffs_in_window), as IncrementalTWA.window_averages() does - arrays of shape
+    # (firefighters,), (firefighters, windows, gases) and (firefighters, windows).
+    def window_averages(self, window_sums_df) :
+
+        windows = range(len(self.WINDOW_MINS))
+        sums = np.stack([window_sums_df[[SUM_COL % (gas, window) for gas in self.GASES]].to_numpy()
+                         for window in windows], axis=1)
+        counts = np.stack([window_sums_df[[COUNT_COL % (gas, window) for gas in self.GASES]].to_numpy()
+                           for window in windows], axis=1)
+        exceeded = np.stack([window_sums_df[[EXCEEDED_COL % (gas, window) for gas in self.GASES]].to_numpy()
+                             for window in windows], axis=1)
+        with np.errstate(invalid='ignore', divide='ignore') :
+            window_averages = np.where(exceeded > 0, np.inf, np.where(counts > 0, sums / counts, np.nan))
+        ffs_in_window = window_sums_df[[ROWS_COL % (window) for window in windows]].to_numpy() > 0
+        return window_sums_df.index.to_numpy(), window_averages, ffs_in_window
+
+
+    # The sensor readings with at most one per firefighter per timestamp, as they're added up in the database - the
+    # highest, or range-exceeded ('-1') if any of them is. (The pandas calculation can't resample a firefighter's
+    # readings if two of them have the same timestamp.)
+    # readings_df : Sensor readings indexed by timestamp, with FIREFIGHTER_ID_COL and the gases.
+    def one_reading_per_timestamp(self, readings_df) :
+
+        readings = readings_df[self.GASES].astype(float).groupby([readings_df.index, readings_df[FIREFIGHTER_ID_COL]],
+                                                                 observed=True)
+        return readings.max().mask(readings.min() < 0, -1).reset_index(level=FIREFIGHTER_ID_COL)
+
+
+    # The query behind window_sums.
+    def _window_sums_query(self, timestamp_key, shard) :
+
+        one_minute = pd.Timedelta(minutes = 1)
+        block_start = timestamp_key - pd.Timedelta(minutes = max(self.WINDOW_MINS)) + one_minute
+        gas_columns = [sqlalchemy.column(gas) for gas in self.GASES]
+
+        # 1. One reading per firefighter per minute, in the longest window.
+        readings = (select(SENSOR_LOG_FIREFIGHTER_ID, SENSOR_LOG_TIMESTAMP,
+                           *[case((sqlalchemy.func.min(gas_column) < 0, -1),
+                                  else_=sqlalchemy.func.max(gas_column)).label(gas_column.name)
+                             for gas_column in gas_columns])
+                    .select_from(SENSOR_LOG)
+                    .where(SENSOR_LOG_TIMESTAMP.between(block_start.to_pydatetime(), timestamp_key.to_pydatetime()))
+                    .group_by(SENSOR_LOG_FIREFIGHTER_ID, SENSOR_LOG_TIMESTAMP))
+        shard_condition = shard.sql_condition(self._db_engine, SENSOR_LOG_FIREFIGHTER_ID) if shard is not None else None
+        if shard_condition is not None :
+            readings = readings.where(shard_condition)
+        readings = readings.alias('readings')
+
+        # 2. The gaps (in minutes) to each firefighter's previous and next readings.
+        timestamp = readings.c[TIMESTAMP_COL]
+        firefighter_minutes = {'partition_by' : readings.c[FIREFIGHTER_ID_COL], 'order_by' : timestamp}
+        gaps = select(
+            *readings.c,
+            self._minutes_between(sqlalchemy.func.lag(timestamp).over(**firefighter_minutes), timestamp)
+            .label(PREVIOUS_GAP_COL),
+            self._minutes_between(timestamp, sqlalchemy.func.lead(timestamp).over(**firefighter_minutes))
+            .label(NEXT_GAP_COL)).alias('gaps')
+
+        # 3. The number of minutes of each window that each reading stands for.
+        timestamp = gaps.c[TIMESTAMP_COL]
+        weights = []
+        for window, mins in enumerate(self.WINDOW_MINS) :
+            window_start = (timestamp_key - pd.Timedelta(minutes = mins) + one_minute)
+            weights.append((case((timestamp >= window_start.to_pydatetime(), 1), else_=0)
+                            + case((sqlalchemy.and_(gaps.c[PREVIOUS_GAP_COL] >= 2,
+                                                    timestamp > window_start.to_pydatetime()), 1), else_=0)
+                            + case((sqlalchemy.and_(gaps.c[NEXT_GAP_COL] >= 3,
+                                                    timestamp >= (window_start - one_minute).to_pydatetime()), 1),
+                                   else_=0)).label(WEIGHT_COL % (window)))
+        weighted = select(gaps.c[FIREFIGHTER_ID_COL], timestamp,
+                          *([gaps.c[gas_column.name] for gas_column in gas_columns] + weights)).alias('weighted')
+
+        # 4. The sums and counts, per firefighter.
+        aggregates = [sqlalchemy.func.min(weighted.c[TIMESTAMP_COL]).label(DATA_START),
+                      sqlalchemy.func.max(weighted.c[TIMESTAMP_COL]).label(DATA_END)]
+        for window in range(len(self.WINDOW_MINS)) :
+            weight = weighted.c[WEIGHT_COL % (window)]
+            aggregates.append(sqlalchemy.func.sum(weight).label(ROWS_COL % (window)))
+            for gas in self.GASES :
+                value = weighted.c[gas]
+                aggregates += [
+                    sqlalchemy.func.sum(case((value >= 0, value * weight))).label(SUM_COL % (gas, window)),
+                    sqlalchemy.func.sum(case((value.isnot(None), weight), else_=0)).label(COUNT_COL % (gas, window)),
+                    sqlalchemy.func.sum(case((value < 0, weight), else_=0)).label(EXCEEDED_COL % (gas, window))]
+        return (select(weighted.c[FIREFIGHTER_ID_COL], *aggregates)
+                .group_by(weighted.c[FIREFIGHTER_ID_COL]))
+
+
+    # The number of minutes from one timestamp to another, in this database's SQL.
+    def _minutes_between(self, start, end) :
+        if self._db_engine.dialect.name == 'sqlite' :
+            return sqlalchemy.cast(sqlalchemy.func.round((sqlalchemy.func.julianday(end)
+                                                          - sqlalchemy.func.julianday(start)) * 24 * 60),
+                                   sqlalchemy.types.Integer)
+        return sqlalchemy.func.timestampdiff(sqlalchemy.text('MINUTE'), start, end)
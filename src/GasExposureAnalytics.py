@@ -1,10 +1,44 @@
 import json
 import os
+import time
 import numpy as np
 import pandas as pd
 import sqlalchemy
 import logging
 
+# Support both package imports (e.g. 'from src import GasExposureAnalytics', as in the unit tests) and flat imports
+# (e.g. when the service is run from within the src directory, as in the Docker image).
+try :
+    from .IncrementalTWA import IncrementalTWA
+    from .SensorLogCache import SensorLogCache
+    from .AnalyticsWriter import DEFAULT_BATCH_SIZE
+    from .AnalyticsStorage import InMemoryStorage, create_storage, typed_sensor_readings, STORAGE_URL_ENV_VAR
+    from .AnalyticsWriteQueue import AnalyticsWriteQueue
+    from .StatusCache import StatusCache
+    from .AnalyticsMetrics import AnalyticsMetrics
+    from .DatabasePool import pool_status
+    from .ParallelTWA import ParallelTWA, window_averages_in_process
+    from .DatabaseTWA import DatabaseTWA
+    from .SensorRollup import SensorRollup
+    from .AnalyticsShards import ShardAssignment
+    from .AnalyticsCheckpoint import (AnalyticsCheckpoint, DEFAULT_CHECKPOINT_MINS, frame_to_arrays, frame_from_arrays,
+                                      add_prefix, arrays_with_prefix)
+except ImportError :
+    from IncrementalTWA import IncrementalTWA
+    from SensorLogCache import SensorLogCache
+    from AnalyticsWriter import DEFAULT_BATCH_SIZE
+    from AnalyticsStorage import InMemoryStorage, create_storage, typed_sensor_readings, STORAGE_URL_ENV_VAR
+    from AnalyticsWriteQueue import AnalyticsWriteQueue
+    from StatusCache import StatusCache
+    from AnalyticsMetrics import AnalyticsMetrics
+    from DatabasePool import pool_status
+    from ParallelTWA import ParallelTWA, window_averages_in_process
+    from DatabaseTWA import DatabaseTWA
+    from SensorRollup import SensorRollup
+    from AnalyticsShards import ShardAssignment
+    from AnalyticsCheckpoint import (AnalyticsCheckpoint, DEFAULT_CHECKPOINT_MINS, frame_to_arrays, frame_from_arrays,
+                                     add_prefix, arrays_with_prefix)
+
 
 # Constants / definitions
 
@@ -29,10 +63,17 @@ RANGE_EXCEEDED = -1
 # Cache Constants
 DATA_START = 'data_start'
 DATA_END = 'data_end'
-WINDOW_START = 'window_start'
-WINDOW_END = 'window_end'
-OVERLAP_MINS = 'overlap_mins'
-PROPORTION_OF_WINDOW = 'proportion_of_window'
+
+# Incremental (or database) TWAs within this distance of a rounding boundary (in units of the last rounded decimal
+# place) are re-calculated with the pandas reference calculation, so that they round the same way.
+ROUNDING_BOUNDARY_TOLERANCE = 1e-6
+
+# Incremental running sums that are up to this many minutes behind (e.g. after missed runs, or a restart from a
+# checkpoint) are moved on minute by minute. Any further behind, and rebuilding them is quicker.
+MAX_CATCH_UP_MINS = 30
+
+# Default maximum number of missed minutes that run_analytics_catching_up() catches up on.
+DEFAULT_MAX_MISSED_MINS = 60
 
 # Status constants - percentages that define green/red status (yellow is the name of a configuration parameter)
 GREEN_RANGE_START = 0
@@ -159,7 +200,55 @@ class GasExposureAnalytics(object):
     # config_filename   : Allow overriding TWA time-window configurations, so that tests can test against a known
     #                     configuration. This option should not be used at runtime, as prometeo uses a relational
     #                     database and the analytics table schema is static, not dynamic.
-    def __init__(self, list_of_csv_files=None, config_filename=DEFAULT_CONFIG_FILENAME):
+    # incremental       : Calculate time-weighted averages incrementally, from running sums that are updated as each
+    #                     minute arrives (see IncrementalTWA), instead of re-calculating them from scratch every
+    #                     minute. The results are the same - the from-scratch pandas calculation is kept as the
+    #                     reference implementation.
+    # cache_sensor_log  : Keep the latest block of sensor readings in memory between runs and only read new (or
+    #                     late-arriving) sensor records from the database each minute (see SensorLogCache), instead
+    #                     of re-reading the whole block every minute. Only applies when reading from the database.
+    # write_batch_size  : The maximum number of analytic results rows to write to the database per INSERT (see
+    #                     AnalyticsWriter).
+    # write_behind      : Commit analytic results from a background thread (see AnalyticsWriteQueue), so that
+    #                     run_analytics() doesn't wait for the database. Call close() before exiting, to make sure
+    #                     every result is written.
+    # status_cache_mins : Keep the last N minutes of analytic results for each firefighter in memory (see
+    #                     StatusCache), so that the status endpoints can answer without reading the database.
+    #                     None (the default) for no cache.
+    # recompute_late_arrivals : Look for sensor records that arrive late - for minutes that have already been
+    #                     analysed - and recompute (and re-commit) just the analytic results that they change.
+    # storage           : Where to read the sensor log from and write analytic results to - an AnalyticsStorage, or a
+    #                     storage URL (see AnalyticsStorage.create_storage - e.g. 'sqlite:///prometeo.db' for an
+    #                     embedded database). Defaults to the PROMETEO_STORAGE_URL environment variable if it's set,
+    #                     and then to the MariaDB server. Ignored with list_of_csv_files, which always uses in-memory
+    #                     storage (so no database is needed).
+    # parallel_workers  : Calculate the pandas time-weighted averages in a pool of N worker processes, each taking a
+    #                     partition of the firefighters (see ParallelTWA), so that large incidents use more than one
+    #                     core. The results are the same. None (the default) to calculate them in this process. Not
+    #                     used with incremental, which is cheaper still. Call close() before exiting, to stop the
+    #                     worker processes.
+    # aggregate_in_database : Have the database add up the readings in every time-window (see DatabaseTWA), so that
+    #                     each minute only the sums and counts for each firefighter (and the latest minute's sensor
+    #                     records) are read, instead of the whole block of sensor readings. The results are the same.
+    #                     Only applies when reading from MariaDB/MySQL or SQLite. Not used with incremental, and
+    #                     replaces cache_sensor_log and recompute_late_arrivals (late records are still included from
+    #                     the next minute on, but earlier minutes' results aren't recomputed).
+    # rollup_sensor_log : As aggregate_in_database, but adding up whole buckets of minutes from a rollup table that a
+    #                     trigger keeps up to date as sensor records are written (see SensorRollup), and only the
+    #                     readings around the edges of the windows and gaps. Implies aggregate_in_database. The
+    #                     rollup table and trigger are a schema change, added by running migrate_sensor_rollup.py -
+    #                     until then, the readings are added up as with aggregate_in_database.
+    # checkpoint_file   : Save the state kept from minute to minute (the firefighters' time spans, the running sums, the
+    #                     sensor log cache and the record counts for late arrivals) to this file every
+    #                     checkpoint_mins minutes and on close(), and carry on from it the first time the analytics
+    #                     run - so that after a restart only the minutes since the checkpoint are caught up on (see
+    #                     AnalyticsCheckpoint). None (the default) for no checkpoint.
+    # checkpoint_mins   : The number of minutes between checkpoints.
+    def __init__(self, list_of_csv_files=None, config_filename=DEFAULT_CONFIG_FILENAME, incremental=False,
+                 cache_sensor_log=False, write_batch_size=DEFAULT_BATCH_SIZE, write_behind=False,
+                 status_cache_mins=None, recompute_late_arrivals=False, storage=None, parallel_workers=None,
+                 aggregate_in_database=False, rollup_sensor_log=False, checkpoint_file=None,
+                 checkpoint_mins=DEFAULT_CHECKPOINT_MINS):
 
         # Get a logger and keep its name in sync with this filename
         self.logger = logging.getLogger(os.path.basename(__file__))
@@ -200,39 +289,89 @@ class GasExposureAnalytics(object):
         # Validate the configuration - log helpful error messages if invalid.
         self._validate_config(config_filename)
 
-        # db identifiers
-        SQLALCHEMY_DATABASE_URI = ("mysql+pymysql://"+os.getenv('MARIADB_USERNAME')
-                                    +":"+os.getenv("MARIADB_PASSWORD")
-                                    +"@"+os.getenv("MARIADB_HOST")
-                                    +":"+str(os.getenv("MARIADB_PORT"))
-                                    +"/prometeo")
-        metadata=sqlalchemy.MetaData(SQLALCHEMY_DATABASE_URI)
-        self._db_engine = metadata.bind
-
+        # Running sums for calculating time-weighted averages incrementally (None when using the pandas calculation).
+        self._INCREMENTAL_TWA = None
+        if incremental :
+            self._INCREMENTAL_TWA = IncrementalTWA([window[WINDOW_MINS_PROPERTY] for window in self.WINDOWS_AND_LIMITS],
+                                                   len(self.SUPPORTED_GASES))
 
-        # By default, the analytics will run from a database.
-        self._from_db = True
+        # Worker processes for calculating the pandas time-weighted averages (None to calculate them in this process).
+        self._PARALLEL_TWA = None
+        if (parallel_workers is not None) and (parallel_workers > 1) and not incremental :
+            self._PARALLEL_TWA = ParallelTWA(parallel_workers)
 
-        # For testing, the analytics can also be run from a set of CSV files.
-        if list_of_csv_files is not None : 
-            self._from_db = False
+        # METRICS : Timings and counts for each stage of the analytics (see AnalyticsMetrics and metrics_text()).
+        self.METRICS = AnalyticsMetrics()
 
+        # STORAGE : Where the sensor log is read from and analytic results are (batch upsert) written to.
+        # For testing, the analytics can also be run from a set of CSV files (held in memory).
+        if list_of_csv_files is not None :
             self.logger.info("Taking sensor readings *** from CSV ***")
-            # Allow clients to pass either single (non-list) CSV file path, or a list of CSV file paths
-            if not isinstance(list_of_csv_files, list) : list_of_csv_files = [list_of_csv_files]
-            dataframes = []
-            for csv_file in list_of_csv_files : 
-                df = pd.read_csv(csv_file, engine='python', parse_dates=[TIMESTAMP_COL], index_col = TIMESTAMP_COL)
-                assert FIREFIGHTER_ID_COL in df.columns, "CSV files is missing key columns %s" % (required_cols)
-                dataframes.append(df)
-            # Merge the dataframes (also pre-sort, to speed up test runs and enable debug slicing on the index)
-            self._sensor_log_from_csv_df = pd.concat(dataframes).sort_index()
+            self.STORAGE = InMemoryStorage.from_csv_files(list_of_csv_files, metrics=self.METRICS)
+        elif (storage is None) or isinstance(storage, str) :
+            self.STORAGE = create_storage(storage or os.getenv(STORAGE_URL_ENV_VAR), batch_size=write_batch_size,
+                                          metrics=self.METRICS)
+        else :
+            self.STORAGE = storage
+
+        # Whether the analytics are running from a database (rather than from memory, e.g. CSV files).
+        self._from_db = self.STORAGE.db_engine is not None
+
+        # Adds up the readings in every time-window in the database (None when reading the block of sensor readings).
+        self._DATABASE_TWA = None
+        if (aggregate_in_database or rollup_sensor_log) and not incremental :
+            if DatabaseTWA.supports(self.STORAGE.db_engine) :
+                database_twa = SensorRollup if rollup_sensor_log else DatabaseTWA
+                self._DATABASE_TWA = database_twa(self.STORAGE.db_engine,
+                                                  [window[WINDOW_MINS_PROPERTY] for window in self.WINDOWS_AND_LIMITS],
+                                                  self.SUPPORTED_GASES)
+            else :
+                self.logger.warning("Sensor readings can't be added up in this storage - reading them instead")
+
+        # In-memory cache of the latest block of the sensor log (None when reading the whole block every minute).
+        self._SENSOR_LOG_CACHE = None
+        if cache_sensor_log and self._from_db :
+            self._SENSOR_LOG_CACHE = SensorLogCache(self.STORAGE.db_engine, self.STORAGE.sensor_log_exists)
+
+        # Queue for committing analytic results in the background (None when committing them straight away).
+        self._ANALYTICS_WRITE_QUEUE = AnalyticsWriteQueue(self.STORAGE) if write_behind else None
+
+        # STATUS_CACHE : The most recent analytic results, for the status endpoints (None when not caching them).
+        self.STATUS_CACHE = StatusCache(status_cache_mins) if status_cache_mins is not None else None
+
+        # For finding late-arriving sensor records: the number of sensor records for each (firefighter, minute) in the
+        # last block of sensor readings analysed (and for each minute), and the minute key it was analysed for.
+        self._RECOMPUTE_LATE_ARRIVALS = recompute_late_arrivals
+        self._SENSOR_RECORD_COUNTS = None
+        self._SENSOR_MINUTE_COUNTS = None
+        self._SENSOR_RECORD_COUNTS_KEY = None
+
+        # The shard of firefighters being analysed (see AnalyticsShards - None for everyone).
+        self._SHARD = None
+
+        # The latest minute key analysed - the 'high-water mark' that a restart carries on from.
+        self._LAST_TIMESTAMP_KEY = None
+
+        # CHECKPOINT : Where the state kept from minute to minute is saved (None for nowhere). It's restored the first
+        # time the analytics run, when it's known which minute they're carrying on to.
+        self.CHECKPOINT = None
+        if checkpoint_file is not None :
+            configuration = json.dumps({WINDOWS_AND_LIMITS_PROPERTY : [window[WINDOW_MINS_PROPERTY]
+                                                                       for window in self.WINDOWS_AND_LIMITS],
+                                        SUPPORTED_GASES_PROPERTY : self.SUPPORTED_GASES,
+                                        AUTOFILL_MINS_PROPERTY : self.AUTOFILL_MINS}, sort_keys=True)
+            self.CHECKPOINT = AnalyticsCheckpoint(checkpoint_file, configuration, checkpoint_mins)
+        self._CHECKPOINT_RESTORED = False
 
 
     # Query the last N hours of sensor logs, where N is the longest configured time-window length. As with all methods
     # in this class, sensor data is assumed to be keyed on the floor(minute) timestamp when it was captured - i.e.
     # a sensor value captured at 12:00:05 is stored against a timestamp of 12:00:00.
+    # Only the latest minute's records are merged back into the results, so only they are read in full - the rest of
+    # the block is just the firefighter IDs and gases, typed (see AnalyticsStorage.typed_sensor_readings).
     # block_end : The datetime from which to look back when reading the sensor logs (e.g. 'now').
+    # Returns (sensor_log_df, ff_time_spans_df, latest_minute_df) - the block of (typed) readings, the time spans (None
+    # if there are no readings) and the full sensor records for block_end.
     def _get_block_of_sensor_readings(self, block_end) :
         
         # Get the start of the time block to read - i.e. the end time, minus the longest window we're interested in.
@@ -242,23 +381,15 @@ class GasExposureAnalytics(object):
         longest_block = max([window['mins'] for window in self.WINDOWS_AND_LIMITS])
         block_start = block_end - pd.Timedelta(minutes = longest_block) + one_minute # e.g. 8hrs ago
 
-        message = ("Reading sensor log in range [%s to %s]" % (block_start.isoformat(), block_end.isoformat()))
-        if not self._from_db : message += " (local CSV file mode)"
-        self.logger.info(message)
-
-        sensor_log_df = pd.DataFrame()
-        ff_time_spans_df = None
-        if self._from_db :
-            # Get from database with a non-blocking read (this type of SELECT is non-blocking on
-            # MariaDB/InnoDB - ref: https://dev.mysql.com/doc/refman/8.0/en/innodb-consistent-read.html)
-            sql = ("SELECT * FROM " + SENSOR_LOG_TABLE + " where " + TIMESTAMP_COL
-                    + " between '" + block_start.isoformat() + "' and '" + block_end.isoformat() + "'")
-            sensor_log_df = (pd.read_sql_query(sql, self._db_engine,
-                                              parse_dates=[TIMESTAMP_COL], index_col=TIMESTAMP_COL))
-
+        if (not self._from_db) or (self._SENSOR_LOG_CACHE is not None) :
+            # In memory (or in the cache), the records are held in full anyway.
+            sensor_log_df = self._read_sensor_log(block_start, block_end)
+            latest_minute_df = sensor_log_df.loc[block_end:block_end, :]
+            sensor_log_df = typed_sensor_readings(sensor_log_df, self.SUPPORTED_GASES)
         else :
-            # Get from local CSV files - useful when testing (e.g. using known sensor test data)
-            sensor_log_df = self._sensor_log_from_csv_df.loc[block_start:block_end,:].copy()
+            sensor_log_df = self._read_sensor_log(block_start, block_end, gases=self.SUPPORTED_GASES)
+            latest_minute_df = None
+        ff_time_spans_df = None
 
         if (sensor_log_df.empty) :
             self.logger.info("No 'live' sensor records found in range [%s to %s]"
@@ -271,7 +402,40 @@ class GasExposureAnalytics(object):
         else : 
             # sort is required for several operations, e.g. slicing, re-sampling, etc. Do it once, up-front.
             sensor_log_df = sensor_log_df.sort_index()
+            ff_time_spans_df = self._update_ff_time_spans(sensor_log_df)
+            if latest_minute_df is None :
+                latest_minute_df = self._read_sensor_log(block_end, block_end)
+
+        return sensor_log_df, ff_time_spans_df, latest_minute_df
+
+
+    # Read all sensor log records with timestamps in [block_start, block_end] (inclusive) from wherever the analytics
+    # are running from (the in-memory cache of the database, or STORAGE). Returns a time-indexed dataframe.
+    # use_cache       : Set to False to read a one-off block directly from STORAGE, without disturbing the cache.
+    # firefighter_ids : Only read these firefighters' records from STORAGE (defaults to everyone's).
+    # gases           : Only read the firefighter IDs and these gases, typed (see AnalyticsStorage.read_sensor_log).
+    def _read_sensor_log(self, block_start, block_end, use_cache=True, firefighter_ids=None, gases=None) :
+
+        message = ("Reading sensor log in range [%s to %s]" % (block_start.isoformat(), block_end.isoformat()))
+        if not self._from_db : message += " (in-memory mode)"
+        self.logger.info(message)
+
+        if use_cache and (self._SENSOR_LOG_CACHE is not None) :
+            # Get from the in-memory cache, which only reads new and late-arriving records from the database.
+            sensor_log_df = self._SENSOR_LOG_CACHE.get_block_of_sensor_readings(block_start, block_end, self._SHARD)
+            return sensor_log_df if gases is None else typed_sensor_readings(sensor_log_df, gases)
 
+        if gases is None :
+            return self.STORAGE.read_sensor_log(block_start, block_end, firefighter_ids, self._SHARD)
+        return self.STORAGE.read_sensor_log(block_start, block_end, firefighter_ids, self._SHARD, gases=gases)
+
+
+    # Update the cache of 'earliest and latest observed data points for each firefighter' from a (sorted) block of
+    # sensor readings and return a working copy of it, with the AUTOFILL_MINS buffer added on. Since the cache only
+    # ever keeps the earliest start and latest end, any block that includes all the new readings gives the same result.
+    def _update_ff_time_spans(self, sensor_log_df) :
+
+        if not sensor_log_df.empty :
             # Update the cache of 'earliest and latest observed data points for each firefighter'. As firefighters come
             # online (and as data comes in after an outage), each new chunk may contain records for firefighters that
             # are not yet captured in the cache.
@@ -279,53 +443,94 @@ class GasExposureAnalytics(object):
             #                 join an event (and different for each Firefighter)
             # [DATA_END]  : the latest observed data point for each firefighter so far - a moving target, but
             #                 fixed for *this* chunk of data (and potentially different for each Firefighter)
-            ff_time_spans_in_this_block_df = (pd.DataFrame(sensor_log_df.reset_index()
-                                                .groupby(FIREFIGHTER_ID_COL)
-                                                [TIMESTAMP_COL].agg(['min', 'max']))
-                                                .rename(columns = {'min':DATA_START, 'max':DATA_END}))
-            if self._FF_TIME_SPANS_CACHE is None :
-                # First-time cache creation
-                self._FF_TIME_SPANS_CACHE = pd.DataFrame(ff_time_spans_in_this_block_df)
-            else :  
-                # Update the earliest and latest observed timestamp for each firefighter.
-                # note: use pd.merge() not pd.concat() - concat drops the index names causing later steps to crash
-                self._FF_TIME_SPANS_CACHE = pd.merge(np.fmin(ff_time_spans_in_this_block_df.loc[:, DATA_START],
-                                                             self._FF_TIME_SPANS_CACHE.loc[:, DATA_START]),
-                                                     np.fmax(ff_time_spans_in_this_block_df.loc[:, DATA_END],
-                                                             self._FF_TIME_SPANS_CACHE.loc[:, DATA_END]),
-                                                     how='outer', on=FIREFIGHTER_ID_COL)
-
-            # Take a working copy of the cache, so we can manupulate it during analytic processing.
-            ff_time_spans_df = self._FF_TIME_SPANS_CACHE.copy()
-
-            # Add a buffer of N mins (e.g. 10 mins) to the 'data end'. The system will assume up to this
-            # many minutes of missing data just means a device is disconnected and the data is temporarily delayed.
-            # It will 'treat' the missing data (e.g. by substituting an average). After this number of minutes of
-            # missing sensor data, the system will stop estimating and assume the firefighter has powered 
-            # off their device and left the event.
-            ff_time_spans_df.loc[:, DATA_END] += pd.Timedelta(minutes = self.AUTOFILL_MINS)
-
-        return sensor_log_df, ff_time_spans_df
+            self._FF_TIME_SPANS_CACHE = self._merge_ff_time_spans(self._FF_TIME_SPANS_CACHE, sensor_log_df)
+
+        # Take a working copy of the cache, so we can manupulate it during analytic processing.
+        ff_time_spans_df = self._FF_TIME_SPANS_CACHE.copy()
+
+        # Add a buffer of N mins (e.g. 10 mins) to the 'data end'. The system will assume up to this
+        # many minutes of missing data just means a device is disconnected and the data is temporarily delayed.
+        # It will 'treat' the missing data (e.g. by substituting an average). After this number of minutes of
+        # missing sensor data, the system will stop estimating and assume the firefighter has powered 
+        # off their device and left the event.
+        ff_time_spans_df.loc[:, DATA_END] += pd.Timedelta(minutes = self.AUTOFILL_MINS)
+
+        return ff_time_spans_df
+
+
+    # Merge the 'earliest and latest observed data points for each firefighter' in a (non-empty) block of sensor
+    # readings into a set of time spans (or None). Returns the merged time spans.
+    def _merge_ff_time_spans(self, ff_time_spans_df, sensor_log_df) :
+
+        ff_time_spans_in_this_block_df = (pd.DataFrame(sensor_log_df.reset_index()
+                                            .groupby(FIREFIGHTER_ID_COL, observed=True)
+                                            [TIMESTAMP_COL].agg(['min', 'max']))
+                                            .rename(columns = {'min':DATA_START, 'max':DATA_END}))
+        if ff_time_spans_df is None :
+            # First-time cache creation
+            return pd.DataFrame(ff_time_spans_in_this_block_df)
+
+        # Update the earliest and latest observed timestamp for each firefighter.
+        # note: use pd.merge() not pd.concat() - concat drops the index names causing later steps to crash
+        return pd.merge(np.fmin(ff_time_spans_in_this_block_df.loc[:, DATA_START], ff_time_spans_df.loc[:, DATA_START]),
+                        np.fmax(ff_time_spans_in_this_block_df.loc[:, DATA_END], ff_time_spans_df.loc[:, DATA_END]),
+                        how='outer', on=FIREFIGHTER_ID_COL)
 
 
     # Given up to 8 hours of data, calculates the time-weighted average and limit gauge (%) for all firefighters, for
-    # all supported gases, for all configured time periods.
+    # all supported gases, for all configured time periods - with whichever calculation is configured (pandas, parallel
+    # or incremental - see _calculate_TWAs).
     # sensor_log_chunk_df: A time-indexed dataframe covering up to 8 hours of sensor data for all firefighters,
     #                      for all supported gases. Requires firefighterID and supported gases as columns.
-    # ff_time_spans_df   : A dataset containing the 'earliest and latest observed data points for each 
+    # ff_time_spans_df   : A dataset containing the 'earliest and latest observed data points for each
     #                      firefighter'. Necessary for the AUTOFILL_MINS functionality.
     # timestamp_key :    The minute-quantized timestamp key for which to calculate time-weighted averages.
-    def _calculate_TWA_and_gauge_for_all_firefighters(self, sensor_log_chunk_df, ff_time_spans_df, timestamp_key) :
-
-        # We'll be processing the windows in descending order of length (mins) 
-        windows_in_desc_mins_order = sorted([w for w in self.WINDOWS_AND_LIMITS], key=lambda w: w['mins'], reverse=True)
-        longest_window_mins = windows_in_desc_mins_order[0]['mins'] # topmost element in the ordered windows
+    # latest_minute_df : The full sensor records for timestamp_key, to merge into the results - when
+    #                    sensor_log_chunk_df only has the firefighter IDs and gases (see _get_block_of_sensor_readings).
+    #                    Defaults to taking them from sensor_log_chunk_df.
+    def _calculate_TWA_and_gauge_for_all_firefighters(self, sensor_log_chunk_df, ff_time_spans_df, timestamp_key,
+                                                      latest_minute_df=None) :
+
+        # Working out the windows' averages is the 'resample' stage, whichever calculation does it.
+        with self.METRICS.time('resample') :
+            ff_ids, scaled_twas, ffs_in_window = self._calculate_TWAs(sensor_log_chunk_df, ff_time_spans_df,
+                                                                      timestamp_key, self._INCREMENTAL_TWA)
+
+            # Before doing the rest of the work, save a copy of the data for each device at 'timestamp_key' *if*
+            # available (may not be, depending on dropouts). Note: this is the first of several chunks of data that we
+            # will later merge on the timestamp_key.
+            if latest_minute_df is None :
+                latest_minute_df = sensor_log_chunk_df.loc[timestamp_key:timestamp_key, :]
+            latest_device_data, sensor_cols = self._get_latest_device_data_from_records(latest_minute_df, timestamp_key)
+
+        return self._calculate_gauges_and_status([(timestamp_key, ff_ids, scaled_twas, ffs_in_window)],
+                                                 latest_device_data, sensor_cols)
+
+
+    # Works out the time-weighted averages for every firefighter, every window and every gas, from the block of sensor
+    # readings - already scaled to the proportion of each window that each firefighter's data covers. The averages of
+    # the readings come from running sums (see _window_averages_incrementally), or from pandas - in worker processes
+    # (if configured - see ParallelTWA), or in this one. Every calculation gives the same results.
+    # (sensor_log_chunk_df, ff_time_spans_df and timestamp_key are as for _calculate_TWA_and_gauge_for_all_firefighters)
+    # running_sums : The IncrementalTWA to use - or None for the pandas calculation.
+    # Returns (ff_ids, scaled_twas, ffs_in_window) - arrays of shape (firefighters,), (firefighters, windows, gases)
+    # and (firefighters, windows), with windows in the same order as WINDOWS_AND_LIMITS (see
+    # IncrementalTWA.window_averages).
+    def _calculate_TWAs(self, sensor_log_chunk_df, ff_time_spans_df, timestamp_key, running_sums) :
+
+        if running_sums is not None :
+            # Running sums don't add the readings up in the same order as pandas, so any TWAs right on a rounding
+            # boundary are settled with the pandas calculation, from the readings in the block (see _scale_TWAs).
+            (ff_ids, window_averages, ffs_in_window), longest_window_df = self._window_averages_incrementally(
+                sensor_log_chunk_df, timestamp_key, running_sums)
+            return ff_ids, self._scale_TWAs(ff_ids, window_averages, ffs_in_window, ff_time_spans_df, timestamp_key,
+                                            lambda ff_ids_to_settle : longest_window_df), ffs_in_window
 
         # Get sensor records for the longest time-window. Note: we add 1 min to the start-time, because slicing
         # is *in*clusive and we don't want N+1 samples in an N min block of sensor records.
-        one_minute = pd.Timedelta(minutes = 1)
-        longest_window_start = timestamp_key - pd.Timedelta(minutes=longest_window_mins) + one_minute
-        longest_window_df = sensor_log_chunk_df.loc[longest_window_start:timestamp_key, :]
+        window_mins = [window[WINDOW_MINS_PROPERTY] for window in self.WINDOWS_AND_LIMITS]
+        longest_window_start = timestamp_key - pd.Timedelta(minutes=max(window_mins)) + pd.Timedelta(minutes = 1)
+        longest_window_df = sensor_log_chunk_df.loc[longest_window_start:timestamp_key, :].copy()
 
         # It's essential to know when a sensor value can't be trusted - i.e. when it has exceeded its range (signalled
         # by the value '-1'). When this happens, we need to replace that sensor's value with something that
@@ -338,35 +543,207 @@ class GasExposureAnalytics(object):
         # prevent this kind of under-reporting, the device sends '-1' to indicate that the sensor has exceeded its
         # range and we substitute that with infinity (np.inf), which then flows correctly through the time-weighted
         # average calculations.
-        longest_window_df.loc[:, self.SUPPORTED_GASES] = (longest_window_df.loc[:, self.SUPPORTED_GASES].mask(
-                                                   cond=(longest_window_df.loc[:, self.SUPPORTED_GASES] < 0),
-                                                   other=np.inf))
+        longest_window_df = self._mask_range_exceeded_values(longest_window_df)
 
         # To calculate time-weighted averages, every time-slice in the window is quantized ('resampled') to equal
         # 1-minute lengths. (it can be done with 'ragged' / uneven time-slices, but the code is more complex and
         # hence error-prone, so we use 1-min quantization as standard here). The system is expected to provide data
         # that meets this requirement, so this step is defensive. We don't backfill missing entries here.
         #
-        # (note: the double sort_index() here looks odd, but it seems both necessary and fairly low cost:
-        # 1. Resampling requires the original index to be sorted, reasonably enough. 2. The resampled dataframe
-        # can't be sliced by date index unless it's sorted too. However these 'extra' sorts don't seem to carry
-        # a noticeable performance penalty, possibly since the original dataframe is sorted to begin with)
-        resample_timedelta = pd.Timedelta(minutes = 1)
-        longest_window_cleaned_df = (longest_window_df
-                                    .sort_index()
-                                    .groupby(FIREFIGHTER_ID_COL, group_keys=False)
-                                    .resample(resample_timedelta).nearest(limit=1)
-                                    .sort_index())
-        
-        # Before doing the main work, save a copy of the data for each device at 'timestamp_key' *if* available
-        # (may not be, depending on dropouts). Note: this is the first of several chunks of data that we will
-        # later merge on the timestamp_key.
+        # Then the time-weighted average exposure for each time-window is calculated.
+        # A *time-weighted* average, means each sensor reading is multiplied by the length of time the reading
+        # covers, before dividing by the total time covered. This can get very complicated if readings are unevenly
+        # spaced or if they get lost, or sent late due to connectivity dropouts. So Prometeo makes two design
+        # choices that account for these issues, and simplify calculations (reducing opportunities for error).
+        # (1) The system takes exactly one reading per minute, no more & no less, so the multiplication factor for
+        #     every reading is always 1.
+        # (2) Any missing/lost sensor readings are approximated by using the average value for that sensor over the
+        #     time-window in question. (Care needs to be taken to ensure that calculations don't inadvertently
+        #     approximate them as '0ppm').
+        # Since the goal we're after here is to get the average over a time-window, we don't need to actually
+        # fill-in the missing entries, we can just get the average of the available sensor readings.
+        # (see ParallelTWA for how - it's shared out between worker processes, by firefighter, if configured)
+        if self._PARALLEL_TWA is not None :
+            pandas_averages = self._PARALLEL_TWA.window_averages(longest_window_df, self.SUPPORTED_GASES, window_mins,
+                                                                  timestamp_key)
+        else :
+            pandas_averages = window_averages_in_process(longest_window_df, self.SUPPORTED_GASES, window_mins,
+                                                         timestamp_key)
+
+        # These are the pandas calculation's own averages, so there's nothing to settle.
+        ff_ids, window_averages, ffs_in_window = self._window_averages_to_arrays(pandas_averages)
+        return ff_ids, self._scale_TWAs(ff_ids, window_averages, ffs_in_window, ff_time_spans_df, timestamp_key), ffs_in_window
+
+
+    # Moves the running sums on to 'timestamp_key' and gets the average of each gas, for each firefighter, over each
+    # time-window from them. If the minute isn't the one straight after the last minute calculated (e.g. at startup,
+    # or after an outage), or if sensor records have arrived late for minutes that were already added, the running
+    # sums are rebuilt from the block of sensor readings instead.
+    # (sensor_log_chunk_df and timestamp_key are as for _calculate_TWA_and_gauge_for_all_firefighters)
+    # running_sums : The IncrementalTWA to use.
+    # Returns ((ff_ids, window_averages, ffs_in_window), longest_window_df) - the averages, as
+    # IncrementalTWA.window_averages returns them, and the readings in the longest window they're the averages of.
+    def _window_averages_incrementally(self, sensor_log_chunk_df, timestamp_key, running_sums) :
+
+        # Work in integer minutes - the running sums are keyed on those.
+        to_minutes = lambda timestamps : np.asarray(timestamps, dtype='datetime64[m]').astype(np.int64)
+        minute_key = int(to_minutes([timestamp_key])[0])
+
+        # Only the longest window is of interest (as in the pandas calculation). Nothing is copied or masked here -
+        # the running sums' SensorRingBuffer stores range-exceeded values as np.inf itself, so normally only the
+        # readings for the newest minute are touched.
+        longest_window_mins = running_sums.LONGEST_WINDOW_MINS
+        longest_window_start = timestamp_key - pd.Timedelta(minutes=longest_window_mins - 1)
+        longest_window_df = sensor_log_chunk_df.loc[longest_window_start:timestamp_key, :]
+
+        # Move the running sums on to this minute - normally from the previous minute, but after missed runs (or a
+        # restart from a checkpoint) they may be a few minutes behind.
+        if (running_sums.timestamp_key is not None) and (0 < minute_key - running_sums.timestamp_key <= MAX_CATCH_UP_MINS) :
+            for minute in range(running_sums.timestamp_key + 1, minute_key + 1) :
+                minute_timestamp = timestamp_key - pd.Timedelta(minutes = minute_key - minute)
+                minute_df = longest_window_df.loc[minute_timestamp:minute_timestamp, :]
+                running_sums.add_minute(minute, minute_df[FIREFIGHTER_ID_COL].to_numpy(),
+                                        minute_df[self.SUPPORTED_GASES].to_numpy(dtype=float))
+
+        # If the number of readings held doesn't match the number of readings in the block, then some have arrived
+        # late (or the running sums were too far behind to catch up) - either way, rebuild.
+        if (running_sums.timestamp_key != minute_key) or (running_sums.raw_readings_count != len(longest_window_df.index)) :
+            self.logger.info("Rebuilding incremental time-weighted averages at timestamp %s" % (timestamp_key.isoformat()))
+            running_sums.rebuild(minute_key, longest_window_df[FIREFIGHTER_ID_COL].to_numpy(),
+                                 to_minutes(longest_window_df.index),
+                                 longest_window_df[self.SUPPORTED_GASES].to_numpy(dtype=float))
+
+        return running_sums.window_averages(), longest_window_df
+
+
+    # The pandas calculation's averages (see ParallelTWA.window_averages - one dataframe per window), as arrays in the
+    # same form as IncrementalTWA.window_averages returns them.
+    # Returns (ff_ids, window_averages, ffs_in_window) - arrays of shape (firefighters,), (firefighters, windows, gases)
+    # and (firefighters, windows).
+    def _window_averages_to_arrays(self, pandas_averages) :
+
+        ff_ids = pd.Index(np.concatenate([np.asarray(window_twa_df.index, dtype=object)
+                                          for window_twa_df in pandas_averages if window_twa_df is not None]
+                                         or [np.array([], dtype=object)])).unique()
+        window_averages = np.full((len(ff_ids), len(pandas_averages), len(self.SUPPORTED_GASES)), np.nan)
+        ffs_in_window = np.zeros((len(ff_ids), len(pandas_averages)), dtype=bool)
+        for window_idx, window_twa_df in enumerate(pandas_averages) :
+            if window_twa_df is not None :
+                positions = ff_ids.get_indexer(np.asarray(window_twa_df.index, dtype=object))
+                window_averages[positions, window_idx, :] = window_twa_df[self.SUPPORTED_GASES].to_numpy(dtype=float)
+                ffs_in_window[positions, window_idx] = True
+
+        return ff_ids.to_numpy(dtype=object), window_averages, ffs_in_window
+
+
+    # Now the main body of work - given the time-weighted averages for one minute (or several), already scaled to the
+    # proportion of each window covered (as _calculate_TWAs returns them), calculate the limit gauge percentages for
+    # every time window. Then merge all of these bits of info back together (with the original device data) to form
+    # the overall analytic results dataframe.
+    # twas_for_all_minutes : List of (timestamp_key, ff_ids, scaled_twas, ffs_in_window), for each minute.
+    # (latest_device_data and sensor_cols are as for _merge_and_calculate_status)
+    def _calculate_gauges_and_status(self, twas_for_all_minutes, latest_device_data, sensor_cols) :
+
+        windows_start_time = time.perf_counter()
+        windows_in_desc_mins_order = sorted(enumerate(self.WINDOWS_AND_LIMITS), key=lambda w: w[1]['mins'], reverse=True)
+        calculations_for_all_windows = [] # list of results from each window, for merging at the end
+        for window_idx, time_window in windows_in_desc_mins_order :
+            timestamps, ffs, twas = [], [], []
+            for minute_key, minute_ff_ids, minute_twas, minute_ffs_in_window in twas_for_all_minutes :
+                in_this_window = minute_ffs_in_window[:, window_idx]
+                timestamps.append(np.full(in_this_window.sum(), minute_key))
+                ffs.append(minute_ff_ids[in_this_window])
+                twas.append(minute_twas[in_this_window, window_idx, :])
+
+            # If the window is empty (in every minute), then there's nothing to do, just move on to the next window
+            ffs = np.concatenate(ffs)
+            if ffs.size == 0 :
+                continue
+
+            window_twa_df = pd.DataFrame(np.concatenate(twas), columns=self.SUPPORTED_GASES,
+                                         index=pd.Index(ffs, name=FIREFIGHTER_ID_COL))
+            calculations_for_all_windows.append(self._calculate_gauges_for_one_window(
+                window_twa_df, time_window, pd.DatetimeIndex(np.concatenate(timestamps))))
+        self.METRICS.observe('windows', time.perf_counter() - windows_start_time)
+
+        with self.METRICS.time('status') :
+            return self._merge_and_calculate_status(latest_device_data, calculations_for_all_windows, sensor_cols)
+
+
+    # Scales the average of each gas, for each firefighter, over each time-window to the proportion of the window that
+    # each firefighter's data covers (see _get_proportions_of_windows).
+    #
+    # Running sums (and sums added up in the database) are accurate, but they don't add up the readings in the same
+    # order as pandas does, so in the last few bits they can differ. That only matters when a TWA is right on a
+    # rounding boundary (e.g. 0.155 rounded to 2 decimal places) - and those are common with 1-min sensor data. How
+    # pandas adds up a group depends on its version (e.g. pandas 1.3+ compensates for rounding errors as it goes), so
+    # only pandas itself can say which way the reference calculation rounds. So the (few) firefighters with a TWA
+    # within floating point 'dust' of a rounding boundary have their averages worked out again with the pandas
+    # calculation (see ParallelTWA.window_averages_in_process).
+    # (ff_ids, window_averages, ffs_in_window are as IncrementalTWA.window_averages returns them)
+    # read_readings : Function taking the firefighter IDs to settle and returning (at least) their sensor readings in
+    #                 the longest window - e.g. from the block of sensor readings, or the database. None when the
+    #                 averages are the pandas calculation's own (so there's nothing to settle).
+    # Returns the scaled TWAs - an array of shape (firefighters, windows, gases).
+    def _scale_TWAs(self, ff_ids, window_averages, ffs_in_window, ff_time_spans_df, timestamp_key, read_readings=None) :
+
+        proportions_of_windows = self._get_proportions_of_windows(ff_time_spans_df, timestamp_key).reindex(ff_ids).to_numpy()
+        scaled_twas = window_averages * proportions_of_windows[:, :, np.newaxis]
+        if read_readings is None :
+            return scaled_twas
+
+        decimals = np.array([self.SAFE_ROUNDING_FACTORS[gas] for gas in self.SUPPORTED_GASES])
+        with np.errstate(invalid='ignore') :
+            near_boundary = ffs_in_window & np.any(
+                np.abs(np.mod(scaled_twas * (10.0 ** decimals), 1) - 0.5) < ROUNDING_BOUNDARY_TOLERANCE, axis=2)
+        settle = near_boundary.any(axis=1)
+        if not settle.any() :
+            return scaled_twas
+
+        # The same readings the pandas calculation would average - the settled firefighters' (typed and masked)
+        # readings in the longest window.
+        window_mins = [window[WINDOW_MINS_PROPERTY] for window in self.WINDOWS_AND_LIMITS]
+        longest_window_start = timestamp_key - pd.Timedelta(minutes = max(window_mins) - 1)
+        readings_df = read_readings(list(ff_ids[settle])).sort_index().loc[longest_window_start:timestamp_key, :]
+        readings_df = readings_df.loc[readings_df[FIREFIGHTER_ID_COL].isin(ff_ids[settle]), :]
+        readings_df = pd.DataFrame(readings_df[self.SUPPORTED_GASES].to_numpy(dtype=float), columns=self.SUPPORTED_GASES,
+                                   index=readings_df.index).assign(
+            **{FIREFIGHTER_ID_COL : np.asarray(readings_df[FIREFIGHTER_ID_COL], dtype=object)})
+        pandas_averages = window_averages_in_process(self._mask_range_exceeded_values(readings_df),
+                                                     self.SUPPORTED_GASES, window_mins, timestamp_key)
+
+        window_averages = window_averages.copy()
+        for window_idx, window_twa_df in enumerate(pandas_averages) :
+            if window_twa_df is not None :
+                positions = pd.Index(ff_ids).get_indexer(window_twa_df.index)
+                window_averages[positions, window_idx, :] = window_twa_df[self.SUPPORTED_GASES].to_numpy()
+        scaled_twas[settle] = window_averages[settle] * proportions_of_windows[settle, :, np.newaxis]
+
+        return scaled_twas
+
+
+    # Replace the '-1' that a device sends when a sensor has exceeded its range with np.inf (see
+    # _calculate_TWAs for why).
+    # sensor_log_df : A dataframe that includes all supported gases as columns. Modified in place.
+    def _mask_range_exceeded_values(self, sensor_log_df) :
+        sensor_log_df.loc[:, self.SUPPORTED_GASES] = (sensor_log_df.loc[:, self.SUPPORTED_GASES].mask(
+                                                   cond=(sensor_log_df.loc[:, self.SUPPORTED_GASES] < 0),
+                                                   other=np.inf))
+        return sensor_log_df
+
+
+    # Save a copy of the data for each device at 'timestamp_key' *if* available (may not be, depending on dropouts).
+    # Returns a list containing a dataframe keyed on [firefighter_id, timestamp_mins] - or an empty list.
+    # sensor_log_df : A time-indexed dataframe of (1-min quantized) sensor readings.
+    # timestamp_key : The minute-quantized timestamp key for which to get the latest device data.
+    def _get_latest_device_data(self, sensor_log_df, timestamp_key) :
+
         latest_device_data = []
-        if (timestamp_key in longest_window_cleaned_df.index) :
+        if (timestamp_key in sensor_log_df.index) :
             # If there's data for a device at 'timestamp_key', get a copy of it. While some if it is used for
             # calculating average exposures (e.g. gases, times, firefighter_id), much of it is not (e.g. temperature,
             # humidity, battery level) and this data needs to be merged back into the final dataframe.
-            latest_sensor_readings_df = (longest_window_cleaned_df
+            latest_sensor_readings_df = (sensor_log_df
                                         .loc[[timestamp_key],:] # the current minute
                                         .reset_index()
                                         .set_index([FIREFIGHTER_ID_COL, TIMESTAMP_COL])  # key to merge on at the end
@@ -376,107 +753,115 @@ class GasExposureAnalytics(object):
         else : 
             message = "No 'live' sensor records found at timestamp %s. Calculating Time-Weighted Averages anyway..."
             self.logger.info(message % (timestamp_key.isoformat()))
+
+        return latest_device_data
+
+
+    # _get_latest_device_data, from the (unsorted, unmasked) sensor records for 'timestamp_key' - rather than from the
+    # resampled block.
+    # Returns (latest_device_data, sensor_cols), as _merge_and_calculate_status takes them.
+    def _get_latest_device_data_from_records(self, latest_minute_df, timestamp_key) :
+        latest_device_data = self._get_latest_device_data(
+            self._mask_range_exceeded_values(latest_minute_df.sort_index()), timestamp_key)
+        sensor_cols = list(set(latest_minute_df.columns) - set([FIREFIGHTER_ID_COL, TIMESTAMP_COL]))
+        return latest_device_data, sensor_cols
+
+
+    # Works out the proportion of every time-window that each firefighter's data covers, so that their average
+    # exposures can be adjusted to it. Returns a dataframe of proportions (0 to 1), indexed by firefighter, with one
+    # column per time-window (numbered in the same order as WINDOWS_AND_LIMITS).
+    # ff_time_spans_df : The 'earliest and latest observed data points for each firefighter'.
+    # timestamp_key    : The minute-quantized timestamp key for which the averages are calculated.
+    def _get_proportions_of_windows(self, ff_time_spans_df, timestamp_key) :
+
+        # The average alone is not enough, we also have to adjust it to reflect how much of the time-window the
+        # data represents. e.g. Say the 8hr time-weighted average (TWA) exposure limit for CO exposure is 27ppm.
+        # Now imagine we observe 30ppm in the first 15 mins of an event and then have a connectivity dropout for
+        # the next 15 mins. What do we show the command center user? It's over the limit for an 8hr average, but
+        # we're only 30mins into that 8-hour period. So we adjust the TWA to the proportion of the time window
+        # that has actually elapsed. Note: this implicitly assumes that firefighter exposure is zero before the
+        # first recorded sensor value and after the last recorded value.
+
+        # To work out the window proportion, we (A) calculate the time overlap between the moving window and the
+        # available data timespans for each Firefighter, then (B) Divide the overlap by the total length of the
+        # time-window to get the proportion. Finally (C) the caller multiplies the TWAs for each firefighter by the
+        # proportion for that firefighter.
+        # This is done for all firefighters and all windows at once, as (firefighters x windows) array arithmetic on
+        # whole minutes (sensor data is keyed on minutes - see _get_block_of_sensor_readings).
+
+        # (A.1) Get the available data timespans for each Firefighter, as minute offsets from 'timestamp_key'.
+        to_minutes = lambda timestamps : np.asarray(timestamps, dtype='datetime64[m]').astype(np.int64)
+        key_minute = to_minutes([timestamp_key])[0]
+        data_start = (to_minutes(ff_time_spans_df[DATA_START]) - key_minute)[:, np.newaxis]
+        data_end = (to_minutes(ff_time_spans_df[DATA_END]) - key_minute)[:, np.newaxis]
+
+        # (A.2) The moving window timespans, as minute offsets from 'timestamp_key' (note: no start correction here
+        # because it's not a slice).
+        window_mins = np.array([window[WINDOW_MINS_PROPERTY] for window in self.WINDOWS_AND_LIMITS], dtype=np.int64)
+        window_start, window_end = -window_mins, 0
+
+        # (A.3) Calculate the overlap between the moving window and the available data timespans for each Firefighter.
+        # overlap = (earliest_end_time - latest_start_time). Negative overlap is meaningless, so when it happens,
+        # treat it as zero overlap.
+        overlap_mins = np.maximum(np.minimum(data_end, window_end) - np.maximum(data_start, window_start), 0)
+
+        # (B) Divide the overlap by the total length of the time-window to get a proportion. Maximum overlap is 1.
+        proportions = np.minimum(overlap_mins / window_mins.astype(float), 1.0)
+
+        return pd.DataFrame(proportions, index=ff_time_spans_df.index)
+
+
+    # Given the average exposure of each firefighter over one time-window (already adjusted to the proportion of the
+    # window that each firefighter's data covers), rounds it and calculates the gas limit gauges for that window.
+    # window_twa_df : The adjusted average of the available sensor readings, indexed by firefighter, one col per gas
+    #                 (see _get_proportions_of_windows).
+    # time_window   : The configured time-window (one of WINDOWS_AND_LIMITS).
+    # timestamp_key : The minute-quantized timestamp key for which the averages were calculated (or one key per row,
+    #                 when calculating for several minutes at once).
+    def _calculate_gauges_for_one_window(self, window_twa_df, time_window, timestamp_key) :
+
+        # Apply rounding to the adjusted TWAs.
+        window_twa_df = window_twa_df.copy()
+        for gas in self.SUPPORTED_GASES : 
+            window_twa_df.loc[:, gas] = np.round(window_twa_df.loc[:, gas], self.SAFE_ROUNDING_FACTORS[gas])
         
-        # Now the main body of work - iterate over the time windows, calculate their time-weighted averages & limit
-        # gauge percentages. Then merge all of these bits of info back together (with the original device data) to
-        # form the overall analytic results dataframe.
-        calculations_for_all_windows = [] # list of results from each window, for merging at the end
-        for time_window in windows_in_desc_mins_order :
-            
-            # Get the relevant slice of the data for this specific time-window, for all supported gas sensor readings
-            # (and excluding all other columns)
-            window_mins = time_window['mins']
-            window_length = pd.Timedelta(minutes = window_mins)
-            window_start = timestamp_key - window_length + one_minute
-            analytic_cols = self.SUPPORTED_GASES + [FIREFIGHTER_ID_COL]
-            window_df = longest_window_cleaned_df.loc[window_start:timestamp_key, analytic_cols]
-
-            # If the window is empty, then there's nothing to do, just move on to the next window
-            if (window_df.empty) :
-                continue
+        # Prepare the results for limit gauges and merging
+        window_twa_df = (window_twa_df
+                        .assign(**{TIMESTAMP_COL: timestamp_key})
+                        .reset_index()
+                        .set_index([FIREFIGHTER_ID_COL, TIMESTAMP_COL]))
+        
+        # Calculate gas limit gauge - percentage over / under the calculated TWA values
+        # (force gases and limits to have the same column order as each other before comparing)
+        gas_limits = [float(time_window[GAS_LIMITS_PROPERTY][gas]) for gas in self.SUPPORTED_GASES]
+        window_gauge_df = ((window_twa_df.loc[:, self.SUPPORTED_GASES] * 100 / gas_limits)
+                            .round(0)) # we don't need decimal precision for percentages
+
+        # Update column titles - add the time period over which we're averaging, so we can merge dataframes later
+        # without column name conflicts.
+        window_twa_df = window_twa_df.add_suffix((TWA_SUFFIX + MIN_SUFFIX) % (str(time_window[WINDOW_MINS_PROPERTY])))
+        window_gauge_df = window_gauge_df.add_suffix((GAUGE_SUFFIX + MIN_SUFFIX) % (str(time_window[WINDOW_MINS_PROPERTY])))
+
+        # Now return the results from this time window as a single merged dataframe (TWAs and Limit Gauges)
+        return pd.concat([window_twa_df, window_gauge_df], axis='columns')
 
-            # Check that there's never more data in the window than there should be (max 1 record per min, per FF)
-            assert(window_df.groupby(FIREFIGHTER_ID_COL).size().max() <= window_mins)
-
-            # Calculate time-weighted average exposure for this time-window.
-            # A *time-weighted* average, means each sensor reading is multiplied by the length of time the reading
-            # covers, before dividing by the total time covered. This can get very complicated if readings are unevenly
-            # spaced or if they get lost, or sent late due to connectivity dropouts. So Prometeo makes two design
-            # choices that account for these issues, and simplify calculations (reducing opportunities for error).
-            # (1) The system takes exactly one reading per minute, no more & no less, so the multiplication factor for 
-            #     every reading is always 1.
-            # (2) Any missing/lost sensor readings are approximated by using the average value for that sensor over the
-            #     time-window in question. (Care needs to be taken to ensure that calculations don't inadvertently 
-            #     approximate them as '0ppm').
-            # Since the goal we're after here is to get the average over a time-window, we don't need to actually 
-            # fill-in the missing entries, we can just get the average of the available sensor readings.
-            window_twa_df = window_df.groupby(FIREFIGHTER_ID_COL).mean()
-
-            # The average alone is not enough, we also have to adjust it to reflect how much of the time-window the
-            # data represents. e.g. Say the 8hr time-weighted average (TWA) exposure limit for CO exposure is 27ppm.
-            # Now imagine we observe 30ppm in the first 15 mins of an event and then have a connectivity dropout for
-            # the next 15 mins. What do we show the command center user? It's over the limit for an 8hr average, but
-            # we're only 30mins into that 8-hour period. So we adjust the TWA to the proportion of the time window
-            # that has actually elapsed. Note: this implicitly assumes that firefighter exposure is zero before the
-            # first recorded sensor value and after the last recorded value.
-
-            # To work out the window proportion, we (A) calculate the time overlap between the moving window and the
-            # available data timespans for each Firefighter, then (B) Divide the overlap by the total length of the
-            # time-window to get the proportion. Finally (C) Multiply the TWAs for each firefighter by the proportion
-            # for that firefighter.
-
-            # (A.1) Get the available data timespans for each Firefighter, only selecting firefighters that are in
-            # this window. (take a copy so that data from one window does not contaminate the next)
-            ffs_in_this_window = window_df.loc[:, FIREFIGHTER_ID_COL].unique()
-            overlap_df = ff_time_spans_df.loc[ff_time_spans_df.index.isin(ffs_in_this_window), :].copy()
-
-            # (A.2) Add on the moving window timespans (note: no start correction here because it's not a slice.
-            overlap_df = overlap_df.assign(**{WINDOW_START : timestamp_key - window_length, WINDOW_END : timestamp_key})            
-
-            # (A.3) Calculate the overlap between the moving window and the available data timespans for each Firefighter.
-            # overlap = (earliest_end_time - latest_start_time). Negative overlap is meaningless, so when it happens,
-            # treat it as zero overlap.
-            overlap_delta = (overlap_df.loc[:, [DATA_END,WINDOW_END]].min(axis='columns')
-                             - overlap_df.loc[:, [DATA_START,WINDOW_START]].max(axis='columns'))
-            overlap_df.loc[:, OVERLAP_MINS] = (overlap_delta.transform(
-                lambda delta: delta.total_seconds()/float(60) if delta.total_seconds() > 0 else 0))
-
-            # (B) Divide the overlap by the total length of the time-window to get a proportion. Maximum overlap is 1.
-            overlap_df.loc[:, PROPORTION_OF_WINDOW] = (overlap_df.loc[:, OVERLAP_MINS].transform(
-                lambda overlap_mins : overlap_mins/float(window_mins) if overlap_mins < window_mins else 1))
-
-            # (C) Multiply the TWAs for each firefighter by the proportion for that firefighter.
-            # Also apply rounding at this point.
-            window_twa_df = window_twa_df.multiply(overlap_df.loc[:, PROPORTION_OF_WINDOW], axis='rows')
-            for gas in self.SUPPORTED_GASES : 
-                window_twa_df.loc[:, gas] = np.round(window_twa_df.loc[:, gas], self.SAFE_ROUNDING_FACTORS[gas])
-            
-            # Prepare the results for limit gauges and merging
-            window_twa_df = (window_twa_df
-                            .assign(**{TIMESTAMP_COL: timestamp_key})
-                            .reset_index()
-                            .set_index([FIREFIGHTER_ID_COL, TIMESTAMP_COL]))
-            
-            # Calculate gas limit gauge - percentage over / under the calculated TWA values
-            # (force gases and limits to have the same column order as each other before comparing)
-            gas_limits = [float(time_window[GAS_LIMITS_PROPERTY][gas]) for gas in self.SUPPORTED_GASES]
-            window_gauge_df = ((window_twa_df.loc[:, self.SUPPORTED_GASES] * 100 / gas_limits)
-                                .round(0)) # we don't need decimal precision for percentages
-
-            # Update column titles - add the time period over which we're averaging, so we can merge dataframes later
-            # without column name conflicts.
-            window_twa_df = window_twa_df.add_suffix((TWA_SUFFIX + MIN_SUFFIX) % (str(time_window[WINDOW_MINS_PROPERTY])))
-            window_gauge_df = window_gauge_df.add_suffix((GAUGE_SUFFIX + MIN_SUFFIX) % (str(time_window[WINDOW_MINS_PROPERTY])))
-
-            # Now save the results from this time window as a single merged dataframe (TWAs and Limit Gauges)
-            calculations_for_all_windows.append(pd.concat([window_twa_df, window_gauge_df], axis='columns'))
+
+    # Merges 'everything' for one time step (or several) - the latest device data and the TWAs & Gauges from all time
+    # windows - and determines the overall status of each firefighter.
+    # latest_device_data           : List containing the latest device data (see _get_latest_device_data) or empty.
+    # calculations_for_all_windows : List of results from each window (see _calculate_gauges_for_one_window).
+    # sensor_cols                  : The sensor columns to set to null if there's no latest device data.
+    def _merge_and_calculate_status(self, latest_device_data, calculations_for_all_windows, sensor_cols) :
 
         # Merge 'everything' for this time step - TWAs & Gauges from all time windows, latest sensors readings, ...
-        everything_for_1_min_df = pd.concat(latest_device_data + calculations_for_all_windows, axis='columns')
+        # keyed on plain firefighter IDs (the block of sensor readings may hold them as categories, for grouping - see
+        # AnalyticsStorage.typed_sensor_readings).
+        everything_for_1_min_df = pd.concat([self._with_plain_firefighter_ids(df)
+                                             for df in latest_device_data + calculations_for_all_windows],
+                                            axis='columns')
 
         # If there were no latest sensors readings to merge, then just set all the sensor cols to null (np.nan)
         if not latest_device_data :
-            sensor_cols = list(set(longest_window_df.columns) - set([FIREFIGHTER_ID_COL, TIMESTAMP_COL]))
             everything_for_1_min_df = everything_for_1_min_df.assign(**{col:np.NaN for col in sensor_cols})
 
         # Now that we have all the informatiom, we can determine the overall Firefighter status.
@@ -496,40 +881,42 @@ class GasExposureAnalytics(object):
                                               .fillna(value=np.nan)
                                               .replace(np.inf, RANGE_EXCEEDED))
 
-        # Make the dataframe easier to print/read/debug 
+        # Make the dataframe easier to print/read/debug - and the same, row for row, however it was calculated (the
+        # order the windows' results are merged in depends on the pandas version).
         col_headers_sorted_for_readability = sorted(everything_for_1_min_df.columns.to_list(), key=str.casefold)
-        everything_for_1_min_df = everything_for_1_min_df.loc[:, col_headers_sorted_for_readability]
+        everything_for_1_min_df = everything_for_1_min_df.loc[:, col_headers_sorted_for_readability].sort_index()
         
         return everything_for_1_min_df
 
 
+    # The same results, keyed on [firefighter_id, timestamp_mins] with the firefighter IDs as plain strings rather than
+    # categories.
+    def _with_plain_firefighter_ids(self, results_df) :
+
+        firefighter_ids = results_df.index.get_level_values(FIREFIGHTER_ID_COL)
+        if not isinstance(firefighter_ids.dtype, pd.CategoricalDtype) :
+            return results_df
+        results_df = results_df.copy(deep=False)
+        results_df.index = pd.MultiIndex.from_arrays([np.asarray(firefighter_ids, dtype=object),
+                                                      results_df.index.get_level_values(TIMESTAMP_COL)],
+                                                     names=[FIREFIGHTER_ID_COL, TIMESTAMP_COL])
+        return results_df
+
+
     # This is 'main' - runs all of the core analytics for Prometeo in a given minute.
     # current_utc_timestamp : The UTC datetime for which to calculate sensor analytics. Defaults to 'now' (UTC).
     # commit : Utility flag for unit testing - defaults to committing analytic results to
     #          the database. Setting commit=False prevents unit tests from writing to the database.
-    def run_analytics (self, current_utc_timestamp=None, commit=True) :
+    # shard  : Only read and analyse the firefighters in this ShardAssignment (see AnalyticsShards) - e.g. one of
+    #          several analytics workers' share. Defaults to everyone.
+    def run_analytics (self, current_utc_timestamp=None, commit=True, shard=None) :
 
-        # Get the desired timeframe for the analytics run and standardise it to UTC.
-        if current_utc_timestamp is None:
-            # In normal usage, we run the analytics against the current ('now') time.
-            # (and UTC is the prometeo standard format for storing & communicating timestamps)
-            current_utc_timestamp = pd.Timestamp.utcnow()
-        else:
-            # When testing, we usually run against a specific (known) timestamp
-            # (wrapping pd.Timestamp allows us to test with both Pandas and Python-native dates)
-            current_utc_timestamp = pd.Timestamp(current_utc_timestamp)
-        # Drop the '+00:00' suffix from the standard UTC time (because our mariadb DB is not time-zone aware)
-        if current_utc_timestamp.tzinfo is not None: current_utc_timestamp = current_utc_timestamp.tz_convert(None)
-
-        # Very important: All sensor records are keyed on the FF id and the minute in which they arrive. So if 'now'
-        # is 08:10:11 (11s past 8.10am) then there's another 49s to go before we can expect all the similarly-keyed
-        # (08:10:00) sensor records to have arrived. Hence the actual 'latest' data that we're interested in running
-        # analytics for is "any data keyed 08:09:00" i.e. (now.floor() minus 1 minute) - that 1 minute is the arrival
-        # buffer for the data.
-        timestamp_key = current_utc_timestamp.floor(freq='min') - pd.Timedelta(minutes = 1)
+        timestamp_key = self._get_timestamp_key(current_utc_timestamp)
+        self._restore_checkpoint(timestamp_key)
+        self._set_shard(shard)
 
         message = ("Running Prometeo Analytics for minute key '%s'" % (timestamp_key.isoformat()))
-        if not self._from_db : message += " (local CSV file mode)"
+        if not self._from_db : message += " (in-memory mode)"
         self.logger.info(message)
 
         # Read a block of sensor logs from the DB, covering the longest window we're calculating over (usually 8hrs).
@@ -542,15 +929,545 @@ class GasExposureAnalytics(object):
         # detection would be based on derived values containing assumptions about missing data). So for now, we
         # prioritise quality and resist "premature optimisation/efficiency" at least until the system is
         # sound / correct, after which optimisation tradeoffs can be prioritised as needed.
-        sensor_log_df, ff_time_spans_df = self._get_block_of_sensor_readings(timestamp_key)
+        self.METRICS.increment('runs_total')
+        if self._DATABASE_TWA is not None :
+            analytics_df = self._run_analytics_in_database(timestamp_key, commit)
+        else :
+            analytics_df = self._run_analytics_on_block_of_sensor_readings(timestamp_key, commit)
+        self._finish_minute(timestamp_key)
+
+        return analytics_df
+
+
+    # run_analytics, from the block of sensor readings covering the longest window (read from STORAGE, or the sensor
+    # log cache) - with the pandas, parallel or incremental calculation.
+    def _run_analytics_on_block_of_sensor_readings(self, timestamp_key, commit) :
+
+        previous_timestamp_key = self._SENSOR_RECORD_COUNTS_KEY
+        previous_ff_time_spans_df = self._FF_TIME_SPANS_CACHE
+        with self.METRICS.time('read') :
+            sensor_log_df, ff_time_spans_df, latest_minute_df = self._get_block_of_sensor_readings(timestamp_key)
+            late_sensor_records = self._track_sensor_records(sensor_log_df, timestamp_key)
+        self.METRICS.increment('sensor_records_read_total', len(sensor_log_df.index))
 
         # Stop if there's no data (e.g. (1) after the system is booted but before any records have come in. (2) 8+ hours after an event
         if (sensor_log_df.empty) : return
         
         # Work out all the time-weighted averages and corresponding limit gauges for all firefighters, all limits and all gases.
-        analytics_df = self._calculate_TWA_and_gauge_for_all_firefighters(sensor_log_df, ff_time_spans_df, timestamp_key)
+        analytics_df = self._calculate_TWA_and_gauge_for_all_firefighters(sensor_log_df, ff_time_spans_df, timestamp_key,
+                                                                          latest_minute_df)
+        self.METRICS.set_gauge('firefighters', len(analytics_df.index))
 
-        if commit :
-            analytics_df.to_sql(ANALYTICS_TABLE, self._db_engine, if_exists='append', dtype={FIREFIGHTER_ID_COL:FIREFIGHTER_ID_COL_TYPE})
+        self._publish(analytics_df, commit)
+
+        # Correct any earlier results that late-arriving sensor records have changed.
+        if not late_sensor_records.empty :
+            with self.METRICS.time('recompute') :
+                self._recompute_late_arrivals(late_sensor_records, previous_timestamp_key, previous_ff_time_spans_df, commit)
 
         return analytics_df
+
+
+    # run_analytics, with the readings in every time-window added up in the database (see DatabaseTWA). Only the sums
+    # and counts for each firefighter, and the sensor records for 'timestamp_key' (to merge back into the results), are
+    # read.
+    def _run_analytics_in_database(self, timestamp_key, commit) :
+
+        with self.METRICS.time('read') :
+            window_sums_df = self._DATABASE_TWA.window_sums(timestamp_key, self._SHARD)
+            latest_minute_df = self._read_sensor_log(timestamp_key, timestamp_key, use_cache=False)
+        self.METRICS.increment('sensor_records_read_total', len(latest_minute_df.index))
+
+        if window_sums_df.empty :
+            self.logger.info("No 'live' sensor records found up to %s" % (timestamp_key.isoformat()))
+            # Reset the cache of 'earliest and latest observed data points for each firefighter' (as
+            # _get_block_of_sensor_readings does).
+            self._FF_TIME_SPANS_CACHE = None
+            return
+
+        # The earliest and latest reading of each firefighter in the block is all the time spans need.
+        ff_ids = window_sums_df.index.to_numpy()
+        ff_time_spans_df = self._update_ff_time_spans(pd.DataFrame(
+            {FIREFIGHTER_ID_COL : np.concatenate([ff_ids, ff_ids])},
+            index=pd.DatetimeIndex(np.concatenate([window_sums_df[DATA_START].to_numpy(),
+                                                   window_sums_df[DATA_END].to_numpy()]), name=TIMESTAMP_COL)))
+
+        # Averaging the sums is this path's equivalent of the 'resample' stage. Any TWAs right on a rounding boundary
+        # are settled with the pandas calculation, from just their firefighters' readings - one per timestamp, as the
+        # database added them up (see _scale_TWAs).
+        with self.METRICS.time('resample') :
+            block_start = timestamp_key - pd.Timedelta(minutes = max([window['mins'] for window in self.WINDOWS_AND_LIMITS]) - 1)
+            read_readings = lambda ff_ids_to_settle : self._DATABASE_TWA.one_reading_per_timestamp(
+                self._read_sensor_log(block_start, timestamp_key, use_cache=False, firefighter_ids=ff_ids_to_settle,
+                                      gases=self.SUPPORTED_GASES))
+            ff_ids, window_averages, ffs_in_window = self._DATABASE_TWA.window_averages(window_sums_df)
+            scaled_twas = self._scale_TWAs(ff_ids, window_averages, ffs_in_window, ff_time_spans_df, timestamp_key,
+                                           read_readings)
+            latest_device_data, sensor_cols = self._get_latest_device_data_from_records(latest_minute_df, timestamp_key)
+
+        analytics_df = self._calculate_gauges_and_status([(timestamp_key, ff_ids, scaled_twas, ffs_in_window)],
+                                                         latest_device_data, sensor_cols)
+        self.METRICS.set_gauge('firefighters', len(analytics_df.index))
+
+        self._publish(analytics_df, commit)
+
+        return analytics_df
+
+
+    # Record that a minute key has been analysed (the high-water mark), and checkpoint the state kept from minute to
+    # minute if it's time.
+    def _finish_minute(self, timestamp_key) :
+        self._LAST_TIMESTAMP_KEY = timestamp_key
+        self._save_checkpoint()
+
+
+    # Save the state kept from minute to minute, as of the latest minute key analysed, to CHECKPOINT - if it's time.
+    # force : Save it even if it isn't time yet (e.g. on close()).
+    def _save_checkpoint(self, force=False) :
+
+        if (self.CHECKPOINT is None) or (self._LAST_TIMESTAMP_KEY is None) :
+            return
+        if not (force or self.CHECKPOINT.due(self._LAST_TIMESTAMP_KEY)) :
+            return
+
+        with self.METRICS.time('checkpoint') :
+            shard = self._SHARD
+            arrays = {'shard' : np.array([-1, -1] if shard is None else [shard.SHARD_INDEX, shard.SHARD_COUNT])}
+            if self._FF_TIME_SPANS_CACHE is not None :
+                arrays.update(add_prefix('ff_time_spans.', frame_to_arrays(self._FF_TIME_SPANS_CACHE)))
+            if (self._INCREMENTAL_TWA is not None) and (self._INCREMENTAL_TWA.timestamp_key is not None) :
+                arrays.update(add_prefix('running_sums.', self._INCREMENTAL_TWA.state()))
+            sensor_log_cache_state = self._SENSOR_LOG_CACHE.state() if self._SENSOR_LOG_CACHE is not None else None
+            if sensor_log_cache_state is not None :
+                arrays.update(add_prefix('sensor_log_cache.', sensor_log_cache_state))
+            if self._SENSOR_RECORD_COUNTS is not None :
+                arrays.update(add_prefix('sensor_record_counts.',
+                                         frame_to_arrays(self._SENSOR_RECORD_COUNTS.to_frame('records'))))
+                arrays['sensor_record_counts_key'] = np.array(self._SENSOR_RECORD_COUNTS_KEY.to_datetime64())
+            self.CHECKPOINT.save(self._LAST_TIMESTAMP_KEY, arrays)
+
+
+    # Carry on from CHECKPOINT, if there's one to carry on from - the first time the analytics run. Everything in it
+    # is restored as it was, and the next block of sensor readings brings it up to date (as it would from one minute
+    # to the next): the sensor log cache reads the minutes it hasn't seen, the running sums catch up (or are rebuilt)
+    # and late records for minutes already analysed are recomputed.
+    # timestamp_key : The first minute key about to be analysed.
+    def _restore_checkpoint(self, timestamp_key) :
+
+        if (self.CHECKPOINT is None) or self._CHECKPOINT_RESTORED :
+            return
+        self._CHECKPOINT_RESTORED = True
+
+        checkpoint_timestamp_key, arrays = self.CHECKPOINT.load()
+        if arrays is None :
+            return
+
+        # The time spans are forgotten whenever a block has no sensor readings at all (see
+        # _get_block_of_sensor_readings). If every firefighter's data ended at least the longest window before this
+        # minute, then one of the minutes since the checkpoint may have had no readings - so start from scratch. (As
+        # too if the checkpoint is for a later minute).
+        longest_block = pd.Timedelta(minutes = max([window['mins'] for window in self.WINDOWS_AND_LIMITS]))
+        ff_time_spans_arrays = arrays_with_prefix('ff_time_spans.', arrays)
+        ff_time_spans_df = frame_from_arrays(ff_time_spans_arrays) if ff_time_spans_arrays else None
+        if ((checkpoint_timestamp_key > timestamp_key) or (ff_time_spans_df is None)
+            or (ff_time_spans_df[DATA_END].max() + longest_block <= timestamp_key)) :
+            self.logger.info("Nothing in the analytics checkpoint for minute key '%s' to carry on from at minute key "
+                             "'%s' - starting from scratch" % (checkpoint_timestamp_key.isoformat(),
+                                                               timestamp_key.isoformat()))
+            return
+
+        shard_index, shard_count = arrays['shard']
+        self._SHARD = ShardAssignment(int(shard_index), int(shard_count)) if shard_count > 0 else None
+        self._FF_TIME_SPANS_CACHE = ff_time_spans_df
+        running_sums_state = arrays_with_prefix('running_sums.', arrays)
+        if (self._INCREMENTAL_TWA is not None) and running_sums_state :
+            self._INCREMENTAL_TWA.restore(running_sums_state)
+        sensor_log_cache_state = arrays_with_prefix('sensor_log_cache.', arrays)
+        if (self._SENSOR_LOG_CACHE is not None) and sensor_log_cache_state :
+            self._SENSOR_LOG_CACHE.restore(sensor_log_cache_state, self._SHARD)
+        if self._RECOMPUTE_LATE_ARRIVALS and ('sensor_record_counts_key' in arrays) :
+            self._SENSOR_RECORD_COUNTS = frame_from_arrays(arrays_with_prefix('sensor_record_counts.', arrays))['records']
+            self._SENSOR_MINUTE_COUNTS = self._SENSOR_RECORD_COUNTS.groupby(level=TIMESTAMP_COL).sum()
+            self._SENSOR_RECORD_COUNTS_KEY = pd.Timestamp(arrays['sensor_record_counts_key'][()])
+        self._LAST_TIMESTAMP_KEY = checkpoint_timestamp_key
+
+        self.logger.info("Carrying on from the analytics checkpoint for minute key '%s' (%s minute(s) before '%s')"
+                         % (checkpoint_timestamp_key.isoformat(),
+                            int((timestamp_key - checkpoint_timestamp_key) / pd.Timedelta(minutes = 1)),
+                            timestamp_key.isoformat()))
+
+
+    # Switch to analysing a different shard of the firefighters (or everyone) - e.g. when analytics workers join or
+    # leave. Everything kept from earlier minutes is about the old shard's firefighters, so it's forgotten (and rebuilt
+    # from the next block of sensor readings).
+    def _set_shard(self, shard) :
+
+        if shard == self._SHARD :
+            return
+        self.logger.info("Analysing %s" % ('all firefighters' if shard is None else
+                                           'shard %s of %s' % (shard.SHARD_INDEX + 1, shard.SHARD_COUNT)))
+        self._SHARD = shard
+        self._FF_TIME_SPANS_CACHE = None
+        self._SENSOR_RECORD_COUNTS = None
+        self._SENSOR_RECORD_COUNTS_KEY = None
+        if self._INCREMENTAL_TWA is not None :
+            self._INCREMENTAL_TWA.reset()
+
+
+    # Keep track of which sensor records have been analysed, to find any that arrive late (only when
+    # recompute_late_arrivals is set). Sensor records are only ever inserted, so any (firefighter, minute) that has
+    # more records in this block than it had in the previous minute's block - for a minute that the previous block
+    # covered - has had records arrive late. (Records that arrive later than the longest window can no longer affect
+    # the current results, so they aren't looked for).
+    # sensor_log_df : The (sorted) block of sensor readings about to be analysed for timestamp_key.
+    # Returns the [firefighter_id, timestamp_mins] keys with late records (may be empty).
+    def _track_sensor_records(self, sensor_log_df, timestamp_key) :
+
+        late_sensor_records = pd.MultiIndex.from_arrays([[], []], names=[FIREFIGHTER_ID_COL, TIMESTAMP_COL])
+        if not self._RECOMPUTE_LATE_ARRIVALS :
+            return late_sensor_records
+
+        # (An empty block - e.g. from storage with no sensor log yet - may not have the columns.)
+        if sensor_log_df.empty :
+            sensor_log_df = sensor_log_df.reindex(columns=[FIREFIGHTER_ID_COL])
+
+        # Counted by plain firefighter ID (not the block's categories, which change from block to block).
+        firefighter_ids = pd.Index(np.asarray(sensor_log_df[FIREFIGHTER_ID_COL], dtype=object), name=FIREFIGHTER_ID_COL)
+        sensor_record_counts = sensor_log_df.groupby([firefighter_ids, sensor_log_df.index]).size()
+        minute_record_counts = sensor_log_df.index.value_counts()
+        if (self._SENSOR_RECORD_COUNTS is not None) and (self._SENSOR_RECORD_COUNTS_KEY < timestamp_key) :
+            # A (firefighter, minute) can only have gained records if the minute has - so only the (few) minutes with
+            # more records than before need their firefighters' counts compared.
+            analysed_minutes = minute_record_counts[minute_record_counts.index <= self._SENSOR_RECORD_COUNTS_KEY]
+            previous_minute_counts = self._SENSOR_MINUTE_COUNTS.reindex(analysed_minutes.index, fill_value=0)
+            grown_minutes = analysed_minutes.index[analysed_minutes.to_numpy() > previous_minute_counts.to_numpy()]
+            if not grown_minutes.empty :
+                previously_analysed = sensor_record_counts[
+                    sensor_record_counts.index.get_level_values(TIMESTAMP_COL).isin(grown_minutes)]
+                previous_counts = self._SENSOR_RECORD_COUNTS[
+                    self._SENSOR_RECORD_COUNTS.index.get_level_values(TIMESTAMP_COL).isin(grown_minutes)]
+                previous_counts = previous_counts.reindex(previously_analysed.index, fill_value=0)
+                late_sensor_records = previously_analysed.index[previously_analysed.to_numpy() >
+                                                                previous_counts.to_numpy()]
+
+        self._SENSOR_RECORD_COUNTS = sensor_record_counts
+        self._SENSOR_MINUTE_COUNTS = minute_record_counts
+        self._SENSOR_RECORD_COUNTS_KEY = timestamp_key
+        return late_sensor_records
+
+
+    # Recompute (and publish) the earlier analytic results that late-arriving sensor records have changed - and only
+    # those. A late record for firefighter F at minute M changes F's results from M onwards: every window that
+    # includes M, plus - through the proportion of each window that F's data covers - any window that now overlaps F's
+    # data (including the AUTOFILL_MINS buffer after it) further than it did. That's at most up to the longest window
+    # (plus the buffer) after M, or after F's previous earliest record if M is earlier than it. Other firefighters'
+    # results don't depend on F's records, so they're left alone.
+    # late_sensor_records       : The [firefighter_id, timestamp_mins] keys with late records.
+    # last_timestamp_key        : The latest minute analysed before the late records were found.
+    # previous_ff_time_spans_df : The 'earliest and latest observed data points for each firefighter' as of then.
+    # Returns the recomputed results (already published).
+    def _recompute_late_arrivals(self, late_sensor_records, last_timestamp_key, previous_ff_time_spans_df, commit) :
+
+        one_minute = pd.Timedelta(minutes = 1)
+        longest_block = pd.Timedelta(minutes = max([window['mins'] for window in self.WINDOWS_AND_LIMITS]))
+        autofill = pd.Timedelta(minutes = self.AUTOFILL_MINS)
+
+        # The minutes affected, for each firefighter with late records.
+        affected_from = late_sensor_records.to_frame(index=False).groupby(FIREFIGHTER_ID_COL)[TIMESTAMP_COL].min()
+        previous_data_start = pd.Series(pd.NaT, index=affected_from.index)
+        if previous_ff_time_spans_df is not None :
+            previous_data_start = previous_ff_time_spans_df[DATA_START].reindex(affected_from.index)
+        affected_to = (pd.concat([affected_from, previous_data_start], axis=1).max(axis=1)
+                       + longest_block + autofill - one_minute)
+        affected_to = affected_to.where(affected_to <= last_timestamp_key, last_timestamp_key)
+
+        first_timestamp_key = affected_from.min()
+        self.logger.info("Late sensor records found for %s firefighter(s) - recomputing from minute key '%s' to '%s'"
+                         % (len(affected_from.index), first_timestamp_key.isoformat(), last_timestamp_key.isoformat()))
+
+        # Recalculate the affected firefighters over the affected minutes, from scratch - with the configured
+        # calculation (and their own running sums, if it's incremental), leaving the live state as it is. Their time
+        # spans start from what was known before the affected minutes' blocks (anything within the blocks is re-read).
+        first_block_start = first_timestamp_key - longest_block + one_minute
+        sensor_log_df = self._read_sensor_log(first_block_start, last_timestamp_key, use_cache=False,
+                                              firefighter_ids=affected_from.index.to_list()).sort_index()
+        ff_time_spans_cache = None
+        if previous_ff_time_spans_df is not None :
+            earlier_data_start = previous_data_start[previous_data_start < first_block_start]
+            if not earlier_data_start.empty :
+                ff_time_spans_cache = pd.DataFrame({DATA_START : earlier_data_start, DATA_END : earlier_data_start})
+        running_sums = None
+        if self._INCREMENTAL_TWA is not None :
+            running_sums = IncrementalTWA([window[WINDOW_MINS_PROPERTY] for window in self.WINDOWS_AND_LIMITS],
+                                          len(self.SUPPORTED_GASES))
+        recomputed_df, _ = self._calculate_analytics_for_range(sensor_log_df, first_timestamp_key, last_timestamp_key,
+                                                               running_sums, ff_time_spans_cache)
+        if recomputed_df is None :
+            return None
+
+        # Keep just the affected results.
+        ffs = recomputed_df.index.get_level_values(FIREFIGHTER_ID_COL)
+        timestamps = recomputed_df.index.get_level_values(TIMESTAMP_COL)
+        recomputed_df = recomputed_df.loc[(timestamps >= affected_from.reindex(ffs).to_numpy())
+                                          & (timestamps <= affected_to.reindex(ffs).to_numpy())]
+
+        self.logger.info("Recomputed %s analytic results affected by late sensor records" % (len(recomputed_df.index)))
+        self._publish(recomputed_df, commit)
+
+        return recomputed_df
+
+
+    # Runs the analytics for every minute in a range in one pass - e.g. to back-fill the analytics after an outage, or
+    # to replay a past event. The results are the same as calling run_analytics() for each minute in turn (and so is
+    # the state left behind), but the sensor log is read just once for the whole range and the time-weighted averages
+    # are moved on from minute to minute with running sums (see IncrementalTWA), instead of re-reading and
+    # re-averaging up to 8 hours of sensor records for every minute. Whichever calculation is configured, the results
+    # are exactly the same - any TWAs right on a rounding boundary are settled with the pandas calculation (see
+    # _scale_TWAs).
+    # start_utc_timestamp, end_utc_timestamp : The first and last UTC datetimes (inclusive) to run the analytics for -
+    #          i.e. as if run_analytics(current_utc_timestamp) had been called at each minute from start to end.
+    # commit : Utility flag for unit testing - defaults to committing analytic results to
+    #          the database. Setting commit=False prevents unit tests from writing to the database.
+    # shard  : Only read and analyse the firefighters in this ShardAssignment (as for run_analytics).
+    # Returns the analytic results for all minutes in one dataframe (None if there were none).
+    def run_analytics_range (self, start_utc_timestamp, end_utc_timestamp, commit=True, shard=None) :
+
+        first_timestamp_key = self._get_timestamp_key(start_utc_timestamp)
+        last_timestamp_key = self._get_timestamp_key(end_utc_timestamp)
+        self._restore_checkpoint(first_timestamp_key)
+        self._set_shard(shard)
+
+        message = ("Running Prometeo Analytics for minute keys '%s' to '%s'"
+                   % (first_timestamp_key.isoformat(), last_timestamp_key.isoformat()))
+        if not self._from_db : message += " (in-memory mode)"
+        self.logger.info(message)
+
+        # Read every sensor record that any of the minutes will need, once. Read directly - a one-off block like this
+        # (e.g. replaying a past event) would only displace the recent records held in the sensor log cache - unless
+        # the range carries on from the last minute analysed (e.g. catching up on missed minutes), in which case the
+        # cache holds most of it already.
+        one_minute = pd.Timedelta(minutes = 1)
+        longest_block = pd.Timedelta(minutes = max([window['mins'] for window in self.WINDOWS_AND_LIMITS]))
+        carrying_on = ((self._LAST_TIMESTAMP_KEY is not None)
+                       and (first_timestamp_key - one_minute == self._LAST_TIMESTAMP_KEY))
+        previous_timestamp_key = self._SENSOR_RECORD_COUNTS_KEY
+        previous_ff_time_spans_df = self._FF_TIME_SPANS_CACHE
+        self.METRICS.increment('runs_total')
+        with self.METRICS.time('read') :
+            sensor_log_df = self._read_sensor_log(first_timestamp_key - longest_block + one_minute, last_timestamp_key,
+                                                  use_cache=carrying_on).sort_index()
+        self.METRICS.increment('sensor_records_read_total', len(sensor_log_df.index))
+
+        running_sums = self._INCREMENTAL_TWA
+        if running_sums is None :
+            running_sums = IncrementalTWA([window[WINDOW_MINS_PROPERTY] for window in self.WINDOWS_AND_LIMITS],
+                                          len(self.SUPPORTED_GASES))
+
+        analytics_df, self._FF_TIME_SPANS_CACHE = self._calculate_analytics_for_range(
+            sensor_log_df, first_timestamp_key, last_timestamp_key, running_sums, self._FF_TIME_SPANS_CACHE)
+        late_sensor_records = self._track_sensor_records(
+            sensor_log_df.loc[last_timestamp_key - longest_block + one_minute:last_timestamp_key, :], last_timestamp_key)
+        self._finish_minute(last_timestamp_key)
+
+        if analytics_df is not None :
+            self._publish(analytics_df, commit)
+
+        # Correct any results from before the range that late-arriving sensor records have changed (as run_analytics).
+        if not late_sensor_records.empty :
+            with self.METRICS.time('recompute') :
+                self._recompute_late_arrivals(late_sensor_records, previous_timestamp_key, previous_ff_time_spans_df, commit)
+
+        return analytics_df
+
+
+    # Runs the analytics for the last minute, as run_analytics() does - and for any minutes missed since the last
+    # minute analysed (e.g. after a run that overran, or a restart from a checkpoint), in the same pass (see
+    # run_analytics_range). This is how the scheduled analytics run, so that missed minutes don't leave holes in the
+    # results. Only the latest max_missed_mins missed minutes are caught up on - any earlier ones are left out.
+    # (current_utc_timestamp, commit and shard are as for run_analytics)
+    # max_missed_mins : The maximum number of missed minutes to catch up on.
+    # Returns the analytic results for every minute run, in one dataframe (None if there were none).
+    def run_analytics_catching_up (self, current_utc_timestamp=None, commit=True, shard=None,
+                                   max_missed_mins=DEFAULT_MAX_MISSED_MINS) :
+
+        one_minute = pd.Timedelta(minutes = 1)
+        timestamp_key = self._get_timestamp_key(current_utc_timestamp)
+        self._restore_checkpoint(timestamp_key)
+
+        missed_mins = 0
+        if (self._LAST_TIMESTAMP_KEY is not None) and (self._LAST_TIMESTAMP_KEY < timestamp_key) :
+            missed_mins = int((timestamp_key - self._LAST_TIMESTAMP_KEY) / one_minute) - 1
+        if missed_mins == 0 :
+            return self.run_analytics(timestamp_key + one_minute, commit, shard)
+
+        if missed_mins > max_missed_mins :
+            self.logger.warning("%s minutes missed since minute key '%s' - only catching up on the latest %s"
+                                % (missed_mins, self._LAST_TIMESTAMP_KEY.isoformat(), max_missed_mins))
+        catch_up_mins = min(missed_mins, max_missed_mins)
+        self.logger.info("Catching up on %s missed minute(s)" % (catch_up_mins))
+        self.METRICS.increment('missed_minutes_total', missed_mins)
+        self.METRICS.increment('caught_up_minutes_total', catch_up_mins)
+
+        # (run_analytics_range takes the times the analytics would have run at, a minute after each minute key)
+        return self.run_analytics_range(timestamp_key - (catch_up_mins - 1) * one_minute, timestamp_key + one_minute,
+                                        commit, shard)
+
+
+    # The calculation behind run_analytics_range() - the analytic results for every minute from first_timestamp_key
+    # to last_timestamp_key, moving the running sums on from minute to minute.
+    # sensor_log_df       : Every (sorted) sensor record that any of the minutes need.
+    # running_sums        : The IncrementalTWA to use - or None to calculate every minute with pandas (see
+    #                       _calculate_TWAs).
+    # ff_time_spans_cache : The 'earliest and latest observed data points for each firefighter' before the first
+    #                       minute (as kept in _FF_TIME_SPANS_CACHE - may be None).
+    # Returns (analytics_df, ff_time_spans_cache) - the results for all minutes in one dataframe (None if there were
+    # none) and the time spans as of the last minute.
+    def _calculate_analytics_for_range(self, sensor_log_df, first_timestamp_key, last_timestamp_key, running_sums,
+                                       ff_time_spans_cache) :
+
+        one_minute = pd.Timedelta(minutes = 1)
+        longest_block = pd.Timedelta(minutes = max([window['mins'] for window in self.WINDOWS_AND_LIMITS]))
+
+        # The 'earliest and latest observed data points for each firefighter' (as in _update_ff_time_spans), kept as
+        # plain lists between minutes - [firefighter ids], {firefighter id : position}, [data starts], [data ends].
+        ff_time_spans = None
+        autofill = pd.Timedelta(minutes = self.AUTOFILL_MINS)
+
+        twas_for_all_minutes = [] # (timestamp_key, ff_ids, scaled_twas, ffs_in_window) for each minute with data
+        for timestamp_key in pd.date_range(first_timestamp_key, last_timestamp_key, freq='min') :
+
+            # The same block of sensor readings that run_analytics() would read for this minute.
+            block_df = sensor_log_df.loc[timestamp_key - longest_block + one_minute:timestamp_key, :]
+            if (block_df.empty) :
+                # As in _get_block_of_sensor_readings - no data, so reset the firefighter time spans and skip.
+                ff_time_spans = None
+                continue
+
+            if ff_time_spans is None :
+                # First block (or first after a gap) - update the time spans from the whole block, as usual.
+                ff_time_spans_cache = self._merge_ff_time_spans(ff_time_spans_cache, block_df)
+                ff_ids = list(ff_time_spans_cache.index)
+                ff_time_spans = (ff_ids, {ff : idx for idx, ff in enumerate(ff_ids)},
+                                 list(ff_time_spans_cache[DATA_START]), list(ff_time_spans_cache[DATA_END]))
+            else :
+                # Only the readings for this minute are new since the previous minute's block, so they're all it
+                # takes to move the time spans on - new firefighters start now, and all of them have data up to now.
+                ff_ids, ff_positions, data_starts, data_ends = ff_time_spans
+                for ff in block_df.loc[timestamp_key:timestamp_key, FIREFIGHTER_ID_COL] :
+                    if ff not in ff_positions :
+                        ff_positions[ff] = len(ff_ids)
+                        ff_ids.append(ff)
+                        data_starts.append(timestamp_key)
+                        data_ends.append(timestamp_key)
+                    data_ends[ff_positions[ff]] = max(data_ends[ff_positions[ff]], timestamp_key)
+
+            ff_ids, _, data_starts, data_ends = ff_time_spans
+            ff_time_spans_df = pd.DataFrame({DATA_START : data_starts, DATA_END : data_ends},
+                                            index=pd.Index(ff_ids, name=FIREFIGHTER_ID_COL))
+            ff_time_spans_df.loc[:, DATA_END] += autofill
+
+            twas_for_all_minutes.append((timestamp_key,) + self._calculate_TWAs(
+                block_df, ff_time_spans_df, timestamp_key, running_sums))
+
+        # The time spans as of the last minute (None if its block was empty).
+        ff_time_spans_cache = None
+        if ff_time_spans is not None :
+            ff_ids, _, data_starts, data_ends = ff_time_spans
+            ff_time_spans_cache = pd.DataFrame({DATA_START : data_starts, DATA_END : data_ends},
+                                               index=pd.Index(ff_ids, name=FIREFIGHTER_ID_COL))
+
+        if not twas_for_all_minutes : return None, ff_time_spans_cache
+
+        # Now build the results for all minutes at once (rather than one small dataframe per minute), keyed on
+        # [firefighter_id, timestamp_mins] as usual. Every sensor record in the range is the 'latest device data' for
+        # its own minute.
+        latest_device_df = self._mask_range_exceeded_values(
+            sensor_log_df.loc[first_timestamp_key:last_timestamp_key, :].copy())
+        latest_device_data = []
+        if not latest_device_df.empty :
+            latest_device_data = [latest_device_df.reset_index().set_index([FIREFIGHTER_ID_COL, TIMESTAMP_COL])]
+
+        sensor_cols = list(set(sensor_log_df.columns) - set([FIREFIGHTER_ID_COL, TIMESTAMP_COL]))
+        analytics_df = self._calculate_gauges_and_status(twas_for_all_minutes, latest_device_data, sensor_cols)
+
+        return analytics_df, ff_time_spans_cache
+
+
+    # Runs the analytics minute by minute over a sensor log that's streamed from files (see SensorLogStream - it must
+    # be STORAGE), from the first sensor record to the last - e.g. to replay an archive that's too big to hold in
+    # memory. Results are yielded as they're calculated, rather than collected, so memory stays bounded by the
+    # longest time-window (use incremental=True for the fastest replay).
+    # commit : Also commit each minute's results to STORAGE.
+    # Returns a generator of each minute's analytic results (minutes with no results are skipped).
+    def stream_analytics (self, commit=False) :
+
+        one_minute = pd.Timedelta(minutes = 1)
+        for timestamp_key in self.STORAGE.minutes() :
+            analytics_df = self.run_analytics(timestamp_key + one_minute, commit)
+            if analytics_df is not None :
+                yield analytics_df
+
+
+    # Make analytic results available - in the status cache straight away, and in the database if committing.
+    def _publish(self, analytics_df, commit) :
+        self.METRICS.increment('results_total', len(analytics_df.index))
+        if self.STATUS_CACHE is not None :
+            self.STATUS_CACHE.publish(analytics_df)
+        if commit :
+            self._commit(analytics_df)
+
+
+    # Write analytic results to the database - straight away, or via the write-behind queue.
+    def _commit(self, analytics_df) :
+        with self.METRICS.time('commit') :
+            if self._ANALYTICS_WRITE_QUEUE is not None :
+                self._ANALYTICS_WRITE_QUEUE.put(analytics_df)
+            else :
+                self.STORAGE.write(analytics_df)
+
+
+    # The analytics metrics (see METRICS), in the Prometheus text format - e.g. for a /metrics endpoint.
+    def metrics_text(self) :
+        if self._ANALYTICS_WRITE_QUEUE is not None :
+            self.METRICS.set_gauge('write_backlog_frames', self._ANALYTICS_WRITE_QUEUE.backlog())
+        # The database connection pool, shared with anything else using STORAGE.db_engine (e.g. the status endpoints).
+        for gauge, value in (pool_status(self.STORAGE.db_engine) or {}).items() :
+            self.METRICS.set_gauge(gauge, value)
+        return self.METRICS.to_prometheus_text()
+
+
+    # Make sure all analytic results have been written (or spilled to file, if the database is unreachable) - e.g.
+    # before exiting. Only needed with write_behind (or parallel_workers, whose worker processes are stopped, or
+    # checkpoint_file, which is saved).
+    def close(self) :
+        self._save_checkpoint(force=True)
+        if self._ANALYTICS_WRITE_QUEUE is not None :
+            self._ANALYTICS_WRITE_QUEUE.close()
+        if self._PARALLEL_TWA is not None :
+            self._PARALLEL_TWA.close()
+
+
+    # Get the minute key to run the analytics for, given the time they're run at.
+    # current_utc_timestamp : The UTC datetime at which the analytics are run. Defaults to 'now' (UTC).
+    def _get_timestamp_key (self, current_utc_timestamp=None) :
+
+        # Get the desired timeframe for the analytics run and standardise it to UTC.
+        if current_utc_timestamp is None:
+            # In normal usage, we run the analytics against the current ('now') time.
+            # (and UTC is the prometeo standard format for storing & communicating timestamps)
+            current_utc_timestamp = pd.Timestamp.utcnow()
+        else:
+            # When testing, we usually run against a specific (known) timestamp
+            # (wrapping pd.Timestamp allows us to test with both Pandas and Python-native dates)
+            current_utc_timestamp = pd.Timestamp(current_utc_timestamp)
+        # Drop the '+00:00' suffix from the standard UTC time (because our mariadb DB is not time-zone aware)
+        if current_utc_timestamp.tzinfo is not None: current_utc_timestamp = current_utc_timestamp.tz_convert(None)
+
+        # Very important: All sensor records are keyed on the FF id and the minute in which they arrive. So if 'now'
+        # is 08:10:11 (11s past 8.10am) then there's another 49s to go before we can expect all the similarly-keyed
+        # (08:10:00) sensor records to have arrived. Hence the actual 'latest' data that we're interested in running
+        # analytics for is "any data keyed 08:09:00" i.e. (now.floor() minus 1 minute) - that 1 minute is the arrival
+        # buffer for the data.
+        timestamp_key = current_utc_timestamp.floor(freq='min') - pd.Timedelta(minutes = 1)
+
+        return timestamp_key
@@ -0,0 +1,360 @@
+import numpy as np
+
+try :
+    from .SensorRingBuffer import SensorRingBuffer
+except ImportError :
+    from SensorRingBuffer import SensorRingBuffer
+
+
+# Sentinels for 'no sensor reading in the longest window'. They're chosen so that the comparisons used below
+# ("is there a reading earlier / later than minute m?") are simply False when there is no reading at all.
+NO_EARLIEST_MINUTE = np.iinfo(np.int64).max
+NO_LATEST_MINUTE = np.iinfo(np.int64).min
+
+# The arrays kept for each firefighter (alongside their raw readings - see IncrementalTWA._allocate).
+PER_FIREFIGHTER_ARRAYS = ['_eff', '_eff_present', '_earliest', '_latest', '_sums', '_counts', '_inf_counts',
+                          '_minute_counts']
+
+
+# Incremental ('running sum') calculation of the windowed sensor averages that GasExposureAnalytics uses for its
+# time-weighted averages. Instead of re-averaging up to 480 rows per firefighter for every window, every minute, it
+# keeps a running sum and count for each (firefighter, window, gas). Each minute, the readings for the newest minute
+# are added and the minute leaving each window is subtracted, so the cost per minute is
+# O(firefighters x windows x gases) - not O(rows in the longest window).
+#
+# The results are the same as the pandas calculation (the reference implementation in
+# GasExposureAnalytics._calculate_TWAs), including its 1-min quantization: the pandas
+# path resamples each firefighter's readings over the longest window with .nearest(limit=1), which *fills* a missing
+# minute with a neighbouring reading if there's a reading 1 minute either side of it. The precise rule, for a
+# missing minute 'm' in the longest window [start, end] is :
+#   (1) If there's a reading at m+1 and at least one earlier reading in the window -> use the reading at m+1
+#       (ties go to the later reading)
+#   (2) Otherwise, if there's a reading at m-1 and at least one later reading in the window -> use the reading at m-1
+#   (3) Otherwise the minute is missing, and doesn't count towards the average.
+# Here, these 'effective' readings are kept alongside the raw readings (which are held in a SensorRingBuffer). When the windows move on by one minute,
+# only a handful of minutes per firefighter can change their effective reading (the newest minute, the minute
+# before it, the minute after the previous latest reading, the start of the longest window and the minute before
+# the earliest reading) - so only those are re-evaluated.
+#
+# Range-exceeded sensor values ('-1') are stored as np.inf by the SensorRingBuffer (see GasExposureAnalytics). Since
+# inf - inf is not 0, the running sums only hold finite values and infinite values are counted separately - an
+# average is inf if any value in its window is inf, just as with pandas.
+#
+# Timestamps are integer minutes (e.g. minutes since the epoch) and each firefighter is expected to have at most one
+# reading per minute (if there are more, the last one given is used).
+class IncrementalTWA(object):
+
+
+    # window_mins : The length (in minutes) of every time-window to calculate averages for.
+    # num_gases   : The number of gas sensor values in each reading.
+    def __init__(self, window_mins, num_gases):
+
+        self.WINDOW_MINS = np.array(window_mins, dtype=np.int64)
+        self.LONGEST_WINDOW_MINS = int(self.WINDOW_MINS.max())
+        self.NUM_GASES = num_gases
+        self.READINGS = SensorRingBuffer(self.LONGEST_WINDOW_MINS, num_gases)
+
+        self.reset()
+
+
+    # Forget everything - e.g. before rebuilding from a block of sensor readings.
+    def reset(self) :
+
+        self.READINGS.reset()
+        self._minutes_since_recalculation = 0
+        self._allocate(self.READINGS.capacity, keep_contents=False)
+
+
+    # The latest minute that has been added.
+    @property
+    def timestamp_key(self) :
+        return self.READINGS.latest_minute
+
+
+    # The number of raw readings currently held (used to detect late arrivals).
+    @property
+    def raw_readings_count(self) :
+        return self.READINGS.readings_count
+
+
+    # (Re-)allocate per-firefighter storage (in step with the raw readings' SensorRingBuffer), optionally keeping any
+    # existing contents.
+    def _allocate(self, capacity, keep_contents=True) :
+
+        shapes_and_fills = {
+            # Effective readings for the longest window, laid out like the raw readings
+            # i.e. indexed [firefighter, minute % LONGEST_WINDOW_MINS, gas]
+            '_eff'           : ((capacity, self.LONGEST_WINDOW_MINS, self.NUM_GASES), np.nan),
+            '_eff_present'   : ((capacity, self.LONGEST_WINDOW_MINS), False),
+            # Earliest & latest raw reading in the longest window, for each firefighter
+            '_earliest'      : ((capacity,), NO_EARLIEST_MINUTE),
+            '_latest'        : ((capacity,), NO_LATEST_MINUTE),
+            # Running aggregates, indexed [firefighter, window, gas] (or [firefighter, window])
+            '_sums'          : ((capacity, len(self.WINDOW_MINS), self.NUM_GASES), 0.0),
+            '_counts'        : ((capacity, len(self.WINDOW_MINS), self.NUM_GASES), 0),
+            '_inf_counts'    : ((capacity, len(self.WINDOW_MINS), self.NUM_GASES), 0),
+            '_minute_counts' : ((capacity, len(self.WINDOW_MINS)), 0),
+        }
+        for name, (shape, fill) in shapes_and_fills.items() :
+            new_array = np.full(shape, fill)
+            if keep_contents :
+                old_array = getattr(self, name)
+                new_array[:old_array.shape[0]] = old_array
+            setattr(self, name, new_array)
+
+
+    # Everything held, as a dict of arrays - e.g. for a checkpoint (see AnalyticsCheckpoint).
+    def state(self) :
+        num_ffs = len(self.READINGS.ff_ids)
+        state = {'readings.' + name : array for name, array in self.READINGS.state().items()}
+        state.update({name : getattr(self, name)[:num_ffs] for name in PER_FIREFIGHTER_ARRAYS})
+        state['minutes_since_recalculation'] = np.array(self._minutes_since_recalculation)
+        return state
+
+
+    # Replace everything held with a state() saved earlier (for the same windows and number of gases) - so the
+    # running sums carry on from the minute they were saved at.
+    def restore(self, state) :
+
+        self.READINGS.restore({name[len('readings.'):] : array for name, array in state.items()
+                               if name.startswith('readings.')})
+        self._allocate(self.READINGS.capacity, keep_contents=False)
+        num_ffs = len(self.READINGS.ff_ids)
+        for name in PER_FIREFIGHTER_ARRAYS :
+            getattr(self, name)[:num_ffs] = state[name]
+        self._minutes_since_recalculation = int(state['minutes_since_recalculation'])
+
+
+    # Get the storage rows for the given firefighters, adding any firefighters that haven't been seen before.
+    def _get_rows(self, ff_ids) :
+
+        rows = self.READINGS.get_rows(ff_ids)
+        if self.READINGS.capacity > self._eff.shape[0] :
+            self._allocate(self.READINGS.capacity)
+
+        return rows
+
+
+    # The values, counts and infinities that a set of (effective) readings contribute to a window.
+    @staticmethod
+    def _contributions(values, present) :
+        present = present[:, np.newaxis]
+        finite_values = np.where(np.isfinite(values) & present, values, 0.0)
+        counts = (~np.isnan(values) & present).astype(np.int64)
+        inf_counts = (np.isinf(values) & present).astype(np.int64)
+        return finite_values, counts, inf_counts
+
+
+    # Add (sign=1) or subtract (sign=-1) a set of effective readings to/from the running aggregates of one window.
+    def _apply_to_window(self, window_idx, rows, values, present, sign) :
+
+        finite_values, counts, inf_counts = self._contributions(values, present)
+        self._sums[rows, window_idx] += sign * finite_values
+        self._counts[rows, window_idx] += sign * counts
+        self._inf_counts[rows, window_idx] += sign * inf_counts
+        self._minute_counts[rows, window_idx] += sign * present
+
+
+    # Work out the effective (i.e. 1-min quantized) reading for one minute per firefighter (see the class notes).
+    # rows    : Firefighter storage rows.
+    # minutes : The minute to evaluate for each of the rows.
+    def _effective_readings(self, rows, minutes) :
+
+        longest_window_start = self.timestamp_key - self.LONGEST_WINDOW_MINS + 1
+        in_longest_window = lambda m : (m >= longest_window_start) & (m <= self.timestamp_key)
+        slot = self.READINGS.slots
+        raw, raw_present = self.READINGS.values, self.READINGS.valid
+
+        reading = in_longest_window(minutes) & raw_present[rows, slot(minutes)]
+        reading_after = (~reading & in_longest_window(minutes + 1)
+                         & raw_present[rows, slot(minutes + 1)]
+                         & (self._earliest[rows] < minutes))
+        reading_before = (~reading & ~reading_after & in_longest_window(minutes - 1)
+                          & raw_present[rows, slot(minutes - 1)]
+                          & (self._latest[rows] > minutes))
+
+        values = np.full((len(rows), self.NUM_GASES), np.nan)
+        values[reading] = raw[rows[reading], slot(minutes[reading])]
+        values[reading_after] = raw[rows[reading_after], slot(minutes[reading_after] + 1)]
+        values[reading_before] = raw[rows[reading_before], slot(minutes[reading_before] - 1)]
+
+        return values, (reading | reading_after | reading_before)
+
+
+    # Re-evaluate the effective reading for one minute per firefighter and update every window containing it.
+    def _refresh_effective_readings(self, rows, minutes) :
+
+        longest_window_start = self.timestamp_key - self.LONGEST_WINDOW_MINS + 1
+        in_longest_window = (minutes >= longest_window_start) & (minutes <= self.timestamp_key)
+        rows, minutes = rows[in_longest_window], minutes[in_longest_window]
+        if rows.size == 0 :
+            return
+
+        slots = minutes % self.LONGEST_WINDOW_MINS
+        new_values, new_present = self._effective_readings(rows, minutes)
+        old_values, old_present = self._eff[rows, slots], self._eff_present[rows, slots]
+
+        # Only touch the readings that have actually changed (NaN == NaN here, so unchanged gaps are skipped)
+        changed = ((new_present != old_present)
+                   | ~np.all((new_values == old_values) | (np.isnan(new_values) & np.isnan(old_values)), axis=1))
+        if not changed.any() :
+            return
+        rows, minutes, slots = rows[changed], minutes[changed], slots[changed]
+        new_values, new_present = new_values[changed], new_present[changed]
+        old_values, old_present = old_values[changed], old_present[changed]
+
+        for window_idx, window_mins in enumerate(self.WINDOW_MINS) :
+            in_window = minutes > (self.timestamp_key - window_mins)
+            if in_window.any() :
+                self._apply_to_window(window_idx, rows[in_window], old_values[in_window], old_present[in_window], -1)
+                self._apply_to_window(window_idx, rows[in_window], new_values[in_window], new_present[in_window], 1)
+
+        self._eff[rows, slots] = new_values
+        self._eff_present[rows, slots] = new_present
+
+
+    # Find the earliest raw reading in the longest window for the given firefighters.
+    def _find_earliest_readings(self, rows) :
+
+        longest_window_start = self.timestamp_key - self.LONGEST_WINDOW_MINS + 1
+        present_in_time_order = self.READINGS.valid[rows][:, self.READINGS.window_slots(self.LONGEST_WINDOW_MINS)]
+        return np.where(present_in_time_order.any(axis=1),
+                        longest_window_start + present_in_time_order.argmax(axis=1),
+                        NO_EARLIEST_MINUTE)
+
+
+    # Move all windows on to the next minute, adding the readings for that minute.
+    # timestamp_key : The new minute. Must be exactly 1 minute after the previous one.
+    # ff_ids        : The firefighter for each reading in this minute.
+    # values        : The gas values for each reading in this minute - shape (readings, gases).
+    def add_minute(self, timestamp_key, ff_ids, values) :
+
+        assert (self.timestamp_key is not None) and (timestamp_key == self.timestamp_key + 1), \
+            "Minutes must be added in order, one at a time. Use rebuild() to start from a new minute."
+
+        new_rows = self._get_rows(ff_ids)
+        all_rows = np.arange(len(self.READINGS.ff_ids))
+        longest_window_start = timestamp_key - self.LONGEST_WINDOW_MINS + 1
+
+        # (1) Subtract the minute leaving each window (its effective reading is still held in its old slot).
+        for window_idx, window_mins in enumerate(self.WINDOW_MINS) :
+            leaving_slot = self.READINGS.slots(timestamp_key - window_mins)
+            self._apply_to_window(window_idx, all_rows, self._eff[all_rows, leaving_slot],
+                                  self._eff_present[all_rows, leaving_slot], -1)
+
+        # (2) The minute leaving the longest window shares a slot with the new minute - clear it.
+        self.READINGS.move_to(timestamp_key)
+        new_slot = self.READINGS.slots(timestamp_key)
+        self._eff[:, new_slot] = np.nan
+        self._eff_present[:, new_slot] = False
+
+        # (3) Store the new readings.
+        self.READINGS.add_readings(np.full(new_rows.shape, timestamp_key), ff_ids, values)
+
+        # (4) Update the earliest & latest readings for each firefighter.
+        previous_latest = self._latest[all_rows].copy()
+        self._latest[new_rows] = timestamp_key
+        self._latest[self._latest < longest_window_start] = NO_LATEST_MINUTE
+        previous_earliest = self._earliest[all_rows].copy()
+        self._earliest[new_rows] = np.minimum(self._earliest[new_rows], timestamp_key)
+        earliest_has_left = (self._earliest[all_rows] < longest_window_start)
+        if earliest_has_left.any() :
+            self._earliest[all_rows[earliest_has_left]] = self._find_earliest_readings(all_rows[earliest_has_left])
+
+        # (5) Re-evaluate the only minutes whose effective readings can have changed (see the class notes).
+        minutes_to_refresh = [np.full(all_rows.shape, timestamp_key),
+                              np.full(all_rows.shape, timestamp_key - 1),
+                              np.where(previous_latest == NO_LATEST_MINUTE, timestamp_key, previous_latest + 1),
+                              np.full(all_rows.shape, longest_window_start),
+                              np.where(self._earliest[all_rows] == previous_earliest, timestamp_key,
+                                       self._earliest[all_rows] - 1)]
+        for minutes in minutes_to_refresh :
+            self._refresh_effective_readings(all_rows, minutes.astype(np.int64))
+
+        self._reset_empty_windows()
+
+        # Periodically discard accumulated floating point errors (cheap, since it's only once per longest window).
+        self._minutes_since_recalculation += 1
+        if self._minutes_since_recalculation >= self.LONGEST_WINDOW_MINS :
+            self.recalculate_windows()
+
+
+    # Rebuild everything from a block of readings covering (up to) the longest window ending at 'timestamp_key'.
+    # Readings outside the longest window are ignored.
+    # timestamp_key : The latest minute in the block.
+    # ff_ids        : The firefighter for each reading.
+    # minutes       : The minute of each reading.
+    # values        : The gas values for each reading - shape (readings, gases).
+    def rebuild(self, timestamp_key, ff_ids, minutes, values) :
+
+        self.reset()
+        self.READINGS.move_to(timestamp_key)
+        longest_window_start = timestamp_key - self.LONGEST_WINDOW_MINS + 1
+
+        minutes = np.asarray(minutes, dtype=np.int64)
+        in_longest_window = (minutes >= longest_window_start) & (minutes <= timestamp_key)
+        ff_ids = np.asarray(ff_ids, dtype=object)[in_longest_window]
+        minutes = minutes[in_longest_window]
+        values = np.asarray(values, dtype=float).reshape(-1, self.NUM_GASES)[in_longest_window]
+
+        rows = self._get_rows(ff_ids)
+        self.READINGS.add_readings(minutes, ff_ids, values)
+
+        np.maximum.at(self._latest, rows, minutes)
+        all_rows = np.arange(len(self.READINGS.ff_ids))
+        self._earliest[all_rows] = self._find_earliest_readings(all_rows)
+
+        # Work out the effective readings for every minute in the longest window, then the aggregates from those.
+        for minute in range(longest_window_start, timestamp_key + 1) :
+            slot = self.READINGS.slots(minute)
+            self._eff[all_rows, slot], self._eff_present[all_rows, slot] = (
+                self._effective_readings(all_rows, np.full(all_rows.shape, minute, dtype=np.int64)))
+        self.recalculate_windows()
+
+
+    # Recalculate the running aggregates from scratch, from the effective readings held. Also useful to periodically
+    # discard the (tiny) floating point errors that accumulate from repeatedly adding and subtracting.
+    def recalculate_windows(self) :
+
+        slots_in_time_order = self.READINGS.window_slots(self.LONGEST_WINDOW_MINS)
+        num_ffs = len(self.READINGS.ff_ids)
+        eff = self._eff[:num_ffs][:, slots_in_time_order]
+        eff_present = self._eff_present[:num_ffs][:, slots_in_time_order]
+
+        for window_idx, window_mins in enumerate(self.WINDOW_MINS) :
+            window_eff = eff[:, -window_mins:]
+            window_present = eff_present[:, -window_mins:, np.newaxis]
+            self._sums[:num_ffs, window_idx] = np.where(np.isfinite(window_eff) & window_present, window_eff, 0.0).sum(axis=1)
+            self._counts[:num_ffs, window_idx] = (~np.isnan(window_eff) & window_present).sum(axis=1)
+            self._inf_counts[:num_ffs, window_idx] = (np.isinf(window_eff) & window_present).sum(axis=1)
+            self._minute_counts[:num_ffs, window_idx] = eff_present[:, -window_mins:].sum(axis=1)
+
+        self._minutes_since_recalculation = 0
+
+
+    # Once a window is empty (or a gas has no values in it), make sure its running sum is exactly zero again, so
+    # that floating point 'dust' can't accumulate across events.
+    def _reset_empty_windows(self) :
+        self._sums[self._counts == 0] = 0.0
+
+
+    # The average of each gas over each window, for every firefighter.
+    # Returns (ff_ids, averages, in_window) where
+    #   ff_ids    : array of firefighter ids.
+    #   averages  : array of shape (firefighters, windows, gases) - np.inf if any value in the window was np.inf,
+    #               np.nan if there are no values for that gas in the window.
+    #   in_window : boolean array of shape (firefighters, windows) - True if the firefighter has any readings in that
+    #               window (i.e. if pandas would have produced an average for them, even if it's np.nan).
+    def window_averages(self) :
+
+        num_ffs = len(self.READINGS.ff_ids)
+        sums = self._sums[:num_ffs]
+        counts = self._counts[:num_ffs]
+        inf_counts = self._inf_counts[:num_ffs]
+
+        with np.errstate(invalid='ignore', divide='ignore') :
+            averages = sums / counts
+        averages[counts == 0] = np.nan
+        averages[inf_counts > 0] = np.inf
+
+        return self.READINGS.ff_ids.copy(), averages, (self._minute_counts[:num_ffs] > 0)
@@ -0,0 +1,193 @@
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import pandas as pd
+
+# Shared memory needs Python 3.8 or later - without it, the arrays are sent to the worker processes instead.
+try :
+    from multiprocessing import shared_memory
+except ImportError :
+    shared_memory = None
+
+
+# Sensor log constants (in sync with GasExposureAnalytics)
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+
+
+# Calculates the windowed sensor averages that GasExposureAnalytics uses for its time-weighted averages (the pandas
+# calculation - see GasExposureAnalytics._calculate_TWAs) in a pool of worker processes, so that a large incident uses
+# more than one core.
+#
+# The firefighters are split into one partition per worker (contiguous runs of their sorted IDs), and each worker
+# resamples and averages its own partition's readings. Every firefighter's averages only depend on their own readings,
+# which each worker adds up in the same order as the single-process calculation - so the results are exactly the same.
+# The readings for the longest window are put in shared memory once per minute (as plain arrays: timestamps,
+# firefighter codes and gas values), so the workers read them without the dataframe being pickled to each of them.
+# Only the averages (one row per firefighter, per window) are sent back.
+class ParallelTWA(object):
+
+
+    # workers : The number of worker processes (and partitions of the firefighters).
+    def __init__(self, workers):
+
+        # Get a logger and keep its name in sync with this filename
+        self.logger = logging.getLogger(os.path.basename(__file__))
+
+        assert workers >= 1, "workers must be at least 1, but is %s" % (workers)
+        self.WORKERS = workers
+        self._pool = None
+
+
+    # The average of each gas, for each firefighter, over each time-window - as the pandas calculation works them out
+    # (before they're scaled to the proportion of each window covered).
+    # longest_window_df : The (time-indexed, range-exceeded masked) sensor readings in the longest window.
+    # gases             : The supported gases (columns of longest_window_df).
+    # window_mins       : The length (in minutes) of every time-window.
+    # timestamp_key     : The minute-quantized timestamp key at the end of every window.
+    # Returns a list with, for each window, a dataframe of averages indexed by firefighter (or None if the window has
+    # no readings).
+    def window_averages(self, longest_window_df, gases, window_mins, timestamp_key) :
+
+        arrays, firefighter_ids = _to_arrays(longest_window_df, gases)
+        partitions = [(int(partition[0]), int(partition[-1]) + 1)
+                      for partition in np.array_split(np.arange(len(firefighter_ids)), self.WORKERS) if len(partition)]
+
+        # Not worth sending to the pool.
+        if len(partitions) <= 1 :
+            return _window_averages_for_partition(arrays, firefighter_ids, (0, len(firefighter_ids)), gases,
+                                                  window_mins, timestamp_key)
+
+        shared_arrays = _SharedArrays(arrays)
+        try :
+            if self._pool is None :
+                self._pool = ProcessPoolExecutor(max_workers=self.WORKERS)
+            futures = [self._pool.submit(_window_averages_for_partition, shared_arrays.HANDLES, firefighter_ids,
+                                         partition, gases, window_mins, timestamp_key)
+                       for partition in partitions]
+            partition_averages = [future.result() for future in futures]
+        except BrokenProcessPool :
+            # A worker died (e.g. killed for running out of memory) - start a new pool next time, and calculate this
+            # minute in this process instead.
+            self.logger.exception("Parallel TWA worker process failed - calculating in this process")
+            self._pool = None
+            return _window_averages_for_partition(arrays, firefighter_ids, (0, len(firefighter_ids)), gases,
+                                                  window_mins, timestamp_key)
+        finally :
+            shared_arrays.close()
+
+        # Stitch the partitions' averages back together, for each window (partitions are in firefighter ID order).
+        window_averages = []
+        for window_idx in range(len(window_mins)) :
+            averages = [averages[window_idx] for averages in partition_averages if averages[window_idx] is not None]
+            window_averages.append(pd.concat(averages).sort_index() if averages else None)
+        return window_averages
+
+
+    # Stop the worker processes.
+    def close(self) :
+        if self._pool is not None :
+            self._pool.shutdown()
+            self._pool = None
+
+
+# ParallelTWA.window_averages, calculated in this process - e.g. for a few firefighters.
+def window_averages_in_process(longest_window_df, gases, window_mins, timestamp_key) :
+    arrays, firefighter_ids = _to_arrays(longest_window_df, gases)
+    return _window_averages_for_partition(arrays, firefighter_ids, (0, len(firefighter_ids)), gases, window_mins,
+                                          timestamp_key)
+
+
+# The sensor readings as plain arrays - timestamps (int64 nanoseconds), firefighter codes and gas values - and the
+# firefighter ID for each code.
+def _to_arrays(longest_window_df, gases) :
+    codes, firefighter_ids = pd.factorize(longest_window_df[FIREFIGHTER_ID_COL], sort=True)
+    arrays = [np.asarray(longest_window_df.index.values, dtype='datetime64[ns]').view(np.int64),
+              codes.astype(np.int64),
+              longest_window_df[gases].to_numpy(dtype=float)]
+    return arrays, np.asarray(firefighter_ids, dtype=object)
+
+
+# Worker process side of ParallelTWA.window_averages - the same resampling and averaging as the pandas calculation, for
+# one partition of the firefighters.
+# arrays    : Timestamps (int64 nanoseconds), firefighter codes and gas values - or _SharedArrays handles for them.
+# partition : The range of firefighter codes, [first, last + 1), to average.
+def _window_averages_for_partition(arrays, firefighter_ids, partition, gases, window_mins, timestamp_key) :
+
+    codes = _read_array(arrays[1])
+    rows = (codes >= partition[0]) & (codes < partition[1])
+    longest_window_df = pd.DataFrame(_read_array(arrays[2], rows), columns=gases,
+                                     index=pd.DatetimeIndex(_read_array(arrays[0], rows).view('datetime64[ns]'),
+                                                            name=TIMESTAMP_COL))
+    longest_window_df[FIREFIGHTER_ID_COL] = firefighter_ids[codes[rows]]
+
+    # (note: the double sort_index() here looks odd, but it seems both necessary and fairly low cost:
+    # 1. Resampling requires the original index to be sorted, reasonably enough. 2. The resampled dataframe
+    # can't be sliced by date index unless it's sorted too.)
+    # (Grouped by the firefighter IDs' values rather than by the column, so that the column is still resampled along
+    # with the readings - left empty in minutes with no reading near enough, which the averages then skip - without
+    # pandas warning about the resample being applied to the grouping column.)
+    one_minute = pd.Timedelta(minutes = 1)
+    longest_window_df = longest_window_df.sort_index()
+    longest_window_cleaned_df = (longest_window_df
+                                .groupby(longest_window_df[FIREFIGHTER_ID_COL].to_numpy(), group_keys=False)
+                                .resample(one_minute).nearest(limit=1)
+                                .sort_index())
+
+    window_averages = []
+    analytic_cols = gases + [FIREFIGHTER_ID_COL]
+    for mins in window_mins :
+        window_start = timestamp_key - pd.Timedelta(minutes = mins) + one_minute
+        window_df = longest_window_cleaned_df.loc[window_start:timestamp_key, analytic_cols]
+        if (window_df.empty) :
+            window_averages.append(None)
+            continue
+        assert(window_df.groupby(FIREFIGHTER_ID_COL).size().max() <= mins)
+        window_averages.append(window_df.groupby(FIREFIGHTER_ID_COL).mean())
+    return window_averages
+
+
+# Copies numpy arrays into shared memory, for worker processes to read (see _read_array) without them being pickled.
+# Without shared memory (before Python 3.8), the handles are just the arrays themselves.
+class _SharedArrays(object):
+
+
+    def __init__(self, arrays):
+
+        self._blocks = []
+        self.HANDLES = []
+        for array in arrays :
+            if (shared_memory is None) or (array.nbytes == 0) :
+                self.HANDLES.append(array)
+                continue
+            block = shared_memory.SharedMemory(create=True, size=array.nbytes)
+            self._blocks.append(block)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self.HANDLES.append((block.name, array.shape, array.dtype.str))
+
+
+    # Free the shared memory (once the workers are done with it).
+    def close(self) :
+        for block in self._blocks :
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+# Read an array (or some of its rows) from a _SharedArrays handle. Returns a copy, so the shared memory can be freed.
+def _read_array(handle, rows=None) :
+
+    if isinstance(handle, np.ndarray) :
+        return handle if rows is None else handle[rows]
+
+    name, shape, dtype = handle
+    block = shared_memory.SharedMemory(name=name)
+    try :
+        shared_array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        array = shared_array.copy() if rows is None else shared_array[rows]
+        del shared_array # release the buffer before closing
+        return array
+    finally :
+        block.close()
@@ -0,0 +1,149 @@
+import os
+import logging
+import pandas as pd
+
+# pyarrow is optional - it's only needed for Parquet storage.
+try :
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.csv
+    import pyarrow.dataset
+    import pyarrow.fs
+    import pyarrow.parquet
+except ImportError :
+    pyarrow = None
+
+try :
+    from .AnalyticsStorage import AnalyticsStorage, InMemoryStorage, typed_sensor_readings
+except ImportError :
+    from AnalyticsStorage import AnalyticsStorage, InMemoryStorage, typed_sensor_readings
+
+
+# Sensor log constants (in sync with GasExposureAnalytics)
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+DEVICE_ID_COL = 'device_id'
+DEVICE_TIMESTAMP_COL = 'device_timestamp'
+# The gases that Prometeo devices currently have sensors for (in sync with prometeo_config.json)
+SUPPORTED_GASES = ['carbon_monoxide', 'nitrogen_dioxide']
+
+# By default, only read the columns the analytics need.
+DEFAULT_COLUMNS = [TIMESTAMP_COL, FIREFIGHTER_ID_COL] + SUPPORTED_GASES
+# Default number of rows per Parquet row group - the unit that time-range and firefighter filters can skip. e.g. about
+# 100 minutes of readings from 500 firefighters.
+DEFAULT_ROW_GROUP_ROWS = 50000
+PARQUET_FILE_EXTENSION = '.parquet'
+
+
+# Storage that reads the sensor log from a Parquet dataset (a Parquet file, or a directory of them) - e.g. for
+# replaying archives of past incidents. Results are kept in memory (see InMemoryStorage).
+#
+# Unlike CSV files, nothing is read up-front: each read asks for just one block of the sensor log, and the time range
+# (and firefighter) filters are pushed down to the Parquet reader, which skips every file and row group whose min/max
+# statistics rule it out. Only the columns the analytics need are read, and local files are memory-mapped, so replays
+# are bound by I/O rather than by parsing. This works best when each file is sorted by time (as csv_to_parquet and
+# write_sensor_log write them), so that each row group covers a short time range.
+class ParquetStorage(AnalyticsStorage):
+
+
+    # path           : A Parquet file, or a directory of them (e.g. one file per incident, or per day).
+    # columns        : The sensor log columns to read (None for all of them).
+    # memory_map     : Memory-map the files rather than reading them into buffers.
+    # row_group_rows : Rows per row group, for files written by write_sensor_log.
+    # metrics        : AnalyticsMetrics to record write timings and row counts in (optional).
+    def __init__(self, path, columns=DEFAULT_COLUMNS, memory_map=True, row_group_rows=DEFAULT_ROW_GROUP_ROWS,
+                 metrics=None):
+
+        # Get a logger and keep its name in sync with this filename
+        self.logger = logging.getLogger(os.path.basename(__file__))
+
+        if pyarrow is None :
+            raise ValueError("Parquet storage needs the pyarrow package (pip install pyarrow)")
+
+        self.PATH = os.path.abspath(path)
+        self.COLUMNS = columns
+        self.ROW_GROUP_ROWS = row_group_rows
+        self._filesystem = pyarrow.fs.LocalFileSystem(use_mmap=memory_map)
+        self._results = InMemoryStorage(metrics=metrics)
+        self._open_dataset()
+
+
+    # (Re-)discover the files in the dataset.
+    def _open_dataset(self) :
+        self._dataset = None
+        if os.path.isfile(self.PATH) or (os.path.isdir(self.PATH) and os.listdir(self.PATH)) :
+            self._dataset = pyarrow.dataset.dataset(self.PATH, format='parquet', filesystem=self._filesystem)
+
+
+    def read_sensor_log(self, block_start, block_end, firefighter_ids=None, shard=None, gases=None) :
+
+        if self._dataset is None :
+            return pd.DataFrame(index=pd.DatetimeIndex([], name=TIMESTAMP_COL))
+
+        timestamp = pyarrow.dataset.field(TIMESTAMP_COL)
+        condition = (timestamp >= block_start.to_pydatetime()) & (timestamp <= block_end.to_pydatetime())
+        if firefighter_ids is not None :
+            condition = condition & pyarrow.dataset.field(FIREFIGHTER_ID_COL).isin(list(firefighter_ids))
+
+        columns = self.COLUMNS if gases is None else [TIMESTAMP_COL, FIREFIGHTER_ID_COL] + list(gases)
+        sensor_log_table = self._dataset.to_table(columns=columns, filter=condition)
+        sensor_log_df = sensor_log_table.to_pandas().set_index(TIMESTAMP_COL)
+        # Shards are hashed on the firefighter ID, which Parquet statistics can't help with - so select them here.
+        if shard is not None :
+            sensor_log_df = shard.filter(sensor_log_df)
+        return sensor_log_df if gases is None else typed_sensor_readings(sensor_log_df, gases)
+
+
+    # Add records to the sensor log, as a new (time-sorted) file in the dataset directory.
+    def write_sensor_log(self, sensor_log_df) :
+
+        if sensor_log_df.empty :
+            return
+        assert not os.path.isfile(self.PATH), "Can only add sensor records to a directory, but %s is a file" % (self.PATH)
+        os.makedirs(self.PATH, exist_ok=True)
+        sensor_log_df = sensor_log_df.sort_index(kind='mergesort')
+        filename = ('sensor_log_%s_%s%s' % (sensor_log_df.index[0].strftime('%Y%m%dT%H%M'), len(os.listdir(self.PATH)),
+                                            PARQUET_FILE_EXTENSION))
+        sensor_log_table = pyarrow.Table.from_pandas(sensor_log_df.reset_index(), preserve_index=False)
+        pyarrow.parquet.write_table(sensor_log_table, os.path.join(self.PATH, filename), row_group_size=self.ROW_GROUP_ROWS)
+        self._open_dataset()
+
+
+    def write(self, analytics_df) :
+        return self._results.write(analytics_df)
+
+
+    # The results written so far, sorted by [firefighter_id, timestamp_mins] (None if there aren't any).
+    def analytics(self) :
+        return self._results.analytics()
+
+
+# Convert sensor log CSV files (e.g. an archive of past incidents) to Parquet files that ParquetStorage can read -
+# one time-sorted Parquet file per CSV file, in the given directory. Returns the Parquet file paths.
+# list_of_csv_files : A CSV file path, or a list of them.
+# row_group_rows    : Rows per row group.
+def csv_to_parquet(list_of_csv_files, directory, row_group_rows=DEFAULT_ROW_GROUP_ROWS) :
+
+    if pyarrow is None :
+        raise ValueError("Parquet conversion needs the pyarrow package (pip install pyarrow)")
+    if not isinstance(list_of_csv_files, list) : list_of_csv_files = [list_of_csv_files]
+    os.makedirs(directory, exist_ok=True)
+
+    # Keep the IDs as text (e.g. '0007', not 7) and device timestamps as they were sent, as when reading the CSV files
+    # with pandas.
+    convert_options = pyarrow.csv.ConvertOptions(column_types={FIREFIGHTER_ID_COL : pyarrow.string(),
+                                                               DEVICE_ID_COL : pyarrow.string(),
+                                                               DEVICE_TIMESTAMP_COL : pyarrow.string(),
+                                                               TIMESTAMP_COL : pyarrow.timestamp('ns')})
+    parquet_files = []
+    for csv_file in list_of_csv_files :
+        sensor_log_table = pyarrow.csv.read_csv(csv_file, convert_options=convert_options)
+        assert FIREFIGHTER_ID_COL in sensor_log_table.column_names, \
+            "CSV file %s is missing key column %s" % (csv_file, FIREFIGHTER_ID_COL)
+        # Sort by time, so that each row group covers a short time range (a stable sort keeps the arrival order).
+        sorted_indices = pyarrow.compute.sort_indices(sensor_log_table, sort_keys=[(TIMESTAMP_COL, 'ascending')])
+        parquet_file = os.path.join(directory, os.path.splitext(os.path.basename(csv_file))[0] + PARQUET_FILE_EXTENSION)
+        pyarrow.parquet.write_table(sensor_log_table.take(sorted_indices), parquet_file, row_group_size=row_group_rows)
+        parquet_files.append(parquet_file)
+
+    return parquet_files
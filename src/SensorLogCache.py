@@ -0,0 +1,197 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+try :
+    from .AnalyticsCheckpoint import frame_to_arrays, frame_from_arrays
+    from .DatabaseFrames import read_frame, select
+except ImportError :
+    from AnalyticsCheckpoint import frame_to_arrays, frame_from_arrays
+    from DatabaseFrames import read_frame, select
+
+
+# Database constants (in sync with GasExposureAnalytics)
+SENSOR_LOG_TABLE = 'firefighter_sensor_log'
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+MINUTE_COUNT_COL = 'readings'
+
+# SQL expressions for the sensor log. The timestamp column is typed, so that timestamps are passed to the database in
+# whatever form it expects (e.g. MariaDB DATETIME or SQLite text) rather than as hand-formatted strings.
+SENSOR_LOG = sqlalchemy.table(SENSOR_LOG_TABLE)
+SENSOR_LOG_TIMESTAMP = sqlalchemy.column(TIMESTAMP_COL, sqlalchemy.types.DateTime)
+SENSOR_LOG_FIREFIGHTER_ID = sqlalchemy.column(FIREFIGHTER_ID_COL)
+
+
+# An in-process cache of the most recent block of the sensor log (e.g. the last 8 hours), so that the analytics don't
+# have to re-read (and re-parse) the whole block from the database every minute.
+#
+# The block is read in full once. After that, each read only fetches the minutes that have changed since they were
+# cached - i.e. new minutes after the 'high-water mark' (the latest minute read so far) plus any earlier minutes that
+# have had records arrive late (e.g. from devices that were disconnected). Minutes older than the block are evicted.
+#
+# How are late arrivals found? The sensor log has no 'inserted at' column, so the cache asks the database for the
+# number of records in each minute of the block - a small query (one row per minute, answered from the timestamp
+# index) - and compares that with the number of records it holds for each minute. Only minutes where the two differ
+# are fetched. This catches every late record, however late, as long as sensor records are only ever inserted (not
+# updated or deleted) - which is how the sensor log is used.
+#
+# The cache can hold just one shard of the firefighters (see AnalyticsShards). If the database can select the shard,
+# only its records are read (and counted) - otherwise everyone's records are cached, and the shard is selected from them.
+class SensorLogCache(object):
+
+
+    # db_engine         : SQLAlchemy engine (or connection) for the Prometeo database.
+    # sensor_log_exists : Function returning whether the sensor log table exists yet (e.g. the storage's
+    #                     AnalyticsStorage.sensor_log_exists) - until it does, every block is empty. None if it always
+    #                     exists (e.g. on the MariaDB server).
+    def __init__(self, db_engine, sensor_log_exists=None):
+
+        # Get a logger and keep its name in sync with this filename
+        self.logger = logging.getLogger(os.path.basename(__file__))
+
+        self._db_engine = db_engine
+        self._sensor_log_exists = sensor_log_exists
+        self.reset()
+
+
+    # Forget all cached records - the next read will re-read the whole block.
+    def reset(self) :
+        self._sensor_log_df = None   # cached records, indexed (and sorted) by timestamp
+        self._minute_counts = None   # number of cached records in each minute
+        self._cached_start = None    # the earliest minute the cache covers
+        self._shard = None           # the shard of firefighters the cache is for (None for everyone)
+        self._shard_condition = None # SQL condition selecting the shard (None if it's selected after reading)
+
+
+    # The latest minute read so far (or None).
+    @property
+    def high_water_mark(self) :
+        if (self._sensor_log_df is None) or self._sensor_log_df.empty :
+            return None
+        return self._sensor_log_df.index[-1]
+
+
+    # The cached records (None if nothing's cached yet), as a dict of arrays - e.g. for a checkpoint (see
+    # AnalyticsCheckpoint).
+    def state(self) :
+        if self._sensor_log_df is None :
+            return None
+        state = frame_to_arrays(self._sensor_log_df)
+        state['cached_start'] = np.array(self._cached_start.to_datetime64())
+        return state
+
+
+    # Replace the cached records with a state() saved earlier - so that the next read only fetches the minutes that
+    # have changed since then (as usual).
+    # shard : The shard of firefighters the state was saved for (None for everyone).
+    def restore(self, state, shard=None) :
+
+        self.reset()
+        self._shard = shard
+        if shard is not None :
+            self._shard_condition = shard.sql_condition(self._db_engine, SENSOR_LOG_FIREFIGHTER_ID)
+        self._sensor_log_df = frame_from_arrays(state)
+        self._minute_counts = self._sensor_log_df.index.value_counts()
+        self._cached_start = pd.Timestamp(state['cached_start'][()])
+
+
+    # Read the sensor log records that match an SQL condition (on the timestamp) from the database.
+    def _read_sensor_log(self, condition) :
+
+        # Non-blocking read (this type of SELECT is non-blocking on MariaDB/InnoDB - ref:
+        # https://dev.mysql.com/doc/refman/8.0/en/innodb-consistent-read.html)
+        sql = select(sqlalchemy.literal_column('*')).select_from(SENSOR_LOG).where(condition)
+        if self._shard_condition is not None :
+            sql = sql.where(self._shard_condition)
+
+        return read_frame(self._db_engine, sql, parse_dates=[TIMESTAMP_COL], index_col=TIMESTAMP_COL)
+
+
+    # Ask the database how many sensor records there are in each minute in [block_start, block_end].
+    def _read_minute_counts(self, block_start, block_end) :
+
+        sql = (select(SENSOR_LOG_TIMESTAMP, sqlalchemy.func.count().label(MINUTE_COUNT_COL))
+               .select_from(SENSOR_LOG)
+               .where(SENSOR_LOG_TIMESTAMP.between(block_start.to_pydatetime(), block_end.to_pydatetime()))
+               .group_by(SENSOR_LOG_TIMESTAMP))
+        if self._shard_condition is not None :
+            sql = sql.where(self._shard_condition)
+        minute_counts_df = read_frame(self._db_engine, sql, parse_dates=[TIMESTAMP_COL], index_col=TIMESTAMP_COL)
+
+        return minute_counts_df[MINUTE_COUNT_COL].astype('int64')
+
+
+    # Get all the sensor log records with timestamps in [block_start, block_end] (inclusive), as a time-indexed and
+    # sorted dataframe - the same as reading them directly from the database.
+    # shard : Only get the records of the firefighters in this ShardAssignment (defaults to everyone's). The cache is
+    #         re-read whenever the shard changes.
+    def get_block_of_sensor_readings(self, block_start, block_end, shard=None) :
+
+        if shard != self._shard :
+            self.reset()
+            self._shard = shard
+            if shard is not None :
+                self._shard_condition = shard.sql_condition(self._db_engine, SENSOR_LOG_FIREFIGHTER_ID)
+
+        # A new embedded database has no sensor log until the first records are written - nothing to cache until then.
+        if (self._sensor_log_df is None) and (self._sensor_log_exists is not None) and not self._sensor_log_exists() :
+            return pd.DataFrame(index=pd.DatetimeIndex([], name=TIMESTAMP_COL))
+
+        if (self._sensor_log_df is None) or (block_start < self._cached_start) :
+            # First read (or a block that starts before anything cached) - read the whole block.
+            sensor_log_df = self._read_sensor_log(
+                SENSOR_LOG_TIMESTAMP.between(block_start.to_pydatetime(), block_end.to_pydatetime())).sort_index()
+            self._sensor_log_df = sensor_log_df
+            self._minute_counts = sensor_log_df.index.value_counts()
+            self._cached_start = block_start
+            self.logger.info("Sensor log cache loaded %s records" % (len(sensor_log_df.index)))
+
+        else :
+            # Evict minutes older than the block.
+            self._sensor_log_df = self._sensor_log_df.loc[block_start:, :]
+            self._minute_counts = self._minute_counts.loc[self._minute_counts.index >= block_start]
+            self._cached_start = block_start
+
+            # Find the minutes where the database and the cache disagree on the number of records - i.e. new minutes
+            # and minutes with late arrivals.
+            database_minute_counts = self._read_minute_counts(block_start, block_end)
+            cached_minute_counts = self._minute_counts.loc[self._minute_counts.index <= block_end]
+            all_minutes = database_minute_counts.index.union(cached_minute_counts.index)
+            changed_minutes = all_minutes[database_minute_counts.reindex(all_minutes, fill_value=0)
+                                          != cached_minute_counts.reindex(all_minutes, fill_value=0)]
+
+            if not changed_minutes.empty :
+                # Read new minutes (after the high-water mark) as a range, and late minutes individually.
+                high_water_mark = self.high_water_mark
+                late_minutes = changed_minutes
+                changed_dfs = []
+                if high_water_mark is not None :
+                    late_minutes = changed_minutes[changed_minutes <= high_water_mark]
+                    if changed_minutes.max() > high_water_mark :
+                        changed_dfs.append(self._read_sensor_log(
+                            (SENSOR_LOG_TIMESTAMP > high_water_mark.to_pydatetime())
+                            & (SENSOR_LOG_TIMESTAMP <= block_end.to_pydatetime())))
+                if not late_minutes.empty :
+                    self.logger.info("Sensor log cache found late records for %s minute(s) [%s to %s]"
+                                     % (len(late_minutes), late_minutes.min().isoformat(), late_minutes.max().isoformat()))
+                    changed_dfs.append(self._read_sensor_log(
+                        SENSOR_LOG_TIMESTAMP.in_([minute.to_pydatetime() for minute in late_minutes])))
+
+                unchanged_df = self._sensor_log_df.loc[~self._sensor_log_df.index.isin(changed_minutes), :]
+                changed_df = pd.concat(changed_dfs)
+                sensor_log_df = pd.concat([unchanged_df, changed_df])
+                if not sensor_log_df.index.is_monotonic_increasing :
+                    sensor_log_df = sensor_log_df.sort_index()
+
+                self._sensor_log_df = sensor_log_df
+                self._minute_counts = pd.concat([self._minute_counts.drop(changed_minutes, errors='ignore'),
+                                                 changed_df.index.value_counts()])
+
+        # Return a copy, so that callers are free to modify it.
+        sensor_log_df = self._sensor_log_df.loc[block_start:block_end, :]
+        if (self._shard is not None) and (self._shard_condition is None) :
+            sensor_log_df = self._shard.filter(sensor_log_df)
+        return sensor_log_df.copy()
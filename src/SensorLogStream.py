@@ -0,0 +1,133 @@
+import os
+import logging
+import pandas as pd
+
+try :
+    from .AnalyticsStorage import AnalyticsStorage, InMemoryStorage, typed_sensor_readings
+except ImportError :
+    from AnalyticsStorage import AnalyticsStorage, InMemoryStorage, typed_sensor_readings
+
+
+# Sensor log constants (in sync with GasExposureAnalytics)
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+DEVICE_ID_COL = 'device_id'
+PARQUET_FILE_EXTENSION = '.parquet'
+
+# Default number of sensor records to read from a file at a time.
+DEFAULT_CHUNK_ROWS = 10000
+
+
+# Storage that streams the sensor log from files too large to hold in memory (e.g. a season's archive) - instead of
+# reading every file up-front, as InMemoryStorage.from_csv_files does.
+#
+# The files are read a chunk at a time, in order, into a buffer that slides along with the analytics: each read
+# reads on until the end of the block it asks for, and drops the records from before the start of it. So memory is
+# bounded by the longest time-window (e.g. 8 hours of records) plus a chunk, however long the input is. The files must
+# be in time order, and each one sorted by time (e.g. one file per incident or per day, as exported from the sensor
+# log) - reads can only move forwards. Use minutes() (or GasExposureAnalytics.stream_analytics) to step through them.
+#
+# Results are written to results_storage (e.g. a database, or nowhere - commit=False - to keep memory bounded).
+class SensorLogStream(AnalyticsStorage):
+
+
+    # list_of_files   : A sensor log file path, or a list of them - CSV, or Parquet (.parquet, needs pyarrow).
+    # chunk_rows      : The number of sensor records to read from a file at a time.
+    # results_storage : Where to write analytic results (defaults to an InMemoryStorage).
+    def __init__(self, list_of_files, chunk_rows=DEFAULT_CHUNK_ROWS, results_storage=None):
+
+        # Get a logger and keep its name in sync with this filename
+        self.logger = logging.getLogger(os.path.basename(__file__))
+
+        # Allow clients to pass either single (non-list) file path, or a list of file paths
+        if not isinstance(list_of_files, list) : list_of_files = [list_of_files]
+        self.FILES = list_of_files
+        self.CHUNK_ROWS = chunk_rows
+        self._results_storage = results_storage if results_storage is not None else InMemoryStorage()
+
+        self._chunks = self._read_chunks()
+        self._buffer_df = pd.DataFrame(index=pd.DatetimeIndex([], name=TIMESTAMP_COL))
+        self._latest_read = None    # the latest timestamp read so far
+        self._evicted_before = None # records from before this have been dropped from the buffer
+        self._exhausted = False     # whether every file has been read
+
+
+    # The sensor log, a chunk (time-indexed dataframe) at a time.
+    def _read_chunks(self) :
+        for sensor_log_file in self.FILES :
+            self.logger.info("Streaming sensor readings from %s" % (sensor_log_file))
+            if sensor_log_file.endswith(PARQUET_FILE_EXTENSION) :
+                import pyarrow.parquet
+                for batch in pyarrow.parquet.ParquetFile(sensor_log_file).iter_batches(batch_size=self.CHUNK_ROWS) :
+                    yield batch.to_pandas().set_index(TIMESTAMP_COL)
+            else :
+                # Keep the IDs as text (e.g. '0007', not 7), and parse numbers exactly - as InMemoryStorage does.
+                for chunk_df in pd.read_csv(sensor_log_file, parse_dates=[TIMESTAMP_COL], index_col=TIMESTAMP_COL,
+                                            dtype={FIREFIGHTER_ID_COL : str, DEVICE_ID_COL : str},
+                                            float_precision='round_trip', chunksize=self.CHUNK_ROWS) :
+                    yield chunk_df
+
+
+    # Read on until every record up to (and including) timestamp is in the buffer - i.e. until a later record has
+    # been read, or there are no more.
+    def _fill_through(self, timestamp) :
+
+        while (not self._exhausted) and ((self._latest_read is None) or (self._latest_read <= timestamp)) :
+            chunk_df = next(self._chunks, None)
+            if chunk_df is None :
+                self._exhausted = True
+                break
+            if chunk_df.empty :
+                continue
+            if (not chunk_df.index.is_monotonic_increasing) or \
+                    ((self._latest_read is not None) and (chunk_df.index[0] < self._latest_read)) :
+                raise ValueError("Sensor log files must be in time order to stream them - found records for %s after %s"
+                                 % (chunk_df.index.min().isoformat(),
+                                    (self._latest_read or chunk_df.index[0]).isoformat()))
+            self._buffer_df = pd.concat([self._buffer_df, chunk_df])
+            self._latest_read = chunk_df.index[-1]
+
+
+    def read_sensor_log(self, block_start, block_end, firefighter_ids=None, shard=None, gases=None) :
+
+        if (self._evicted_before is not None) and (block_start < self._evicted_before) :
+            raise ValueError("Can't read the sensor log from %s - streaming has already moved on to %s"
+                             % (block_start.isoformat(), self._evicted_before.isoformat()))
+        self._fill_through(block_end)
+
+        # Slide the buffer on - drop everything before this block.
+        self._buffer_df = self._buffer_df.loc[block_start:, :]
+        self._evicted_before = block_start
+
+        sensor_log_df = self._buffer_df.loc[:block_end, :]
+        if firefighter_ids is not None :
+            sensor_log_df = sensor_log_df.loc[sensor_log_df[FIREFIGHTER_ID_COL].isin(firefighter_ids), :]
+        if shard is not None :
+            sensor_log_df = shard.filter(sensor_log_df)
+        return sensor_log_df.copy() if gases is None else typed_sensor_readings(sensor_log_df, gases)
+
+
+    def write(self, analytics_df) :
+        return self._results_storage.write(analytics_df)
+
+
+    # The number of sensor records in the buffer.
+    def buffered_records(self) :
+        return len(self._buffer_df.index)
+
+
+    # Every minute from the first sensor record to the last, as they're streamed (i.e. the minute keys to run the
+    # analytics for).
+    def minutes(self) :
+
+        one_minute = pd.Timedelta(minutes = 1)
+        self._fill_through(pd.Timestamp.min)
+        if self._latest_read is None :
+            return
+        timestamp_key = (self._buffer_df.index[0] if not self._buffer_df.empty else self._latest_read).floor('min')
+        while True :
+            self._fill_through(timestamp_key)
+            if self._exhausted and (timestamp_key > self._latest_read) :
+                return
+            yield timestamp_key
+            timestamp_key += one_minute
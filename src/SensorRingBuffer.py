@@ -0,0 +1,172 @@
+import numpy as np
+
+
+# Initial number of firefighters to allocate space for. Storage doubles whenever it runs out.
+INITIAL_FIREFIGHTER_CAPACITY = 16
+
+
+# A compact, array-backed store of the last N minutes of gas sensor readings for every firefighter (N being the
+# longest configured time-window, e.g. 8hrs). Readings are indexed by minute, so windowed averages, the
+# 'range exceeded' masking and the latest minute's readings are all vectorized array slices - no dataframes needed.
+#
+# Layout - each firefighter has a fixed-size 'ring' of N minutes. A reading for minute 'm' (integer minutes, e.g.
+# minutes since the epoch) is stored in slot (m % N), overwriting the reading from N minutes earlier:
+#   values[firefighter, m % N, gas] : float64 - the gas readings (np.nan if missing, np.inf if the sensor's range
+#                                     was exceeded - i.e. the device sent '-1')
+#   valid[firefighter, m % N]       : bool    - True if there's a reading for that firefighter in that minute
+# So the memory cost is fixed at N x (8 x gases + 1) bytes per firefighter - e.g. 480 x (8 x 2 + 1) = 8,160 bytes
+# for 8hrs of 2 gases - however many readings there are. Space for new firefighters is allocated in bulk (doubling).
+class SensorRingBuffer(object):
+
+
+    # longest_window_mins : The number of minutes of readings to keep (N).
+    # num_gases           : The number of gas sensor values in each reading.
+    def __init__(self, longest_window_mins, num_gases):
+
+        self.LONGEST_WINDOW_MINS = int(longest_window_mins)
+        self.NUM_GASES = int(num_gases)
+
+        self.reset()
+
+
+    # Forget everything.
+    def reset(self) :
+
+        self.latest_minute = None   # the latest minute that readings are stored for
+        self.readings_count = 0     # the number of (valid) readings currently held
+
+        self.ff_ids = np.empty(0, dtype=object) # row -> firefighter id
+        self._ff_rows = {}                      # firefighter id -> row
+        self.values = np.full((INITIAL_FIREFIGHTER_CAPACITY, self.LONGEST_WINDOW_MINS, self.NUM_GASES), np.nan)
+        self.valid = np.zeros((INITIAL_FIREFIGHTER_CAPACITY, self.LONGEST_WINDOW_MINS), dtype=bool)
+
+
+    # The number of firefighters that space is allocated for.
+    @property
+    def capacity(self) :
+        return self.values.shape[0]
+
+
+    # The fixed memory cost of storing one firefighter's readings (see the layout notes).
+    def bytes_per_firefighter(self) :
+        return self.values[0].nbytes + self.valid[0].nbytes
+
+
+    # The storage slots for the given (integer) minutes.
+    def slots(self, minutes) :
+        return np.mod(minutes, self.LONGEST_WINDOW_MINS)
+
+
+    # The storage slots for the last 'mins' minutes (up to the latest minute), in time order.
+    def window_slots(self, mins) :
+        return self.slots(self.latest_minute - mins + 1 + np.arange(mins))
+
+
+    # Get the storage rows for the given firefighters, adding any that haven't been seen before.
+    def get_rows(self, ff_ids) :
+
+        new_ffs = [ff for ff in dict.fromkeys(ff_ids) if ff not in self._ff_rows]
+        if new_ffs :
+            first_new_row = len(self.ff_ids)
+            self._ff_rows.update({ff : first_new_row + idx for idx, ff in enumerate(new_ffs)})
+            self.ff_ids = np.concatenate([self.ff_ids, np.array(new_ffs, dtype=object)])
+            if len(self.ff_ids) > self.capacity :
+                new_capacity = max(2 * self.capacity, len(self.ff_ids))
+                values = np.full((new_capacity, self.LONGEST_WINDOW_MINS, self.NUM_GASES), np.nan)
+                valid = np.zeros((new_capacity, self.LONGEST_WINDOW_MINS), dtype=bool)
+                values[:self.capacity], valid[:self.capacity] = self.values, self.valid
+                self.values, self.valid = values, valid
+
+        return np.array([self._ff_rows[ff] for ff in ff_ids], dtype=np.int64)
+
+
+    # Move on to a new latest minute, clearing the slots of every minute that leaves the ring.
+    def move_to(self, minute) :
+
+        if self.latest_minute is not None :
+            assert minute >= self.latest_minute, "The ring can't be moved back in time - reset() it instead."
+            minutes_to_clear = min(minute - self.latest_minute, self.LONGEST_WINDOW_MINS)
+            cleared_slots = self.slots(minute - np.arange(minutes_to_clear))
+            self.readings_count -= int(self.valid[:, cleared_slots].sum())
+            self.values[:, cleared_slots] = np.nan
+            self.valid[:, cleared_slots] = False
+
+        self.latest_minute = minute
+
+
+    # Store readings. The device sends '-1' when a sensor has exceeded its range - these are stored as np.inf (see
+    # GasExposureAnalytics for why).
+    # minutes : The minute of each reading (must be within the last N minutes).
+    # ff_ids  : The firefighter for each reading.
+    # values  : The gas values for each reading - shape (readings, gases).
+    # Returns the storage rows of the firefighters.
+    def add_readings(self, minutes, ff_ids, values) :
+
+        rows = self.get_rows(ff_ids)
+        slots = self.slots(np.asarray(minutes, dtype=np.int64))
+        values = np.asarray(values, dtype=float).reshape(len(rows), self.NUM_GASES)
+        with np.errstate(invalid='ignore') :
+            values = np.where(values < 0, np.inf, values)
+
+        self.readings_count -= int(self.valid[rows, slots].sum())
+        self.values[rows, slots] = values
+        self.valid[rows, slots] = True
+        self.readings_count += int(self.valid[rows, slots].sum())
+
+        return rows
+
+
+    # The readings for the last 'mins' minutes for every firefighter, in time order.
+    # Returns (values, valid) with shapes (firefighters, mins, gases) and (firefighters, mins).
+    def window(self, mins) :
+        window_slots = self.window_slots(mins)
+        num_ffs = len(self.ff_ids)
+        return self.values[:num_ffs][:, window_slots], self.valid[:num_ffs][:, window_slots]
+
+
+    # The plain average of the readings in the last 'mins' minutes, for every firefighter (np.inf if any reading in
+    # the window is np.inf, np.nan if there are no readings for that gas). Note: no 1-min gap-filling here - see
+    # IncrementalTWA for the time-weighted averaging rules.
+    # Returns (averages, has_readings) with shapes (firefighters, gases) and (firefighters,).
+    def window_averages(self, mins) :
+
+        values, valid = self.window(mins)
+        counted = ~np.isnan(values) & valid[:, :, np.newaxis]
+        with np.errstate(invalid='ignore', divide='ignore') :
+            averages = np.where(counted, values, 0.0).sum(axis=1) / counted.sum(axis=1)
+        averages[(np.isinf(values) & counted).any(axis=1)] = np.inf
+
+        return averages, valid.any(axis=1)
+
+
+    # The readings for the latest minute - for the firefighters that have one.
+    # Returns (ff_ids, values) with shapes (firefighters,) and (firefighters, gases).
+    def latest_readings(self) :
+
+        num_ffs = len(self.ff_ids)
+        latest_slot = self.slots(self.latest_minute)
+        has_reading = self.valid[:num_ffs, latest_slot]
+
+        return self.ff_ids[has_reading], self.values[:num_ffs][has_reading, latest_slot]
+
+
+    # Everything held, as a dict of arrays - e.g. for a checkpoint (see AnalyticsCheckpoint).
+    def state(self) :
+        num_ffs = len(self.ff_ids)
+        return {'latest_minute' : np.array([] if self.latest_minute is None else [self.latest_minute], dtype=np.int64),
+                'ff_ids'        : self.ff_ids,
+                'values'        : self.values[:num_ffs],
+                'valid'         : self.valid[:num_ffs]}
+
+
+    # Replace everything held with a state() saved earlier (for the same number of minutes and gases).
+    def restore(self, state) :
+
+        self.reset()
+        if state['latest_minute'].size :
+            self.latest_minute = int(state['latest_minute'][0])
+        self.get_rows(state['ff_ids'])
+        num_ffs = len(self.ff_ids)
+        self.values[:num_ffs] = state['values']
+        self.valid[:num_ffs] = state['valid']
+        self.readings_count = int(self.valid.sum())
@@ -0,0 +1,390 @@
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+try :
+    from .AnalyticsStorage import SENSOR_LOG_TABLE, SENSOR_LOG, SENSOR_LOG_TIMESTAMP, SENSOR_LOG_FIREFIGHTER_ID
+    from .DatabaseTWA import (DatabaseTWA, FIREFIGHTER_ID_COL, TIMESTAMP_COL, DATA_START, DATA_END, ROWS_COL, SUM_COL,
+                              COUNT_COL, EXCEEDED_COL)
+    from .DatabaseFrames import read_frame, select, case
+except ImportError :
+    from AnalyticsStorage import SENSOR_LOG_TABLE, SENSOR_LOG, SENSOR_LOG_TIMESTAMP, SENSOR_LOG_FIREFIGHTER_ID
+    from DatabaseTWA import (DatabaseTWA, FIREFIGHTER_ID_COL, TIMESTAMP_COL, DATA_START, DATA_END, ROWS_COL, SUM_COL,
+                             COUNT_COL, EXCEEDED_COL)
+    from DatabaseFrames import read_frame, select, case
+
+
+# Database constants
+ROLLUP_TABLE = 'firefighter_sensor_rollup'
+ROLLUP_TRIGGER = 'firefighter_sensor_rollup_insert'
+BUCKET_COL = 'bucket'
+READINGS_COL = 'readings'
+MINUTES_SEEN_COL = 'minutes_seen'
+FIRST_MINUTE_COL = 'first_minute'
+LAST_MINUTE_COL = 'last_minute'
+GAS_SUM_COL = '%s_sum'
+GAS_COUNT_COL = '%s_count'
+GAS_EXCEEDED_COL = '%s_exceeded'
+GAS_FIRST_COL = '%s_first'
+GAS_LAST_COL = '%s_last'
+MINUTE_COL = 'minute'
+
+# Default length of a bucket, in minutes - an 8 hour window is then 48 buckets.
+DEFAULT_BUCKET_MINS = 10
+# The longest bucket, in minutes - each bucket keeps one bit per minute (in a BIGINT) for the minutes with a reading.
+MAX_BUCKET_MINS = 62
+# Beyond this many separate ranges of minutes to read sensor records for, read the whole block instead (it's simpler
+# SQL, and there's little left to save).
+MAX_READING_RANGES = 200
+
+
+# A rollup of the sensor log, kept in the database: for each firefighter and each fixed bucket of minutes (e.g.
+# 09:30-09:39), the number of readings, the first and last minute with a reading, which minutes have a reading (one bit
+# each) and, for each gas, the sum and count of the readings, the number that were out of range and the first and last
+# readings. A trigger on the sensor log keeps it up to date as sensor records arrive (however they're written - normally
+# by the devices), so it costs nothing to read.
+#
+# The rollup table and its trigger are a schema change, so they're only ever added by running the migration
+# deliberately (migrate(), e.g. from migrate_sensor_rollup.py) - which also fills the rollup from the records already in
+# the sensor log. Until it has been run on a database, the readings are added up as DatabaseTWA does (with a warning).
+#
+# Averaging averages loses their denominators (see run_analytics), but these are exact partial sums, so the analytics
+# can add up whole buckets (e.g. 48 rows per firefighter for 8 hours) instead of every reading (480 rows). The rest of
+# each window - the buckets that a window starts or ends part way through, and buckets with missing readings (where the
+# 1-min quantization fills some of the gaps - see IncrementalTWA) - is read from the sensor log and added up as
+# DatabaseTWA does, with each reading weighted by the minutes it stands for. The first and last reading of each whole
+# bucket are what the readings next to it would be filled from. The averages are the same as DatabaseTWA's (and so as
+# the pandas calculation's).
+#
+# Sensor records are expected to be appended (not updated or deleted - rebuild() the rollup if they are). A firefighter
+# can have more than one record in a minute: a bucket is only whole if it has exactly one reading for every one of its
+# minutes, so buckets with duplicates are read from the sensor log like the rest, and their minutes resolved as
+# DatabaseTWA does (the highest reading, or range-exceeded if any of them is).
+class SensorRollup(DatabaseTWA):
+
+
+    # db_engine   : SQLAlchemy engine for the Prometeo database.
+    # window_mins : The length (in minutes) of every time-window to calculate averages for.
+    # gases       : The supported gases (sensor log columns).
+    # bucket_mins : The length of each bucket, in minutes.
+    def __init__(self, db_engine, window_mins, gases, bucket_mins=DEFAULT_BUCKET_MINS):
+
+        super().__init__(db_engine, window_mins, gases)
+
+        assert 2 <= bucket_mins <= MAX_BUCKET_MINS, \
+            "bucket_mins must be from 2 to %s, but is %s" % (MAX_BUCKET_MINS, bucket_mins)
+        self.BUCKET_MINS = bucket_mins
+        self._rollup_ready = False
+        self._warned_not_migrated = False
+
+        gas_cols = []
+        for gas in self.GASES :
+            gas_cols += [sqlalchemy.Column(GAS_SUM_COL % (gas), sqlalchemy.types.Float(precision=53), nullable=False),
+                         sqlalchemy.Column(GAS_COUNT_COL % (gas), sqlalchemy.types.Integer, nullable=False),
+                         sqlalchemy.Column(GAS_EXCEEDED_COL % (gas), sqlalchemy.types.Integer, nullable=False),
+                         sqlalchemy.Column(GAS_FIRST_COL % (gas), sqlalchemy.types.Float(precision=53)),
+                         sqlalchemy.Column(GAS_LAST_COL % (gas), sqlalchemy.types.Float(precision=53))]
+        self._METADATA = sqlalchemy.MetaData()
+        self.ROLLUP = sqlalchemy.Table(ROLLUP_TABLE, self._METADATA,
+                                       sqlalchemy.Column(FIREFIGHTER_ID_COL, sqlalchemy.types.VARCHAR(length=20),
+                                                         primary_key=True),
+                                       sqlalchemy.Column(BUCKET_COL, sqlalchemy.types.BigInteger, primary_key=True,
+                                                         autoincrement=False),
+                                       sqlalchemy.Column(READINGS_COL, sqlalchemy.types.Integer, nullable=False),
+                                       sqlalchemy.Column(MINUTES_SEEN_COL, sqlalchemy.types.BigInteger, nullable=False),
+                                       sqlalchemy.Column(FIRST_MINUTE_COL, sqlalchemy.types.BigInteger, nullable=False),
+                                       sqlalchemy.Column(LAST_MINUTE_COL, sqlalchemy.types.BigInteger, nullable=False),
+                                       *gas_cols)
+
+
+    # The sums and counts of the readings in every window, for every firefighter with readings in the longest one (as
+    # DatabaseTWA.window_sums).
+    def window_sums(self, timestamp_key, shard=None) :
+
+        if not self._rollup_ready :
+            self._rollup_ready = self._rollup_exists()
+            if not self._rollup_ready :
+                if not self._warned_not_migrated :
+                    self.logger.warning("The sensor rollup hasn't been added to this database (run "
+                                        "migrate_sensor_rollup.py) - adding up the readings instead")
+                    self._warned_not_migrated = True
+                return super().window_sums(timestamp_key, shard)
+
+        last_minute = int(_to_minutes([timestamp_key])[0])
+        first_minute = last_minute - max(self.WINDOW_MINS) + 1
+        window_starts = [last_minute - mins + 1 for mins in self.WINDOW_MINS]
+
+        # The buckets that overlap the longest window, and which of them can be added up whole: those with exactly one
+        # reading every minute (as many readings as minutes, and every minute seen), that are inside the longest window,
+        # and that no window starts part way through.
+        sql = (select(self.ROLLUP)
+               .where(self.ROLLUP.c[BUCKET_COL].between(first_minute // self.BUCKET_MINS, last_minute // self.BUCKET_MINS)))
+        shard_condition = shard.sql_condition(self._db_engine, self.ROLLUP.c[FIREFIGHTER_ID_COL]) if shard is not None else None
+        if shard_condition is not None :
+            sql = sql.where(shard_condition)
+        buckets_df = read_frame(self._db_engine, sql)
+        if (shard is not None) and (shard_condition is None) :
+            buckets_df = shard.filter(buckets_df)
+        bucket_start = buckets_df[BUCKET_COL].to_numpy() * self.BUCKET_MINS
+        bucket_end = bucket_start + self.BUCKET_MINS - 1
+        whole = ((buckets_df[READINGS_COL].to_numpy() == self.BUCKET_MINS)
+                 & (buckets_df[MINUTES_SEEN_COL].to_numpy().astype(np.int64) == (1 << self.BUCKET_MINS) - 1)
+                 & (bucket_start >= first_minute) & (bucket_end <= last_minute))
+        for window_start in window_starts :
+            whole &= ~((bucket_start < window_start) & (window_start <= bucket_end))
+        whole_buckets_df = buckets_df.loc[whole, :].assign(**{MINUTE_COL : bucket_start[whole]})
+
+        readings_df = self._read_readings(buckets_df.loc[~whole, :], whole_buckets_df, first_minute, last_minute, shard)
+        if readings_df.empty and whole_buckets_df.empty :
+            return pd.DataFrame()
+
+        # Every reading read, plus the first and last reading of each whole bucket - which only stand for the minute
+        # before and after the bucket (the bucket's own minutes are in its sums).
+        bucket_edges_df = pd.concat([
+            whole_buckets_df.rename(columns=dict([(GAS_FIRST_COL % (gas), gas) for gas in self.GASES]))
+                .assign(own=0, back=1, forward=0),
+            whole_buckets_df.rename(columns=dict([(GAS_LAST_COL % (gas), gas) for gas in self.GASES]))
+                .assign(**{MINUTE_COL : bucket_end[whole]}).assign(own=0, back=0, forward=1)])
+        points_df = (pd.concat([readings_df.assign(own=1, back=1, forward=1),
+                                bucket_edges_df[[FIREFIGHTER_ID_COL, MINUTE_COL] + self.GASES + ['own', 'back', 'forward']]])
+                     .sort_values([FIREFIGHTER_ID_COL, MINUTE_COL], kind='mergesort')
+                     .reset_index(drop=True))
+        minutes = points_df[MINUTE_COL].to_numpy()
+        firefighter_minutes = points_df.groupby(FIREFIGHTER_ID_COL)[MINUTE_COL]
+        previous_gap = (minutes - firefighter_minutes.shift(1)).to_numpy()
+        next_gap = (firefighter_minutes.shift(-1) - minutes).to_numpy()
+
+        # Add up the readings (weighted by the minutes of each window they stand for - as in DatabaseTWA) and the whole
+        # buckets in each window.
+        with np.errstate(invalid='ignore') :
+            sums = {}
+            for window, window_start in enumerate(window_starts) :
+                weight = (points_df['own'].to_numpy() * (minutes >= window_start)
+                          + points_df['back'].to_numpy() * ((previous_gap >= 2) & (minutes - 1 >= window_start))
+                          + points_df['forward'].to_numpy() * ((next_gap >= 3) & (minutes + 1 >= window_start)))
+                in_window = (whole_buckets_df[MINUTE_COL].to_numpy() >= window_start)
+                sums[ROWS_COL % (window)] = (weight, whole_buckets_df[READINGS_COL].to_numpy() * in_window)
+                for gas in self.GASES :
+                    values = points_df[gas].to_numpy(dtype=float)
+                    sums[SUM_COL % (gas, window)] = (np.where(values >= 0, values, 0) * weight,
+                                                     whole_buckets_df[GAS_SUM_COL % (gas)].to_numpy() * in_window)
+                    sums[COUNT_COL % (gas, window)] = (~np.isnan(values) * weight,
+                                                       whole_buckets_df[GAS_COUNT_COL % (gas)].to_numpy() * in_window)
+                    sums[EXCEEDED_COL % (gas, window)] = ((values < 0) * weight,
+                                                          whole_buckets_df[GAS_EXCEEDED_COL % (gas)].to_numpy() * in_window)
+        points_sums_df = pd.DataFrame(dict([(col, point_sums) for col, (point_sums, _) in sums.items()]))
+        bucket_sums_df = pd.DataFrame(dict([(col, bucket_sums) for col, (_, bucket_sums) in sums.items()]))
+        window_sums_df = (pd.concat([points_sums_df.groupby(points_df[FIREFIGHTER_ID_COL]).sum(),
+                                     bucket_sums_df.groupby(whole_buckets_df[FIREFIGHTER_ID_COL].to_numpy()).sum()])
+                          .groupby(level=0).sum().astype(float))
+
+        # The first and last minute with a reading, for the time spans.
+        data_spans_df = pd.concat([readings_df[[FIREFIGHTER_ID_COL, MINUTE_COL]].assign(last=readings_df[MINUTE_COL]),
+                                   whole_buckets_df[[FIREFIGHTER_ID_COL, FIRST_MINUTE_COL, LAST_MINUTE_COL]]
+                                       .rename(columns={FIRST_MINUTE_COL : MINUTE_COL, LAST_MINUTE_COL : 'last'})])
+        data_spans_df = data_spans_df.groupby(FIREFIGHTER_ID_COL).agg({MINUTE_COL : 'min', 'last' : 'max'})
+        window_sums_df[DATA_START] = pd.to_datetime(data_spans_df[MINUTE_COL].reindex(window_sums_df.index) * 60, unit='s')
+        window_sums_df[DATA_END] = pd.to_datetime(data_spans_df['last'].reindex(window_sums_df.index) * 60, unit='s')
+        window_sums_df.index.name = FIREFIGHTER_ID_COL
+        return window_sums_df
+
+
+    # Read the sensor readings for the minutes of the longest window that aren't in whole buckets, with at most one
+    # reading per firefighter per minute (as DatabaseTWA). Returns a dataframe of firefighter IDs, minutes (since the
+    # epoch) and gases.
+    def _read_readings(self, part_buckets_df, whole_buckets_df, first_minute, last_minute, shard) :
+
+        # The ranges of minutes to read, for each firefighter (joining up neighbouring buckets).
+        bucket_start = np.maximum(part_buckets_df[BUCKET_COL].to_numpy() * self.BUCKET_MINS, first_minute)
+        bucket_end = np.minimum(bucket_start - (bucket_start % self.BUCKET_MINS) + self.BUCKET_MINS - 1, last_minute)
+        ranges_df = (pd.DataFrame({FIREFIGHTER_ID_COL : part_buckets_df[FIREFIGHTER_ID_COL].to_numpy(),
+                                   'start' : bucket_start, 'end' : bucket_end})
+                     .sort_values([FIREFIGHTER_ID_COL, 'start']))
+        new_range = ((ranges_df[FIREFIGHTER_ID_COL] != ranges_df[FIREFIGHTER_ID_COL].shift(1))
+                     | (ranges_df['start'] != ranges_df['end'].shift(1) + 1))
+        ranges_df = ranges_df.groupby(new_range.cumsum().to_numpy()).agg(
+            {FIREFIGHTER_ID_COL : 'first', 'start' : 'min', 'end' : 'max'})
+        if ranges_df.empty :
+            return pd.DataFrame(columns=[FIREFIGHTER_ID_COL, MINUTE_COL] + self.GASES)
+
+        to_datetime = lambda minute : pd.Timestamp(int(minute) * 60, unit='s').to_pydatetime()
+        sql = (select(SENSOR_LOG_FIREFIGHTER_ID, SENSOR_LOG_TIMESTAMP, *[sqlalchemy.column(gas) for gas in self.GASES])
+               .select_from(SENSOR_LOG)
+               .where(SENSOR_LOG_TIMESTAMP.between(to_datetime(first_minute), to_datetime(last_minute))))
+        read_everything = len(ranges_df.index) > MAX_READING_RANGES
+        if not read_everything :
+            sql = sql.where(sqlalchemy.or_(*[sqlalchemy.and_(SENSOR_LOG_FIREFIGHTER_ID == firefighter_id,
+                                                             SENSOR_LOG_TIMESTAMP.between(to_datetime(start), to_datetime(end)))
+                                             for firefighter_id, start, end in ranges_df.itertuples(index=False)]))
+        shard_condition = shard.sql_condition(self._db_engine, SENSOR_LOG_FIREFIGHTER_ID) if shard is not None else None
+        if shard_condition is not None :
+            sql = sql.where(shard_condition)
+        readings_df = read_frame(self._db_engine, sql, parse_dates=[TIMESTAMP_COL])
+        if (shard is not None) and (shard_condition is None) :
+            readings_df = shard.filter(readings_df)
+        readings_df[MINUTE_COL] = _to_minutes(readings_df[TIMESTAMP_COL])
+        if read_everything :
+            whole_minutes = pd.MultiIndex.from_arrays([whole_buckets_df[FIREFIGHTER_ID_COL].to_numpy(),
+                                                       whole_buckets_df[BUCKET_COL].to_numpy()])
+            in_whole_bucket = pd.MultiIndex.from_arrays([readings_df[FIREFIGHTER_ID_COL].to_numpy(),
+                                                         readings_df[MINUTE_COL].to_numpy() // self.BUCKET_MINS]
+                                                        ).isin(whole_minutes)
+            readings_df = readings_df.loc[~in_whole_bucket, :]
+
+        # One reading per minute - the highest, or range-exceeded if any of them is (as DatabaseTWA).
+        readings_df[self.GASES] = readings_df[self.GASES].astype(float)
+        readings = readings_df.groupby([FIREFIGHTER_ID_COL, MINUTE_COL])[self.GASES]
+        readings_df = readings.max().mask(readings.min() < 0, -1).reset_index()
+        return readings_df
+
+
+    # Add the rollup to the database: create the rollup table, the trigger that keeps it up to date and fill it from
+    # the sensor log. This is a schema change, so it's only run deliberately (see migrate_sensor_rollup.py) - run it
+    # while no sensor records are being written, as MariaDB commits each CREATE straight away. Returns False if the
+    # rollup was already there.
+    def migrate(self) :
+
+        if self._rollup_exists() :
+            return False
+        table_names = sqlalchemy.inspect(self._db_engine).get_table_names()
+        if SENSOR_LOG_TABLE not in table_names :
+            raise ValueError("Can't add the sensor rollup - there's no sensor log (%s) in this database yet"
+                             % (SENSOR_LOG_TABLE))
+
+        self.logger.info("Adding the sensor rollup (%s) to the database" % (ROLLUP_TABLE))
+        with self._db_engine.begin() as connection :
+            self._METADATA.create_all(connection, tables=[self.ROLLUP])
+            connection.execute(sqlalchemy.text(self._trigger_sql()))
+            connection.execute(self.ROLLUP.delete())
+            self._fill_rollup(connection)
+        return True
+
+
+    # Whether the rollup table and its trigger have been added to the database (by migrate()).
+    def _rollup_exists(self) :
+
+        if ROLLUP_TABLE not in sqlalchemy.inspect(self._db_engine).get_table_names() :
+            return False
+        if self._db_engine.dialect.name == 'sqlite' :
+            sql = "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name = :name"
+        else :
+            sql = ("SELECT trigger_name FROM information_schema.triggers "
+                   "WHERE trigger_schema = DATABASE() AND trigger_name = :name")
+        return not read_frame(self._db_engine, sql, params={'name' : ROLLUP_TRIGGER}).empty
+
+
+    # Empty the rollup table and fill it again from the sensor log - e.g. if sensor records have been corrected.
+    def rebuild(self) :
+
+        if not self._rollup_exists() :
+            raise ValueError("Can't rebuild the sensor rollup - it hasn't been added to this database (see migrate())")
+        with self._db_engine.begin() as connection :
+            connection.execute(self.ROLLUP.delete())
+            self._fill_rollup(connection)
+
+
+    # Add up the sensor log into the rollup table.
+    def _fill_rollup(self, connection) :
+
+        minute = self._minutes_since_epoch(SENSOR_LOG_TIMESTAMP)
+        firefighter_bucket = {'partition_by' : [SENSOR_LOG_FIREFIGHTER_ID, self._bucket(minute)]}
+        readings = select(
+            SENSOR_LOG_FIREFIGHTER_ID, minute.label(MINUTE_COL),
+            *([sqlalchemy.column(gas) for gas in self.GASES]
+              + [sqlalchemy.func.first_value(sqlalchemy.column(gas))
+                 .over(order_by=SENSOR_LOG_TIMESTAMP, **firefighter_bucket).label(GAS_FIRST_COL % (gas)) for gas in self.GASES]
+              + [sqlalchemy.func.first_value(sqlalchemy.column(gas))
+                 .over(order_by=SENSOR_LOG_TIMESTAMP.desc(), **firefighter_bucket).label(GAS_LAST_COL % (gas))
+                 for gas in self.GASES])).select_from(SENSOR_LOG).alias('readings')
+
+        minute = readings.c[MINUTE_COL]
+        aggregates = [readings.c[FIREFIGHTER_ID_COL], self._bucket(minute), sqlalchemy.func.count(),
+                      sqlalchemy.func.sum(sqlalchemy.distinct(self._minute_bit(minute))), # OR of the minutes' bits
+                      sqlalchemy.func.min(minute), sqlalchemy.func.max(minute)]
+        for gas in self.GASES :
+            value = readings.c[gas]
+            aggregates += [sqlalchemy.func.coalesce(sqlalchemy.func.sum(case((value >= 0, value), else_=0)), 0),
+                           sqlalchemy.func.count(value),
+                           sqlalchemy.func.sum(case((value < 0, 1), else_=0)),
+                           sqlalchemy.func.max(readings.c[GAS_FIRST_COL % (gas)]),
+                           sqlalchemy.func.max(readings.c[GAS_LAST_COL % (gas)])]
+        connection.execute(self.ROLLUP.insert().from_select(
+            [column.name for column in self.ROLLUP.columns],
+            select(*aggregates).group_by(readings.c[FIREFIGHTER_ID_COL], self._bucket(minute))))
+
+
+    # The trigger that adds each new sensor record to the rollup, in this database's SQL.
+    def _trigger_sql(self) :
+
+        new = lambda col : 'NEW.%s' % (col)
+        minute = str(self._minutes_since_epoch(sqlalchemy.literal_column(new(TIMESTAMP_COL)))
+                     .compile(dialect=self._db_engine.dialect, compile_kwargs={'literal_binds' : True}))
+        bucket = str(self._bucket(sqlalchemy.literal_column(minute))
+                     .compile(dialect=self._db_engine.dialect, compile_kwargs={'literal_binds' : True}))
+        minute_bit = str(self._minute_bit(sqlalchemy.literal_column(minute))
+                         .compile(dialect=self._db_engine.dialect, compile_kwargs={'literal_binds' : True}))
+        columns = [FIREFIGHTER_ID_COL, BUCKET_COL, READINGS_COL, MINUTES_SEEN_COL, FIRST_MINUTE_COL, LAST_MINUTE_COL]
+        values = [new(FIREFIGHTER_ID_COL), bucket, '1', minute_bit, minute, minute]
+        for gas in self.GASES :
+            columns += [GAS_SUM_COL % (gas), GAS_COUNT_COL % (gas), GAS_EXCEEDED_COL % (gas), GAS_FIRST_COL % (gas),
+                        GAS_LAST_COL % (gas)]
+            values += ['CASE WHEN %s >= 0 THEN %s ELSE 0 END' % (new(gas), new(gas)),
+                       'CASE WHEN %s IS NULL THEN 0 ELSE 1 END' % (new(gas)),
+                       'CASE WHEN %s < 0 THEN 1 ELSE 0 END' % (new(gas)),
+                       new(gas), new(gas)]
+
+        if self._db_engine.dialect.name == 'sqlite' :
+            inserted = lambda col : 'excluded.%s' % (col)
+        else :
+            inserted = lambda col : 'VALUES(%s)' % (col)
+        # (MariaDB sets columns one after another, so the first and last readings are updated before the minutes
+        # they're compared with.)
+        updates = []
+        for gas in self.GASES :
+            updates += ['%s = CASE WHEN %s < %s THEN %s ELSE %s END' % (GAS_FIRST_COL % (gas), inserted(FIRST_MINUTE_COL),
+                                                                        FIRST_MINUTE_COL, inserted(GAS_FIRST_COL % (gas)),
+                                                                        GAS_FIRST_COL % (gas)),
+                        '%s = CASE WHEN %s > %s THEN %s ELSE %s END' % (GAS_LAST_COL % (gas), inserted(LAST_MINUTE_COL),
+                                                                        LAST_MINUTE_COL, inserted(GAS_LAST_COL % (gas)),
+                                                                        GAS_LAST_COL % (gas))]
+        for col in columns[2:] :
+            if col == FIRST_MINUTE_COL :
+                updates.append('%s = CASE WHEN %s < %s THEN %s ELSE %s END' % (col, inserted(col), col, inserted(col), col))
+            elif col == LAST_MINUTE_COL :
+                updates.append('%s = CASE WHEN %s > %s THEN %s ELSE %s END' % (col, inserted(col), col, inserted(col), col))
+            elif col == MINUTES_SEEN_COL :
+                updates.append('%s = %s | %s' % (col, col, inserted(col)))
+            elif not col.endswith(('_first', '_last')) :
+                updates.append('%s = %s + %s' % (col, col, inserted(col)))
+
+        insert = 'INSERT INTO %s (%s) VALUES (%s)' % (ROLLUP_TABLE, ', '.join(columns), ', '.join(values))
+        if self._db_engine.dialect.name == 'sqlite' :
+            return ('CREATE TRIGGER IF NOT EXISTS %s AFTER INSERT ON %s FOR EACH ROW BEGIN %s ON CONFLICT (%s, %s) '
+                    'DO UPDATE SET %s; END' % (ROLLUP_TRIGGER, SENSOR_LOG_TABLE, insert, FIREFIGHTER_ID_COL, BUCKET_COL,
+                                               ', '.join(updates)))
+        return ('CREATE TRIGGER IF NOT EXISTS %s AFTER INSERT ON %s FOR EACH ROW %s ON DUPLICATE KEY UPDATE %s'
+                % (ROLLUP_TRIGGER, SENSOR_LOG_TABLE, insert, ', '.join(updates)))
+
+
+    # The minutes since the epoch of a timestamp, in this database's SQL.
+    def _minutes_since_epoch(self, timestamp) :
+        if self._db_engine.dialect.name == 'sqlite' :
+            return sqlalchemy.cast(sqlalchemy.func.strftime('%s', timestamp), sqlalchemy.types.Integer) / 60
+        return sqlalchemy.func.timestampdiff(sqlalchemy.text('MINUTE'), '1970-01-01 00:00:00', timestamp)
+
+
+    # The bucket of a minute (since the epoch), in this database's SQL.
+    def _bucket(self, minute) :
+        if self._db_engine.dialect.name == 'sqlite' :
+            return minute / self.BUCKET_MINS # integer division
+        return sqlalchemy.func.floor(minute / self.BUCKET_MINS)
+
+
+    # The bit for a minute (since the epoch) within its bucket, in this database's SQL.
+    def _minute_bit(self, minute) :
+        return sqlalchemy.literal_column('1').op('<<')(minute - self._bucket(minute) * self.BUCKET_MINS)
+
+
+# Timestamps as integer minutes since the epoch.
+def _to_minutes(timestamps) :
+    return np.asarray(timestamps, dtype='datetime64[m]').astype(np.int64)
@@ -0,0 +1,147 @@
+import json
+import os
+import logging
+import queue
+import threading
+
+
+# Database constants (in sync with GasExposureAnalytics)
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+STATUS_LED_COL = 'analytics_status_LED'
+# The name clients expect for the status LED column.
+CLIENT_STATUS_COL = 'status'
+
+# Server-Sent Events 'event' name for status updates.
+STATUS_EVENT = 'status'
+# Default number of unsent messages a subscriber can fall behind by before it's disconnected.
+DEFAULT_MAX_QUEUED_MESSAGES = 10
+# Default number of idle seconds between keep-alive comments (which also detect clients that have gone away).
+DEFAULT_KEEPALIVE_SECONDS = 15
+
+# Queued to end a subscriber's stream.
+_DISCONNECT = object()
+
+
+# Pushes status changes to subscribed clients (e.g. dashboards) as Server-Sent Events, as soon as each minute's
+# analytics are calculated - so that clients don't need to poll for them. Each minute, only the firefighters whose
+# status has changed since the previous minute (or who have just appeared) are sent, as a JSON array of the same
+# records as /get_status:
+#
+#   event: status
+#   data: [{"firefighter_id":"0001","timestamp_mins":"2000-01-01T12:00:00.000Z","status":"2"}, ...]
+#
+# A new subscriber first receives the latest status of every firefighter, so that it's in sync before the deltas
+# start. Every message is encoded once and then queued for each subscriber. A subscriber that falls too far behind is
+# disconnected (EventSource clients reconnect automatically, and are re-synced when they do).
+class StatusBroadcaster(object):
+
+
+    # max_queued_messages : The number of unsent messages a subscriber can fall behind by before it's disconnected.
+    # keepalive_seconds   : Idle seconds between keep-alive comments.
+    def __init__(self, max_queued_messages=DEFAULT_MAX_QUEUED_MESSAGES, keepalive_seconds=DEFAULT_KEEPALIVE_SECONDS):
+
+        # Get a logger and keep its name in sync with this filename
+        self.logger = logging.getLogger(os.path.basename(__file__))
+
+        self.MAX_QUEUED_MESSAGES = max_queued_messages
+        self.KEEPALIVE_SECONDS = keepalive_seconds
+
+        self._subscribers = set()
+        # {firefighter_id : the latest status record sent}
+        self._latest_statuses = {}
+        self._lock = threading.Lock()
+
+
+    # Encode status records as a Server-Sent Event.
+    def _format_event(self, status_records) :
+        return 'event: %s\ndata: %s\n\n' % (STATUS_EVENT, json.dumps(status_records, separators=(',', ':')))
+
+
+    # Queue a message for a subscriber - or disconnect it, if it has fallen too far behind.
+    def _send(self, subscriber, message) :
+        if subscriber.qsize() >= self.MAX_QUEUED_MESSAGES :
+            self.logger.warning("Status subscriber is %s messages behind - disconnecting it" % (subscriber.qsize()))
+            self._subscribers.discard(subscriber)
+            subscriber.put(_DISCONNECT)
+        else :
+            subscriber.put(message)
+
+
+    # Send the status changes in analytic results (as returned by GasExposureAnalytics.run_analytics - keyed on
+    # [firefighter_id, timestamp_mins]) to every subscriber - one message per minute that has any changes.
+    def publish(self, analytics_df) :
+
+        if (analytics_df is None) or analytics_df.empty :
+            return
+
+        status_df = analytics_df[[STATUS_LED_COL]].reset_index().sort_values([TIMESTAMP_COL, FIREFIGHTER_ID_COL])
+        # The status LED is stored as text in the database, so send it as text here too (as /get_status does).
+        status_df[STATUS_LED_COL] = status_df[STATUS_LED_COL].astype(str).where(status_df[STATUS_LED_COL].notna(), None)
+        status_records = json.loads(status_df.rename(columns={STATUS_LED_COL: CLIENT_STATUS_COL}) # name as expected by client
+                                    .to_json(orient='records', date_format='iso'))
+
+        with self._lock :
+            changes_by_minute = {}
+            for status_record in status_records :
+                latest_status = self._latest_statuses.get(status_record[FIREFIGHTER_ID_COL])
+                # (A corrected result for an earlier minute - e.g. recomputed after sensor records arrived late - isn't
+                # the firefighter's status any more.)
+                if (latest_status is not None) and (status_record[TIMESTAMP_COL] < latest_status[TIMESTAMP_COL]) :
+                    continue
+                if (latest_status is None) or (latest_status[CLIENT_STATUS_COL] != status_record[CLIENT_STATUS_COL]) :
+                    changes_by_minute.setdefault(status_record[TIMESTAMP_COL], []).append(status_record)
+                self._latest_statuses[status_record[FIREFIGHTER_ID_COL]] = status_record
+
+            for changes in changes_by_minute.values() :
+                message = self._format_event(changes)
+                for subscriber in list(self._subscribers) :
+                    self._send(subscriber, message)
+
+
+    # Subscribe to status changes - starting with the latest status of every firefighter.
+    # Returns a generator of Server-Sent Events text, which ends the subscription when it's closed (e.g. when the
+    # client disconnects).
+    def stream(self) :
+
+        subscriber = queue.Queue()
+        with self._lock :
+            if self._latest_statuses :
+                subscriber.put(self._format_event(sorted(self._latest_statuses.values(),
+                                                         key=lambda status_record : status_record[FIREFIGHTER_ID_COL])))
+            self._subscribers.add(subscriber)
+        self.logger.info("Status subscriber connected (%s subscribers)" % (len(self._subscribers)))
+
+        return self._messages(subscriber)
+
+
+    # The messages for one subscriber, with keep-alive comments while idle.
+    def _messages(self, subscriber) :
+        try :
+            while True :
+                try :
+                    message = subscriber.get(timeout=self.KEEPALIVE_SECONDS)
+                except queue.Empty :
+                    yield ': keepalive\n\n'
+                    continue
+                if message is _DISCONNECT :
+                    return
+                yield message
+        finally :
+            with self._lock :
+                self._subscribers.discard(subscriber)
+            self.logger.info("Status subscriber disconnected (%s subscribers)" % (len(self._subscribers)))
+
+
+    # The number of subscribers.
+    def subscribers(self) :
+        with self._lock :
+            return len(self._subscribers)
+
+
+    # End every subscriber's stream - e.g. at shutdown.
+    def close(self) :
+        with self._lock :
+            for subscriber in self._subscribers :
+                subscriber.put(_DISCONNECT)
+            self._subscribers.clear()
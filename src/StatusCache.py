@@ -0,0 +1,167 @@
+import json
+import threading
+import pandas as pd
+
+
+# Database constants (in sync with GasExposureAnalytics)
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+
+# Default number of minutes of results to keep for each firefighter.
+DEFAULT_RETENTION_MINS = 60
+
+
+# An in-memory cache of the most recent analytic results, so that the status endpoints can answer without a database
+# round trip. GasExposureAnalytics publishes each minute's results into the cache as soon as they're calculated, and
+# the cache keeps the last N minutes for each firefighter (and forgets firefighters with no results in the last N
+# minutes), so it stays small however long the service runs.
+#
+# Each result is kept as a plain JSON-ready record (a dict of column : value, converted in one go per minute with the
+# same pandas JSON encoding the endpoints use for database rows), keyed on firefighter id and minute. Publishing and
+# lookups can happen on different threads (the scheduler and the Flask request handlers).
+class StatusCache(object):
+
+
+    # retention_mins : The number of minutes of results to keep for each firefighter.
+    def __init__(self, retention_mins=DEFAULT_RETENTION_MINS):
+
+        assert retention_mins > 0, "retention_mins must be a positive number of minutes, but is %s" % (retention_mins)
+        self.RETENTION = pd.Timedelta(minutes = retention_mins)
+
+        # {firefighter_id : {timestamp_mins : record}}
+        self._records = {}
+        self._lock = threading.Lock()
+        # The first and latest minutes published, and the latest minute with all of its results published - bounds for
+        # which minutes the cache can answer for (see covers).
+        self._first_minute = None
+        self._latest_minute = None
+        self._complete_minute = None
+
+        self.hits = 0
+        self.misses = 0
+
+
+    # Add analytic results (as returned by GasExposureAnalytics.run_analytics - keyed on
+    # [firefighter_id, timestamp_mins]), replacing any results already cached for the same firefighters and minutes.
+    # complete : Whether these are all of the results for their minutes. False if more results may still come for the
+    #            latest of them - e.g. results read from the database while sharded workers (each writing its own
+    #            firefighters' results) are still writing that minute. The cache then only covers that minute once
+    #            results for a later minute are published.
+    # Returns the results that weren't already cached as they are - i.e. new ones, and ones that have changed (e.g.
+    # recomputed after sensor records arrived late).
+    def publish(self, analytics_df, complete=True) :
+
+        if (analytics_df is None) or analytics_df.empty :
+            return analytics_df
+
+        records_df = analytics_df.reset_index()
+        # Categorical columns (i.e. the status LED) are stored as text in the database, so return them as text here too.
+        for col in records_df.columns[records_df.dtypes == 'category'] :
+            records_df[col] = records_df[col].astype(str).where(records_df[col].notna(), None)
+        records = json.loads(records_df.to_json(orient='records', date_format='iso'))
+        keys = zip(records_df[FIREFIGHTER_ID_COL], records_df[TIMESTAMP_COL])
+
+        changed = []
+        with self._lock :
+            for (firefighter_id, timestamp), record in zip(keys, records) :
+                minutes = self._records.setdefault(firefighter_id, {})
+                changed.append(minutes.get(timestamp) != record)
+                minutes[timestamp] = record
+            published_minutes = records_df[TIMESTAMP_COL]
+            complete_minute = published_minutes.max() - (pd.Timedelta(0) if complete else pd.Timedelta(minutes = 1))
+            if self._first_minute is None :
+                self._first_minute = published_minutes.min()
+                self._latest_minute = published_minutes.max()
+                self._complete_minute = complete_minute
+            else :
+                self._first_minute = min(self._first_minute, published_minutes.min())
+                self._latest_minute = max(self._latest_minute, published_minutes.max())
+                self._complete_minute = max(self._complete_minute, complete_minute)
+
+            # Drop everything older than the retention period - measured back from each firefighter's latest minute,
+            # and (for firefighters who have left) from the latest minute of all.
+            latest_minutes = {firefighter_id : max(minutes) for firefighter_id, minutes in self._records.items()}
+            latest_of_all = max(latest_minutes.values())
+            for firefighter_id, minutes in list(self._records.items()) :
+                if latest_minutes[firefighter_id] <= latest_of_all - self.RETENTION :
+                    del self._records[firefighter_id]
+                    continue
+                oldest_kept = latest_minutes[firefighter_id] - self.RETENTION
+                for timestamp in [timestamp for timestamp in minutes if timestamp <= oldest_kept] :
+                    del minutes[timestamp]
+
+        return analytics_df.loc[changed]
+
+
+    # The latest minute published (None if nothing has been published yet).
+    def latest_minute(self) :
+        with self._lock :
+            return self._latest_minute
+
+
+    # The oldest minute cached (None if nothing is cached).
+    def oldest_minute(self) :
+        with self._lock :
+            return min([min(minutes) for minutes in self._records.values() if minutes], default=None)
+
+
+    # Whether the cache holds all of the results for a range of minutes - i.e. the minutes are no older than the first
+    # minute published, within the retention period of the latest minute (so no firefighter's results for them can
+    # have been dropped), and all of their results have been published (see publish).
+    def covers(self, start_timestamp, end_timestamp) :
+        with self._lock :
+            if self._latest_minute is None :
+                return False
+            oldest_kept = max(self._first_minute, self._latest_minute - self.RETENTION + pd.Timedelta(minutes = 1))
+            return oldest_kept <= start_timestamp <= end_timestamp <= self._complete_minute
+
+
+    # The cached results for a range of minutes, ordered by firefighter id and then minute.
+    # firefighter_ids : The firefighters to include (defaults to all of them).
+    # start_timestamp, end_timestamp : The first and last minutes (inclusive) to include.
+    # Returns a list of records (dicts of column : value).
+    def records(self, firefighter_ids, start_timestamp, end_timestamp) :
+        records = []
+        with self._lock :
+            if firefighter_ids is None :
+                firefighter_ids = self._records.keys()
+            for firefighter_id in sorted(set(firefighter_ids)) :
+                minutes = self._records.get(firefighter_id, {})
+                records.extend(minutes[timestamp] for timestamp in sorted(minutes)
+                               if start_timestamp <= timestamp <= end_timestamp)
+        return records
+
+
+    # Look up the cached results for a firefighter and minute.
+    # firefighter_id : The firefighter id, as stored in the database.
+    # timestamp_mins : The minute, as anything pd.Timestamp understands (e.g. '2000-01-01T12:00:00' from a query string).
+    # Returns the record (a dict of column : value), or None if it isn't cached.
+    def get(self, firefighter_id, timestamp_mins) :
+
+        try :
+            timestamp = pd.Timestamp(timestamp_mins)
+        except ValueError :
+            timestamp = None
+        if (timestamp is not None) and (timestamp.tzinfo is not None) :
+            # Our timestamps are UTC without a time zone (because our mariadb DB is not time-zone aware)
+            timestamp = timestamp.tz_convert(None)
+
+        with self._lock :
+            record = self._records.get(firefighter_id, {}).get(timestamp)
+            if record is None :
+                self.misses += 1
+            else :
+                self.hits += 1
+        return record
+
+
+    # The cached minutes for a firefighter, oldest first.
+    def minutes(self, firefighter_id) :
+        with self._lock :
+            return sorted(self._records.get(firefighter_id, {}))
+
+
+    # The number of results cached.
+    def __len__(self) :
+        with self._lock :
+            return sum(len(minutes) for minutes in self._records.values())
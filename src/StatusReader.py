@@ -0,0 +1,170 @@
+import json
+import os
+import logging
+import pandas as pd
+import sqlalchemy
+
+try :
+    from .DatabaseFrames import read_frame, read_frame_chunks
+except ImportError :
+    from DatabaseFrames import read_frame, read_frame_chunks
+
+
+# Database constants (in sync with GasExposureAnalytics)
+ANALYTICS_TABLE = 'firefighter_status_analytics'
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+STATUS_LED_COL = 'analytics_status_LED'
+# The name clients expect for the status LED column.
+CLIENT_STATUS_COL = 'status'
+# The columns of a status (as opposed to the full status details).
+STATUS_COLS = [FIREFIGHTER_ID_COL, TIMESTAMP_COL, STATUS_LED_COL]
+
+# Default number of rows read from the database (and encoded) at a time.
+DEFAULT_CHUNK_ROWS = 1000
+
+
+# Reads the statuses (or full status details) of many firefighters over a range of minutes in one go - e.g. for a
+# dashboard showing a whole crew. Recent minutes are answered from the analytics engine's StatusCache when it holds all
+# of them, anything else with a single query on the analytics table (which is indexed on both firefighter_id and
+# timestamp_mins). Results are returned as a JSON array of the same records as /get_status (or /get_status_details),
+# ordered by firefighter and then minute, and are encoded a chunk at a time as they're streamed - so a large range
+# never needs to be held in memory as one string.
+class StatusReader(object):
+
+
+    # db_engine    : SQLAlchemy engine for the Prometeo database.
+    # status_cache : The analytics engine's cache of recent results (None to always read from the database).
+    # chunk_rows   : The number of rows to read (and encode) at a time.
+    def __init__(self, db_engine, status_cache=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+
+        # Get a logger and keep its name in sync with this filename
+        self.logger = logging.getLogger(os.path.basename(__file__))
+
+        self._db_engine = db_engine
+        self._status_cache = status_cache
+        self.CHUNK_ROWS = chunk_rows
+        self._analytics_table_exists = False
+
+
+    # Read statuses as a JSON array, in chunks of text.
+    # firefighter_ids : The firefighters to include - defaults to all of the firefighters with results in the range.
+    # start_timestamp, end_timestamp : The first and last minutes (inclusive) to include, as anything pd.Timestamp
+    #                   understands. The end defaults to the latest minute with results and the start to the end.
+    # details         : Include the full status details, instead of just the status.
+    # Raises ValueError for invalid timestamps (up-front, before anything is streamed).
+    # Returns a generator of JSON text.
+    def stream_json(self, firefighter_ids=None, start_timestamp=None, end_timestamp=None, details=False) :
+
+        end_timestamp = self._parse_timestamp(end_timestamp) if end_timestamp is not None else self._latest_minute()
+        start_timestamp = self._parse_timestamp(start_timestamp) if start_timestamp is not None else end_timestamp
+        if (firefighter_ids is not None) : firefighter_ids = list(firefighter_ids)
+
+        if end_timestamp is None :
+            chunks = iter([]) # No results at all yet
+        elif (self._status_cache is not None) and self._status_cache.covers(start_timestamp, end_timestamp) :
+            chunks = self._chunks_from_cache(firefighter_ids, start_timestamp, end_timestamp, details)
+        else :
+            chunks = self._chunks_from_db(firefighter_ids, start_timestamp, end_timestamp, details)
+
+        return self._json_array(chunks)
+
+
+    # Read the results (with their full details) for every minute after a given minute from the database - e.g. for a
+    # web process that doesn't run the analytics itself, to keep its StatusCache and status stream up to date.
+    # after_timestamp : Defaults to the minute before the latest minute with results (i.e. read the latest minute).
+    # Returns a dataframe keyed on [firefighter_id, timestamp_mins] (empty if there are no newer results).
+    def read_results_after(self, after_timestamp=None) :
+
+        # A new embedded database has no analytics table until the first results are written.
+        if not self._analytics_table_exists :
+            self._analytics_table_exists = ANALYTICS_TABLE in sqlalchemy.inspect(self._db_engine).get_table_names()
+            if not self._analytics_table_exists :
+                return pd.DataFrame(index=pd.MultiIndex.from_arrays([[], []], names=[FIREFIGHTER_ID_COL, TIMESTAMP_COL]))
+
+        if after_timestamp is None :
+            sql = ('SELECT * FROM ' + ANALYTICS_TABLE + ' WHERE ' + TIMESTAMP_COL
+                   + ' = (SELECT MAX(' + TIMESTAMP_COL + ') FROM ' + ANALYTICS_TABLE + ')')
+            query, parameters = sqlalchemy.text(sql), {}
+        else :
+            sql = 'SELECT * FROM ' + ANALYTICS_TABLE + ' WHERE ' + TIMESTAMP_COL + ' > :after_timestamp'
+            query = sqlalchemy.text(sql).bindparams(sqlalchemy.bindparam('after_timestamp', type_=sqlalchemy.types.DateTime))
+            parameters = {'after_timestamp' : self._parse_timestamp(after_timestamp).to_pydatetime()}
+        return (read_frame(self._db_engine, query, params=parameters, parse_dates=[TIMESTAMP_COL])
+                .set_index([FIREFIGHTER_ID_COL, TIMESTAMP_COL]).sort_index())
+
+
+    # Bring the status cache up to date from the database - e.g. in a web process that doesn't run the analytics itself.
+    # Every minute the cache holds is read again, as well as the newer ones, because results that have already been read
+    # can still change: the analytics recompute earlier minutes when sensor records arrive late (and write them again),
+    # and sharded workers each write their own firefighters' results for a minute, at different times. So the latest
+    # minute read isn't taken to be complete until there are results for a later one (see StatusCache.publish).
+    # Returns the results that are new or have changed, e.g. for the status stream (may be empty).
+    def read_status_updates(self) :
+        oldest_minute = self._status_cache.oldest_minute()
+        after_timestamp = None if oldest_minute is None else oldest_minute - pd.Timedelta(minutes = 1)
+        return self._status_cache.publish(self.read_results_after(after_timestamp), complete=False)
+
+
+    # Query-string timestamps may be time-zone aware, but ours are UTC without a time zone (because our mariadb DB is
+    # not time-zone aware).
+    def _parse_timestamp(self, timestamp_text) :
+        timestamp = pd.Timestamp(timestamp_text)
+        if timestamp is pd.NaT :
+            raise ValueError("Invalid timestamp : '%s'" % (timestamp_text))
+        if timestamp.tzinfo is not None :
+            timestamp = timestamp.tz_convert(None)
+        return timestamp
+
+
+    # The latest minute with results (None if there are none).
+    def _latest_minute(self) :
+        if (self._status_cache is not None) and (self._status_cache.latest_minute() is not None) :
+            return self._status_cache.latest_minute()
+        latest_minute = read_frame(self._db_engine, 'SELECT MAX(' + TIMESTAMP_COL + ') AS ' + TIMESTAMP_COL + ' FROM ' + ANALYTICS_TABLE,
+                                   parse_dates=[TIMESTAMP_COL]).iloc[0, 0]
+        return None if pd.isnull(latest_minute) else latest_minute
+
+
+    # Wrap chunks of comma-separated JSON records into a JSON array.
+    def _json_array(self, chunks) :
+        yield '['
+        separator = ''
+        for chunk in chunks :
+            yield separator + chunk
+            separator = ','
+        yield ']'
+
+
+    # Encode cached records as comma-separated JSON, a chunk at a time.
+    def _chunks_from_cache(self, firefighter_ids, start_timestamp, end_timestamp, details) :
+        records = self._status_cache.records(firefighter_ids, start_timestamp, end_timestamp)
+        for chunk_start in range(0, len(records), self.CHUNK_ROWS) :
+            yield ','.join(json.dumps({(CLIENT_STATUS_COL if col == STATUS_LED_COL else col) : value # name as expected by client
+                                       for col, value in record.items() if details or (col in STATUS_COLS)},
+                                      separators=(',', ':'))
+                           for record in records[chunk_start:chunk_start + self.CHUNK_ROWS])
+
+
+    # Read records from the database with a single query, and encode them as comma-separated JSON a chunk at a time.
+    def _chunks_from_db(self, firefighter_ids, start_timestamp, end_timestamp, details) :
+
+        sql = ('SELECT ' + ('*' if details else ', '.join(STATUS_COLS)) + ' FROM ' + ANALYTICS_TABLE
+               + ' WHERE ' + TIMESTAMP_COL + ' BETWEEN :start_timestamp AND :end_timestamp'
+               + ('' if firefighter_ids is None else ' AND ' + FIREFIGHTER_ID_COL + ' IN :firefighter_ids')
+               + ' ORDER BY ' + FIREFIGHTER_ID_COL + ', ' + TIMESTAMP_COL)
+        parameters = {'start_timestamp' : start_timestamp.to_pydatetime(), 'end_timestamp' : end_timestamp.to_pydatetime()}
+        query = sqlalchemy.text(sql).bindparams(sqlalchemy.bindparam('start_timestamp', type_=sqlalchemy.types.DateTime),
+                                                sqlalchemy.bindparam('end_timestamp', type_=sqlalchemy.types.DateTime))
+        if firefighter_ids is not None :
+            if not firefighter_ids :
+                return
+            query = query.bindparams(sqlalchemy.bindparam('firefighter_ids', expanding=True))
+            parameters['firefighter_ids'] = firefighter_ids
+
+        # Stream the rows from the database too (where the driver supports it), instead of fetching them all up-front.
+        with self._db_engine.connect() as connection :
+            connection = connection.execution_options(stream_results=True)
+            for chunk_df in read_frame_chunks(connection, query, self.CHUNK_ROWS, params=parameters, parse_dates=[TIMESTAMP_COL]) :
+                yield (chunk_df.rename(columns={STATUS_LED_COL: CLIENT_STATUS_COL}) # name as expected by client
+                       .to_json(orient='records', date_format='iso')[1:-1]) # records, without the enclosing [ ]
@@ -0,0 +1,88 @@
+import os
+import logging
+import signal
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from dotenv import load_dotenv
+from apscheduler.schedulers.blocking import BlockingScheduler
+from GasExposureAnalytics import GasExposureAnalytics
+from AnalyticsScheduler import AnalyticsScheduler
+from AnalyticsLease import AnalyticsLease
+from AnalyticsShards import ShardMembership
+
+# The dedicated analytics worker: runs the analytics once a minute, so that the web processes
+# (core_decision_flask_app.py, with PROMETEO_WEB_RUNS_ANALYTICS=false) only serve reads. Run two or more workers for
+# fail-over - they share the scheduler lease (see AnalyticsLease), so only one of them runs the analytics at a time.
+# Or, with PROMETEO_ANALYTICS_SHARDED=true, every worker runs the analytics for its own shard of the firefighters (see
+# AnalyticsShards) - for incidents too big for one worker.
+#
+#   python analytics_worker.py [metrics port]
+
+# get logging level from the environment, default to INFO
+logging.basicConfig(level=os.environ.get("LOGLEVEL", logging.INFO))
+
+# Get a logger and keep its name in sync with this filename
+logger = logging.getLogger(os.path.basename(__file__))
+
+# load environment variables
+load_dotenv()
+
+# The port to serve the analytics metrics on, at /metrics (in the Prometheus text format - see AnalyticsMetrics).
+metrics_port = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.getenv('METRICS_PORT', 8081))
+
+logger.info('starting analytics worker')
+
+# The prometeo Analytics engine. Its storage is the MariaDB server, unless PROMETEO_STORAGE_URL says otherwise (see
+# AnalyticsStorage.create_storage). If PROMETEO_CHECKPOINT_FILE is set (e.g. to a file on a volume), the state the
+# analytics keep from minute to minute is checkpointed to it, so that a restarted worker carries on from where it left
+# off instead of starting from scratch (see AnalyticsCheckpoint).
+perMinuteAnalytics = GasExposureAnalytics(incremental=True, cache_sensor_log=True, write_behind=True,
+                                          recompute_late_arrivals=True,
+                                          checkpoint_file=os.getenv('PROMETEO_CHECKPOINT_FILE') or None)
+
+# The lease (or shard membership) is kept in the database - without one (e.g. in-memory storage) there can only be one
+# worker anyway.
+DB_ENGINE = perMinuteAnalytics.STORAGE.db_engine
+if DB_ENGINE is None:
+    analyticsScheduler = AnalyticsScheduler(perMinuteAnalytics)
+elif os.getenv('PROMETEO_ANALYTICS_SHARDED', 'false').lower() == 'true':
+    analyticsScheduler = AnalyticsScheduler(perMinuteAnalytics, membership=ShardMembership(DB_ENGINE))
+else:
+    analyticsScheduler = AnalyticsScheduler(perMinuteAnalytics, AnalyticsLease(DB_ENGINE))
+
+
+# Serves the analytics metrics.
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = perMinuteAnalytics.metrics_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+metricsServer = HTTPServer(('0.0.0.0', metrics_port), MetricsHandler)
+threading.Thread(target=metricsServer.serve_forever, name='metrics', daemon=True).start()
+
+
+# Stop cleanly on SIGTERM (e.g. from Kubernetes) as well as Ctrl-C - writing any analytics results that are still
+# waiting to be written, and handing the lease on to a standby worker straight away.
+def shutdown(signum, frame):
+    logger.info('stopping analytics worker')
+    threading.Thread(target=analyticsScheduler.shutdown).start() # not from within the scheduler's own thread
+signal.signal(signal.SIGTERM, shutdown)
+signal.signal(signal.SIGINT, shutdown)
+
+
+if __name__ == '__main__':
+    analyticsScheduler.start(BlockingScheduler())
+    metricsServer.shutdown()
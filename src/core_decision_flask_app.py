@@ -5,6 +5,10 @@ from flask_cors import CORS, cross_origin
 import json
 import pandas as pd
 from GasExposureAnalytics import GasExposureAnalytics
+from StatusReader import StatusReader
+from StatusBroadcaster import StatusBroadcaster
+from AnalyticsScheduler import AnalyticsScheduler, ANALYTICS_FREQUENCY_SECONDS
+from AnalyticsLease import AnalyticsLease
 from dotenv import load_dotenv
 import time
 import atexit
@@ -12,7 +16,7 @@ from apscheduler.schedulers.background import BackgroundScheduler
 import logging
 import sqlalchemy
 import sys
-from flask import request
+from flask import request, stream_with_context
 from werkzeug.exceptions import HTTPException
 
 # get logging level from the environment, default to INFO
@@ -34,49 +38,86 @@ logger.info('starting application')
 # When running this app on the local machine, default to 8080
 port = int(os.getenv('PORT', 8080))
 
-# DB Connections and identifier constants
-SQLALCHEMY_DATABASE_URI = ("mysql+pymysql://"+os.getenv('MARIADB_USERNAME')
-                            +":"+os.getenv("MARIADB_PASSWORD")
-                            +"@"+os.getenv("MARIADB_HOST")
-                            +":"+str(os.getenv("MARIADB_PORT"))
-                            +"/prometeo")
-DB_ENGINE = sqlalchemy.MetaData(SQLALCHEMY_DATABASE_URI).bind
+# DB identifier constants
 ANALYTICS_TABLE = 'firefighter_status_analytics'
 FIREFIGHTER_ID_COL = 'firefighter_id'
 TIMESTAMP_COL = 'timestamp_mins'
 STATUS_LED_COL = 'analytics_status_LED'
 
-# We initialize the prometeo Analytics engine.
-perMinuteAnalytics = GasExposureAnalytics()
-
-
-
-# Calculates Time-Weighted Average exposures and exposure-limit status 'gauges' for all firefighters for the last minute.
-def callGasExposureAnalytics():
-    logger.info('Running analytics')
-
-    # Run all of the core analytics for Prometeo for a given minute.
-    status_updates_df = perMinuteAnalytics.run_analytics()
-
-    # # TODO: Pass all status details and gauges on to the dashboard via an update API
-    # status_updates_json = None # Information available for the current minute (may be None)
-    # if status_updates_df is not None:
-    #     status_updates_json = (status_updates_df.reset_index(TIMESTAMP_COL) # index json by firefighter only
-    #                            .to_json(orient='index', date_format='iso')) # send json to dashboard 
-    #
-    # resp = requests.post(API_URL, json=status_updates_json)
-    # if resp.status_code != EXPECTED_RESPONSE_CODE:
-    #     logger.error(f'ERROR: dashboard update API error code [{resp.status_code}]')
-    #     logger.debug(f'\t with JSON: {status_updates_json}')
-
-
-# Start up a scheduled job to run once per minute
-ANALYTICS_FREQUENCY_SECONDS = 60
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=callGasExposureAnalytics, trigger="interval", seconds=ANALYTICS_FREQUENCY_SECONDS)
-scheduler.start()
-# Shut down the scheduler when exiting the app
-atexit.register(lambda: scheduler.shutdown())
+# The number of minutes of recent results per firefighter that the status endpoints can serve from memory.
+STATUS_CACHE_MINS = 60
+
+# Whether this web process may run the scheduled analytics (if it holds the scheduler lease - see AnalyticsLease).
+# Set to 'false' when the analytics run in a dedicated worker (analytics_worker.py), so that web processes only serve
+# reads and can be scaled freely.
+WEB_RUNS_ANALYTICS = os.getenv('PROMETEO_WEB_RUNS_ANALYTICS', 'true').lower() == 'true'
+
+# We initialize the prometeo Analytics engine. Its storage is the MariaDB server, unless PROMETEO_STORAGE_URL says
+# otherwise (e.g. sqlite:///prometeo.db for an embedded database - see AnalyticsStorage.create_storage).
+perMinuteAnalytics = GasExposureAnalytics(incremental=True, cache_sensor_log=True, write_behind=WEB_RUNS_ANALYTICS,
+                                          status_cache_mins=STATUS_CACHE_MINS, recompute_late_arrivals=True)
+
+# DB Connections - one pool, shared with the analytics engine (sized by the PROMETEO_DB_POOL_* environment variables -
+# see DatabasePool, and /metrics for its usage). The endpoints query the database, so the storage must be one.
+DB_ENGINE = perMinuteAnalytics.STORAGE.db_engine
+if DB_ENGINE is None:
+    logger.error('The endpoints need a database - set PROMETEO_STORAGE_URL to a database URL (e.g. sqlite://)')
+    sys.exit(1)
+
+
+# Reads statuses for many firefighters / minutes at once (from the cache of recent results where possible).
+statusReader = StatusReader(DB_ENGINE, perMinuteAnalytics.STATUS_CACHE)
+
+# Pushes each minute's status changes to subscribed clients (see /status_stream).
+statusBroadcaster = StatusBroadcaster()
+
+
+# Look up a firefighter's status for a minute in the analytics engine's cache of recent results, and return it as JSON
+# in the same form as a status read from the database (or None if it isn't cached).
+# columns : The columns to return (defaults to all of them).
+def getCachedStatusJson(firefighter_id, timestamp_mins, columns=None):
+    record = perMinuteAnalytics.STATUS_CACHE.get(firefighter_id, timestamp_mins)
+    if record is None:
+        return None
+    if columns is None:
+        columns = record.keys()
+    return json.dumps({("status" if col == STATUS_LED_COL else col): record[col] for col in columns}, # name as expected by client
+                      separators=(',', ':'))
+
+
+
+# Push each minute's status changes to subscribed clients straight away (status_updates_df may be None).
+def publishStatusUpdates(status_updates_df):
+    statusBroadcaster.publish(status_updates_df)
+
+
+# When another process runs the analytics, read each minute's results from the database instead - so the status cache
+# and the status stream are still kept up to date (including earlier minutes' results, when they're recomputed).
+def readStatusUpdates():
+    publishStatusUpdates(statusReader.read_status_updates())
+
+
+# Calculates Time-Weighted Average exposures and exposure-limit status 'gauges' for all firefighters for the last
+# minute - once a minute, in whichever process holds the scheduler lease (at most one per deployment).
+if WEB_RUNS_ANALYTICS:
+    analyticsScheduler = AnalyticsScheduler(perMinuteAnalytics, AnalyticsLease(DB_ENGINE),
+                                            on_results=publishStatusUpdates, on_standby=readStatusUpdates)
+    analyticsScheduler.start(BackgroundScheduler())
+else:
+    logger.info('Not running the analytics - they run in a dedicated worker (analytics_worker.py)')
+    analyticsScheduler = None
+    statusScheduler = BackgroundScheduler()
+    statusScheduler.add_job(func=readStatusUpdates, trigger="interval", seconds=ANALYTICS_FREQUENCY_SECONDS)
+    statusScheduler.start()
+# Shut down the scheduler when exiting the app - then write any analytics results that are still waiting to be written,
+# hand the scheduler lease on, and end any status streams.
+def shutdown():
+    if analyticsScheduler is not None:
+        analyticsScheduler.shutdown()
+    else:
+        statusScheduler.shutdown()
+    statusBroadcaster.close()
+atexit.register(shutdown)
 
 
 @app.route('/health', methods=['GET'])
@@ -99,6 +140,12 @@ def getStatus():
                             +', '+TIMESTAMP_COL+' : '+str(timestamp_mins))
             abort(404)
 
+        # Answer from memory if we can - recent results are cached as they're calculated.
+        firefighter_status_json = getCachedStatusJson(firefighter_id, timestamp_mins,
+                                                      [FIREFIGHTER_ID_COL, TIMESTAMP_COL, STATUS_LED_COL])
+        if firefighter_status_json is not None:
+            return firefighter_status_json
+
         # Read the requested Firefighter status
         sql = ('SELECT '+FIREFIGHTER_ID_COL+', '+TIMESTAMP_COL+', '+STATUS_LED_COL+' FROM '+ANALYTICS_TABLE+
             ' WHERE '+FIREFIGHTER_ID_COL+' = "'+firefighter_id+'" AND '+TIMESTAMP_COL+' = "'+timestamp_mins+'"')
@@ -143,6 +190,11 @@ def getStatusDetails():
                             +', '+TIMESTAMP_COL+' : '+str(timestamp_mins))
             abort(404)
 
+        # Answer from memory if we can - recent results are cached as they're calculated.
+        firefighter_status_json = getCachedStatusJson(firefighter_id, timestamp_mins)
+        if firefighter_status_json is not None:
+            return firefighter_status_json
+
         # Read the requested Firefighter status
         sql = ('SELECT * FROM '+ANALYTICS_TABLE+
             ' WHERE '+FIREFIGHTER_ID_COL+' = "'+firefighter_id+'" AND '+TIMESTAMP_COL+' = "'+timestamp_mins+'"')
@@ -167,6 +219,53 @@ def getStatusDetails():
         logger.error(f'Internal Server Error: {e}')
         abort(500)
 
+# Statuses for many firefighters, for one minute or a range of minutes, in one response (streamed as a JSON array of
+# the same records as /get_status, ordered by firefighter and then minute). Parameters (all optional):
+#   firefighter_id       : Repeated (or comma-separated) firefighter ids. Defaults to 'all' - every active firefighter,
+#                          i.e. everyone with a status in the requested minutes.
+#   timestamp_mins       : A single minute. Or start_timestamp_mins and/or end_timestamp_mins for a range (inclusive).
+#                          Defaults to the latest minute.
+#   details              : 'true' for the full status details (as /get_status_details).
+@app.route('/get_status_batch', methods=['GET'])
+def getStatusBatch():
+
+    try:
+        firefighter_ids = [firefighter_id for param in request.args.getlist(FIREFIGHTER_ID_COL)
+                           for firefighter_id in param.split(',') if firefighter_id]
+        if (not firefighter_ids) or (firefighter_ids == ['all']):
+            firefighter_ids = None
+        start_timestamp_mins = request.args.get('start_timestamp_mins', request.args.get(TIMESTAMP_COL))
+        end_timestamp_mins = request.args.get('end_timestamp_mins', request.args.get(TIMESTAMP_COL))
+        details = request.args.get('details', 'false').lower() == 'true'
+
+        # Return 400 (Bad Request) if the minutes are invalid
+        try:
+            status_json_chunks = statusReader.stream_json(firefighter_ids, start_timestamp_mins, end_timestamp_mins, details)
+        except ValueError as e:
+            logger.error(f'Invalid parameters : {e}')
+            abort(400)
+
+        return Response(stream_with_context(status_json_chunks), mimetype='application/json')
+    except HTTPException as e:
+        logger.error(f'{e}')
+        raise e
+    except Exception as e:
+        # Return 500 (Internal Server Error) if there's any unexpected errors.
+        logger.error(f'Internal Server Error: {e}')
+        abort(500)
+
+# A Server-Sent Events stream of status changes: first the latest status of every firefighter, then each minute the
+# statuses that have changed (see StatusBroadcaster). e.g. in a browser: new EventSource('/status_stream')
+@app.route('/status_stream', methods=['GET'])
+def statusStream():
+    return Response(stream_with_context(statusBroadcaster.stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}) # don't buffer the events
+
+# Analytics timings, throughput and backlog, in the Prometheus text format (see AnalyticsMetrics).
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(perMinuteAnalytics.metrics_text(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/get_configuration', methods=['GET'])
 def getConfiguration():
 
@@ -0,0 +1,37 @@
+import os
+import logging
+import sys
+from dotenv import load_dotenv
+from GasExposureAnalytics import GasExposureAnalytics
+from SensorRollup import SensorRollup
+
+# Adds the sensor rollup (its table, and the trigger on the sensor log that keeps it up to date - see SensorRollup) to
+# the database, filled from the sensor records already there - the schema change that the analytics' rollup_sensor_log
+# needs. Run it once per database, while no sensor records are being written. It does nothing if the rollup is already
+# there. With --rebuild, it empties the rollup and fills it again from the sensor log instead (e.g. after sensor records
+# have been corrected).
+#
+#   python migrate_sensor_rollup.py [--rebuild]
+
+# get logging level from the environment, default to INFO
+logging.basicConfig(level=os.environ.get("LOGLEVEL", logging.INFO))
+
+# Get a logger and keep its name in sync with this filename
+logger = logging.getLogger(os.path.basename(__file__))
+
+# load environment variables
+load_dotenv()
+
+# The database is the MariaDB server, unless PROMETEO_STORAGE_URL says otherwise (see AnalyticsStorage.create_storage),
+# and the gases are the configured ones.
+analytics = GasExposureAnalytics()
+sensorRollup = SensorRollup(analytics.STORAGE.db_engine, [window['mins'] for window in analytics.WINDOWS_AND_LIMITS],
+                            analytics.SUPPORTED_GASES)
+
+if '--rebuild' in sys.argv[1:]:
+    logger.info('rebuilding the sensor rollup')
+    sensorRollup.rebuild()
+elif sensorRollup.migrate():
+    logger.info('added the sensor rollup')
+else:
+    logger.info('the sensor rollup is already there')
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+
+# Status stream client - prints the status changes pushed by the rules-decision service (see /status_stream in
+# src/core_decision_flask_app.py) as they arrive. For trying the stream out against a local service, e.g.:
+#   python status-stream-client.py http://localhost:8080/status_stream
+
+import json
+import sys
+import urllib.request
+
+DEFAULT_URL = 'http://localhost:8080/status_stream'
+
+
+if __name__ == '__main__':
+    url = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_URL
+    print('Listening for status changes on ' + url)
+
+    with urllib.request.urlopen(url) as stream:
+        event = None
+        for line in stream:
+            line = line.decode('utf8').rstrip('\n')
+            if line.startswith('event:'):
+                event = line[len('event:'):].strip()
+            elif line.startswith('data:'):
+                for status in json.loads(line[len('data:'):]):
+                    print('%s %s firefighter %s : status %s'
+                          % (event, status['timestamp_mins'], status['firefighter_id'], status['status']))
@@ -0,0 +1,135 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from src import GasExposureAnalytics
+from src.AnalyticsCheckpoint import AnalyticsCheckpoint, frame_to_arrays, frame_from_arrays
+from src.AnalyticsStorage import InMemoryStorage, create_storage
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+TEST_DATA_CSV_FILEPATH = reference_tests.TEST_DATA_CSV_FILEPATH
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+
+# ---------------------------------------
+
+# Unit tests for the AnalyticsCheckpoint class - and for restarting the analytics from a checkpoint, which should carry
+# on with exactly the same results as if they had never stopped.
+class AnalyticsCheckpointTestCase(unittest.TestCase):
+
+    _sensor_log_df = InMemoryStorage.from_csv_files(TEST_DATA_CSV_FILEPATH).sensor_log_df
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._url = 'sqlite:///' + os.path.join(self._tmp_dir.name, 'prometeo.db')
+        self._checkpoint_file = os.path.join(self._tmp_dir.name, 'checkpoint', 'analytics.npz')
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    # The analytics as the analytics worker runs them, from the SQLite database (with the sensor log written to it).
+    def _analytics(self, sensor_log_df=None, checkpoint_file=None) :
+        analytics = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST, incremental=True,
+                                         cache_sensor_log=True, recompute_late_arrivals=True, status_cache_mins=60,
+                                         storage=create_storage(self._url), checkpoint_file=checkpoint_file)
+        if sensor_log_df is not None :
+            analytics.STORAGE.write_sensor_log(sensor_log_df)
+        return analytics
+
+    def _run_minute_by_minute(self, analytics, start_str, end_str) :
+        return pd.concat([analytics.run_analytics(now, commit=False)
+                          for now in pd.date_range(start_str, end_str, freq='min')])
+
+
+    def test_arrays_and_frames_are_saved_and_loaded(self):
+        checkpoint = AnalyticsCheckpoint(self._checkpoint_file, 'configuration')
+        self.assertTrue(checkpoint.due(pd.Timestamp('2000-01-01 12:00:00')))
+        frame_df = self._sensor_log_df.iloc[:50].copy()
+        frame_df.iloc[0, frame_df.columns.get_loc('device_id')] = None
+        arrays = {'ids' : np.array(['a', None, 'b', 'a'], dtype=object), 'values' : np.arange(4.0)}
+        arrays.update({'frame.' + name : array for name, array in frame_to_arrays(frame_df).items()})
+        self.assertTrue(checkpoint.save(pd.Timestamp('2000-01-01 12:00:00'), arrays))
+        self.assertFalse(checkpoint.due(pd.Timestamp('2000-01-01 12:04:00')))
+        self.assertTrue(checkpoint.due(pd.Timestamp('2000-01-01 12:05:00')))
+
+        timestamp_key, loaded = AnalyticsCheckpoint(self._checkpoint_file, 'configuration').load()
+        self.assertEqual(timestamp_key, pd.Timestamp('2000-01-01 12:00:00'))
+        self.assertEqual(list(loaded['ids']), ['a', None, 'b', 'a'])
+        np.testing.assert_array_equal(loaded['values'], arrays['values'])
+        pd.testing.assert_frame_equal(frame_df, frame_from_arrays({name[len('frame.'):] : array for name, array
+                                                                   in loaded.items() if name.startswith('frame.')}))
+
+    def test_checkpoint_for_another_configuration_or_unreadable_is_ignored(self):
+        AnalyticsCheckpoint(self._checkpoint_file, 'configuration').save(pd.Timestamp('2000-01-01 12:00:00'),
+                                                                         {'values' : np.arange(4.0)})
+        self.assertEqual(AnalyticsCheckpoint(self._checkpoint_file, 'another configuration').load(), (None, None))
+        with open(self._checkpoint_file, 'wb') as file :
+            file.write(b'not a checkpoint')
+        self.assertEqual(AnalyticsCheckpoint(self._checkpoint_file, 'configuration').load(), (None, None))
+
+    def test_restart_carries_on_with_the_same_results(self):
+        # (the reference results - the pandas calculation, minute by minute, never stopped)
+        never_stopped = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+        expected_df = self._run_minute_by_minute(never_stopped, '2000-01-01 11:30:00', '2000-01-01 12:10:00')
+        create_storage(self._url).write_sensor_log(self._sensor_log_df)
+
+        # Stop at 11:49 (saving the checkpoint), and start again a few minutes later.
+        before_restart = self._analytics(checkpoint_file=self._checkpoint_file)
+        self._run_minute_by_minute(before_restart, '2000-01-01 11:30:00', '2000-01-01 11:50:00')
+        before_restart.close()
+
+        restarted = self._analytics(checkpoint_file=self._checkpoint_file)
+        with self.assertLogs(level='INFO') as logs :
+            actual_df = self._run_minute_by_minute(restarted, '2000-01-01 11:55:00', '2000-01-01 12:10:00')
+
+        # Carried on from the checkpoint - without re-reading the whole block or rebuilding the running sums (they're
+        # moved on over the minutes missed, as they're fewer than MAX_CATCH_UP_MINS).
+        logs = '\n'.join(logs.output)
+        self.assertIn("Carrying on from the analytics checkpoint for minute key '2000-01-01T11:49:00'", logs)
+        self.assertNotIn('Sensor log cache loaded', logs)
+        self.assertNotIn('Rebuilding incremental time-weighted averages', logs)
+        pd.testing.assert_frame_equal(expected_df.loc[actual_df.index].sort_index(), actual_df.sort_index())
+
+    def test_late_records_while_stopped_are_recomputed_after_a_restart(self):
+        late_firefighter, late_minutes = reference_tests.LateArrivalsTestCase.LATE_FIREFIGHTER, ('2000-01-01 11:30:00',
+                                                                                                '2000-01-01 11:35:00')
+        held_back = ((self._sensor_log_df[FIREFIGHTER_ID_COL] == late_firefighter)
+                     & (self._sensor_log_df.index >= late_minutes[0]) & (self._sensor_log_df.index <= late_minutes[1]))
+        on_time = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                       status_cache_mins=60)
+        self._run_minute_by_minute(on_time, '2000-01-01 11:30:00', '2000-01-01 11:42:00')
+
+        before_restart = self._analytics(self._sensor_log_df.loc[~held_back, :], checkpoint_file=self._checkpoint_file)
+        self._run_minute_by_minute(before_restart, '2000-01-01 11:30:00', '2000-01-01 11:41:00')
+        before_restart.close()
+        before_restart.STORAGE.write_sensor_log(self._sensor_log_df.loc[held_back, :])
+
+        restarted = self._analytics(checkpoint_file=self._checkpoint_file)
+        with self.assertLogs(level='INFO') as logs :
+            restarted.run_analytics('2000-01-01 11:42:00', commit=False)
+        self.assertIn('Late sensor records found for 1 firefighter(s)', '\n'.join(logs.output))
+        for minute in pd.date_range(late_minutes[0], '2000-01-01 11:41:00', freq='min') :
+            self.assertEqual(restarted.STATUS_CACHE.get(late_firefighter, minute),
+                             on_time.STATUS_CACHE.get(late_firefighter, minute))
+
+    def test_checkpoint_older_than_the_longest_window_is_not_carried_on_from(self):
+        before_restart = self._analytics(self._sensor_log_df, checkpoint_file=self._checkpoint_file)
+        self._run_minute_by_minute(before_restart, '2000-01-01 10:00:00', '2000-01-01 10:05:00')
+        before_restart.close()
+
+        restarted = self._analytics(checkpoint_file=self._checkpoint_file)
+        with self.assertLogs(level='INFO') as logs :
+            restarted.run_analytics('2000-01-01 23:00:00', commit=False)
+        self.assertIn('starting from scratch', '\n'.join(logs.output))
+        self.assertIsNone(restarted._FF_TIME_SPANS_CACHE)
+
+
+if __name__ == '__main__':
+    unittest.main()
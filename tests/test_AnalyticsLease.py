@@ -0,0 +1,100 @@
+import os
+import tempfile
+import time
+import unittest
+
+import sqlalchemy
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from src import GasExposureAnalytics
+from src.AnalyticsLease import AnalyticsLease
+from src.AnalyticsScheduler import AnalyticsScheduler
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+# ---------------------------------------
+
+# Unit tests for the AnalyticsLease and AnalyticsScheduler classes - only one process at a time should run the
+# analytics. Each 'process' has its own engine on a shared SQLite file, in place of MariaDB.
+class AnalyticsLeaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._url = 'sqlite:///' + os.path.join(self._tmp_dir.name, 'prometeo.db')
+        self._db_engines = []
+
+    def tearDown(self):
+        for db_engine in self._db_engines :
+            db_engine.dispose()
+        self._tmp_dir.cleanup()
+
+    def _lease(self, holder_id, lease_seconds=60) :
+        self._db_engines.append(sqlalchemy.create_engine(self._url))
+        return AnalyticsLease(self._db_engines[-1], holder_id=holder_id, lease_seconds=lease_seconds)
+
+
+    def test_only_one_holder_at_a_time(self):
+        lease_1, lease_2 = self._lease('worker-1'), self._lease('worker-2')
+        self.assertTrue(lease_1.acquire())
+        self.assertFalse(lease_2.acquire())
+        self.assertTrue(lease_1.acquire()) # renewed
+        self.assertTrue(lease_1.held)
+        self.assertFalse(lease_2.held)
+        self.assertEqual(lease_2.holder(), 'worker-1')
+
+    def test_expired_lease_fails_over(self):
+        lease_1, lease_2 = self._lease('worker-1', lease_seconds=0.2), self._lease('worker-2', lease_seconds=0.2)
+        self.assertTrue(lease_1.acquire())
+        self.assertFalse(lease_2.acquire())
+        time.sleep(0.3) # worker-1 has died
+        self.assertFalse(lease_1.held)
+        self.assertIsNone(lease_2.holder())
+        self.assertTrue(lease_2.acquire())
+        self.assertFalse(lease_1.acquire())
+
+    def test_released_lease_is_taken_over_straight_away(self):
+        lease_1, lease_2 = self._lease('worker-1'), self._lease('worker-2')
+        self.assertTrue(lease_1.acquire())
+        lease_1.release()
+        self.assertFalse(lease_1.held)
+        self.assertTrue(lease_2.acquire())
+
+    def test_scheduler_only_runs_the_analytics_while_holding_the_lease(self):
+        schedulers = []
+        runs = {'worker-1' : [], 'worker-2' : []}
+        standbys = {'worker-1' : [], 'worker-2' : []}
+        for holder_id in ['worker-1', 'worker-2'] :
+            analytics = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST, storage=self._url)
+            self._db_engines.append(analytics.STORAGE.db_engine)
+            lease = AnalyticsLease(analytics.STORAGE.db_engine, holder_id=holder_id)
+            schedulers.append(AnalyticsScheduler(analytics, lease, on_results=runs[holder_id].append,
+                                                 on_standby=lambda standbys=standbys[holder_id] : standbys.append(1)))
+
+        self.assertTrue(schedulers[0].run_once())
+        self.assertFalse(schedulers[1].run_once())
+        self.assertEqual((len(runs['worker-1']), len(standbys['worker-1'])), (1, 0))
+        self.assertEqual((len(runs['worker-2']), len(standbys['worker-2'])), (0, 1))
+        self.assertEqual(schedulers[1].ANALYTICS.METRICS.value('scheduler_lease_held'), 0)
+
+        # The holder shuts down, and the standby takes over.
+        schedulers[0].shutdown()
+        self.assertTrue(schedulers[1].run_once())
+        self.assertEqual(schedulers[1].ANALYTICS.METRICS.value('scheduler_lease_held'), 1)
+
+    def test_scheduled_runs_never_overlap(self):
+        analytics = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST, storage=self._url)
+        self._db_engines.append(analytics.STORAGE.db_engine)
+        scheduler = AnalyticsScheduler(analytics)
+        scheduler.start(BackgroundScheduler())
+        try :
+            job = scheduler._scheduler.get_jobs()[0]
+            self.assertEqual((job.max_instances, job.coalesce), (1, True))
+        finally :
+            scheduler.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
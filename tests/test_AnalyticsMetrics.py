@@ -0,0 +1,62 @@
+import unittest
+
+import sqlalchemy
+
+from src import GasExposureAnalytics
+from src.AnalyticsMetrics import AnalyticsMetrics
+from src.AnalyticsWriter import AnalyticsWriter
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+TEST_DATA_CSV_FILEPATH = reference_tests.TEST_DATA_CSV_FILEPATH
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+# ---------------------------------------
+
+# Unit tests for the AnalyticsMetrics class, and the metrics the analytics record in it.
+class AnalyticsMetricsTestCase(unittest.TestCase):
+
+    def test_prometheus_text_format(self):
+        metrics = AnalyticsMetrics()
+        with metrics.time('read') :
+            pass
+        metrics.observe('read', 0.5)
+        metrics.increment('runs_total')
+        metrics.set_gauge('firefighters', 3)
+
+        lines = metrics.to_prometheus_text().splitlines()
+        self.assertIn('# TYPE prometeo_analytics_stage_seconds summary', lines)
+        self.assertIn('prometeo_analytics_stage_seconds_count{stage="read"} 2', lines)
+        self.assertIn('prometeo_analytics_stage_last_seconds{stage="read"} 0.5', lines)
+        self.assertIn('# TYPE prometeo_analytics_runs_total counter', lines)
+        self.assertIn('prometeo_analytics_runs_total 1', lines)
+        self.assertIn('prometeo_analytics_firefighters 3.0', lines)
+        total_seconds, count = metrics.stage_seconds('read')
+        self.assertGreaterEqual(total_seconds, 0.5)
+        self.assertEqual(count, 2)
+
+    def test_analytics_stages_are_timed(self):
+        for incremental in [False, True] :
+            analytics = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                             incremental=incremental)
+            analytics_df = analytics.run_analytics('2000-01-01 12:00:00', commit=False)
+            for stage in ['read', 'resample', 'windows', 'status'] :
+                self.assertEqual(analytics.METRICS.stage_seconds(stage)[1], 1, stage)
+            self.assertEqual(analytics.METRICS.value('runs_total'), 1)
+            self.assertGreater(analytics.METRICS.value('sensor_records_read_total'), 0)
+            self.assertEqual(analytics.METRICS.value('firefighters'), len(analytics_df.index))
+            self.assertIn('prometeo_analytics_results_total %d' % len(analytics_df.index),
+                          analytics.metrics_text().splitlines())
+
+    def test_written_rows_are_counted(self):
+        analytics_df = (GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+                        .run_analytics('2000-01-01 12:00:00', commit=False))
+        metrics = AnalyticsMetrics()
+        AnalyticsWriter(sqlalchemy.create_engine('sqlite://'), batch_size=2, metrics=metrics).write(analytics_df)
+        self.assertEqual(metrics.value('rows_written_total'), len(analytics_df.index))
+        self.assertEqual(metrics.stage_seconds('write')[1], -(-len(analytics_df.index) // 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
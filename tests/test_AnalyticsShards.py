@@ -0,0 +1,115 @@
+import os
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+import sqlalchemy
+
+from src import GasExposureAnalytics
+from src.AnalyticsShards import ShardAssignment, ShardMembership
+from src.AnalyticsStorage import InMemoryStorage, create_storage
+from src.DatabaseFrames import read_frame, select
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+TEST_DATA_CSV_FILEPATH = reference_tests.TEST_DATA_CSV_FILEPATH
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+FIREFIGHTER_ID_COL = 'firefighter_id'
+SHARD_COUNT = 3
+
+# ---------------------------------------
+
+# Unit tests for sharding the firefighters across analytics workers - between them, the shards' results should be the
+# same as analysing everyone at once.
+class AnalyticsShardsTestCase(unittest.TestCase):
+
+    _sensor_log_df = InMemoryStorage.from_csv_files(TEST_DATA_CSV_FILEPATH).sensor_log_df
+    _shards = [ShardAssignment(shard_index, SHARD_COUNT) for shard_index in range(SHARD_COUNT)]
+
+    @classmethod
+    def setUpClass(cls):
+        # Minute keys 11:59 to 12:09, for everyone at once - minute by minute, in one process.
+        single_process = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+        cls._analytics_df = pd.concat([single_process.run_analytics(timestamp, commit=False)
+                                       for timestamp in pd.date_range('2000-01-01 12:00:00', '2000-01-01 12:10:00', freq='min')])
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._url = 'sqlite:///' + os.path.join(self._tmp_dir.name, 'prometeo.db')
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def _run_minute_by_minute(self, analytics, shard) :
+        return pd.concat([analytics.run_analytics(timestamp, commit=False, shard=shard)
+                          for timestamp in pd.date_range('2000-01-01 12:00:00', '2000-01-01 12:10:00', freq='min')])
+
+
+    def test_every_firefighter_is_in_exactly_one_shard(self):
+        firefighter_ids = self._sensor_log_df[FIREFIGHTER_ID_COL].unique()
+        owners = sum(shard.owns(firefighter_ids).astype(int) for shard in self._shards)
+        self.assertTrue((owners == 1).all())
+        self.assertTrue(ShardAssignment(0, 1).owns(firefighter_ids).all())
+
+    def test_shards_add_up_to_everyone(self):
+        for incremental in [False, True] :
+            analytics = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                             incremental=incremental)
+            sharded_df = pd.concat([self._run_minute_by_minute(analytics, shard) for shard in self._shards])
+            pd.testing.assert_frame_equal(sharded_df.sort_index(), self._analytics_df.sort_index())
+
+            shard_df = analytics.run_analytics_range('2000-01-01 12:00:00', '2000-01-01 12:10:00', commit=False,
+                                                     shard=self._shards[0])
+            pd.testing.assert_frame_equal(shard_df, self._shards[0].filter(self._analytics_df).sort_index())
+
+    def test_shards_are_selected_in_the_database(self):
+        storage = create_storage(self._url)
+        storage.write_sensor_log(self._sensor_log_df)
+        for shard in self._shards :
+            sql = (select(sqlalchemy.column(FIREFIGHTER_ID_COL)).distinct()
+                   .select_from(sqlalchemy.table('firefighter_sensor_log'))
+                   .where(shard.sql_condition(storage.db_engine, sqlalchemy.column(FIREFIGHTER_ID_COL))))
+            firefighter_ids = read_frame(storage.db_engine, sql)[FIREFIGHTER_ID_COL]
+            self.assertEqual(sorted(firefighter_ids), sorted(shard.filter(self._sensor_log_df)[FIREFIGHTER_ID_COL].unique()))
+
+        # With each calculation - including the sensor log cache (moving between shards), and adding up the
+        # readings in the database.
+        for engine in [{'incremental' : True, 'cache_sensor_log' : True}, {}, {'aggregate_in_database' : True}] :
+            with self.subTest(**engine) :
+                analytics = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST, storage=storage,
+                                                 **engine)
+                sharded_df = pd.concat([self._run_minute_by_minute(analytics, shard) for shard in self._shards])
+                pd.testing.assert_frame_equal(sharded_df.sort_index(), self._analytics_df.sort_index())
+        storage.close()
+
+    def test_no_sql_condition_without_a_crc32_function(self):
+        self.assertIsNone(self._shards[0].sql_condition(sqlalchemy.create_engine(self._url),
+                                                        sqlalchemy.column(FIREFIGHTER_ID_COL)))
+
+    def test_shards_rebalance_as_workers_join_and_leave(self):
+        db_engine = sqlalchemy.create_engine(self._url)
+        worker_1 = ShardMembership(db_engine, worker_id='worker-1', membership_seconds=0.5)
+        self.assertEqual(worker_1.refresh(), ShardAssignment(0, 1))
+
+        worker_2 = ShardMembership(db_engine, worker_id='worker-2', membership_seconds=0.5)
+        self.assertEqual(worker_2.refresh(), ShardAssignment(1, 2))
+        self.assertEqual(worker_1.refresh(), ShardAssignment(0, 2))
+
+        # worker-1 leaves
+        worker_1.leave()
+        self.assertEqual(worker_2.refresh(), ShardAssignment(0, 1))
+
+        # worker-1 comes back, then dies
+        self.assertEqual(worker_1.refresh(), ShardAssignment(0, 2))
+        time.sleep(0.3)
+        self.assertEqual(worker_2.refresh(), ShardAssignment(1, 2))
+        time.sleep(0.3)
+        self.assertEqual(worker_2.refresh(), ShardAssignment(0, 1))
+        db_engine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
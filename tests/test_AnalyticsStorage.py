@@ -0,0 +1,133 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+import sqlalchemy
+
+from src import GasExposureAnalytics
+from src.AnalyticsStorage import DatabaseStorage, InMemoryStorage, create_storage, STORAGE_URL_ENV_VAR
+from src.DatabaseFrames import read_frame
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+TEST_DATA_CSV_FILEPATH = reference_tests.TEST_DATA_CSV_FILEPATH
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+ANALYTICS_TABLE = 'firefighter_status_analytics'
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+
+try :
+    import duckdb_engine
+    DUCKDB_AVAILABLE = True
+except ImportError :
+    DUCKDB_AVAILABLE = False
+
+# ---------------------------------------
+
+# Unit tests for the storage backends - running the analytics from each of them should give the same results.
+class AnalyticsStorageTestCase(unittest.TestCase):
+
+    # Minute keys 11:59 to 12:09
+    _sensor_log_df = InMemoryStorage.from_csv_files(TEST_DATA_CSV_FILEPATH).sensor_log_df
+    _analytics_df = (GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+                     .run_analytics_range('2000-01-01 12:00:00', '2000-01-01 12:10:00', commit=False))
+
+    def _run_analytics(self, storage) :
+        analytics = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST, storage=storage)
+        analytics.STORAGE.write_sensor_log(self._sensor_log_df)
+        return analytics, analytics.run_analytics_range('2000-01-01 12:00:00', '2000-01-01 12:10:00')
+
+    def _read_analytics(self, db_engine) :
+        analytics_df = read_frame(db_engine, 'SELECT * FROM ' + ANALYTICS_TABLE, parse_dates=[TIMESTAMP_COL],
+                                  index_col=[FIREFIGHTER_ID_COL, TIMESTAMP_COL])
+        return analytics_df.sort_index()
+
+
+    def test_in_memory_storage(self):
+        analytics, analytics_df = self._run_analytics(InMemoryStorage())
+        pd.testing.assert_frame_equal(analytics_df, self._analytics_df)
+        pd.testing.assert_frame_equal(analytics.STORAGE.analytics(), self._analytics_df.sort_index())
+
+        # Writes are upserts.
+        analytics.STORAGE.write(analytics_df.iloc[:3])
+        self.assertEqual(len(analytics.STORAGE.analytics().index), len(self._analytics_df.index))
+
+    def test_embedded_sqlite_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir :
+            url = 'sqlite:///' + os.path.join(tmp_dir, 'prometeo.db')
+            analytics, analytics_df = self._run_analytics(url)
+            self.assertIsInstance(analytics.STORAGE, DatabaseStorage)
+            pd.testing.assert_frame_equal(analytics_df, self._analytics_df)
+            self.assertEqual(len(self._read_analytics(sqlalchemy.create_engine(url)).index), len(analytics_df.index))
+            analytics.STORAGE.close()
+
+    def test_in_memory_sqlite_is_shared_by_every_connection(self):
+        storage = create_storage('sqlite://')
+        _, analytics_df = self._run_analytics(storage)
+        with storage.db_engine.connect() as connection_1, storage.db_engine.connect() as connection_2 :
+            self.assertEqual(len(self._read_analytics(connection_1).index), len(analytics_df.index))
+            self.assertEqual(len(self._read_analytics(connection_2).index), len(analytics_df.index))
+
+    def test_new_database_has_no_sensor_log_yet(self):
+        storage = create_storage('sqlite://')
+        self.assertTrue(storage.read_sensor_log(pd.Timestamp('2000-01-01 12:00:00'),
+                                                pd.Timestamp('2000-01-01 12:10:00')).empty)
+        analytics = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST, storage=storage)
+        self.assertIsNone(analytics.run_analytics('2000-01-01 12:10:00'))
+
+    def test_storage_url_from_the_environment(self):
+        with mock.patch.dict(os.environ, {STORAGE_URL_ENV_VAR : 'memory://'}) :
+            analytics = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+        self.assertIsInstance(analytics.STORAGE, InMemoryStorage)
+
+    def test_csv_files_and_in_memory_storage_need_no_database_settings(self):
+        mariadb_env_vars = [env_var for env_var in os.environ if env_var.startswith('MARIADB_')]
+        with mock.patch.dict(os.environ) :
+            for env_var in mariadb_env_vars :
+                del os.environ[env_var]
+            GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+            GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST, storage='memory://')
+            with self.assertRaisesRegex(ValueError, STORAGE_URL_ENV_VAR) :
+                create_storage()
+
+    def test_reading_just_the_gases(self):
+        gases = ['carbon_monoxide', 'nitrogen_dioxide']
+        block_start, block_end = pd.Timestamp('2000-01-01 11:00:00'), pd.Timestamp('2000-01-01 12:10:00')
+        sqlite_storage = create_storage('sqlite://')
+        sqlite_storage.write_sensor_log(self._sensor_log_df)
+        for storage in [InMemoryStorage(self._sensor_log_df), sqlite_storage] :
+            sensor_log_df = storage.read_sensor_log(block_start, block_end).sort_index(kind='mergesort')
+            readings_df = storage.read_sensor_log(block_start, block_end, gases=gases).sort_index(kind='mergesort')
+            self.assertEqual(readings_df.columns.to_list(), [FIREFIGHTER_ID_COL] + gases)
+            self.assertEqual(readings_df[FIREFIGHTER_ID_COL].dtype, 'category')
+            self.assertTrue((readings_df[gases].dtypes == 'float64').all())
+            pd.testing.assert_index_equal(readings_df.index, sensor_log_df.index)
+            pd.testing.assert_frame_equal(readings_df[gases], sensor_log_df[gases].astype(float))
+            self.assertEqual(readings_df[FIREFIGHTER_ID_COL].to_list(), sensor_log_df[FIREFIGHTER_ID_COL].to_list())
+
+    def test_minute_by_minute_from_sqlite(self):
+        # Only the latest minute is read in full - every other column is still in the results.
+        reference = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+        analytics = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST, storage='sqlite://')
+        analytics.STORAGE.write_sensor_log(self._sensor_log_df)
+        for now in pd.date_range('2000-01-01 12:00:00', '2000-01-01 12:10:00', freq='2min') :
+            expected_df = reference.run_analytics(now, commit=False)
+            actual_df = analytics.run_analytics(now, commit=False)
+            pd.testing.assert_frame_equal(expected_df, actual_df)
+            # (Keyed on plain firefighter IDs, not the categories they're read as.)
+            self.assertEqual(actual_df.index.get_level_values(FIREFIGHTER_ID_COL).dtype, object)
+
+    @unittest.skipUnless(DUCKDB_AVAILABLE, 'needs the duckdb_engine package')
+    def test_embedded_duckdb_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir :
+            analytics, analytics_df = self._run_analytics('duckdb:///' + os.path.join(tmp_dir, 'prometeo.duckdb'))
+            pd.testing.assert_frame_equal(analytics_df, self._analytics_df)
+            analytics.STORAGE.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import pandas as pd
+import sqlalchemy
+
+from src.AnalyticsWriteQueue import (AnalyticsWriteQueue, SPILL_DIRECTORY_ENV_VAR, SPILL_FILE_EXTENSION,
+                                     BAD_SPILL_FILE_EXTENSION)
+from src.AnalyticsCheckpoint import load_frame
+
+# ---------------------------------------
+
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+
+# ---------------------------------------
+
+# Stands in for an AnalyticsWriter - records the frames written, and can be made to block or to fail as if the
+# database were unreachable (or as if the data were bad).
+class FakeWriter(object):
+
+    def __init__(self):
+        self.written = []
+        self.unreachable = False
+        self.bad_data = False
+        self.unblocked = threading.Event()
+        self.unblocked.set()
+
+    def write(self, analytics_df) :
+        self.unblocked.wait()
+        if self.unreachable :
+            raise sqlalchemy.exc.OperationalError('INSERT', {}, Exception("Can't connect to MySQL server"))
+        if self.bad_data :
+            raise sqlalchemy.exc.IntegrityError('INSERT', {}, Exception("Column 'firefighter_id' cannot be null"))
+        self.written.append(analytics_df)
+
+
+# Unit tests for the AnalyticsWriteQueue class.
+class AnalyticsWriteQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._spill_directory = tempfile.mkdtemp()
+        self._writer = FakeWriter()
+
+    def tearDown(self):
+        shutil.rmtree(self._spill_directory)
+
+    def _make_queue(self, **kwargs) :
+        return AnalyticsWriteQueue(self._writer, spill_directory=self._spill_directory, **kwargs)
+
+    def _frame(self, minute) :
+        return pd.DataFrame({'carbon_monoxide_twa_10min' : [float(minute)]},
+                            index=pd.MultiIndex.from_tuples([('0001', pd.Timestamp('2000-01-01 12:00:00')
+                                                              + pd.Timedelta(minutes=minute))],
+                                                            names=[FIREFIGHTER_ID_COL, TIMESTAMP_COL]))
+
+    def _written_minutes(self) :
+        return [int(df.iloc[0, 0]) for df in self._writer.written]
+
+
+    def test_frames_are_written_in_the_background(self):
+        write_queue = self._make_queue()
+        for minute in range(5) :
+            self.assertTrue(write_queue.put(self._frame(minute)))
+        write_queue.close()
+        self.assertEqual(self._written_minutes(), [0, 1, 2, 3, 4])
+
+    def test_full_queue_applies_backpressure_then_spills(self):
+        self._writer.unblocked.clear() # the 'database' is very slow
+        write_queue = self._make_queue(max_size=1, put_timeout=0.1)
+        write_queue.put(self._frame(0))  # being written
+        write_queue.put(self._frame(1))  # waiting
+        self.assertFalse(write_queue.put(self._frame(2))) # no room - waits, then spills
+        self.assertEqual(write_queue.backlog(), 2)
+
+        # Once the database catches up, everything is written - nothing lost, and in order (the spilled frame after
+        # the one that was still queued, and before the next).
+        self._writer.unblocked.set()
+        write_queue.put(self._frame(3))
+        write_queue.close()
+        self.assertEqual(self._written_minutes(), [0, 1, 2, 3])
+
+    def test_frames_spill_while_the_database_is_unreachable_then_replay(self):
+        self._writer.unreachable = True
+        write_queue = self._make_queue(retry_seconds=0.05)
+        for minute in range(3) :
+            write_queue.put(self._frame(minute))
+        write_queue.flush()
+        self.assertEqual(write_queue.backlog(), 3)
+        self.assertEqual(self._writer.written, [])
+
+        # Reconnect - the spill is replayed, in order.
+        self._writer.unreachable = False
+        write_queue.put(self._frame(3))
+        write_queue.close()
+        self.assertEqual(self._written_minutes(), [0, 1, 2, 3])
+        self.assertEqual(write_queue.backlog(), 0)
+
+    def test_spill_survives_a_restart(self):
+        self._writer.unreachable = True
+        write_queue = self._make_queue()
+        write_queue.put(self._frame(0))
+        write_queue.close() # e.g. shutdown while the database is down
+
+        self._writer.unreachable = False
+        restarted_queue = self._make_queue()
+        restarted_queue.close()
+        self.assertEqual(self._written_minutes(), [0])
+        pd.testing.assert_frame_equal(self._writer.written[0], self._frame(0))
+
+    def test_spill_directory_is_configured_by_the_environment(self):
+        with mock.patch.dict(os.environ, {SPILL_DIRECTORY_ENV_VAR : self._spill_directory}) :
+            write_queue = AnalyticsWriteQueue(self._writer)
+        self.assertEqual(write_queue.SPILL_DIRECTORY, self._spill_directory)
+        write_queue.close()
+
+    def test_frames_that_fail_to_write_are_set_aside(self):
+        self._writer.bad_data = True
+        write_queue = self._make_queue()
+        frame_df = self._frame(0).assign(analytics_status_LED=pd.Categorical(['Green']), device_id=[None])
+        write_queue.put(frame_df)
+        write_queue.close()
+
+        # Not retried (so it doesn't hold up the rest), but kept - as data only, without pickle.
+        self.assertEqual(write_queue.backlog(), 0)
+        bad_files = [filename for filename in os.listdir(self._spill_directory)
+                     if filename.endswith(SPILL_FILE_EXTENSION + BAD_SPILL_FILE_EXTENSION)]
+        self.assertEqual(len(bad_files), 1)
+        pd.testing.assert_frame_equal(load_frame(os.path.join(self._spill_directory, bad_files[0])),
+                                      frame_df.astype({'analytics_status_LED' : object}))
+
+
+if __name__ == '__main__':
+    unittest.main()
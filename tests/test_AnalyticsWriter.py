@@ -0,0 +1,81 @@
+import unittest
+
+import pandas as pd
+import sqlalchemy
+from sqlalchemy.dialects import mysql
+
+from src import GasExposureAnalytics
+from src.AnalyticsWriter import AnalyticsWriter
+from src.DatabaseFrames import read_frame, write_frame
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+TEST_DATA_CSV_FILEPATH = reference_tests.TEST_DATA_CSV_FILEPATH
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+ANALYTICS_TABLE = 'firefighter_status_analytics'
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+CARBON_MONOXIDE_TWA_COL = 'carbon_monoxide_twa_10min'
+
+# ---------------------------------------
+
+# Unit tests for the AnalyticsWriter class, using an in-memory SQLite database in place of MariaDB.
+class AnalyticsWriterTestCase(unittest.TestCase):
+
+    _analytics = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+    _analytics_df = _analytics.run_analytics_range('2000-01-01 12:00:00', '2000-01-01 12:10:00', commit=False)
+
+    def setUp(self):
+        self._db_engine = sqlalchemy.create_engine('sqlite://')
+
+    def _read_analytics_table(self) :
+        return read_frame(self._db_engine, 'SELECT * FROM ' + ANALYTICS_TABLE, parse_dates=[TIMESTAMP_COL])
+
+
+    def test_writes_in_batches(self):
+        rows = len(self._analytics_df.index)
+        writer = AnalyticsWriter(self._db_engine, batch_size=7)
+        self.assertEqual(writer.write(self._analytics_df), rows)
+
+        self.assertEqual(len(self._read_analytics_table().index), rows)
+        self.assertEqual(sum(batch_rows for batch_rows, _ in writer.batch_latencies), rows)
+        self.assertEqual(len(writer.batch_latencies), -(-rows // 7))
+        self.assertTrue(all(batch_rows <= 7 for batch_rows, _ in writer.batch_latencies))
+
+    def test_values_match_the_analytics(self):
+        AnalyticsWriter(self._db_engine).write(self._analytics_df)
+        written_df = self._read_analytics_table().set_index([FIREFIGHTER_ID_COL, TIMESTAMP_COL]).sort_index()
+        expected_df = self._analytics_df.sort_index()
+        pd.testing.assert_series_equal(expected_df[CARBON_MONOXIDE_TWA_COL], written_df[CARBON_MONOXIDE_TWA_COL])
+
+    def test_rewriting_a_minute_replaces_its_rows(self):
+        writer = AnalyticsWriter(self._db_engine)
+        writer.write(self._analytics_df)
+
+        # Retry the last minute, with changed results
+        last_minute_df = self._analytics_df.loc[self._analytics_df.index.get_level_values(TIMESTAMP_COL)
+                                                == self._analytics_df.index.get_level_values(TIMESTAMP_COL).max()].copy()
+        last_minute_df[CARBON_MONOXIDE_TWA_COL] = 123.4
+        writer.write(last_minute_df)
+
+        written_df = self._read_analytics_table()
+        self.assertEqual(len(written_df.index), len(self._analytics_df.index))
+        self.assertEqual((written_df[CARBON_MONOXIDE_TWA_COL] == 123.4).sum(), len(last_minute_df.index))
+
+    def test_warns_if_the_table_has_no_unique_key(self):
+        write_frame(self._analytics_df.head(0), ANALYTICS_TABLE, self._db_engine)
+        with self.assertLogs(level='WARNING') as logs :
+            AnalyticsWriter(self._db_engine).write(self._analytics_df)
+        self.assertIn('no unique key', logs.output[0])
+
+    def test_mariadb_writes_are_upserts(self):
+        mariadb_engine = sqlalchemy.create_engine('mysql+pymysql://', strategy='mock', executor=lambda *args, **kwargs : None)
+        statement = AnalyticsWriter(mariadb_engine)._upsert_statement([FIREFIGHTER_ID_COL, TIMESTAMP_COL, CARBON_MONOXIDE_TWA_COL])
+        self.assertIn('ON DUPLICATE KEY UPDATE %s = VALUES(%s)' % (CARBON_MONOXIDE_TWA_COL, CARBON_MONOXIDE_TWA_COL),
+                      str(statement.compile(dialect=mysql.dialect())))
+
+
+if __name__ == '__main__':
+    unittest.main()
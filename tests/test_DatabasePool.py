@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import sqlalchemy
+
+from src import GasExposureAnalytics
+from src.AnalyticsMetrics import AnalyticsMetrics
+from src.AnalyticsStorage import DatabaseStorage
+from src.DatabasePool import (create_db_engine, pool_settings_from_env, pool_status, POOL_SIZE_ENV_VAR,
+                              POOL_PRE_PING_ENV_VAR, POOL_TIMEOUT_ENV_VAR, DEFAULT_MAX_OVERFLOW)
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+# ---------------------------------------
+
+# Unit tests for the shared database connection pool (an SQLite file stands in for the MariaDB server).
+class DatabasePoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._url = 'sqlite:///' + os.path.join(self._tmp_dir.name, 'prometeo.db')
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+
+    def test_settings_from_the_environment(self):
+        with mock.patch.dict(os.environ, {POOL_SIZE_ENV_VAR : '20', POOL_PRE_PING_ENV_VAR : 'false',
+                                          POOL_TIMEOUT_ENV_VAR : ''}) :
+            settings = pool_settings_from_env()
+        self.assertEqual(settings['pool_size'], 20)
+        self.assertFalse(settings['pool_pre_ping'])
+        self.assertEqual(settings['max_overflow'], DEFAULT_MAX_OVERFLOW)
+        self.assertGreater(settings['pool_timeout'], 0)
+
+    def test_pool_usage_is_recorded(self):
+        metrics = AnalyticsMetrics()
+        db_engine = create_db_engine(self._url, metrics=metrics, pool_size=2, max_overflow=1, pool_timeout=0.1)
+        connections = [db_engine.connect() for _ in range(3)]
+        self.assertEqual(pool_status(db_engine), {'db_pool_size' : 2, 'db_pool_checked_out' : 3,
+                                                  'db_pool_checked_in' : 0, 'db_pool_overflow' : 1})
+        with self.assertRaises(sqlalchemy.exc.TimeoutError) :
+            db_engine.connect()
+        for connection in connections :
+            connection.close()
+
+        self.assertEqual(pool_status(db_engine)['db_pool_checked_out'], 0)
+        self.assertEqual(metrics.value('db_pool_checkouts_total'), 3)
+        self.assertEqual(metrics.value('db_pool_timeouts_total'), 1)
+        self.assertGreaterEqual(metrics.value('db_pool_wait_seconds_total'), 0.1)
+        db_engine.dispose()
+
+    def test_pool_is_exported_with_the_analytics_metrics(self):
+        analytics = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                         storage=DatabaseStorage(create_db_engine(self._url)))
+        with analytics.STORAGE.db_engine.connect() :
+            lines = analytics.metrics_text().splitlines()
+        self.assertIn('prometeo_analytics_db_pool_checked_out 1.0', lines)
+        self.assertIsNone(pool_status(None))
+        analytics.STORAGE.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
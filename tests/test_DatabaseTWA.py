@@ -0,0 +1,79 @@
+import unittest
+
+import pandas as pd
+
+from src import GasExposureAnalytics
+from src.AnalyticsStorage import InMemoryStorage, create_storage
+from src.AnalyticsShards import ShardAssignment
+from benchmarks.SyntheticIncident import SyntheticIncident, ARRIVAL_DELAY_COL
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+TEST_DATA_CSV_FILEPATH = reference_tests.TEST_DATA_CSV_FILEPATH
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+TIMESTAMP_COL = 'timestamp_mins'
+
+# ---------------------------------------
+
+# The analytics, with the given sensor log in an in-memory SQLite database (by default, added up in the database).
+def _analytics_in_sqlite(sensor_log_df, aggregate_in_database=True) :
+    analytics = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                     storage=create_storage('sqlite://'), aggregate_in_database=aggregate_in_database)
+    analytics.STORAGE.write_sensor_log(sensor_log_df)
+    return analytics
+
+
+# Re-run every GasExposureAnalytics test (known results for the burn test dataset) with the readings added up in the
+# database.
+class DatabaseGasExposureAnalyticsTestCase(reference_tests.GasExposureAnalyticsTestCase):
+
+    _analytics_test = _analytics_in_sqlite(InMemoryStorage.from_csv_files(TEST_DATA_CSV_FILEPATH).sensor_log_df)
+
+
+# Unit tests for the DatabaseTWA class.
+class DatabaseTWATestCase(unittest.TestCase):
+
+    # Check that running analytics minute-by-minute from the database's sums gives exactly the same results as the
+    # pandas reference implementation.
+    def _check_minutes_match_reference(self, sensor_log_df, minutes, shard=None) :
+        reference = _analytics_in_sqlite(sensor_log_df, aggregate_in_database=False)
+        in_database = _analytics_in_sqlite(sensor_log_df)
+        self.assertIsNotNone(in_database._DATABASE_TWA)
+        for now in minutes :
+            expected_df = reference.run_analytics(now, commit=False, shard=shard)
+            actual_df = in_database.run_analytics(now, commit=False, shard=shard)
+            if expected_df is None :
+                self.assertIsNone(actual_df)
+            else :
+                pd.testing.assert_frame_equal(expected_df.sort_index(), actual_df.sort_index(), check_categorical=False)
+
+    def test_matches_reference_during_dropouts_and_range_exceeded(self):
+        sensor_log_df = InMemoryStorage.from_csv_files(TEST_DATA_CSV_FILEPATH).sensor_log_df
+        self._check_minutes_match_reference(sensor_log_df,
+                                            pd.date_range('2000-01-01 11:50:00', '2000-01-01 12:05:00', freq='min'))
+
+    def test_matches_reference_for_a_synthetic_incident(self):
+        # Dropouts of every length fill (or don't fill) minutes on both sides of the gaps.
+        incident = SyntheticIncident(20, 60, dropout_rate=0.3, range_exceeded_rate=0.02, seed=5)
+        sensor_log_df = incident.sensor_log().drop(columns=[ARRIVAL_DELAY_COL]).set_index(TIMESTAMP_COL).sort_index()
+        first_minute, last_minute = incident.time_span()
+        self._check_minutes_match_reference(sensor_log_df, pd.date_range(first_minute, last_minute + pd.Timedelta(minutes=20),
+                                                                         freq='3min'))
+
+    def test_matches_reference_for_a_shard(self):
+        incident = SyntheticIncident(10, 20, dropout_rate=0.1, seed=6)
+        sensor_log_df = incident.sensor_log().drop(columns=[ARRIVAL_DELAY_COL]).set_index(TIMESTAMP_COL).sort_index()
+        first_minute, last_minute = incident.time_span()
+        self._check_minutes_match_reference(sensor_log_df, [last_minute], shard=ShardAssignment(1, 3))
+
+    def test_storage_without_a_database_reads_the_sensor_log(self):
+        analytics = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                         aggregate_in_database=True)
+        self.assertIsNone(analytics._DATABASE_TWA)
+        self.assertIsNotNone(analytics.run_analytics(pd.Timestamp('2000-01-01 12:00:00'), commit=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
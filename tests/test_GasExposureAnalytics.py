@@ -8,6 +8,7 @@ from dotenv import load_dotenv
 
 import src
 from src import GasExposureAnalytics
+from src.AnalyticsStorage import InMemoryStorage
 
 # ---------------------------------------
 
@@ -498,6 +499,197 @@ class GasExposureAnalyticsTestCase(unittest.TestCase):
                                                      expected_values=[21.0, 67.0, 76.0, 102.0, 50.0], expected_status=RED)
 
 
+# Unit tests for GasExposureAnalytics.run_analytics_range - which should give exactly the same results as
+# run_analytics, called once per minute.
+class RunAnalyticsRangeTestCase(unittest.TestCase):
+
+    def _check_range_matches_minute_by_minute(self, start_str, end_str, engines=[{}]) :
+
+        minute_by_minute = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+        results = [minute_by_minute.run_analytics(now, commit=False) for now in pd.date_range(start_str, end_str, freq='min')]
+        expected_df = pd.concat([df for df in results if df is not None])
+        next_minute = pd.Timestamp(end_str) + pd.Timedelta(minutes=1)
+        expected_next_minute_df = minute_by_minute.run_analytics(next_minute, commit=False)
+
+        for engine in engines :
+            with self.subTest(**engine) :
+                in_one_pass = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH,
+                                                   config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST, **engine)
+                actual_df = in_one_pass.run_analytics_range(start_str, end_str, commit=False)
+                pd.testing.assert_frame_equal(expected_df.sort_index(), actual_df.sort_index(), check_categorical=False)
+
+                # ... and leaves the analytics in the same state, ready for the next minute.
+                pd.testing.assert_frame_equal(expected_next_minute_df.sort_index(),
+                                              in_one_pass.run_analytics(next_minute, commit=False).sort_index(),
+                                              check_categorical=False)
+
+    def test_range_from_before_the_first_sensor_records(self):
+        self._check_range_matches_minute_by_minute('2000-01-01 09:20:00', '2000-01-01 10:00:00')
+
+    def test_range_during_dropouts_and_range_exceeded(self):
+        self._check_range_matches_minute_by_minute('2000-01-01 11:50:00', '2000-01-01 12:20:00',
+                                                   engines=[{'incremental' : True}])
+
+    def test_range_with_every_engine(self):
+        # (an hour with TWAs right on a rounding boundary in most minutes)
+        self._check_range_matches_minute_by_minute('2000-01-01 12:20:00', '2000-01-01 13:20:00',
+                                                   engines=[{}, {'incremental' : True}, {'parallel_workers' : 2}])
+
+    def test_range_with_no_sensor_records(self):
+        analytics = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+        self.assertIsNone(analytics.run_analytics_range('2000-01-01 08:00:00', '2000-01-01 09:00:00', commit=False))
+
+
+# Unit tests for GasExposureAnalytics.run_analytics_catching_up - missed minutes should be caught up on in one pass,
+# with the same results as if they had never been missed.
+class CatchingUpTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        minute_by_minute = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+        cls._expected_df = pd.concat([minute_by_minute.run_analytics(now, commit=False)
+                                      for now in pd.date_range('2000-01-01 11:30:00', '2000-01-01 11:55:00', freq='min')])
+
+    def _catching_up(self, incremental=True) :
+        return GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                    incremental=incremental, cache_sensor_log=True)
+
+    def _check_minutes_match_expected(self, actual_df, first_minute_str, last_minute_str) :
+        minutes = pd.date_range(first_minute_str, last_minute_str, freq='min')
+        self.assertEqual(sorted(actual_df.index.get_level_values(TIMESTAMP_COL).unique()), list(minutes))
+        pd.testing.assert_frame_equal(self._expected_df.loc[actual_df.index].sort_index(), actual_df.sort_index())
+
+    def test_missed_minutes_are_caught_up_on_in_one_pass(self):
+        analytics = self._catching_up()
+        for now in pd.date_range('2000-01-01 11:30:00', '2000-01-01 11:40:00', freq='min') :
+            self._check_minutes_match_expected(analytics.run_analytics_catching_up(now, commit=False),
+                                               now - pd.Timedelta(minutes=1), now - pd.Timedelta(minutes=1))
+
+        # The runs due at 11:41 to 11:45 are missed (e.g. the last one overran).
+        with self.assertLogs(level='INFO') as logs :
+            actual_df = analytics.run_analytics_catching_up('2000-01-01 11:46:00', commit=False)
+        self.assertIn('Catching up on 5 missed minute(s)', '\n'.join(logs.output))
+        self._check_minutes_match_expected(actual_df, '2000-01-01 11:40:00', '2000-01-01 11:45:00')
+        self.assertEqual(analytics.METRICS.value('caught_up_minutes_total'), 5)
+
+        # ... and then carries on as usual.
+        self._check_minutes_match_expected(analytics.run_analytics_catching_up('2000-01-01 11:47:00', commit=False),
+                                           '2000-01-01 11:46:00', '2000-01-01 11:46:00')
+
+    def test_only_the_latest_missed_minutes_are_caught_up_on(self):
+        analytics = self._catching_up()
+        analytics.run_analytics_catching_up('2000-01-01 11:30:00', commit=False)
+        with self.assertLogs(level='WARNING') as logs :
+            actual_df = analytics.run_analytics_catching_up('2000-01-01 11:50:00', commit=False, max_missed_mins=5)
+        self.assertIn('19 minutes missed', '\n'.join(logs.output))
+        self._check_minutes_match_expected(actual_df, '2000-01-01 11:44:00', '2000-01-01 11:49:00')
+        self.assertEqual(analytics.METRICS.value('missed_minutes_total'), 19)
+        self.assertEqual(analytics.METRICS.value('caught_up_minutes_total'), 5)
+
+    def test_caught_up_minutes_match_the_live_ones_with_the_pandas_calculation(self):
+        analytics = self._catching_up(incremental=False)
+        analytics.run_analytics_catching_up('2000-01-01 11:30:00', commit=False)
+        self._check_minutes_match_expected(analytics.run_analytics_catching_up('2000-01-01 11:55:00', commit=False),
+                                           '2000-01-01 11:30:00', '2000-01-01 11:54:00')
+
+
+
+# Unit tests for recomputing results when sensor records arrive late (e.g. from a device that was disconnected).
+class LateArrivalsTestCase(unittest.TestCase):
+
+    LATE_FIREFIGHTER = '0001'
+    LATE_MINUTES = ('2000-01-01 11:30:00', '2000-01-01 11:35:00')
+
+    def test_late_records_correct_only_the_results_they_affect(self):
+
+        # The results with all the sensor records on time.
+        on_time = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                       status_cache_mins=60)
+        on_time.run_analytics_range('2000-01-01 11:30:00', '2000-01-01 11:42:00', commit=False)
+
+        # Hold back a few minutes of one firefighter's records, then let them arrive (at key 11:41).
+        all_records_df = on_time.STORAGE.sensor_log_df
+        held_back = ((all_records_df[FIREFIGHTER_ID_COL] == self.LATE_FIREFIGHTER)
+                     & (all_records_df.index >= self.LATE_MINUTES[0]) & (all_records_df.index <= self.LATE_MINUTES[1]))
+        self.assertTrue(held_back.any())
+        late = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST, status_cache_mins=60,
+                                    recompute_late_arrivals=True, storage=InMemoryStorage(all_records_df.loc[~held_back, :]))
+        for now in pd.date_range('2000-01-01 11:30:00', '2000-01-01 11:41:00', freq='min') :
+            late.run_analytics(now, commit=False)
+
+        minutes = pd.date_range('2000-01-01 11:29:00', '2000-01-01 11:40:00', freq='min')
+        different = lambda firefighter : [minute for minute in minutes
+                                          if late.STATUS_CACHE.get(firefighter, minute) != on_time.STATUS_CACHE.get(firefighter, minute)]
+        self.assertTrue(different(self.LATE_FIREFIGHTER))
+
+        late.STORAGE.write_sensor_log(all_records_df.loc[held_back, :])
+        with self.assertLogs(level='INFO') as logs :
+            late.run_analytics('2000-01-01 11:42:00', commit=False)
+
+        # Every result for the late firefighter from the first late minute onwards is recomputed (and now matches),
+        # and nobody else's.
+        self.assertIn('Recomputed %s analytic results' % (len(pd.date_range(self.LATE_MINUTES[0], '2000-01-01 11:40:00', freq='min'))),
+                      '\n'.join(logs.output))
+        for firefighter in all_records_df[FIREFIGHTER_ID_COL].unique() :
+            self.assertEqual(different(firefighter), [], firefighter)
+        self.assertEqual(late.STATUS_CACHE.get(self.LATE_FIREFIGHTER, '2000-01-01 11:41:00'),
+                         on_time.STATUS_CACHE.get(self.LATE_FIREFIGHTER, '2000-01-01 11:41:00'))
+
+    def test_recomputed_results_match_the_configured_calculation(self):
+
+        for engine in [{}, {'incremental' : True}] :
+            with self.subTest(**engine) :
+                on_time = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH,
+                                               config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST, **engine)
+                expected_df = pd.concat([on_time.run_analytics(now, commit=False)
+                                         for now in pd.date_range('2000-01-01 11:30:00', '2000-01-01 11:41:00', freq='min')])
+
+                all_records_df = on_time.STORAGE.sensor_log_df
+                held_back = ((all_records_df[FIREFIGHTER_ID_COL] == self.LATE_FIREFIGHTER)
+                             & (all_records_df.index >= self.LATE_MINUTES[0]) & (all_records_df.index <= self.LATE_MINUTES[1]))
+                late = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST, recompute_late_arrivals=True,
+                                            storage=InMemoryStorage(all_records_df.loc[~held_back, :]), **engine)
+                for now in pd.date_range('2000-01-01 11:30:00', '2000-01-01 11:41:00', freq='min') :
+                    late.run_analytics(now, commit=False)
+
+                # The recomputed results (published after the minute's own) are exactly the on-time ones.
+                published = []
+                late._publish = lambda analytics_df, commit : published.append(analytics_df)
+                late.STORAGE.write_sensor_log(all_records_df.loc[held_back, :])
+                late.run_analytics('2000-01-01 11:42:00', commit=False)
+                recomputed_df = published[-1]
+                self.assertFalse(recomputed_df.empty)
+                pd.testing.assert_frame_equal(expected_df.loc[recomputed_df.index].sort_index(), recomputed_df.sort_index())
+
+    def test_no_recompute_without_late_records(self):
+        analytics = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                         recompute_late_arrivals=True)
+        with self.assertLogs(level='INFO') as logs :
+            for now in pd.date_range('2000-01-01 11:30:00', '2000-01-01 11:35:00', freq='min') :
+                analytics.run_analytics(now, commit=False)
+        self.assertNotIn('Late sensor records', '\n'.join(logs.output))
+
+
+
+# Unit tests for running the analytics on storage that has no sensor records yet (e.g. a fresh in-memory store, before
+# the first records arrive) - there are no results, rather than an error, until there are records.
+class EmptyStorageTestCase(unittest.TestCase):
+
+    def test_no_results_from_an_empty_store(self):
+        sensor_log_df = InMemoryStorage.from_csv_files(TEST_DATA_CSV_FILEPATH).sensor_log_df
+        for engine in [{}, {'incremental' : True, 'recompute_late_arrivals' : True}, {'cache_sensor_log' : True},
+                       {'parallel_workers' : 2}] :
+            with self.subTest(**engine) :
+                analytics = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                                 storage=InMemoryStorage(), **engine)
+                self.assertIsNone(analytics.run_analytics('2000-01-01 09:30:00', commit=False))
+                self.assertIsNone(analytics.run_analytics_range('2000-01-01 09:31:00', '2000-01-01 09:35:00', commit=False))
+                self.assertIsNone(analytics.run_analytics_catching_up('2000-01-01 09:37:00', commit=False))
+
+                # ... and once the records arrive, there are.
+                analytics.STORAGE.write_sensor_log(sensor_log_df)
+                self.assertFalse(analytics.run_analytics('2000-01-01 10:30:00', commit=False).empty)
+                analytics.close()
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+
+import pandas as pd
+import numpy as np
+
+from src import GasExposureAnalytics
+from src.IncrementalTWA import IncrementalTWA
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+TEST_DATA_CSV_FILEPATH = reference_tests.TEST_DATA_CSV_FILEPATH
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+# ---------------------------------------
+
+# Re-run every GasExposureAnalytics test (known results for the burn test dataset) with incremental TWAs.
+class IncrementalGasExposureAnalyticsTestCase(reference_tests.GasExposureAnalyticsTestCase):
+
+    _analytics_test = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                           incremental=True)
+
+
+# Unit tests for the IncrementalTWA class.
+class IncrementalTWATestCase(unittest.TestCase):
+
+    # Check that running analytics minute-by-minute gives exactly the same results as the pandas reference
+    # implementation, including when the running sums are moved on (not just rebuilt).
+    def _check_consecutive_minutes_match_reference(self, start_str, end_str, freq='min') :
+
+        reference = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+        incremental = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                           incremental=True)
+        for now in pd.date_range(start_str, end_str, freq=freq) :
+            expected_df = reference.run_analytics(now, commit=False)
+            actual_df = incremental.run_analytics(now, commit=False)
+            if expected_df is None :
+                self.assertIsNone(actual_df)
+            else :
+                pd.testing.assert_frame_equal(expected_df.sort_index(), actual_df.sort_index(), check_categorical=False)
+
+    def test_matches_reference_during_dropouts_and_range_exceeded(self):
+        # Connection dropouts for several firefighters, plus an out-of-range sensor for '0006'
+        self._check_consecutive_minutes_match_reference('2000-01-01 11:50:00', '2000-01-01 12:20:00')
+
+    def test_matches_reference_as_first_readings_leave_the_longest_window(self):
+        # The first readings of the day (09:32) drop out of the 8hr window at 17:32
+        self._check_consecutive_minutes_match_reference('2000-01-01 17:25:00', '2000-01-01 17:40:00')
+
+
+    def test_matches_reference_when_catching_up_on_skipped_minutes(self):
+        # e.g. after missed runs - the running sums are moved on over the minutes in between, not rebuilt
+        with self.assertLogs(level='INFO') as logs :
+            self._check_consecutive_minutes_match_reference('2000-01-01 11:50:00', '2000-01-01 12:40:00', freq='7min')
+        self.assertEqual(sum('Rebuilding incremental' in line for line in logs.output), 1)
+
+    def test_restored_state_carries_on_the_same(self):
+        running_sums = IncrementalTWA([2, 5], 2)
+        running_sums.rebuild(10, ['a', 'b', 'a'], [6, 9, 10], [[1.0, 0.1], [2.0, -1], [3.0, 0.3]])
+        restored = IncrementalTWA([2, 5], 2)
+        restored.restore(running_sums.state())
+        for running in [running_sums, restored] :
+            running.add_minute(11, ['b', 'c'], [[4.0, 0.4], [5.0, 0.5]])
+        for expected, actual in zip(running_sums.window_averages(), restored.window_averages()) :
+            np.testing.assert_array_equal(expected, actual)
+        self.assertEqual(running_sums.raw_readings_count, restored.raw_readings_count)
+
+    def test_averages_match_pandas_resampling_with_random_gaps(self):
+        # Compare against the 1-min quantization that the pandas reference uses - .resample().nearest(limit=1)
+        # - with random gaps in the data, so that the gap-filling rules get a thorough workout.
+        rng = np.random.RandomState(42)
+        window_mins = [3, 7, 20]
+        minutes = np.arange(100)
+        readings_df = pd.concat([pd.DataFrame({'ff' : ff, 'minute' : minutes[rng.rand(minutes.size) < 0.6],})
+                                 for ff in ['a', 'b', 'c']])
+        readings_df['gas'] = rng.randint(0, 50, len(readings_df.index)) / 10.0
+        readings_df.loc[rng.rand(len(readings_df.index)) < 0.05, 'gas'] = np.nan
+        readings_df = readings_df.set_index(pd.to_datetime(readings_df['minute'], unit='m')).sort_index()
+
+        running_sums = IncrementalTWA(window_mins, 1)
+        running_sums.rebuild(-1, [], [], np.empty((0, 1)))
+        for minute in minutes :
+            this_minute_df = readings_df[readings_df['minute'] == minute]
+            running_sums.add_minute(minute, this_minute_df['ff'].to_numpy(), this_minute_df[['gas']].to_numpy())
+            ff_ids, averages, in_window = running_sums.window_averages()
+
+            key = pd.to_datetime(minute, unit='m')
+            longest_df = readings_df.loc[key - pd.Timedelta(minutes=max(window_mins) - 1):key, ['ff', 'gas']]
+            if longest_df.empty :
+                self.assertFalse(in_window.any())
+                continue
+            resampled_df = (longest_df.groupby(longest_df['ff'].to_numpy(), group_keys=False)
+                            .resample('1min').nearest(limit=1).sort_index())
+            for window_idx, mins in enumerate(window_mins) :
+                expected = (resampled_df.loc[key - pd.Timedelta(minutes=mins - 1):key]
+                            .groupby('ff')['gas'].mean())
+                actual = pd.Series(averages[in_window[:, window_idx], window_idx, 0],
+                                   index=ff_ids[in_window[:, window_idx]])
+                pd.testing.assert_series_equal(expected.sort_index(), actual.sort_index(),
+                                               check_names=False, check_index_type=False)
+
+
+    def test_range_exceeded_readings_make_the_average_infinite(self):
+        running_sums = IncrementalTWA([2], 1)
+        running_sums.rebuild(0, ['a'], [0], [[1.0]])
+        running_sums.add_minute(1, ['a'], [[np.inf]])
+        self.assertEqual(running_sums.window_averages()[1][0, 0, 0], np.inf)
+        # ... and finite again once the out-of-range reading has left the window (inf - inf would be NaN)
+        running_sums.add_minute(2, ['a'], [[2.0]])
+        running_sums.add_minute(3, ['a'], [[4.0]])
+        self.assertEqual(running_sums.window_averages()[1][0, 0, 0], 3.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+
+import pandas as pd
+
+from src import GasExposureAnalytics
+from src.AnalyticsStorage import InMemoryStorage
+from src.ParallelTWA import ParallelTWA
+from benchmarks.SyntheticIncident import SyntheticIncident, ARRIVAL_DELAY_COL
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+TEST_DATA_CSV_FILEPATH = reference_tests.TEST_DATA_CSV_FILEPATH
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+
+# ---------------------------------------
+
+# Re-run every GasExposureAnalytics test (known results for the burn test dataset) with the time-weighted averages
+# calculated in worker processes.
+class ParallelGasExposureAnalyticsTestCase(reference_tests.GasExposureAnalyticsTestCase):
+
+    _analytics_test = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                           parallel_workers=3)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._analytics_test.close()
+
+
+# Unit tests for the ParallelTWA class.
+class ParallelTWATestCase(unittest.TestCase):
+
+    # Check that running analytics minute-by-minute in parallel gives exactly the same results as the pandas reference
+    # implementation.
+    def _check_minutes_match_reference(self, parallel, reference, minutes) :
+        for now in minutes :
+            expected_df = reference.run_analytics(now, commit=False)
+            actual_df = parallel.run_analytics(now, commit=False)
+            if expected_df is None :
+                self.assertIsNone(actual_df)
+            else :
+                pd.testing.assert_frame_equal(expected_df, actual_df)
+
+    def test_matches_reference_during_dropouts_and_range_exceeded(self):
+        reference = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+        parallel = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                        parallel_workers=4)
+        try :
+            self._check_minutes_match_reference(parallel, reference,
+                                                pd.date_range('2000-01-01 11:50:00', '2000-01-01 12:05:00', freq='min'))
+        finally :
+            parallel.close()
+
+    def test_matches_reference_for_a_synthetic_incident(self):
+        # More firefighters than workers, with dropouts and out-of-range sensors.
+        incident = SyntheticIncident(23, 40, dropout_rate=0.2, range_exceeded_rate=0.05, seed=3)
+        sensor_log_df = incident.sensor_log().drop(columns=[ARRIVAL_DELAY_COL]).set_index(TIMESTAMP_COL).sort_index()
+        reference = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                         storage=InMemoryStorage(sensor_log_df))
+        parallel = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                        storage=InMemoryStorage(sensor_log_df), parallel_workers=3)
+        first_minute, last_minute = incident.time_span()
+        try :
+            self._check_minutes_match_reference(parallel, reference,
+                                                pd.date_range(first_minute, last_minute, freq='7min'))
+        finally :
+            parallel.close()
+
+    def test_one_firefighter_is_averaged_without_the_pool(self):
+        readings_df = pd.DataFrame({FIREFIGHTER_ID_COL : ['a', 'a'], 'gas' : [1.0, 2.0]},
+                                   index=pd.DatetimeIndex(['2000-01-01 00:00', '2000-01-01 00:01'], name=TIMESTAMP_COL))
+        parallel_twa = ParallelTWA(2)
+        averages = parallel_twa.window_averages(readings_df, ['gas'], [1, 5], pd.Timestamp('2000-01-01 00:01'))
+        self.assertIsNone(parallel_twa._pool)
+        self.assertEqual(averages[0].loc['a', 'gas'], 2.0)
+        self.assertEqual(averages[1].loc['a', 'gas'], 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
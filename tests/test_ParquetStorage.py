@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from src import GasExposureAnalytics
+from src.AnalyticsStorage import InMemoryStorage, create_storage
+from src.ParquetStorage import ParquetStorage, csv_to_parquet, pyarrow
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+TEST_DATA_CSV_FILEPATH = reference_tests.TEST_DATA_CSV_FILEPATH
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+FIREFIGHTER_ID_COL = 'firefighter_id'
+
+# ---------------------------------------
+
+# Unit tests for the ParquetStorage class - running the analytics from Parquet should give the same results as from CSV.
+@unittest.skipIf(pyarrow is None, 'needs the pyarrow package')
+class ParquetStorageTestCase(unittest.TestCase):
+
+    # Minute keys 11:59 to 12:09
+    _analytics_df = (GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+                     .run_analytics_range('2000-01-01 12:00:00', '2000-01-01 12:10:00', commit=False))
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._parquet_dir = os.path.join(self._tmp_dir.name, 'sensor_log')
+        # Small row groups, so that there are some to skip.
+        csv_to_parquet(TEST_DATA_CSV_FILEPATH, self._parquet_dir, row_group_rows=100)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def _run_analytics(self, storage) :
+        analytics = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST, storage=storage)
+        return analytics.run_analytics_range('2000-01-01 12:00:00', '2000-01-01 12:10:00', commit=False)
+
+
+    def test_same_results_as_csv(self):
+        pd.testing.assert_frame_equal(self._run_analytics(ParquetStorage(self._parquet_dir, columns=None)),
+                                      self._analytics_df)
+
+    def test_reads_only_the_columns_the_analytics_need(self):
+        analytics_df = self._run_analytics(create_storage('parquet://' + self._parquet_dir))
+        self.assertNotIn('temperature', analytics_df.columns)
+        pd.testing.assert_frame_equal(analytics_df, self._analytics_df[analytics_df.columns])
+
+    def test_time_range_and_firefighter_filters(self):
+        csv_df = InMemoryStorage.from_csv_files(TEST_DATA_CSV_FILEPATH).sensor_log_df
+        block_start, block_end = pd.Timestamp('2000-01-01 11:00:00'), pd.Timestamp('2000-01-01 11:30:00')
+        firefighter_ids = csv_df[FIREFIGHTER_ID_COL].unique()[:2]
+
+        storage = ParquetStorage(self._parquet_dir, columns=None)
+        sensor_log_df = storage.read_sensor_log(block_start, block_end, firefighter_ids)
+        expected_df = csv_df.loc[block_start:block_end, :]
+        expected_df = expected_df.loc[expected_df[FIREFIGHTER_ID_COL].isin(firefighter_ids), :]
+        pd.testing.assert_frame_equal(sensor_log_df.sort_index(kind='mergesort'), expected_df, check_index_type=False)
+        self.assertTrue(storage.read_sensor_log(pd.Timestamp('1999-01-01'), pd.Timestamp('1999-01-02')).empty)
+
+    def test_new_records_are_added_as_files(self):
+        csv_df = InMemoryStorage.from_csv_files(TEST_DATA_CSV_FILEPATH).sensor_log_df
+        storage = ParquetStorage(os.path.join(self._tmp_dir.name, 'new'), columns=None)
+        self.assertTrue(storage.read_sensor_log(pd.Timestamp('2000-01-01 12:00:00'),
+                                                pd.Timestamp('2000-01-01 12:10:00')).empty)
+        storage.write_sensor_log(csv_df.loc[:'2000-01-01 11:00:00', :])
+        storage.write_sensor_log(csv_df.loc['2000-01-01 11:00:01':, :])
+        pd.testing.assert_frame_equal(self._run_analytics(storage), self._analytics_df)
+        storage.write(self._analytics_df)
+        self.assertEqual(len(storage.analytics().index), len(self._analytics_df.index))
+
+
+if __name__ == '__main__':
+    unittest.main()
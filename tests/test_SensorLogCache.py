@@ -0,0 +1,108 @@
+import os
+import unittest
+
+import pandas as pd
+import sqlalchemy
+
+from src import GasExposureAnalytics
+from src.AnalyticsStorage import create_storage
+from src.DatabaseFrames import read_frame, write_frame
+from src.SensorLogCache import SensorLogCache
+
+# ---------------------------------------
+
+# DATASET FOR TESTING
+TEST_DIR = os.path.dirname(__file__)
+TEST_DATA_CSV_FILEPATH = os.path.join(TEST_DIR, 'GasExposureAnalytics_test_dataset.csv')
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = os.path.join(TEST_DIR, 'GasExposureAnalytics_test_config.json')
+
+# FIELD / COLUMN / VALUE NAMES
+SENSOR_LOG_TABLE = 'firefighter_sensor_log'
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+
+# ---------------------------------------
+
+# Unit tests for the SensorLogCache class, using an in-memory SQLite database in place of MariaDB.
+class SensorLogCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._sensor_log_df = pd.read_csv(TEST_DATA_CSV_FILEPATH, engine='python', dtype={FIREFIGHTER_ID_COL : str},
+                                          parse_dates=[TIMESTAMP_COL], index_col=TIMESTAMP_COL)
+        self._db_engine = sqlalchemy.create_engine('sqlite://')
+        write_frame(self._sensor_log_df, SENSOR_LOG_TABLE, self._db_engine)
+
+        # Record what the cache reads from the sensor log, so we can check it only reads what it has to.
+        self._cache = SensorLogCache(self._db_engine)
+        self._records_read = []
+        read_sensor_log = self._cache._read_sensor_log
+        def recording_read_sensor_log(condition) :
+            records_df = read_sensor_log(condition)
+            self._records_read.append(len(records_df.index))
+            return records_df
+        self._cache._read_sensor_log = recording_read_sensor_log
+
+    # Read from the cache - and check it matches a direct read of the same block.
+    def _check_block(self, block_start_str, block_end_str) :
+        block_start, block_end = pd.Timestamp(block_start_str), pd.Timestamp(block_end_str)
+        cached_df = self._cache.get_block_of_sensor_readings(block_start, block_end)
+
+        expected_df = (read_frame(self._db_engine, 'SELECT * FROM ' + SENSOR_LOG_TABLE, parse_dates=[TIMESTAMP_COL],
+                                  index_col=TIMESTAMP_COL)
+                       .sort_index().loc[block_start:block_end, :])
+        sort_by = [TIMESTAMP_COL, FIREFIGHTER_ID_COL]
+        pd.testing.assert_frame_equal(expected_df.reset_index().sort_values(sort_by).reset_index(drop=True),
+                                      cached_df.reset_index().sort_values(sort_by).reset_index(drop=True))
+        return cached_df
+
+
+    def test_only_new_minutes_are_read_after_the_first_block(self):
+        self._check_block('2000-01-01 10:00:00', '2000-01-01 11:00:00')
+        self._check_block('2000-01-01 10:01:00', '2000-01-01 11:01:00')
+        self._check_block('2000-01-01 10:02:00', '2000-01-01 11:02:00')
+
+        # One full read, then just the records for each new minute.
+        records_per_minute = lambda minute_str : len(self._sensor_log_df.loc[[pd.Timestamp(minute_str)]].index)
+        self.assertEqual(self._records_read[1:], [records_per_minute('2000-01-01 11:01:00'),
+                                                  records_per_minute('2000-01-01 11:02:00')])
+
+    def test_late_arrivals_are_read(self):
+        self._check_block('2000-01-01 10:00:00', '2000-01-01 11:00:00')
+
+        # A disconnected device catches up, long after the minute it recorded (and another reconnects on time).
+        late_records_df = pd.DataFrame({FIREFIGHTER_ID_COL : ['late_1', 'late_1', 'on_time'],
+                                        'carbon_monoxide' : [1.0, 2.0, 3.0], 'nitrogen_dioxide' : [0.1, 0.2, 0.3]},
+                                       index=pd.DatetimeIndex(['2000-01-01 10:15:00', '2000-01-01 10:16:00',
+                                                               '2000-01-01 11:01:00'], name=TIMESTAMP_COL))
+        write_frame(late_records_df, SENSOR_LOG_TABLE, self._db_engine, if_exists='append')
+
+        cached_df = self._check_block('2000-01-01 10:01:00', '2000-01-01 11:01:00')
+        self.assertEqual(cached_df[FIREFIGHTER_ID_COL].isin(['late_1', 'on_time']).sum(), 3)
+
+    def test_old_minutes_are_evicted(self):
+        self._check_block('2000-01-01 10:00:00', '2000-01-01 11:00:00')
+        self._check_block('2000-01-01 10:30:00', '2000-01-01 11:30:00')
+        self.assertGreaterEqual(self._cache._sensor_log_df.index.min(), pd.Timestamp('2000-01-01 10:30:00'))
+
+    def test_block_starting_before_the_cache_is_read_in_full(self):
+        self._check_block('2000-01-01 10:00:00', '2000-01-01 11:00:00')
+        self._check_block('2000-01-01 09:00:00', '2000-01-01 10:00:00')
+        self.assertEqual(len(self._records_read), 2)
+
+    def test_fresh_embedded_database_with_no_sensor_log_yet(self):
+        # The analytics (with the cache) on a new SQLite database have nothing to read until the first records arrive
+        # - and then read them, as without the cache.
+        cached = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                      storage=create_storage('sqlite://'), cache_sensor_log=True)
+        self.assertIsNone(cached.run_analytics('2000-01-01 10:59:00', commit=False))
+        self.assertIsNone(cached.run_analytics('2000-01-01 11:00:00', commit=False))
+
+        cached.STORAGE.write_sensor_log(self._sensor_log_df)
+        uncached = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                        storage=cached.STORAGE)
+        pd.testing.assert_frame_equal(uncached.run_analytics('2000-01-01 11:01:00', commit=False),
+                                      cached.run_analytics('2000-01-01 11:01:00', commit=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
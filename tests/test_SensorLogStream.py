@@ -0,0 +1,100 @@
+import json
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from src import GasExposureAnalytics
+from src.AnalyticsStorage import InMemoryStorage
+from src.ParquetStorage import csv_to_parquet, pyarrow
+from src.SensorLogStream import SensorLogStream
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+TEST_DATA_CSV_FILEPATH = reference_tests.TEST_DATA_CSV_FILEPATH
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+TIMESTAMP_COL = 'timestamp_mins'
+SHORTEST_WINDOWS_MINS = 30
+# Stream the first hour of the test data (to keep the tests quick).
+LAST_MINUTE = pd.Timestamp('2000-01-01 10:31:00')
+
+# ---------------------------------------
+
+# Unit tests for the SensorLogStream class - streaming should give the same results as reading everything up-front.
+class SensorLogStreamTestCase(unittest.TestCase):
+
+    _sensor_log_df = InMemoryStorage.from_csv_files(TEST_DATA_CSV_FILEPATH).sensor_log_df.loc[:LAST_MINUTE, :]
+    _one_minute = pd.Timedelta(minutes = 1)
+    _analytics_df = (GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                          storage=InMemoryStorage(_sensor_log_df))
+                     .run_analytics_range(_sensor_log_df.index[0] + _one_minute, LAST_MINUTE + _one_minute, commit=False)
+                     .sort_index())
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._csv_filepath = os.path.join(self._tmp_dir.name, 'sensor_log.csv')
+        self._sensor_log_df.to_csv(self._csv_filepath)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def _stream_analytics(self, stream, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST) :
+        analytics = GasExposureAnalytics(config_filename=config_filename, incremental=True, storage=stream)
+        return pd.concat(list(analytics.stream_analytics())).sort_index()
+
+
+    def test_same_results_as_reading_everything(self):
+        pd.testing.assert_frame_equal(self._stream_analytics(SensorLogStream(self._csv_filepath, chunk_rows=50)),
+                                      self._analytics_df)
+
+    def test_memory_is_bounded_by_the_longest_window(self):
+        # Only the shorter windows, so that the test data is longer than the longest window.
+        with open(ANALYTIC_CONFIGURATION_FOR_THIS_TEST) as file :
+            configuration = json.load(file)
+        configuration['windows_and_limits'] = [window for window in configuration['windows_and_limits']
+                                               if window['mins'] <= SHORTEST_WINDOWS_MINS]
+        config_filename = os.path.join(self._tmp_dir.name, 'config.json')
+        with open(config_filename, 'w') as file :
+            json.dump(configuration, file)
+
+        stream = SensorLogStream(self._csv_filepath, chunk_rows=50)
+        analytics = GasExposureAnalytics(config_filename=config_filename, incremental=True, storage=stream)
+        most_records_in_window = (self._sensor_log_df.index.to_series().groupby(self._sensor_log_df.index).size()
+                                  .rolling(SHORTEST_WINDOWS_MINS + 1, min_periods=1).sum().max())
+        minutes = 0
+        for _ in analytics.stream_analytics() :
+            self.assertLessEqual(stream.buffered_records(), most_records_in_window + stream.CHUNK_ROWS)
+            minutes += 1
+        self.assertLess(most_records_in_window + stream.CHUNK_ROWS, len(self._sensor_log_df.index))
+        self.assertGreater(minutes, SHORTEST_WINDOWS_MINS)
+
+    def test_files_in_time_order(self):
+        first_half_csv = os.path.join(self._tmp_dir.name, 'first_half.csv')
+        second_half_csv = os.path.join(self._tmp_dir.name, 'second_half.csv')
+        middle = self._sensor_log_df.index[len(self._sensor_log_df.index) // 2]
+        self._sensor_log_df.loc[:middle, :].to_csv(first_half_csv)
+        self._sensor_log_df.loc[middle + self._one_minute:, :].to_csv(second_half_csv)
+
+        pd.testing.assert_frame_equal(self._stream_analytics(SensorLogStream([first_half_csv, second_half_csv])),
+                                      self._analytics_df)
+        with self.assertRaisesRegex(ValueError, 'time order') :
+            self._stream_analytics(SensorLogStream([second_half_csv, first_half_csv]))
+
+    def test_reads_can_only_move_forwards(self):
+        stream = SensorLogStream(self._csv_filepath)
+        stream.read_sensor_log(pd.Timestamp('2000-01-01 11:00:00'), pd.Timestamp('2000-01-01 12:00:00'))
+        with self.assertRaises(ValueError) :
+            stream.read_sensor_log(pd.Timestamp('2000-01-01 10:00:00'), pd.Timestamp('2000-01-01 12:01:00'))
+
+    @unittest.skipIf(pyarrow is None, 'needs the pyarrow package')
+    def test_parquet_files(self):
+        parquet_files = csv_to_parquet(self._csv_filepath, os.path.join(self._tmp_dir.name, 'parquet'), row_group_rows=100)
+        pd.testing.assert_frame_equal(self._stream_analytics(SensorLogStream(parquet_files, chunk_rows=50)),
+                                      self._analytics_df, check_index_type=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
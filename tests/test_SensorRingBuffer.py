@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+
+from src.SensorRingBuffer import SensorRingBuffer
+
+
+# Unit tests for the SensorRingBuffer class.
+class SensorRingBufferTestCase(unittest.TestCase):
+
+    def test_memory_cost_per_firefighter_is_fixed(self):
+        ring = SensorRingBuffer(480, 2)
+        self.assertEqual(ring.bytes_per_firefighter(), 480 * (8 * 2 + 1))
+
+        # Adding lots of firefighters only grows storage in bulk, and keeps what's already stored.
+        ring.move_to(0)
+        ring.add_readings([0], ['ff_0'], [[1.0, 2.0]])
+        ring.add_readings(np.zeros(100), ['ff_%s' % ff for ff in range(100)], np.ones((100, 2)))
+        self.assertGreaterEqual(ring.capacity, 100)
+        self.assertEqual(ring.values.nbytes + ring.valid.nbytes, ring.capacity * ring.bytes_per_firefighter())
+        self.assertEqual(ring.readings_count, 100)
+
+    def test_range_exceeded_readings_are_stored_as_inf(self):
+        ring = SensorRingBuffer(5, 2)
+        ring.move_to(10)
+        ring.add_readings([9, 10], ['a', 'a'], [[-1.0, 2.0], [3.0, np.nan]])
+        averages, has_readings = ring.window_averages(2)
+        np.testing.assert_array_equal(averages, [[np.inf, 2.0]])
+        self.assertTrue(has_readings[0])
+
+    def test_window_averages_and_latest_readings(self):
+        ring = SensorRingBuffer(4, 1)
+        ring.move_to(0)
+        ring.add_readings([0, 0], ['a', 'b'], [[1.0], [10.0]])
+        for minute, value in [(1, 2.0), (2, 3.0), (3, 4.0), (4, 5.0)] :
+            ring.move_to(minute)
+            ring.add_readings([minute], ['a'], [[value]])
+
+        # Minute 0 has left the ring - so 'b' has nothing left, and 'a' has minutes 1 to 4.
+        averages, has_readings = ring.window_averages(4)
+        np.testing.assert_array_equal(averages[:, 0], [3.5, np.nan])
+        np.testing.assert_array_equal(has_readings, [True, False])
+        np.testing.assert_array_equal(ring.window_averages(2)[0][:, 0], [4.5, np.nan])
+        self.assertEqual(ring.readings_count, 4)
+
+        ff_ids, values = ring.latest_readings()
+        self.assertEqual(list(ff_ids), ['a'])
+        np.testing.assert_array_equal(values, [[5.0]])
+
+    def test_moving_on_past_the_whole_ring_clears_it(self):
+        ring = SensorRingBuffer(3, 1)
+        ring.move_to(0)
+        ring.add_readings([0], ['a'], [[1.0]])
+        ring.move_to(100)
+        self.assertEqual(ring.readings_count, 0)
+        self.assertFalse(ring.valid.any())
+        self.assertEqual(len(ring.latest_readings()[0]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
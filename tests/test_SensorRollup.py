@@ -0,0 +1,149 @@
+import unittest
+
+import pandas as pd
+import sqlalchemy
+
+from src import GasExposureAnalytics
+from src.AnalyticsStorage import InMemoryStorage, create_storage
+from src.AnalyticsShards import ShardAssignment
+from src.DatabaseFrames import read_frame
+from src.SensorRollup import SensorRollup, ROLLUP_TABLE, DEFAULT_BUCKET_MINS
+from benchmarks.SyntheticIncident import SyntheticIncident, ARRIVAL_DELAY_COL, SUPPORTED_GASES
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+TEST_DATA_CSV_FILEPATH = reference_tests.TEST_DATA_CSV_FILEPATH
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+TIMESTAMP_COL = 'timestamp_mins'
+FIREFIGHTER_ID_COL = 'firefighter_id'
+
+# ---------------------------------------
+
+# The analytics, with the given sensor log in an in-memory SQLite database (by default, added up from the rollup - which
+# is migrated into the database, unless 'migrate' is False).
+def _analytics_in_sqlite(sensor_log_df, rollup_sensor_log=True, aggregate_in_database=False, migrate=True) :
+    analytics = GasExposureAnalytics(config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                     storage=create_storage('sqlite://'), rollup_sensor_log=rollup_sensor_log,
+                                     aggregate_in_database=aggregate_in_database)
+    analytics.STORAGE.write_sensor_log(sensor_log_df)
+    if rollup_sensor_log and migrate :
+        analytics._DATABASE_TWA.migrate()
+    return analytics
+
+
+# A synthetic incident's sensor log (sorted by time).
+def _synthetic_sensor_log(incident) :
+    return incident.sensor_log().drop(columns=[ARRIVAL_DELAY_COL]).set_index(TIMESTAMP_COL).sort_index()
+
+
+# Re-run every GasExposureAnalytics test (known results for the burn test dataset) with the readings added up from the
+# rollup.
+class RollupGasExposureAnalyticsTestCase(reference_tests.GasExposureAnalyticsTestCase):
+
+    _analytics_test = _analytics_in_sqlite(InMemoryStorage.from_csv_files(TEST_DATA_CSV_FILEPATH).sensor_log_df)
+
+
+# Unit tests for the SensorRollup class.
+class SensorRollupTestCase(unittest.TestCase):
+
+    # Check that running analytics minute-by-minute from the rollup gives exactly the same results as the pandas
+    # reference implementation.
+    def _check_minutes_match_reference(self, reference, from_rollup, minutes, shard=None) :
+        self.assertIsInstance(from_rollup._DATABASE_TWA, SensorRollup)
+        for now in minutes :
+            expected_df = reference.run_analytics(now, commit=False, shard=shard)
+            actual_df = from_rollup.run_analytics(now, commit=False, shard=shard)
+            if expected_df is None :
+                self.assertIsNone(actual_df)
+            else :
+                pd.testing.assert_frame_equal(expected_df.sort_index(), actual_df.sort_index(), check_categorical=False)
+
+    def test_matches_reference_during_dropouts_and_range_exceeded(self):
+        sensor_log_df = InMemoryStorage.from_csv_files(TEST_DATA_CSV_FILEPATH).sensor_log_df
+        self._check_minutes_match_reference(_analytics_in_sqlite(sensor_log_df, rollup_sensor_log=False),
+                                            _analytics_in_sqlite(sensor_log_df),
+                                            pd.date_range('2000-01-01 11:50:00', '2000-01-01 12:05:00', freq='min'))
+
+    def test_matches_reference_for_a_synthetic_incident(self):
+        # Dropouts of every length, inside buckets and across their edges.
+        incident = SyntheticIncident(20, 90, dropout_rate=0.15, range_exceeded_rate=0.01, seed=7)
+        sensor_log_df = _synthetic_sensor_log(incident)
+        first_minute, last_minute = incident.time_span()
+        self._check_minutes_match_reference(_analytics_in_sqlite(sensor_log_df, rollup_sensor_log=False),
+                                            _analytics_in_sqlite(sensor_log_df),
+                                            pd.date_range(first_minute, last_minute + pd.Timedelta(minutes=20),
+                                                          freq='4min'))
+
+    def test_trigger_adds_new_records_to_the_rollup(self):
+        # The rollup is migrated (and filled) part way through the incident - later records arrive through the trigger.
+        incident = SyntheticIncident(8, 60, dropout_rate=0.1, range_exceeded_rate=0.01, seed=8)
+        sensor_log_df = _synthetic_sensor_log(incident)
+        first_minute, last_minute = incident.time_span()
+        halfway = first_minute + (last_minute - first_minute) / 2
+        reference = _analytics_in_sqlite(sensor_log_df.loc[:halfway], rollup_sensor_log=False)
+        from_rollup = _analytics_in_sqlite(sensor_log_df.loc[:halfway])
+        self._check_minutes_match_reference(reference, from_rollup, [halfway.floor('min')])
+        later_records_df = sensor_log_df.loc[halfway:].iloc[1:]
+        reference.STORAGE.write_sensor_log(later_records_df)
+        from_rollup.STORAGE.write_sensor_log(later_records_df)
+        self._check_minutes_match_reference(reference, from_rollup, pd.date_range(halfway.floor('min'), last_minute,
+                                                                                  freq='5min'))
+
+        # Rebuilding it from the sensor log gives the same rollup.
+        rollup_sql = sqlalchemy.text('SELECT * FROM %s ORDER BY 1, 2' % (ROLLUP_TABLE))
+        maintained_df = read_frame(from_rollup.STORAGE.db_engine, rollup_sql)
+        from_rollup._DATABASE_TWA.rebuild()
+        pd.testing.assert_frame_equal(maintained_df, read_frame(from_rollup.STORAGE.db_engine, rollup_sql))
+
+    def test_matches_reference_for_a_shard(self):
+        sensor_log_df = _synthetic_sensor_log(SyntheticIncident(10, 40, dropout_rate=0.1, seed=6))
+        last_minute = sensor_log_df.index.max().floor('min')
+        self._check_minutes_match_reference(_analytics_in_sqlite(sensor_log_df, rollup_sensor_log=False),
+                                            _analytics_in_sqlite(sensor_log_df), [last_minute],
+                                            shard=ShardAssignment(1, 3))
+
+    def test_readings_are_added_up_until_the_rollup_is_migrated(self):
+        sensor_log_df = _synthetic_sensor_log(SyntheticIncident(6, 40, dropout_rate=0.1, seed=5))
+        last_minute = sensor_log_df.index.max().floor('min')
+        reference = _analytics_in_sqlite(sensor_log_df, rollup_sensor_log=False)
+        from_rollup = _analytics_in_sqlite(sensor_log_df, migrate=False)
+
+        # Nothing is added to the database without the migration.
+        with self.assertLogs(from_rollup._DATABASE_TWA.logger, level='WARNING') :
+            self._check_minutes_match_reference(reference, from_rollup, [last_minute - pd.Timedelta(minutes=5)])
+        self.assertNotIn(ROLLUP_TABLE, sqlalchemy.inspect(from_rollup.STORAGE.db_engine).get_table_names())
+        with self.assertRaises(ValueError) :
+            from_rollup._DATABASE_TWA.rebuild()
+
+        # Then the rollup is used from the next minute on. The migration only runs once.
+        self.assertTrue(from_rollup._DATABASE_TWA.migrate())
+        self.assertFalse(from_rollup._DATABASE_TWA.migrate())
+        self._check_minutes_match_reference(reference, from_rollup, [last_minute])
+        self.assertTrue(from_rollup._DATABASE_TWA._rollup_ready)
+
+    def test_duplicate_minutes_match_the_database_calculation(self):
+        # A reading every minute, except that in some buckets one minute's reading is missing and another minute has
+        # two - so they have a reading for every minute of the bucket bar one. And a few more duplicates, in the minute
+        # of a missing reading.
+        sensor_log_df = _synthetic_sensor_log(SyntheticIncident(6, 60, dropout_rate=0, seed=4))
+        minutes = sensor_log_df.index.floor('min')
+        missing = (minutes.minute % 20 == 3) & (sensor_log_df[FIREFIGHTER_ID_COL] != sensor_log_df[FIREFIGHTER_ID_COL].min())
+        duplicates_df = sensor_log_df.loc[minutes.minute % 20 == 7].copy()
+        duplicates_df[SUPPORTED_GASES] *= 1.5
+        sensor_log_df = pd.concat([sensor_log_df.loc[~missing], duplicates_df]).sort_index(kind='mergesort')
+        self.assertTrue(sensor_log_df.reset_index()
+                        .assign(minute=lambda df : df[TIMESTAMP_COL].dt.floor('min'))
+                        .duplicated([FIREFIGHTER_ID_COL, 'minute']).any())
+
+        first_minute = sensor_log_df.index.min().floor('min')
+        last_minute = sensor_log_df.index.max().floor('min')
+        reference = _analytics_in_sqlite(sensor_log_df, rollup_sensor_log=False, aggregate_in_database=True)
+        self._check_minutes_match_reference(reference, _analytics_in_sqlite(sensor_log_df),
+                                            pd.date_range(first_minute + pd.Timedelta(minutes=DEFAULT_BUCKET_MINS),
+                                                          last_minute, freq='7min'))
+
+
+if __name__ == '__main__':
+    unittest.main()
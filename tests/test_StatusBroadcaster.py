@@ -0,0 +1,125 @@
+import json
+import unittest
+
+import pandas as pd
+
+from src import GasExposureAnalytics
+from src.StatusBroadcaster import StatusBroadcaster
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+TEST_DATA_CSV_FILEPATH = reference_tests.TEST_DATA_CSV_FILEPATH
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+STATUS_LED_COL = 'analytics_status_LED'
+
+# ---------------------------------------
+
+# Unit tests for the StatusBroadcaster class - reading its streams as a local client would.
+class StatusBroadcasterTestCase(unittest.TestCase):
+
+    # Minute keys 11:59 to 12:09
+    _analytics_df = (GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+                     .run_analytics_range('2000-01-01 12:00:00', '2000-01-01 12:10:00', commit=False))
+
+    def _minute_df(self, timestamp) :
+        return self._analytics_df.loc[self._analytics_df.index.get_level_values(TIMESTAMP_COL) == pd.Timestamp(timestamp)]
+
+    # Parse a Server-Sent Event into its event name and data.
+    def _parse_event(self, message) :
+        fields = dict(line.split(': ', 1) for line in message.strip('\n').split('\n'))
+        return fields['event'], json.loads(fields['data'])
+
+    def _firefighter_ids(self, statuses) :
+        return [status[FIREFIGHTER_ID_COL] for status in statuses]
+
+    # A timestamp as the broadcaster encodes it (which depends on the pandas version).
+    def _iso_timestamp(self, timestamp) :
+        return json.loads(pd.Series([pd.Timestamp(timestamp)]).to_json(orient='records', date_format='iso'))[0]
+
+
+    def test_new_subscribers_get_the_latest_statuses_first(self):
+        broadcaster = StatusBroadcaster()
+        broadcaster.publish(self._minute_df('2000-01-01 12:00:00'))
+        event, statuses = self._parse_event(next(broadcaster.stream()))
+        self.assertEqual(event, 'status')
+        minute_df = self._minute_df('2000-01-01 12:00:00')
+        self.assertEqual(self._firefighter_ids(statuses), sorted(minute_df.index.get_level_values(FIREFIGHTER_ID_COL)))
+        self.assertEqual(statuses[0]['status'], str(minute_df.loc[(statuses[0][FIREFIGHTER_ID_COL], slice(None)),
+                                                                  STATUS_LED_COL].iloc[0]))
+
+    def test_only_changed_statuses_are_pushed(self):
+        broadcaster = StatusBroadcaster()
+        stream = broadcaster.stream()
+        broadcaster.publish(self._minute_df('2000-01-01 12:00:00'))
+        next(stream) # every firefighter is new
+
+        # Change one firefighter's status, and keep the rest.
+        next_minute_df = (self._minute_df('2000-01-01 12:00:00').reset_index()
+                          .assign(**{TIMESTAMP_COL : pd.Timestamp('2000-01-01 12:01:00')})
+                          .set_index([FIREFIGHTER_ID_COL, TIMESTAMP_COL]))
+        changed_firefighter_id = next_minute_df.index[0][0]
+        next_minute_df[STATUS_LED_COL] = next_minute_df[STATUS_LED_COL].astype(object)
+        next_minute_df.loc[next_minute_df.index[0], STATUS_LED_COL] = 99
+        broadcaster.publish(next_minute_df)
+        broadcaster.publish(next_minute_df) # no changes - nothing pushed
+
+        _, statuses = self._parse_event(next(stream))
+        self.assertEqual(statuses, [{FIREFIGHTER_ID_COL : changed_firefighter_id,
+                                     TIMESTAMP_COL : self._iso_timestamp('2000-01-01 12:01:00'), 'status' : '99'}])
+        broadcaster.close()
+        self.assertEqual(list(stream), [])
+
+    def test_corrected_earlier_minutes_are_not_pushed(self):
+        broadcaster = StatusBroadcaster()
+        broadcaster.publish(self._minute_df('2000-01-01 12:01:00'))
+        stream = broadcaster.stream()
+        _, latest_statuses = self._parse_event(next(stream))
+
+        # A recomputed result for the minute before doesn't replace the latest status.
+        earlier_minute_df = self._minute_df('2000-01-01 12:00:00').copy()
+        earlier_minute_df[STATUS_LED_COL] = 99
+        broadcaster.publish(earlier_minute_df)
+        broadcaster.close()
+        self.assertEqual(list(stream), [])
+        _, statuses = self._parse_event(next(broadcaster.stream()))
+        self.assertEqual(statuses, latest_statuses)
+
+    def test_a_range_of_minutes_is_pushed_minute_by_minute(self):
+        broadcaster = StatusBroadcaster()
+        stream = broadcaster.stream()
+        broadcaster.publish(self._analytics_df)
+        broadcaster.close()
+        minutes = [self._parse_event(message)[1][0][TIMESTAMP_COL] for message in stream]
+        self.assertEqual(minutes, sorted(set(minutes)))
+        self.assertEqual(minutes[0], self._iso_timestamp('2000-01-01 11:59:00'))
+
+    def test_keepalive_while_idle(self):
+        broadcaster = StatusBroadcaster(keepalive_seconds=0.01)
+        self.assertEqual(next(broadcaster.stream()), ': keepalive\n\n')
+
+    def test_slow_subscribers_are_disconnected(self):
+        broadcaster = StatusBroadcaster(max_queued_messages=2)
+        slow_stream = broadcaster.stream()
+        for timestamp in pd.date_range('2000-01-01 11:59:00', '2000-01-01 12:09:00', freq='min') :
+            minute_df = self._minute_df(timestamp).copy()
+            minute_df[STATUS_LED_COL] = timestamp.minute + 100 # a change every minute
+            broadcaster.publish(minute_df)
+        self.assertEqual(broadcaster.subscribers(), 0)
+        self.assertEqual(len(list(slow_stream)), 2) # what was queued, then the end of the stream
+
+    def test_closing_a_stream_unsubscribes(self):
+        broadcaster = StatusBroadcaster()
+        stream = broadcaster.stream()
+        self.assertEqual(broadcaster.subscribers(), 1)
+        broadcaster.publish(self._minute_df('2000-01-01 12:00:00'))
+        next(stream)
+        stream.close() # e.g. the client went away
+        self.assertEqual(broadcaster.subscribers(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+
+import pandas as pd
+
+from src import GasExposureAnalytics
+from src.StatusCache import StatusCache
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+TEST_DATA_CSV_FILEPATH = reference_tests.TEST_DATA_CSV_FILEPATH
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+STATUS_LED_COL = 'analytics_status_LED'
+CARBON_MONOXIDE_TWA_COL = 'carbon_monoxide_twa_10min'
+
+# ---------------------------------------
+
+# Unit tests for the StatusCache class, and for GasExposureAnalytics publishing its results into one.
+class StatusCacheTestCase(unittest.TestCase):
+
+    _analytics_df = (GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+                     .run_analytics_range('2000-01-01 12:00:00', '2000-01-01 12:10:00', commit=False))
+
+    def _minute_df(self, timestamp) :
+        return self._analytics_df.loc[self._analytics_df.index.get_level_values(TIMESTAMP_COL) == timestamp]
+
+
+    def test_records_match_the_analytics(self):
+        cache = StatusCache()
+        cache.publish(self._analytics_df)
+        self.assertEqual(len(cache), len(self._analytics_df.index))
+
+        (firefighter_id, timestamp), row = next(self._analytics_df.iterrows())
+        record = cache.get(firefighter_id, timestamp.isoformat())
+        self.assertEqual(record[FIREFIGHTER_ID_COL], firefighter_id)
+        # UTC, with or without a time zone (depending on the pandas version that encoded it).
+        record_timestamp = pd.Timestamp(record[TIMESTAMP_COL])
+        if record_timestamp.tzinfo is not None :
+            record_timestamp = record_timestamp.tz_convert(None)
+        self.assertEqual(record_timestamp, timestamp)
+        self.assertEqual(record[CARBON_MONOXIDE_TWA_COL], row[CARBON_MONOXIDE_TWA_COL])
+        self.assertEqual(record[STATUS_LED_COL], str(row[STATUS_LED_COL])) # text, as in the database
+
+    def test_lookups_accept_query_string_timestamps(self):
+        cache = StatusCache()
+        cache.publish(self._analytics_df)
+        firefighter_id, _ = self._analytics_df.index[0]
+        for timestamp_mins in ['2000-01-01 12:05:00', '2000-01-01T12:05:00', '2000-01-01T12:05:00.000Z'] :
+            self.assertIsNotNone(cache.get(firefighter_id, timestamp_mins), timestamp_mins)
+        self.assertIsNone(cache.get(firefighter_id, 'not a timestamp'))
+        self.assertIsNone(cache.get('no such firefighter', '2000-01-01 12:05:00'))
+        self.assertEqual(cache.misses, 2)
+
+    def test_keeps_the_last_n_minutes_per_firefighter(self):
+        cache = StatusCache(retention_mins=3)
+        for timestamp in pd.date_range('2000-01-01 11:59:00', '2000-01-01 12:09:00', freq='min') :
+            cache.publish(self._minute_df(timestamp))
+
+        firefighter_id, _ = self._analytics_df.index[0]
+        self.assertEqual(cache.minutes(firefighter_id),
+                         list(pd.date_range('2000-01-01 12:07:00', '2000-01-01 12:09:00', freq='min')))
+        self.assertIsNone(cache.get(firefighter_id, '2000-01-01 12:06:00'))
+
+    def test_forgets_firefighters_who_have_left(self):
+        cache = StatusCache(retention_mins=3)
+        first_minute_df = self._minute_df(pd.Timestamp('2000-01-01 11:59:00'))
+        leaver = first_minute_df.index[0][0]
+        cache.publish(first_minute_df)
+        last_minute_df = self._minute_df(pd.Timestamp('2000-01-01 12:09:00'))
+        cache.publish(last_minute_df.loc[last_minute_df.index.get_level_values(FIREFIGHTER_ID_COL) != leaver])
+        self.assertEqual(cache.minutes(leaver), [])
+        self.assertIsNone(cache.get(leaver, '2000-01-01 11:59:00'))
+
+    def test_publishing_returns_the_new_and_changed_results(self):
+        cache = StatusCache()
+        minute_df = self._minute_df(pd.Timestamp('2000-01-01 12:00:00'))
+        pd.testing.assert_frame_equal(cache.publish(minute_df), minute_df)
+        self.assertTrue(cache.publish(minute_df).empty)
+
+        recomputed_df = minute_df.copy()
+        recomputed_df.loc[recomputed_df.index[0], CARBON_MONOXIDE_TWA_COL] += 1
+        pd.testing.assert_frame_equal(cache.publish(recomputed_df), recomputed_df.iloc[[0]])
+        self.assertEqual(cache.oldest_minute(), pd.Timestamp('2000-01-01 12:00:00'))
+
+    def test_covers_incomplete_minutes_once_a_later_minute_is_published(self):
+        cache = StatusCache()
+        minutes = pd.date_range('2000-01-01 12:00:00', '2000-01-01 12:02:00', freq='min')
+        cache.publish(self._minute_df(minutes[0]))
+        self.assertTrue(cache.covers(minutes[0], minutes[0]))
+
+        # e.g. the results read from the database so far, while some are still being written.
+        cache.publish(self._minute_df(minutes[1]).iloc[:2], complete=False)
+        self.assertFalse(cache.covers(minutes[0], minutes[1]))
+        cache.publish(self._minute_df(minutes[2]), complete=False)
+        self.assertTrue(cache.covers(minutes[0], minutes[1]))
+        self.assertFalse(cache.covers(minutes[2], minutes[2]))
+
+    def test_analytics_publish_each_minute(self):
+        analytics = GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST,
+                                         status_cache_mins=5)
+        analytics_df = analytics.run_analytics('2000-01-01 12:11:00', commit=False)
+        firefighter_id, timestamp = analytics_df.index[0]
+        self.assertEqual(analytics.STATUS_CACHE.get(firefighter_id, timestamp)[CARBON_MONOXIDE_TWA_COL],
+                         analytics_df.loc[(firefighter_id, timestamp), CARBON_MONOXIDE_TWA_COL])
+
+
+if __name__ == '__main__':
+    unittest.main()
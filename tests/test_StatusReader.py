@@ -0,0 +1,147 @@
+import json
+import unittest
+
+import pandas as pd
+import sqlalchemy
+
+from src import GasExposureAnalytics
+from src.AnalyticsWriter import AnalyticsWriter
+from src.DatabaseFrames import write_frame
+from src.StatusCache import StatusCache
+from src.StatusReader import StatusReader
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+TEST_DATA_CSV_FILEPATH = reference_tests.TEST_DATA_CSV_FILEPATH
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+CARBON_MONOXIDE_TWA_COL = 'carbon_monoxide_twa_10min'
+
+# ---------------------------------------
+
+# Unit tests for the StatusReader class, using an in-memory SQLite database in place of MariaDB.
+class StatusReaderTestCase(unittest.TestCase):
+
+    # Minute keys 11:59 to 12:09
+    _analytics_df = (GasExposureAnalytics(TEST_DATA_CSV_FILEPATH, config_filename=ANALYTIC_CONFIGURATION_FOR_THIS_TEST)
+                     .run_analytics_range('2000-01-01 12:00:00', '2000-01-01 12:10:00', commit=False))
+    _firefighter_ids = sorted(_analytics_df.index.get_level_values(FIREFIGHTER_ID_COL).unique())
+
+    def setUp(self):
+        self._db_engine = sqlalchemy.create_engine('sqlite://')
+        AnalyticsWriter(self._db_engine).write(self._analytics_df)
+        self._status_cache = StatusCache()
+        self._status_cache.publish(self._analytics_df)
+
+    def _read(self, status_reader, *args, **kwargs) :
+        return json.loads(''.join(status_reader.stream_json(*args, **kwargs)))
+
+    # (firefighter_id, timestamp) of each record - the timestamps are UTC, with or without a time zone (depending on the
+    # pandas version that encoded them), as StatusReader accepts them.
+    def _keys(self, records) :
+        return [(record[FIREFIGHTER_ID_COL], StatusReader(self._db_engine)._parse_timestamp(record[TIMESTAMP_COL]))
+                for record in records]
+
+
+    def test_cache_and_database_give_the_same_results(self):
+        for details in [False, True] :
+            from_db = self._read(StatusReader(self._db_engine), self._firefighter_ids[:2],
+                                 '2000-01-01 12:01:00', '2000-01-01 12:05:00', details)
+            from_cache = self._read(StatusReader(self._db_engine, self._status_cache), self._firefighter_ids[:2],
+                                    '2000-01-01 12:01:00', '2000-01-01 12:05:00', details)
+            self.assertEqual(len(from_db), 2 * 5)
+            self.assertEqual(from_db, from_cache)
+        self.assertIn(CARBON_MONOXIDE_TWA_COL, from_db[0])
+
+    def test_results_are_ordered_by_firefighter_then_minute(self):
+        records = self._read(StatusReader(self._db_engine), None, '2000-01-01 11:59:00', '2000-01-01 12:09:00')
+        self.assertEqual(self._keys(records), sorted(self._analytics_df.index))
+
+    def test_defaults_to_all_firefighters_in_the_latest_minute(self):
+        for status_reader in [StatusReader(self._db_engine), StatusReader(self._db_engine, self._status_cache)] :
+            records = self._read(status_reader)
+            self.assertEqual(self._keys(records), [(firefighter_id, pd.Timestamp('2000-01-01 12:09:00'))
+                                                   for firefighter_id in self._firefighter_ids])
+
+    def test_streams_in_chunks(self):
+        for status_reader in [StatusReader(self._db_engine, chunk_rows=4),
+                              StatusReader(self._db_engine, self._status_cache, chunk_rows=4)] :
+            chunks = list(status_reader.stream_json(None, '2000-01-01 11:59:00', '2000-01-01 12:09:00'))
+            self.assertEqual(len(chunks), 2 + -(-len(self._analytics_df.index) // 4)) # plus the [ and ]
+            self.assertEqual(len(json.loads(''.join(chunks))), len(self._analytics_df.index))
+
+    def test_reads_minutes_the_cache_no_longer_holds_from_the_database(self):
+        status_cache = StatusCache(retention_mins=3)
+        status_cache.publish(self._analytics_df)
+        records = self._read(StatusReader(self._db_engine, status_cache), self._firefighter_ids[:1],
+                             '2000-01-01 12:00:00', '2000-01-01 12:09:00')
+        self.assertEqual(len(records), 10)
+
+    def test_empty_results(self):
+        self.assertEqual(self._read(StatusReader(self._db_engine), []), [])
+        self.assertEqual(self._read(StatusReader(self._db_engine), ['no such firefighter']), [])
+        empty_db_engine = sqlalchemy.create_engine('sqlite://')
+        write_frame(self._analytics_df.head(0), 'firefighter_status_analytics', empty_db_engine)
+        self.assertEqual(self._read(StatusReader(empty_db_engine)), [])
+
+    def test_reads_results_after_a_minute(self):
+        status_reader = StatusReader(self._db_engine)
+        latest_df = status_reader.read_results_after()
+        self.assertEqual(list(latest_df.index), [(firefighter_id, pd.Timestamp('2000-01-01 12:09:00'))
+                                                 for firefighter_id in self._firefighter_ids])
+        self.assertIn(CARBON_MONOXIDE_TWA_COL, latest_df.columns)
+        self.assertEqual(len(status_reader.read_results_after('2000-01-01 12:07:00').index), 2 * len(self._firefighter_ids))
+        self.assertTrue(status_reader.read_results_after('2000-01-01 12:09:00').empty)
+        self.assertTrue(StatusReader(sqlalchemy.create_engine('sqlite://')).read_results_after().empty)
+
+    def test_status_updates_include_rewritten_minutes(self):
+        # A web process that doesn't run the analytics starts with the latest minute...
+        status_cache = StatusCache()
+        status_reader = StatusReader(self._db_engine, status_cache)
+        latest_df = self._analytics_df.loc[self._analytics_df.index.get_level_values(TIMESTAMP_COL)
+                                           == pd.Timestamp('2000-01-01 12:09:00')]
+        self.assertEqual(list(status_reader.read_status_updates().index), list(latest_df.index))
+        self.assertTrue(status_reader.read_status_updates().empty)
+
+        # ... and picks up a result that the analytics recompute and write again.
+        recomputed_df = latest_df.iloc[[0]].copy()
+        recomputed_df[CARBON_MONOXIDE_TWA_COL] += 1
+        AnalyticsWriter(self._db_engine).write(recomputed_df)
+        self.assertEqual(list(status_reader.read_status_updates().index), list(recomputed_df.index))
+        firefighter_id, timestamp = recomputed_df.index[0]
+        self.assertEqual(status_cache.get(firefighter_id, timestamp)[CARBON_MONOXIDE_TWA_COL],
+                         recomputed_df[CARBON_MONOXIDE_TWA_COL].iloc[0])
+
+    def test_minutes_written_by_shards_at_different_times(self):
+        # One shard has written the latest minute's results, and the other hasn't yet.
+        db_engine = sqlalchemy.create_engine('sqlite://')
+        minutes = self._analytics_df.index.get_level_values(TIMESTAMP_COL)
+        first_shard = self._analytics_df.index.get_level_values(FIREFIGHTER_ID_COL).isin(self._firefighter_ids[::2])
+        AnalyticsWriter(db_engine).write(self._analytics_df.loc[(minutes < pd.Timestamp('2000-01-01 12:09:00'))
+                                                                | first_shard])
+        status_cache = StatusCache()
+        status_reader = StatusReader(db_engine, status_cache)
+        status_reader.read_status_updates()
+        status_reader.read_status_updates()
+
+        # The cache can't answer for that minute yet.
+        self.assertFalse(status_cache.covers(pd.Timestamp('2000-01-01 12:09:00'), pd.Timestamp('2000-01-01 12:09:00')))
+
+        # The other shard's results are read (and passed on) once they're written.
+        second_shard_df = self._analytics_df.loc[(minutes == pd.Timestamp('2000-01-01 12:09:00')) & ~first_shard]
+        AnalyticsWriter(db_engine).write(second_shard_df)
+        self.assertEqual(list(status_reader.read_status_updates().index), list(second_shard_df.index))
+        records = self._read(status_reader, None, '2000-01-01 12:09:00', '2000-01-01 12:09:00')
+        self.assertEqual(self._keys(records), [(firefighter_id, pd.Timestamp('2000-01-01 12:09:00'))
+                                               for firefighter_id in self._firefighter_ids])
+
+    def test_invalid_timestamps_raise_before_streaming(self):
+        with self.assertRaises(ValueError) :
+            StatusReader(self._db_engine).stream_json(None, 'not a timestamp')
+
+
+if __name__ == '__main__':
+    unittest.main()
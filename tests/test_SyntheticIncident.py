@@ -0,0 +1,60 @@
+import json
+import unittest
+
+import pandas as pd
+
+from benchmarks.SyntheticIncident import SyntheticIncident, ARRIVAL_DELAY_COL, SENSOR_LOG_COLS
+from benchmarks import run_benchmarks
+from tests import test_GasExposureAnalytics as reference_tests
+
+# ---------------------------------------
+
+ANALYTIC_CONFIGURATION_FOR_THIS_TEST = reference_tests.ANALYTIC_CONFIGURATION_FOR_THIS_TEST
+
+FIREFIGHTER_ID_COL = 'firefighter_id'
+TIMESTAMP_COL = 'timestamp_mins'
+
+# ---------------------------------------
+
+# Unit tests for the synthetic incident generator and the benchmarks that run over it.
+class SyntheticIncidentTestCase(unittest.TestCase):
+
+    def test_the_same_seed_gives_the_same_incident(self):
+        incident_df = SyntheticIncident(20, 30, dropout_rate=0.1, late_arrival_rate=0.1, seed=1).sensor_log()
+        pd.testing.assert_frame_equal(incident_df,
+                                      SyntheticIncident(20, 30, dropout_rate=0.1, late_arrival_rate=0.1, seed=1).sensor_log())
+        self.assertFalse(incident_df.equals(
+            SyntheticIncident(20, 30, dropout_rate=0.1, late_arrival_rate=0.1, seed=2).sensor_log()))
+        self.assertEqual(list(incident_df.columns), SENSOR_LOG_COLS + [ARRIVAL_DELAY_COL])
+
+    def test_rates(self):
+        incident = SyntheticIncident(200, 60, dropout_rate=0.2, late_arrival_rate=0.1, range_exceeded_rate=0.05)
+        incident_df = incident.sensor_log()
+        self.assertEqual(incident_df[FIREFIGHTER_ID_COL].nunique(), 200)
+        first_minute, last_minute = incident.time_span()
+        self.assertGreaterEqual(incident_df[TIMESTAMP_COL].min(), first_minute)
+        self.assertLessEqual(incident_df[TIMESTAMP_COL].max(), last_minute)
+        self.assertLess(len(incident_df.index), 200 * 60 * 0.85) # some firefighters arrive late / leave early too
+        self.assertAlmostEqual((incident_df[ARRIVAL_DELAY_COL] > 0).mean(), 0.1, delta=0.02)
+        self.assertAlmostEqual((incident_df['carbon_monoxide'] < 0).mean(), 0.05, delta=0.01)
+
+    def test_benchmark_results(self):
+        results = run_benchmarks.run_benchmarks([5], [15], [0.1], [0.0, 0.1], [0.01], 0, run_benchmarks.ENGINES,
+                                                ANALYTIC_CONFIGURATION_FOR_THIS_TEST, trace_memory=False)
+        results = json.loads(json.dumps(results)) # i.e. as saved
+        self.assertEqual(len(results['results']), 2 * len(run_benchmarks.ENGINES))
+        for result in results['results'] :
+            self.assertEqual(result['minutes'], 15)
+            self.assertGreater(result['throughput']['minutes_per_second'], 0)
+            if result['engine'] == 'range' :
+                self.assertIsNone(result['latency_ms'])
+            else :
+                self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['p99'])
+
+        comparisons = run_benchmarks.compare_results(results, results)
+        self.assertEqual(len(comparisons), len(results['results']))
+        self.assertEqual(set(comparisons[0]['ratios'].values()), {1.0})
+
+
+if __name__ == '__main__':
+    unittest.main()